@@ -1,12 +1,32 @@
-from fastapi import APIRouter, UploadFile, File
-from app.agents.a3_homework.schemas import GradeTextRequest, GradeLinkRequest, GradeResponse
-from app.agents.a3_homework.service import grade_text, grade_image
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, UploadFile, File
+from app.core.jobs import JobStatus, job_handler, job_headers, submit_job
+from app.core.uploads import receive_upload
+from app.agents.a3_homework.schemas import (
+    GradeTextRequest, GradeLinkRequest, GradeResponse, GradeBatchRequest, GradeBatchResponse
+)
+from app.agents.a3_homework.service import grade_text_async, grade_image_async, grade_batch_async
 
 router = APIRouter()
 
+class _ImageContext:
+    """Context of /grade-image, built inline from the query fields (để test nhanh)."""
+
+    def __init__(self, homework_id: str, student_id: str, skill: str = "writing", instructions: str = ""):
+        self.homework_id = homework_id
+        self.student_id = student_id
+        self.skill = skill
+        self.instructions = instructions
+        self.rubric = None
+
 @router.post("/grade-text", response_model=GradeResponse)
-def grade_text_api(req: GradeTextRequest):
-    return grade_text(req.context, req.student_answer_text, req.expected_answer_text, req.language)
+async def grade_text_api(req: GradeTextRequest):
+    return await grade_text_async(req.context, req.student_answer_text, req.expected_answer_text, req.language)
+
+@router.post("/grade-batch", response_model=GradeBatchResponse)
+async def grade_batch_api(req: GradeBatchRequest):
+    return await grade_batch_async(req.context, req.items, req.language, req.max_concurrency, req.pack_size)
 
 @router.post("/grade-image", response_model=GradeResponse)
 async def grade_image_api(
@@ -18,20 +38,58 @@ async def grade_image_api(
     language: str = "vi",
     file: UploadFile = File(...)
 ):
-    # build context inline (để test nhanh)
-    class Ctx:
-        def __init__(self):
-            self.homework_id = homework_id
-            self.student_id = student_id
-            self.skill = skill
-            self.instructions = instructions
-            self.rubric = None
-
-    img = await file.read()
-    return grade_image(Ctx(), img, file.content_type or "image/jpeg", expected_answer_text or None, language)
+    ctx = _ImageContext(homework_id, student_id, skill, instructions)
+    upload = await receive_upload(file, "/a3/grade-image", "image/jpeg")
+    return await grade_image_async(ctx, upload.file, upload.content_type, expected_answer_text or None, language)
 
 @router.post("/grade-link", response_model=GradeResponse)
-def grade_link_api(req: GradeLinkRequest):
+async def grade_link_api(req: GradeLinkRequest):
     # Demo chuẩn: .NET download + parse nội dung rồi gửi extracted_text vào
     text = req.extracted_text or f"(LINK ONLY) {req.link_url}\nChưa có extracted_text."
-    return grade_text(req.context, text, req.expected_answer_text, req.language)
+    return await grade_text_async(req.context, text, req.expected_answer_text, req.language)
+
+# ---- Jobs (app.core.jobs): same work, answered 202 + job id, result via GET /jobs/{id} or callback ----
+
+@job_handler("a3.grade_text", GradeResponse)
+async def _grade_text_job(payload, files):
+    req = GradeTextRequest.model_validate(payload)
+    return await grade_text_async(req.context, req.student_answer_text, req.expected_answer_text, req.language)
+
+@job_handler("a3.grade_batch", GradeBatchResponse)
+async def _grade_batch_job(payload, files):
+    req = GradeBatchRequest.model_validate(payload)
+    return await grade_batch_async(req.context, req.items, req.language, req.max_concurrency, req.pack_size)
+
+@job_handler("a3.grade_image", GradeResponse)
+async def _grade_image_job(payload, files):
+    upload = files[0]
+    ctx = _ImageContext(payload["homework_id"], payload["student_id"], payload["skill"], payload["instructions"])
+    return await grade_image_async(
+        ctx, upload.file, upload.content_type, payload["expected_answer_text"] or None, payload["language"]
+    )
+
+@router.post("/grade-text/jobs", response_model=JobStatus, status_code=202)
+async def grade_text_job_api(req: GradeTextRequest, job: Dict[str, Optional[str]] = Depends(job_headers)):
+    return await submit_job("a3.grade_text", req.model_dump(), **job)
+
+@router.post("/grade-batch/jobs", response_model=JobStatus, status_code=202)
+async def grade_batch_job_api(req: GradeBatchRequest, job: Dict[str, Optional[str]] = Depends(job_headers)):
+    return await submit_job("a3.grade_batch", req.model_dump(), **job)
+
+@router.post("/grade-image/jobs", response_model=JobStatus, status_code=202)
+async def grade_image_job_api(
+    homework_id: str,
+    student_id: str,
+    skill: str = "writing",
+    instructions: str = "",
+    expected_answer_text: str = "",
+    language: str = "vi",
+    file: UploadFile = File(...),
+    job: Dict[str, Optional[str]] = Depends(job_headers),
+):
+    upload = await receive_upload(file, "/a3/grade-image/jobs", "image/jpeg")
+    payload = {
+        "homework_id": homework_id, "student_id": student_id, "skill": skill, "instructions": instructions,
+        "expected_answer_text": expected_answer_text, "language": language,
+    }
+    return await submit_job("a3.grade_image", payload, [upload], **job)
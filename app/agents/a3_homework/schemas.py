@@ -1,6 +1,13 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 
+from app.core.structured import output_model
+from app.core.utils import env_int
+
+# one request may not queue more answers / pack more of them into a prompt than this
+BATCH_MAX_ITEMS = env_int("A3_BATCH_MAX_ITEMS", 200)
+PACK_SIZE_MAX = env_int("A3_PACK_SIZE_MAX", 20)
+
 class HomeworkContext(BaseModel):
     homework_id: str
     student_id: str
@@ -15,6 +22,21 @@ class GradeTextRequest(BaseModel):
     expected_answer_text: Optional[str] = None  # if teacher provides
     language: str = "vi"
 
+class BatchHomeworkContext(HomeworkContext):
+    student_id: str = ""  # per item, see BatchAnswer
+
+class BatchAnswer(BaseModel):
+    student_id: str
+    student_answer_text: str
+    expected_answer_text: Optional[str] = None
+
+class GradeBatchRequest(BaseModel):
+    context: BatchHomeworkContext  # shared by the whole class
+    items: List[BatchAnswer] = Field(max_length=BATCH_MAX_ITEMS)
+    language: str = "vi"
+    max_concurrency: Optional[int] = None  # capped by A3_BATCH_CONCURRENCY
+    pack_size: int = Field(1, ge=1, le=PACK_SIZE_MAX)  # >1: grade up to N short answers per model call
+
 class GradeLinkRequest(BaseModel):
     context: HomeworkContext
     link_url: str
@@ -34,6 +56,32 @@ class GradingResult(BaseModel):
     raw_text: Optional[str] = None
     warnings: List[str] = Field(default_factory=list)
 
+class GradingConfidence(BaseModel):
+    score: float = 0.0
+    extraction: float = 0.0
+
+# What the model fills (response_schema); raw_text is set by the server
+GradingOutput = output_model(
+    GradingResult,
+    exclude=("raw_text",),
+    confidence=(GradingConfidence, Field(default_factory=GradingConfidence)),
+)
+
+class PackedGradingEntry(GradingOutput):
+    index: int = Field(description="số trong ngoặc vuông của bài làm")
+
+class PackedGradingOutput(BaseModel):
+    results: List[PackedGradingEntry]
+
 class GradeResponse(BaseModel):
     ai_used: bool
     result: GradingResult
+
+class BatchGradeItem(BaseModel):
+    student_id: str
+    ai_used: bool
+    result: GradingResult
+
+class GradeBatchResponse(BaseModel):
+    items: List[BatchGradeItem]
+    model_calls: int
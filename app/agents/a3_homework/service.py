@@ -1,19 +1,31 @@
-from app.core.gemini_client import get_gemini_client
-from app.core.utils import safe_json_loads, ensure_list_len
+import asyncio
+import json
 
-def _build_prompt(context, student_answer_text: str, expected_answer_text: str | None, language: str) -> str:
-    rubric = context.rubric or """
+from app.core.gemini_client import count_model_calls, get_gemini_client, generate_content_async, GEMINI_MODEL
+from app.core.image_preprocess import preprocess_image_async
+from app.core.metrics import instrumented, note_ai_error, observe_stage
+from app.core.model_cache import is_cached, CACHED_WARNING
+from app.core.prompts import PromptTemplate, register_prompt, render_prompt
+from app.core.scheduler import ModelOverloaded, batch_lane
+from app.core.structured import output_config, parse_output
+from app.core.utils import ensure_list_len, env_int
+from app.agents.a3_homework.schemas import GradingOutput, PackedGradingOutput
+
+BATCH_CONCURRENCY = env_int("A3_BATCH_CONCURRENCY", 8)
+# Answers longer than this are never packed with others into one prompt
+PACK_MAX_CHARS = env_int("A3_PACK_MAX_CHARS", 800)
+
+DEFAULT_RUBRIC = """
 Chấm theo thang 10:
 - Đúng nội dung/đúng yêu cầu (4)
 - Ngữ pháp/chính tả (3)
 - Từ vựng/diễn đạt (2)
 - Trình bày/độ rõ ràng (1)
 """
-    return f"""
-Bạn là giáo viên KidzGo. Hãy chấm bài dựa trên rubric và hướng dẫn bài. Không bịa.
-Trả về DUY NHẤT 1 JSON object (không markdown, không giải thích) theo schema:
 
-{{
+_SCHEMA_PROMPT = """Trả về DUY NHẤT 1 JSON object (không markdown, không giải thích) theo schema:
+
+{
   "score": number,
   "max_score": 10,
   "summary": "string",
@@ -21,187 +33,418 @@ Trả về DUY NHẤT 1 JSON object (không markdown, không giải thích) theo
   "issues": ["..."],
   "suggestions": ["..."],
   "extracted_student_answer": "string|null",
-  "confidence": {{"score": 0.0, "extraction": 0.0}},
+  "confidence": {"score": 0.0, "extraction": 0.0},
   "warnings": ["..."]
-}}
+}
+"""
+
+_PACKED_SCHEMA_PROMPT = """Trả về DUY NHẤT 1 JSON object (không markdown, không giải thích) theo schema:
 
+{
+  "results": [
+    {
+      "index": number,
+      "score": number,
+      "max_score": 10,
+      "summary": "string",
+      "strengths": ["..."],
+      "issues": ["..."],
+      "suggestions": ["..."],
+      "extracted_student_answer": "string|null",
+      "confidence": {"score": 0.0, "extraction": 0.0},
+      "warnings": ["..."]
+    }
+  ]
+}
+"""
+
+register_prompt(PromptTemplate(
+    "a3.grade_text",
+    "v1",
+    prefix="""
+Bạn là giáo viên KidzGo. Hãy chấm bài dựa trên rubric và hướng dẫn bài. Không bịa.
+{schema}""",
+    suffix="""
 Bối cảnh:
-- HomeworkId: {context.homework_id}
-- StudentId: {context.student_id}
-- Skill: {context.skill}
-- Instructions: {context.instructions or "N/A"}
+- HomeworkId: {homework_id}
+- StudentId: {student_id}
+- Skill: {skill}
+- Instructions: {instructions}
 
 Rubric:
 {rubric}
 
 Đáp án chuẩn (nếu có):
-{expected_answer_text or "N/A"}
+{expected_answer}
 
 Bài làm học sinh (text):
-{student_answer_text}
+{student_answer}
 
 Ngôn ngữ phản hồi: {language} (vi là tiếng Việt).
-"""
+""",
+    schema=_SCHEMA_PROMPT,
+))
+
+register_prompt(PromptTemplate(
+    "a3.grade_image",
+    "v1",
+    prefix="""
+Bạn là giáo viên KidzGo. Ảnh là bài làm học sinh.
+Hãy: (1) trích nội dung bài làm (OCR) (2) chấm theo rubric.
+Không bịa phần không nhìn thấy rõ.
+{schema}""",
+    suffix="""
+Bối cảnh:
+- Skill: {skill}
+- Instructions: {instructions}
+
+Rubric:
+{rubric}
+
+Đáp án chuẩn (nếu có):
+{expected_answer}
+
+Ngôn ngữ phản hồi: {language}
+""",
+    schema=_SCHEMA_PROMPT,
+))
+
+register_prompt(PromptTemplate(
+    "a3.grade_batch",
+    "v1",
+    prefix="""
+Bạn là giáo viên KidzGo. Hãy chấm TỪNG bài làm dưới đây một cách độc lập, dựa trên rubric và hướng dẫn bài. Không bịa.
+{schema}
+Mỗi bài làm có đúng 1 phần tử trong "results", "index" là số trong ngoặc vuông.
+""",
+    suffix="""
+Bối cảnh:
+- HomeworkId: {homework_id}
+- Skill: {skill}
+- Instructions: {instructions}
+
+Rubric:
+{rubric}
+
+Các bài làm học sinh (text):
+{answers}
+
+Ngôn ngữ phản hồi: {language} (vi là tiếng Việt).
+""",
+    schema=_PACKED_SCHEMA_PROMPT,
+))
+
+def _build_prompt(context, student_answer_text: str, expected_answer_text: str | None, language: str) -> str:
+    return render_prompt(
+        "a3.grade_text",
+        key=context.student_id,
+        homework_id=context.homework_id,
+        student_id=context.student_id,
+        skill=context.skill,
+        instructions=context.instructions or "N/A",
+        rubric=context.rubric or DEFAULT_RUBRIC,
+        expected_answer=expected_answer_text or "N/A",
+        student_answer=student_answer_text,
+        language=language,
+    )
+
+def _build_image_prompt(context, expected_answer_text: str | None, language: str) -> str:
+    return render_prompt(
+        "a3.grade_image",
+        key=context.student_id,
+        skill=context.skill,
+        instructions=context.instructions or "N/A",
+        rubric=context.rubric or DEFAULT_RUBRIC,
+        expected_answer=expected_answer_text or "N/A",
+        language=language,
+    )
+
+def _image_contents(prompt: str, image_bytes: bytes, mime_type: str):
+    return [
+        prompt,
+        {"inline_data": {"mime_type": mime_type or "image/jpeg", "data": image_bytes}},
+    ]
+
+def _missing_key_response(extracted_student_answer: str | None):
+    note_ai_error("MissingApiKey")
+    return {
+        "ai_used": False,
+        "result": {
+            "score": 0,
+            "max_score": 10,
+            "summary": "Thiếu GEMINI_API_KEY trong process server.",
+            "strengths": [],
+            "issues": [],
+            "suggestions": [],
+            "extracted_student_answer": extracted_student_answer,
+            "confidence": {},
+            "raw_text": None,
+            "warnings": ["Missing GEMINI_API_KEY"]
+        }
+    }
+
+def _failed_response(summary: str, suggestion: str, extracted_student_answer: str | None, e: Exception):
+    note_ai_error(e)
+    return {
+        "ai_used": False,
+        "result": {
+            "score": 0,
+            "max_score": 10,
+            "summary": summary,
+            "strengths": [],
+            "issues": [],
+            "suggestions": [suggestion],
+            "extracted_student_answer": extracted_student_answer,
+            "confidence": {},
+            "raw_text": None,
+            "warnings": [f"AI failed: {type(e).__name__}: {str(e)}"]
+        }
+    }
+
+def _text_failed_response(student_answer_text: str, e: Exception):
+    return _failed_response(
+        "AI chấm bài lỗi, hệ thống đang fallback.",
+        "Vui lòng thử lại hoặc giáo viên chấm thủ công.",
+        student_answer_text[:2000],
+        e,
+    )
+
+def _image_failed_response(e: Exception):
+    return _failed_response(
+        "AI chấm bài ảnh lỗi, fallback.",
+        "Giáo viên chấm thủ công hoặc thử lại với ảnh rõ hơn.",
+        None,
+        e,
+    )
+
+def _graded_response(raw_text: str | None, extracted_fallback: str | None, cached: bool = False):
+    obj = parse_output(GradingOutput, raw_text)
+    with observe_stage("normalize"):
+        return _graded_response_from_obj(obj, raw_text, extracted_fallback, cached)
+
+def _graded_response_from_obj(obj, raw_text: str | None, extracted_fallback: str | None, cached: bool = False):
+    warnings = obj.get("warnings") or []
+    if cached:
+        warnings = [*warnings, CACHED_WARNING]
+
+    strengths = ensure_list_len(obj.get("strengths"), 2, "Có cố gắng hoàn thành bài.")
+    issues = ensure_list_len(obj.get("issues"), 2, "Cần luyện tập thêm theo hướng dẫn.")
+    suggestions = ensure_list_len(obj.get("suggestions"), 3, "Luyện tập thêm 5–10 phút/ngày.")
+
+    result = {
+        "score": float(obj.get("score", 0)),
+        "max_score": float(obj.get("max_score", 10)),
+        "summary": (obj.get("summary") or "").strip(),
+        "strengths": strengths,
+        "issues": issues,
+        "suggestions": suggestions,
+        "extracted_student_answer": obj.get("extracted_student_answer") or extracted_fallback,
+        "confidence": obj.get("confidence") or {},
+        "raw_text": raw_text,
+        "warnings": warnings
+    }
+    return {"ai_used": True, "result": result}
 
 def grade_text(context, student_answer_text: str, expected_answer_text: str | None, language: str):
     client = get_gemini_client()
     if not client:
-        return {
-            "ai_used": False,
-            "result": {
-                "score": 0,
-                "max_score": 10,
-                "summary": "Thiếu GEMINI_API_KEY trong process server.",
-                "strengths": [],
-                "issues": [],
-                "suggestions": [],
-                "extracted_student_answer": student_answer_text[:2000],
-                "confidence": {},
-                "raw_text": None,
-                "warnings": ["Missing GEMINI_API_KEY"]
-            }
-        }
+        return _missing_key_response(student_answer_text[:2000])
 
     prompt = _build_prompt(context, student_answer_text, expected_answer_text, language)
 
     try:
-        resp = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-        obj = safe_json_loads(resp.text or "")
-
-        strengths = ensure_list_len(obj.get("strengths"), 2, "Có cố gắng hoàn thành bài.")
-        issues = ensure_list_len(obj.get("issues"), 2, "Cần luyện tập thêm theo hướng dẫn.")
-        suggestions = ensure_list_len(obj.get("suggestions"), 3, "Luyện tập thêm 5–10 phút/ngày.")
-
-        result = {
-            "score": float(obj.get("score", 0)),
-            "max_score": float(obj.get("max_score", 10)),
-            "summary": (obj.get("summary") or "").strip(),
-            "strengths": strengths,
-            "issues": issues,
-            "suggestions": suggestions,
-            "extracted_student_answer": obj.get("extracted_student_answer") or student_answer_text,
-            "confidence": obj.get("confidence") or {},
-            "raw_text": resp.text,
-            "warnings": obj.get("warnings") or []
-        }
-        return {"ai_used": True, "result": result}
+        resp = client.models.generate_content(
+            model=GEMINI_MODEL, contents=prompt, config=output_config(GradingOutput)
+        )
+        return _graded_response(resp.text, student_answer_text)
+    except Exception as e:
+        return _text_failed_response(student_answer_text, e)
+
+@instrumented("a3.grade_text")
+async def grade_text_async(context, student_answer_text: str, expected_answer_text: str | None, language: str):
+    client = get_gemini_client()
+    if not client:
+        return _missing_key_response(student_answer_text[:2000])
+
+    with observe_stage("prompt_build"):
+        prompt = _build_prompt(context, student_answer_text, expected_answer_text, language)
 
+    try:
+        resp = await generate_content_async(
+            client, prompt, config=output_config(GradingOutput), endpoint="a3.grade_text", expect_json=True
+        )
+        return _graded_response(resp.text, student_answer_text, cached=is_cached(resp))
+    except ModelOverloaded:
+        raise
     except Exception as e:
-        return {
-            "ai_used": False,
-            "result": {
-                "score": 0,
-                "max_score": 10,
-                "summary": "AI chấm bài lỗi, hệ thống đang fallback.",
-                "strengths": [],
-                "issues": [],
-                "suggestions": ["Vui lòng thử lại hoặc giáo viên chấm thủ công."],
-                "extracted_student_answer": student_answer_text[:2000],
-                "confidence": {},
-                "raw_text": None,
-                "warnings": [f"AI failed: {type(e).__name__}: {str(e)}"]
-            }
-        }
+        return _text_failed_response(student_answer_text, e)
 
 def grade_image(context, image_bytes: bytes, mime_type: str, expected_answer_text: str | None, language: str):
     client = get_gemini_client()
     if not client:
-        return {
-            "ai_used": False,
-            "result": {
-                "score": 0,
-                "max_score": 10,
-                "summary": "Thiếu GEMINI_API_KEY trong process server.",
-                "strengths": [],
-                "issues": [],
-                "suggestions": [],
-                "extracted_student_answer": None,
-                "confidence": {},
-                "raw_text": None,
-                "warnings": ["Missing GEMINI_API_KEY"]
-            }
-        }
+        return _missing_key_response(None)
 
-    rubric = context.rubric or """
-Chấm theo thang 10:
-- Đúng nội dung/đúng yêu cầu (4)
-- Ngữ pháp/chính tả (3)
-- Từ vựng/diễn đạt (2)
-- Trình bày/độ rõ ràng (1)
-"""
+    prompt = _build_image_prompt(context, expected_answer_text, language)
 
-    prompt = f"""
-Bạn là giáo viên KidzGo. Ảnh là bài làm học sinh.
-Hãy: (1) trích nội dung bài làm (OCR) (2) chấm theo rubric.
-Không bịa phần không nhìn thấy rõ.
+    try:
+        resp = client.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=_image_contents(prompt, image_bytes, mime_type),
+            config=output_config(GradingOutput),
+        )
+        return _graded_response(resp.text, None)
+    except Exception as e:
+        return _image_failed_response(e)
 
-Trả về DUY NHẤT 1 JSON:
-{{
-  "score": number,
-  "max_score": 10,
-  "summary": "string",
-  "strengths": ["..."],
-  "issues": ["..."],
-  "suggestions": ["..."],
-  "extracted_student_answer": "string|null",
-  "confidence": {{"score": 0.0, "extraction": 0.0}},
-  "warnings": ["..."]
-}}
+@instrumented("a3.grade_image")
+async def grade_image_async(context, image, mime_type: str, expected_answer_text: str | None, language: str):
+    """image: bytes or a seekable binary file (spooled upload)."""
+    client = get_gemini_client()
+    if not client:
+        return _missing_key_response(None)
 
-Bối cảnh:
-- Skill: {context.skill}
-- Instructions: {context.instructions or "N/A"}
+    with observe_stage("prompt_build"):
+        prompt = _build_image_prompt(context, expected_answer_text, language)
+    prepared = await preprocess_image_async(image, mime_type, document=True, label="a3.grade_image")
 
-Rubric:
-{rubric}
+    try:
+        resp = await generate_content_async(
+            client,
+            _image_contents(prompt, prepared.data, prepared.mime_type),
+            config=output_config(GradingOutput),
+            endpoint="a3.grade_image",
+            expect_json=True,
+        )
+        return _graded_response(resp.text, None, cached=is_cached(resp))
+    except ModelOverloaded:
+        raise
+    except Exception as e:
+        return _image_failed_response(e)
 
-Đáp án chuẩn (nếu có):
-{expected_answer_text or "N/A"}
+def _build_packed_prompt(context, items, language: str) -> str:
+    answers = "\n\n".join(
+        f"[{i}] StudentId: {item.student_id}\n"
+        f"Đáp án chuẩn (nếu có): {item.expected_answer_text or 'N/A'}\n"
+        f"Bài làm:\n{item.student_answer_text}"
+        for i, item in items
+    )
+    return render_prompt(
+        "a3.grade_batch",
+        key=context.homework_id,
+        homework_id=context.homework_id,
+        skill=context.skill,
+        instructions=context.instructions or "N/A",
+        rubric=context.rubric or DEFAULT_RUBRIC,
+        answers=answers,
+        language=language,
+    )
 
-Ngôn ngữ phản hồi: {language}
-"""
+def _item_context(context, student_id: str):
+    return context.model_copy(update={"student_id": student_id})
 
+@instrumented("a3.grade_batch")
+async def _grade_packed(client, context, chunk, language: str, results) -> None:
+    """
+    Grade several short answers in one model call. Items the model skipped or
+    returned malformed are graded one by one instead.
+    """
+    with observe_stage("prompt_build"):
+        prompt = _build_packed_prompt(context, chunk, language)
+    by_index = {}
+    cached = False
     try:
-        resp = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[
-                prompt,
-                {"inline_data": {"mime_type": mime_type or "image/jpeg", "data": image_bytes}},
-            ],
+        resp = await generate_content_async(
+            client, prompt, config=output_config(PackedGradingOutput), endpoint="a3.grade_batch", expect_json=True
         )
-        obj = safe_json_loads(resp.text or "")
-
-        strengths = ensure_list_len(obj.get("strengths"), 2, "Có cố gắng hoàn thành bài.")
-        issues = ensure_list_len(obj.get("issues"), 2, "Cần luyện tập thêm theo hướng dẫn.")
-        suggestions = ensure_list_len(obj.get("suggestions"), 3, "Luyện tập thêm 5–10 phút/ngày.")
-
-        result = {
-            "score": float(obj.get("score", 0)),
-            "max_score": float(obj.get("max_score", 10)),
-            "summary": (obj.get("summary") or "").strip(),
-            "strengths": strengths,
-            "issues": issues,
-            "suggestions": suggestions,
-            "extracted_student_answer": obj.get("extracted_student_answer"),
-            "confidence": obj.get("confidence") or {},
-            "raw_text": resp.text,
-            "warnings": obj.get("warnings") or []
-        }
-        return {"ai_used": True, "result": result}
-
+        cached = is_cached(resp)
+        obj = parse_output(PackedGradingOutput, resp.text)
+        for entry in obj.get("results") or []:
+            if isinstance(entry, dict) and isinstance(entry.get("index"), int):
+                by_index[entry["index"]] = entry
+    except ModelOverloaded:
+        raise
     except Exception as e:
-        return {
-            "ai_used": False,
-            "result": {
-                "score": 0,
-                "max_score": 10,
-                "summary": "AI chấm bài ảnh lỗi, fallback.",
-                "strengths": [],
-                "issues": [],
-                "suggestions": ["Giáo viên chấm thủ công hoặc thử lại với ảnh rõ hơn."],
-                "extracted_student_answer": None,
-                "confidence": {},
-                "raw_text": None,
-                "warnings": [f"AI failed: {type(e).__name__}: {str(e)}"]
-            }
-        }
+        note_ai_error(e)
+        by_index = {}
+
+    retry = []
+    for i, item in chunk:
+        entry = by_index.get(i)
+        try:
+            if entry is None:
+                raise ValueError("missing in packed output")
+            results[i] = _graded_response_from_obj(
+                entry,
+                json.dumps(entry, ensure_ascii=False),
+                item.student_answer_text,
+                cached=cached,
+            )
+        except Exception:
+            retry.append((i, item))
+
+    for i, item in retry:
+        results[i] = await grade_text_async(
+            _item_context(context, item.student_id),
+            item.student_answer_text,
+            item.expected_answer_text,
+            language,
+        )
+
+async def grade_batch_async(context, items, language: str, max_concurrency: int | None = None, pack_size: int = 1):
+    """
+    Grade a whole class against one shared context/rubric.
+    Results keep input order; each item falls back independently (same shape as grade_text).
+    """
+    results = [None] * len(items)
+
+    client = get_gemini_client()
+    if not client:
+        for i, item in enumerate(items):
+            results[i] = _missing_key_response(item.student_answer_text[:2000])
+        return {"items": _batch_items(items, results), "model_calls": 0}
+
+    limit = max(1, min(max_concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    sem = asyncio.Semaphore(limit)
+
+    packable, single = [], []
+    for i, item in enumerate(items):
+        if pack_size > 1 and len(item.student_answer_text) <= PACK_MAX_CHARS:
+            packable.append((i, item))
+        else:
+            single.append((i, item))
+    chunks = [packable[k:k + pack_size] for k in range(0, len(packable), pack_size)]
+
+    async def run_single(i, item):
+        async with sem:
+            try:
+                results[i] = await grade_text_async(
+                    _item_context(context, item.student_id),
+                    item.student_answer_text,
+                    item.expected_answer_text,
+                    language,
+                )
+            except ModelOverloaded as e:
+                # shed by the scheduler: this item falls back, the rest of the class goes on
+                results[i] = _text_failed_response(item.student_answer_text, e)
+
+    async def run_chunk(chunk):
+        async with sem:
+            try:
+                await _grade_packed(client, context, chunk, language, results)
+            except ModelOverloaded as e:
+                for i, item in chunk:
+                    if results[i] is None:
+                        results[i] = _text_failed_response(item.student_answer_text, e)
+
+    with batch_lane(), count_model_calls() as counter:
+        await asyncio.gather(
+            *(run_single(i, item) for i, item in single),
+            *(run_chunk(chunk) for chunk in chunks),
+        )
+    return {"items": _batch_items(items, results), "model_calls": counter["model_calls"]}
+
+def _batch_items(items, results):
+    return [
+        {"student_id": item.student_id, **result}
+        for item, result in zip(items, results)
+    ]
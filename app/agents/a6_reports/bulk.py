@@ -0,0 +1,167 @@
+"""
+Month-end report generation for many students, as a job of the persistent
+queue (app.core.jobs, kind "a6.bulk_reports").
+
+Every web worker and dedicated job worker shares the queue database, so status
+and results do not depend on which process serves the request, and a job
+interrupted by a worker restart (recycling, deploy) is picked up again by
+another worker. Each finished report is stored as a job item right away: a
+resumed job skips the students already done and the NDJSON stream sends reports
+as they finish. Jobs and their reports are kept for JOB_RESULT_TTL.
+"""
+import asyncio
+import json
+import random
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from app.core.gemini_client import get_gemini_client
+from app.core.jobs import FINISHED, current_job_id, get_job_queue, job_handler, submit_job
+from app.core.metrics import instrumented, note_ai_error
+from app.core.resilience import CircuitOpenError
+from app.core.scheduler import ModelOverloaded
+from app.core.utils import env_int, env_float
+from app.agents.a6_reports.schemas import MonthlyReportRequest
+from app.agents.a6_reports.service import (
+    _build_source_summary, _fallback_response, _generate_with_ai
+)
+
+BULK_CONCURRENCY = env_int("A6_BULK_CONCURRENCY", 4)
+BULK_RETRIES = env_int("A6_BULK_RETRIES", 3)
+BULK_BACKOFF_BASE = env_float("A6_BULK_BACKOFF_BASE", 1.0)
+BULK_BACKOFF_MAX = env_float("A6_BULK_BACKOFF_MAX", 30.0)
+# seconds between checks for new reports while streaming results.ndjson
+BULK_STREAM_POLL = env_float("A6_BULK_STREAM_POLL", 0.5)
+
+BULK_KIND = "a6.bulk_reports"
+
+# queue status -> bulk job status
+_STATUS = {"queued": "pending", "running": "running", "succeeded": "completed",
+           "failed": "failed", "cancelled": "cancelled"}
+
+def _concurrency(max_concurrency: Optional[int]) -> int:
+    return max(1, min(max_concurrency or BULK_CONCURRENCY, BULK_CONCURRENCY))
+
+@instrumented("a6.bulk_report")
+async def _generate_one(index: int, req: MonthlyReportRequest) -> Dict[str, Any]:
+    source_summary = _build_source_summary(req)
+    client = get_gemini_client()
+    error = None
+    last_exc: Optional[Exception] = None
+    attempts = 0
+
+    if client:
+        for attempt in range(BULK_RETRIES + 1):
+            attempts = attempt + 1
+            try:
+                report = await _generate_with_ai(client, req, source_summary)
+                return _item(index, req, report, attempts, None)
+            except Exception as e:
+                last_exc = e
+                error = f"{type(e).__name__}: {str(e)}"
+                if attempt < BULK_RETRIES:
+                    if isinstance(e, (CircuitOpenError, ModelOverloaded)):
+                        # batch work can wait for the breaker / quota instead of falling back
+                        wait = e.retry_in if isinstance(e, CircuitOpenError) else e.retry_after
+                        await asyncio.sleep(min(BULK_BACKOFF_MAX, wait + random.uniform(0, 1)))
+                        continue
+                    delay = min(BULK_BACKOFF_MAX, BULK_BACKOFF_BASE * (2 ** attempt))
+                    await asyncio.sleep(random.uniform(0, delay))
+    else:
+        error = "Missing GEMINI_API_KEY"
+
+    note_ai_error(last_exc or "MissingApiKey")
+    return _item(index, req, _fallback_response(req, source_summary), attempts, error)
+
+def _item(index: int, req: MonthlyReportRequest, report: Dict[str, Any], attempts: int, error: Optional[str]):
+    return {
+        "index": index,
+        "student_id": req.student.student_id,
+        "attempts": attempts,
+        "error": error,
+        "report": jsonable_encoder(report),
+    }
+
+def _counts(items: List[Dict[str, Any]]) -> Dict[str, int]:
+    ai_used = sum(1 for item in items if item["report"]["ai_used"])
+    return {
+        "ai_used": ai_used,
+        "fallback": len(items) - ai_used,
+        "retries": sum(max(0, item["attempts"] - 1) for item in items),
+    }
+
+@job_handler(BULK_KIND)
+async def _run_bulk_job(payload: Dict[str, Any], files) -> Dict[str, Any]:
+    """Generates the reports not stored yet (all of them, unless the job is resumed) and stores each one."""
+    job_id = current_job_id()
+    queue = get_job_queue()
+    requests = [MonthlyReportRequest.model_validate(r) for r in payload["requests"]]
+    done = {item["index"] for _, item in await asyncio.to_thread(queue.items, job_id)}
+    sem = asyncio.Semaphore(_concurrency(payload.get("max_concurrency")))
+
+    async def run_one(i: int) -> None:
+        async with sem:
+            item = await _generate_one(i, requests[i])
+        await asyncio.to_thread(queue.add_item, job_id, i, item)
+
+    # the job worker runs handlers in the batch lane
+    await asyncio.gather(*(run_one(i) for i in range(len(requests)) if i not in done))
+    items = [item for _, item in await asyncio.to_thread(queue.items, job_id)]
+    return {"total": len(requests), **_counts(items)}
+
+async def create_bulk_job(
+    requests: List[MonthlyReportRequest],
+    max_concurrency: Optional[int] = None,
+    idempotency_key: Optional[str] = None,
+    callback_url: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Queues the bulk job; returns its BulkReportJobStatus."""
+    payload = {"requests": [r.model_dump() for r in requests], "max_concurrency": max_concurrency}
+    job = await submit_job(BULK_KIND, payload, idempotency_key=idempotency_key, callback_url=callback_url)
+    return await bulk_job_status(job["job_id"])
+
+async def _row(job_id: str) -> Optional[Dict[str, Any]]:
+    row = await asyncio.to_thread(get_job_queue().get, job_id)
+    return row if row is not None and row["kind"] == BULK_KIND else None
+
+async def bulk_job_status(job_id: str, include_results: bool = False) -> Optional[Dict[str, Any]]:
+    """BulkReportJobStatus of a bulk job; None if there is no such job."""
+    row = await _row(job_id)
+    if row is None:
+        return None
+    payload = json.loads(row["payload"])
+    total = len(payload["requests"])
+    items = [item for _, item in await asyncio.to_thread(get_job_queue().items, job_id)]
+    out = {
+        "job_id": job_id,
+        "status": _STATUS.get(row["status"], row["status"]),
+        "total": total,
+        "done": len(items),
+        "progress": round(len(items) / total, 4) if total else 1.0,
+        **_counts(items),
+        "max_concurrency": _concurrency(payload.get("max_concurrency")),
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+        "error": row["error"] if row["status"] == "failed" else None,
+    }
+    if include_results:
+        out["results"] = items
+    return out
+
+async def stream_bulk_results(job_id: str) -> AsyncIterator[bytes]:
+    """One JSON line per finished report (completion order), following the job until it ends."""
+    queue = get_job_queue()
+    seq = 0
+    while True:
+        row = await _row(job_id)
+        finished = row is None or row["status"] in FINISHED
+        for seq, item in await asyncio.to_thread(queue.items, job_id, seq):
+            yield (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+        if finished:
+            return
+        await asyncio.sleep(BULK_STREAM_POLL)
+
+async def bulk_job_exists(job_id: str) -> bool:
+    return await _row(job_id) is not None
@@ -0,0 +1,223 @@
+"""
+Token-budgeted compaction of the student data in the monthly report prompt.
+
+Without limits a heavy student (daily feedback, many tests, long previous
+reports) produces prompts of many thousand tokens. Before the prompt is built,
+the unbounded sections are compacted:
+
+- session feedbacks: near-identical lines (same words, ignoring case, accents
+  and punctuation) are merged, keeping the latest; long lines are clipped
+- recent reports: the latest month is kept in full, older months are reduced
+  to a one-line summary
+- then every section takes items, most relevant first (latest feedbacks,
+  tests and reports), until its own cap or the overall budget is used up.
+  Sections are served in priority order, so the fixed facts (attendance,
+  homework, level) and teacher notes always fit.
+
+What was merged, clipped or dropped is recorded in the report's
+source_summary["prompt_compaction"].
+
+Token counts are the scheduler's estimate (app.core.scheduler).
+
+Env:
+- A6_PROMPT_TOKEN_BUDGET: tokens for the student data part of the prompt (default 2500; 0 = no compaction)
+- A6_PROMPT_SECTION_BUDGETS: per-section caps overriding SECTION_BUDGETS,
+  e.g. "session_feedbacks=1500,recent_reports=400"
+- A6_FEEDBACK_MAX_CHARS: feedback lines are clipped to this length (default 400)
+- A6_FEEDBACK_SIMILARITY: word overlap (Jaccard) from which two feedback lines are duplicates (default 0.8)
+"""
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.keywords import fold_text
+from app.core.scheduler import estimate_input_tokens
+from app.core.utils import env_float, env_int
+
+PROMPT_TOKEN_BUDGET = env_int("A6_PROMPT_TOKEN_BUDGET", 2500)
+FEEDBACK_MAX_CHARS = env_int("A6_FEEDBACK_MAX_CHARS", 400)
+FEEDBACK_SIMILARITY = env_float("A6_FEEDBACK_SIMILARITY", 0.8)
+# older recent reports are summarised to one line of about this length
+OLD_REPORT_MAX_CHARS = 240
+
+# (section, cap in tokens), highest priority first
+SECTION_BUDGETS: List[Tuple[str, int]] = [
+    ("teacher_notes", 400),
+    ("tests", 300),
+    ("topics", 200),
+    ("session_feedbacks", 1200),
+    ("recent_reports", 600),
+]
+
+def _parse_section_budgets(spec: str) -> Dict[str, int]:
+    out = {}
+    for entry in spec.split(","):
+        name, _, value = entry.partition("=")
+        if name.strip() and value.strip().isdigit():
+            out[name.strip()] = int(value)
+    return out
+
+_SECTION_OVERRIDES = _parse_section_budgets(os.getenv("A6_PROMPT_SECTION_BUDGETS", ""))
+
+@dataclass
+class CompactedData:
+    """Prompt-ready lines per section, and what compaction did."""
+    teacher_notes: List[str] = field(default_factory=list)
+    tests: List[str] = field(default_factory=list)
+    topics: List[str] = field(default_factory=list)
+    session_feedbacks: List[str] = field(default_factory=list)
+    recent_reports: List[str] = field(default_factory=list)
+    report: Dict[str, Any] = field(default_factory=dict)
+
+def _clip(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0] or text[:max_chars]
+    return cut.rstrip(" ,;.") + "…"
+
+_WORD = re.compile(r"\w+")
+
+def _word_set(text: str) -> frozenset:
+    return frozenset(_WORD.findall(fold_text(text)))
+
+def _similar(a: frozenset, b: frozenset, threshold: float) -> bool:
+    if a == b:
+        return True
+    small, large = sorted((len(a), len(b)))
+    # |a & b| / |a | b| <= small / large, so most pairs are rejected without a set operation
+    if not large or small / large < threshold:
+        return False
+    return len(a & b) / len(a | b) >= threshold
+
+def dedupe_feedbacks(feedbacks) -> Tuple[List[Any], int]:
+    """
+    Drops near-duplicate feedbacks, keeping the latest of each group.
+    Returns (kept, in input order; number dropped).
+    """
+    latest_first = sorted(range(len(feedbacks)), key=lambda i: feedbacks[i].date, reverse=True)
+    kept_sets: List[frozenset] = []
+    keep = set()
+    for i in latest_first:
+        words = _word_set(feedbacks[i].text)
+        if not words or any(_similar(words, k, FEEDBACK_SIMILARITY) for k in kept_sets):
+            continue
+        kept_sets.append(words)
+        keep.add(i)
+    return [f for i, f in enumerate(feedbacks) if i in keep], len(feedbacks) - len(keep)
+
+def format_report(report, full: bool) -> str:
+    """A previous monthly report as prompt lines; older months (full=False) as one clipped line."""
+    if full:
+        lines = [f"- Tháng: {report.month}"]
+        if report.overview:
+            lines.append(f"  Tổng quan: {report.overview}")
+        if report.strengths:
+            lines.append("  Điểm mạnh: " + "; ".join(report.strengths))
+        if report.improvements:
+            lines.append("  Cần cải thiện: " + "; ".join(report.improvements))
+        return "\n".join(lines)
+    parts = []
+    if report.overview:
+        parts.append(report.overview)
+    if report.strengths:
+        parts.append("Điểm mạnh: " + report.strengths[0])
+    if report.improvements:
+        parts.append("Cần cải thiện: " + report.improvements[0])
+    return f"- Tháng {report.month}: " + _clip(". ".join(parts) or "không có nhận xét", OLD_REPORT_MAX_CHARS)
+
+def _candidates(req, compact: bool = True) -> Tuple[Dict[str, List[Tuple[str, Any]]], Dict[str, Dict[str, int]]]:
+    """
+    Per section: (line, output order key) pairs, most relevant first; and what
+    was merged, clipped or summarized. compact=False: every line as given.
+    """
+    stats: Dict[str, Dict[str, int]] = {}
+
+    def count(section: str, what: str, n: int = 1) -> None:
+        if n:
+            bucket = stats.setdefault(section, {})
+            bucket[what] = bucket.get(what, 0) + n
+
+    out: Dict[str, List[Tuple[str, Any]]] = {name: [] for name, _ in SECTION_BUDGETS}
+
+    notes = (req.teacher_notes or "").strip()
+    if notes:
+        out["teacher_notes"].append((notes, 0))
+
+    if req.test and req.test.tests:
+        tests = sorted(enumerate(req.test.tests), key=lambda t: t[1].date, reverse=True)
+        out["tests"] = [(f"- {t.type}: {t.score}/{t.max_score} ({t.date})", i) for i, t in tests]
+
+    if req.topics and req.topics.topics:
+        out["topics"] = [(t, i) for i, t in enumerate(req.topics.topics)]
+
+    feedbacks = [f for f in req.session_feedbacks if f.text and f.text.strip()]
+    if compact:
+        feedbacks, merged = dedupe_feedbacks(feedbacks)
+        count("session_feedbacks", "duplicates", merged)
+    for i, f in sorted(enumerate(feedbacks), key=lambda x: x[1].date, reverse=True):
+        text = f.text.strip()
+        if compact:
+            clipped = _clip(text, FEEDBACK_MAX_CHARS)
+            count("session_feedbacks", "clipped", clipped != text)
+            text = clipped
+        out["session_feedbacks"].append((f"- {text}", i))
+
+    reports = sorted(enumerate(req.recent_reports), key=lambda r: r[1].month, reverse=True)
+    for rank, (i, report) in enumerate(reports):
+        out["recent_reports"].append((format_report(report, full=rank == 0 or not compact), i))
+    if compact:
+        count("recent_reports", "summarized", max(len(reports) - 1, 0))
+    return out, stats
+
+def compact_report_data(req, budget: Optional[int] = None) -> CompactedData:
+    """Selects and formats the unbounded parts of `req` for the prompt within `budget` tokens."""
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    data = CompactedData()
+    if budget <= 0:
+        # no compaction: everything, in input order
+        candidates, _ = _candidates(req, compact=False)
+        for name, lines in candidates.items():
+            setattr(data, name, [line for line, _ in sorted(lines, key=lambda x: x[1])])
+        data.report = {"estimated_tokens": sum(estimate_input_tokens(line) for line, _ in _flat(candidates))}
+        return data
+
+    candidates, stats = _candidates(req)
+
+    remaining = budget
+    used = 0
+    for name, cap in SECTION_BUDGETS:
+        cap = min(_SECTION_OVERRIDES.get(name, cap), remaining)
+        kept: List[Tuple[str, Any]] = []
+        spent = 0
+        for line, order in candidates[name]:
+            cost = estimate_input_tokens(line)
+            if spent + cost > cap:
+                if name == "teacher_notes" and not kept and cap > 0:
+                    # a single long note is clipped rather than dropped
+                    line = _clip(line, cap * 3)
+                    cost = estimate_input_tokens(line)
+                    stats.setdefault(name, {})["clipped"] = 1
+                else:
+                    break
+            kept.append((line, order))
+            spent += cost
+        dropped = len(candidates[name]) - len(kept)
+        if dropped:
+            stats.setdefault(name, {})["dropped"] = dropped
+        setattr(data, name, [line for line, _ in sorted(kept, key=lambda x: x[1])])
+        remaining -= spent
+        used += spent
+
+    raw, _ = _candidates(req, compact=False)
+    data.report = {
+        "estimated_tokens": used,
+        "uncompacted_tokens": sum(estimate_input_tokens(line) for line, _ in _flat(raw)),
+        "budget": budget,
+    }
+    if stats:
+        data.report["sections"] = stats
+    return data
+
+def _flat(candidates: Dict[str, List[Tuple[str, Any]]]):
+    return (item for lines in candidates.values() for item in lines)
@@ -0,0 +1,191 @@
+"""
+Generated monthly reports per student and month, for cheap regeneration.
+
+Teachers regenerate a report several times after small edits (mostly
+teacher_notes). Every AI-generated report is stored under student id + month
+(of range.from_date) with a fingerprint of each input block (BLOCKS). On the
+next request for the same student and month:
+
+- no block changed: the stored report is returned, no model call
+- some blocks changed: only the sections that read them (SECTION_BLOCKS) are
+  rewritten, with a smaller prompt holding the changed data and the current
+  text of those sections, and merged into the stored report
+- the student block (name, program, range, language) or the prompt version
+  changed, or more than A6_REPORT_PARTIAL_MAX_SECTIONS sections are affected:
+  the report is generated in full
+
+force_regenerate on the request skips the lookup. What happened is reported
+in source_summary["report_store"].
+
+Env:
+- A6_REPORT_STORE: memory | sqlite | off (default memory; sqlite to share
+  reports between workers and keep them across restarts)
+- A6_REPORT_STORE_PATH: sqlite file (default data/a6_reports.sqlite3)
+- A6_REPORT_STORE_TTL: seconds a report is kept (default 40 days)
+- A6_REPORT_STORE_MAX_ENTRIES: default 5000
+- A6_REPORT_PARTIAL_MAX_SECTIONS: most sections rewritten incrementally (default 6)
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.core.metrics import REGISTRY, Counter
+from app.core.model_cache import MemoryLRUCache, SQLiteCache, content_hash
+from app.core.prompts import get_prompt
+from app.core.utils import env_int
+
+PARTIAL_MAX_SECTIONS = env_int("A6_REPORT_PARTIAL_MAX_SECTIONS", 6)
+
+REPORT_STORE_RESULTS = REGISTRY.register(Counter(
+    "kidzgo_ai_a6_report_store_total",
+    "Monthly reports served from the report store (hit), partly rewritten (partial) or generated in full (miss).",
+    ("result",)))
+
+# Input blocks, fingerprinted separately; "student" changes always mean a full report
+BLOCKS = ("student", "attendance", "homework", "tests", "mission", "topics", "feedbacks", "recent_reports", "notes")
+
+# Report section -> input blocks it is written from
+SECTION_BLOCKS: Dict[str, frozenset] = {
+    "attendance_rate": frozenset({"attendance"}),
+    "homework_completion": frozenset({"homework"}),
+    "progress_level": frozenset({"mission"}),
+    "progress_topics": frozenset({"mission", "topics"}),
+    "study_attitude": frozenset({"attendance", "feedbacks", "notes"}),
+    "skills": frozenset({"tests", "feedbacks", "notes"}),
+    "strengths": frozenset({"homework", "tests", "feedbacks", "notes", "recent_reports"}),
+    "improvements": frozenset({"homework", "tests", "feedbacks", "notes", "recent_reports"}),
+    "parent_support": frozenset({"attendance", "homework", "feedbacks", "notes"}),
+}
+
+def block_values(req) -> Dict[str, Any]:
+    return {
+        "student": (req.student, req.range, req.language),
+        "attendance": req.attendance,
+        "homework": req.homework,
+        "tests": req.test,
+        "mission": req.mission,
+        "topics": req.topics,
+        "feedbacks": req.session_feedbacks,
+        "recent_reports": req.recent_reports,
+        "notes": (req.teacher_notes or "").strip(),
+    }
+
+def fingerprints(req) -> Dict[str, str]:
+    return {name: content_hash(value)[:16] for name, value in block_values(req).items()}
+
+def affected_sections(changed_blocks) -> List[str]:
+    changed = set(changed_blocks)
+    return [name for name, blocks in SECTION_BLOCKS.items() if blocks & changed]
+
+def _store_key(req) -> str:
+    return f"{req.student.student_id}:{req.range.from_date[:7]}"
+
+@dataclass
+class ReportPlan:
+    """What a request needs: the stored report (if any) and the sections to (re)write."""
+    key: str
+    prompt: str  # "template/version" the report is written with
+    fingerprints: Dict[str, str]
+    stored: Optional[Dict[str, Any]] = None
+    changed_blocks: List[str] = field(default_factory=list)
+    sections: List[str] = field(default_factory=list)
+
+    @property
+    def result(self) -> str:
+        if self.stored is None:
+            return "miss"
+        return "partial" if self.sections else "hit"
+
+    def summary(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"result": self.result}
+        if self.result == "partial":
+            out["changed_blocks"] = self.changed_blocks
+            out["regenerated"] = self.sections
+        return out
+
+class ReportStore:
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else self._backend_from_env()
+        self._lock = threading.Lock()
+        self._counts = {"hit": 0, "partial": 0, "miss": 0}
+
+    @staticmethod
+    def _backend_from_env():
+        kind = os.getenv("A6_REPORT_STORE", "memory").lower()
+        ttl = env_int("A6_REPORT_STORE_TTL", 40 * 24 * 3600)
+        max_entries = env_int("A6_REPORT_STORE_MAX_ENTRIES", 5000)
+        if kind == "off":
+            return None
+        if kind == "sqlite":
+            path = os.getenv("A6_REPORT_STORE_PATH", os.path.join("data", "a6_reports.sqlite3"))
+            return SQLiteCache(path, max_entries=max_entries, ttl=ttl, table="a6_reports")
+        return MemoryLRUCache(max_entries=max_entries, ttl=ttl)
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def _get(self, key: str) -> Optional[str]:
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.backend.get, key)
+        return self.backend.get(key)
+
+    async def _put(self, key: str, value: str) -> None:
+        if self.backend.blocking:
+            await asyncio.to_thread(self.backend.put, key, value)
+        else:
+            self.backend.put(key, value)
+
+    async def plan(self, req) -> ReportPlan:
+        """Compares `req` with the stored report of the same student and month."""
+        template = get_prompt("a6.monthly_report", req.student.student_id)
+        plan = ReportPlan(
+            key=_store_key(req), prompt=f"{template.name}/{template.version}", fingerprints=fingerprints(req)
+        )
+        raw = None if req.force_regenerate else await self._get(plan.key)
+        entry = json.loads(raw) if raw else None
+        if entry is not None and entry.get("prompt") == plan.prompt:
+            old = entry.get("fingerprints", {})
+            changed = [b for b in BLOCKS if old.get(b) != plan.fingerprints[b]]
+            sections = affected_sections(changed)
+            if "student" not in changed and len(sections) <= PARTIAL_MAX_SECTIONS:
+                plan.stored = entry["sections"]
+                plan.changed_blocks = changed
+                plan.sections = sections
+        with self._lock:
+            self._counts[plan.result] += 1
+        REPORT_STORE_RESULTS.inc(result=plan.result)
+        return plan
+
+    async def save(self, plan: ReportPlan, sections: Dict[str, Any]) -> None:
+        entry = {
+            "prompt": plan.prompt,
+            "fingerprints": plan.fingerprints,
+            "sections": {k: v for k, v in sections.items() if k != "source_summary"},
+            "updated_at": time.time(),
+        }
+        await self._put(plan.key, json.dumps(entry, ensure_ascii=False))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "entries": self.backend.size() if self.backend is not None else 0,
+            **counts,
+        }
+
+_store: Optional[ReportStore] = None
+_store_lock = threading.Lock()
+
+def get_report_store() -> ReportStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ReportStore()
+    return _store
@@ -1,9 +1,49 @@
-from fastapi import APIRouter
-from app.agents.a6_reports.schemas import MonthlyReportRequest, MonthlyReportResponse
-from app.agents.a6_reports.service import generate_monthly_report
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from app.agents.a6_reports.schemas import (
+    MonthlyReportRequest, MonthlyReportResponse, BulkReportJobRequest, BulkReportJobStatus
+)
+from app.agents.a6_reports.service import generate_monthly_report_async, stream_monthly_report_async
+from app.core.jobs import JobStatus, job_handler, job_headers, submit_job
+from app.core.sse import event_stream_response
+from app.agents.a6_reports.bulk import bulk_job_exists, bulk_job_status, create_bulk_job, stream_bulk_results
 
 router = APIRouter()
 
 @router.post("/generate-monthly-report", response_model=MonthlyReportResponse)
-def generate(req: MonthlyReportRequest):
-    return generate_monthly_report(req)
+async def generate(req: MonthlyReportRequest):
+    return await generate_monthly_report_async(req)
+
+@router.post("/generate-monthly-report/stream")
+async def generate_stream(req: MonthlyReportRequest):
+    """SSE: "delta" events with the model's partial output, then one "result" event (MonthlyReportResponse)."""
+    return await event_stream_response(stream_monthly_report_async(req))
+
+@job_handler("a6.monthly_report", MonthlyReportResponse)
+async def _generate_job(payload, files):
+    return await generate_monthly_report_async(MonthlyReportRequest.model_validate(payload))
+
+@router.post("/generate-monthly-report/jobs", response_model=JobStatus, status_code=202)
+async def generate_job(req: MonthlyReportRequest, job: Dict[str, Optional[str]] = Depends(job_headers)):
+    """Job variant (app.core.jobs): 202 + job id; result via GET /jobs/{job_id} or the X-Callback-Url webhook."""
+    return await submit_job("a6.monthly_report", req.model_dump(), **job)
+
+@router.post("/bulk-jobs", response_model=BulkReportJobStatus, status_code=202)
+async def create_bulk(req: BulkReportJobRequest, job: Dict[str, Optional[str]] = Depends(job_headers)):
+    """Queues the reports as one job (app.core.jobs); any web worker can answer the status and results below."""
+    return await create_bulk_job(req.requests, req.max_concurrency, **job)
+
+@router.get("/bulk-jobs/{job_id}", response_model=BulkReportJobStatus)
+async def bulk_status(job_id: str, include_results: bool = False):
+    status = await bulk_job_status(job_id, include_results=include_results)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+@router.get("/bulk-jobs/{job_id}/results.ndjson")
+async def bulk_results(job_id: str):
+    if not await bulk_job_exists(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(stream_bulk_results(job_id), media_type="application/x-ndjson")
@@ -1,6 +1,12 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 
+from app.core.structured import output_model
+from app.core.utils import env_int
+
+# reports one bulk job may queue (every one is a model call, kept for JOB_RESULT_TTL)
+BULK_MAX_REPORTS = env_int("A6_BULK_MAX_REPORTS", 1000)
+
 class StudentInfo(BaseModel):
     student_id: str
     name: str
@@ -79,27 +85,61 @@ class MonthlyReportRequest(BaseModel):
     recent_reports: List[RecentMonthlyReport] = Field(default_factory=list)
     teacher_notes: Optional[str] = None
     language: str = "vi"
+    # Skip the stored report of this student and month (report_store) and write it anew
+    force_regenerate: bool = False
 
 # New response format for monthly report
+# Field descriptions double as instructions in the model's response_schema
 class SkillAssessment(BaseModel):
-    phonics: Optional[str] = None
-    speaking: Optional[str] = None
-    listening: Optional[str] = None
-    writing: Optional[str] = None
+    phonics: Optional[str] = Field(None, description="Đánh giá kỹ năng Phonics")
+    speaking: Optional[str] = Field(None, description="Đánh giá kỹ năng Speaking")
+    listening: Optional[str] = Field(None, description="Đánh giá kỹ năng Listening")
+    writing: Optional[str] = Field(None, description="Đánh giá kỹ năng Writing")
 
 class ReportSections(BaseModel):
-    attendance_rate: str  # e.g., "85%"
-    study_attitude: str
-    progress_level: str
-    progress_topics: List[str]
+    attendance_rate: str = Field(description="VD: 85%")
+    study_attitude: str = Field(description="Mô tả thái độ học tập của học viên trong tháng")
+    progress_level: str = Field(description="VD: Get Ready for Flyers")
+    progress_topics: List[str] = Field(description="Các chủ điểm đã học")
     skills: SkillAssessment
-    strengths: List[str]
-    improvements: List[str]
-    homework_completion: str  # e.g., "90%"
-    parent_support: List[str]
+    strengths: List[str] = Field(description="3 điểm mạnh")
+    improvements: List[str] = Field(description="2 điểm cần cải thiện")
+    homework_completion: str = Field(description="VD: 90%")
+    parent_support: List[str] = Field(description="3 hướng hỗ trợ cho phụ huynh")
     source_summary: Dict[str, Any]
 
+# What the model fills (response_schema); source_summary is built by the server
+ReportSectionsOutput = output_model(ReportSections, exclude=("source_summary",))
+
 class MonthlyReportResponse(BaseModel):
     ai_used: bool
     draft_text: str
     sections: ReportSections
+
+# Bulk month-end generation
+class BulkReportJobRequest(BaseModel):
+    requests: List[MonthlyReportRequest] = Field(max_length=BULK_MAX_REPORTS)
+    max_concurrency: Optional[int] = None  # capped by A6_BULK_CONCURRENCY
+
+class BulkReportItem(BaseModel):
+    index: int
+    student_id: str
+    attempts: int
+    error: Optional[str] = None
+    report: MonthlyReportResponse
+
+class BulkReportJobStatus(BaseModel):
+    job_id: str
+    status: str  # pending / running / completed / failed / cancelled
+    total: int
+    done: int
+    progress: float
+    ai_used: int
+    fallback: int
+    retries: int
+    max_concurrency: int
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    results: Optional[List[BulkReportItem]] = None
@@ -1,13 +1,38 @@
-from typing import List, Dict, Any, Optional
-from app.core.gemini_client import get_gemini_client
-from app.core.utils import safe_json_loads, ensure_list_len
+import functools
+import json
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+from app.core.gemini_client import (
+    get_gemini_client, generate_content_async, generate_content_stream_async, GEMINI_MODEL
+)
+from app.core.json_extract import StreamingJsonExtractor
+from app.core.keywords import KeywordMatcher
+from app.core.metrics import instrumented, note_ai_error, observe_stage, record_ai_result
+from app.core.model_cache import is_cached
+from app.core.prompts import PromptTemplate, register_prompt, render_prompt
+from app.core.scheduler import ModelOverloaded
+from app.core.structured import output_config, output_model, parse_output, validate_output
+from app.core.utils import ensure_list_len
+from app.agents.a6_reports.compaction import compact_report_data
+from app.agents.a6_reports.report_store import ReportPlan, get_report_store
 from app.agents.a6_reports.schemas import (
     MonthlyReportRequest, AttendanceData, HomeworkData, TestData,
-    MissionData, TopicsData, SkillAssessment
+    MissionData, TopicsData, SkillAssessment, ReportSectionsOutput
 )
 
 POSITIVE = ["tiến bộ", "tốt", "tích cực", "tự tin", "chăm", "nhanh", "đúng", "cải thiện"]
 NEGATIVE = ["chậm", "thiếu", "chưa", "sai", "yếu", "quên", "rụt rè", "lẫn", "khó"]
+# "chưa tốt" / "không tự tin" are one negative hit (longest match), not a strength
+NEGATED = [f"{neg} {word}" for neg in ("chưa", "không") for word in POSITIVE]
+
+_FEEDBACK_TONE = KeywordMatcher({
+    "positive": POSITIVE,
+    "negative": NEGATIVE + [(phrase, 2.0) for phrase in NEGATED],
+})
+
+def _top_feedbacks(scored: List[Tuple[str, Dict[str, float]]], label: str, limit: int = 3) -> List[str]:
+    """The `limit` feedbacks scoring highest for label, in their original order."""
+    ranked = sorted((i for i, (_, s) in enumerate(scored) if s.get(label)), key=lambda i: -scored[i][1][label])
+    return [scored[i][0] for i in sorted(ranked[:limit])]
 
 def _rule_based_sections(req) -> Dict[str, Any]:
     """Fallback when AI is not available"""
@@ -27,13 +52,9 @@ def _rule_based_sections(req) -> Dict[str, Any]:
     progress_topics = topics.topics if topics and topics.topics else []
     
     # Extract from session feedbacks
-    strengths, improvements = [], []
-    for t in texts:
-        tl = t.lower()
-        if any(k in tl for k in POSITIVE) and len(strengths) < 3:
-            strengths.append(t.strip())
-        if any(k in tl for k in NEGATIVE) and len(improvements) < 3:
-            improvements.append(t.strip())
+    scored = list(zip(texts, _FEEDBACK_TONE.score_batch(texts)))
+    strengths = _top_feedbacks(scored, "positive")
+    improvements = _top_feedbacks(scored, "negative")
 
     if not strengths:
         strengths = [f"{name} duy trì tham gia học đều và có thái độ hợp tác trong lớp."]
@@ -69,21 +90,6 @@ def _rule_based_sections(req) -> Dict[str, Any]:
         "parent_support": parent_support
     }
 
-def _format_recent_reports(recent_reports: List[Any]) -> str:
-    if not recent_reports:
-        return "Không có dữ liệu báo cáo 3 tháng gần nhất."
-
-    lines = []
-    for report in recent_reports:
-        lines.append(f"- Tháng: {report.month}")
-        if hasattr(report, 'overview') and report.overview:
-            lines.append(f"  Tổng quan: {report.overview}")
-        if hasattr(report, 'strengths') and report.strengths:
-            lines.append("  Điểm mạnh: " + "; ".join(report.strengths))
-        if hasattr(report, 'improvements') and report.improvements:
-            lines.append("  Cần cải thiện: " + "; ".join(report.improvements))
-    return "\n".join(lines)
-
 def _build_source_summary(req) -> Dict[str, Any]:
     """Build source summary from available data"""
     texts = [x.text.strip() for x in req.session_feedbacks if x.text and x.text.strip()]
@@ -147,52 +153,57 @@ def _format_draft_text(sections: Dict[str, Any], name: str) -> str:
     
     return "\n".join(lines)
 
-def generate_monthly_report(req: MonthlyReportRequest) -> Dict[str, Any]:
-    name = req.student.name
-    program = req.student.program or ""
-    from_d, to_d = req.range.from_date, req.range.to_date
-    texts = [x.text.strip() for x in req.session_feedbacks if x.text and x.text.strip()]
-    total = len(texts)
-    
-    recent_reports_summary = _format_recent_reports(req.recent_reports)
-    teacher_notes = (req.teacher_notes or "").strip() or "Không có ghi chú bổ sung."
-    
-    # Get aggregated data
-    attendance = req.attendance
-    homework = req.homework
-    test = req.test
-    mission = req.mission
-    topics = req.topics
+_SCHEMA_PROMPT = """
+Hãy trả về DUY NHẤT 1 JSON object (không markdown, không giải thích):
+{
+  "attendance_rate": "VD: 85%",
+  "study_attitude": "Mô tả thái độ học tập của học viên trong tháng",
+  "progress_level": "VD: Get Ready for Flyers",
+  "progress_topics": ["Chủ điểm 1", "Chủ điểm 2"],
+  "skills": {
+    "phonics": "Đánh giá kỹ năng Phonics",
+    "speaking": "Đánh giá kỹ năng Speaking",
+    "listening": "Đánh giá kỹ năng Listening", 
+    "writing": "Đánh giá kỹ năng Writing"
+  },
+  "strengths": ["Điểm mạnh 1", "Điểm mạnh 2", "Điểm mạnh 3"],
+  "improvements": ["Điểm cần cải thiện 1", "Điểm cần cải thiện 2"],
+  "homework_completion": "VD: 90%",
+  "parent_support": ["Hướng hỗ trợ 1", "Hướng hỗ trợ 2", "Hướng hỗ trợ 3"]
+}
+"""
 
-    # Build source summary
-    source_summary = _build_source_summary(req)
+# The schema block comes before the student data so that the whole static part
+# is one prefix (context cache, see app.core.prompts)
+register_prompt(PromptTemplate(
+    "a6.monthly_report",
+    "v1",
+    prefix="""Bạn là giáo viên trung tâm tiếng Anh KidzGo.
+Hãy tổng hợp báo cáo tháng cho học viên.
+Dựa trên dữ liệu thực tế ở phần DỮ LIỆU HỌC VIÊN, viết nhận xét bằng tiếng Việt.
+{schema}
+=== DỮ LIỆU HỌC VIÊN ===
+""",
+    suffix="""Học viên: {student_name}
+Thời gian: {from_date} đến {to_date}
+Chương trình: {program}
 
-    # Try AI first
-    client = get_gemini_client()
-    if not client:
-        # Fallback to rule-based
-        rb = _rule_based_sections(req)
-        draft_text = _format_draft_text(rb, name)
-        
-        return {
-            "ai_used": False,
-            "draft_text": draft_text,
-            "sections": {
-                **rb,
-                "source_summary": source_summary
-            }
-        }
+{data}""",
+    schema=_SCHEMA_PROMPT,
+))
 
-    # Build prompt with all available data
-    prompt_parts = [
-        f"Bạn là giáo viên trung tâm tiếng Anh KidzGo.",
-        f"Hãy tổng hợp báo cáo tháng cho học viên {name}.",
-        "Dựa trên dữ liệu thực tế dưới đây, viết nhận xét bằng tiếng Việt.",
-        "",
-        f"Thời gian: {from_d} đến {to_d}",
-        f"Chương trình: {program}",
-        ""
-    ]
+def _data_text(req: MonthlyReportRequest, compacted, blocks=None) -> str:
+    """The student data part of the prompt; `blocks` limits it to those input blocks (report_store.BLOCKS)."""
+    def wanted(block: str) -> bool:
+        return blocks is None or block in blocks
+
+    # Get aggregated data
+    attendance = req.attendance if wanted("attendance") else None
+    homework = req.homework if wanted("homework") else None
+    mission = req.mission if wanted("mission") else None
+
+    # Build the data part with all available data
+    prompt_parts = []
 
     # Attendance data
     if attendance:
@@ -217,14 +228,10 @@ def generate_monthly_report(req: MonthlyReportRequest) -> Dict[str, Any]:
         ])
 
     # Test data
-    if test and test.tests:
-        test_info = "\n".join([
-            f"- {t.type}: {t.score}/{t.maxScore} ({t.date})" 
-            for t in test.tests
-        ])
+    if compacted.tests and wanted("tests"):
         prompt_parts.extend([
             "--- DỮ LIỆU BÀI TEST ---",
-            test_info,
+            "\n".join(compacted.tests),
             ""
         ])
 
@@ -240,110 +247,302 @@ def generate_monthly_report(req: MonthlyReportRequest) -> Dict[str, Any]:
         ])
 
     # Topics covered
-    if topics and topics.topics:
+    if compacted.topics and wanted("topics"):
         prompt_parts.extend([
             "--- CÁC CHỦ ĐIỂM ĐÃ HỌC ---",
-            ", ".join(topics.topics),
+            ", ".join(compacted.topics),
             ""
         ])
 
     # Session feedbacks
-    if texts:
+    if compacted.session_feedbacks and wanted("feedbacks"):
         prompt_parts.extend([
             "--- FEEDBACK SAU BUỔI HỌC ---",
-            "\n".join([f"- {t}" for t in texts]),
+            "\n".join(compacted.session_feedbacks),
             ""
         ])
-    
+
     # Recent reports
-    if req.recent_reports:
+    if compacted.recent_reports and wanted("recent_reports"):
         prompt_parts.extend([
             "--- BÁO CÁO 3 THÁNG GẦN NHẤT ---",
-            recent_reports_summary,
+            "\n".join(compacted.recent_reports),
             ""
         ])
 
     # Teacher notes
-    if teacher_notes and teacher_notes != "Không có ghi chú bổ sung.":
+    if compacted.teacher_notes and wanted("notes"):
         prompt_parts.extend([
             "--- GHI CHÚ THÊM TỪ GIÁO VIÊN ---",
-            teacher_notes,
+            "\n".join(compacted.teacher_notes),
             ""
         ])
 
-    prompt = "\n".join(prompt_parts) + """
+    return "\n".join(prompt_parts)
 
-Hãy trả về DUY NHẤT 1 JSON object (không markdown, không giải thích):
-{
-  "attendance_rate": "VD: 85%",
-  "study_attitude": "Mô tả thái độ học tập của học viên trong tháng",
-  "progress_level": "VD: Get Ready for Flyers",
-  "progress_topics": ["Chủ điểm 1", "Chủ điểm 2"],
-  "skills": {
-    "phonics": "Đánh giá kỹ năng Phonics",
-    "speaking": "Đánh giá kỹ năng Speaking",
-    "listening": "Đánh giá kỹ năng Listening", 
-    "writing": "Đánh giá kỹ năng Writing"
-  },
-  "strengths": ["Điểm mạnh 1", "Điểm mạnh 2", "Điểm mạnh 3"],
-  "improvements": ["Điểm cần cải thiện 1", "Điểm cần cải thiện 2"],
-  "homework_completion": "VD: 90%",
-  "parent_support": ["Hướng hỗ trợ 1", "Hướng hỗ trợ 2", "Hướng hỗ trợ 3"]
-}
-"""
+def _build_prompt(req: MonthlyReportRequest, source_summary: Optional[Dict[str, Any]] = None) -> str:
+    """source_summary, if given, gets what the token budget left out ("prompt_compaction")."""
+    # Unbounded sections (feedbacks, tests, topics, recent reports, notes) within the token budget
+    compacted = compact_report_data(req)
+    if source_summary is not None:
+        source_summary["prompt_compaction"] = compacted.report
+
+    return render_prompt(
+        "a6.monthly_report",
+        key=req.student.student_id,
+        student_name=req.student.name,
+        from_date=req.range.from_date,
+        to_date=req.range.to_date,
+        program=req.student.program or "",
+        data=_data_text(req, compacted),
+    )
+
+# Rewrites part of a stored report after some of its input changed (report_store)
+register_prompt(PromptTemplate(
+    "a6.monthly_report_update",
+    "v1",
+    prefix="""Bạn là giáo viên trung tâm tiếng Anh KidzGo.
+Báo cáo tháng của học viên đã được viết, sau đó một phần dữ liệu thay đổi.
+Chỉ viết lại các mục trong "Mục cần cập nhật", dựa trên nội dung hiện tại của các mục đó và DỮ LIỆU MỚI, bằng tiếng Việt.
+Giữ những ý vẫn đúng, sửa hoặc bỏ những ý không còn phù hợp với dữ liệu mới, giữ văn phong như cũ.
+{schema}
+=== CẬP NHẬT BÁO CÁO ===
+""",
+    suffix="""Học viên: {student_name}
+Thời gian: {from_date} đến {to_date}
+Mục cần cập nhật: {sections}
+
+--- NỘI DUNG HIỆN TẠI ---
+{current}
+
+--- DỮ LIỆU MỚI ---
+{data}""",
+    schema="""
+Hãy trả về DUY NHẤT 1 JSON object (không markdown, không giải thích) chỉ gồm các mục cần cập nhật,
+mỗi mục cùng kiểu dữ liệu như trong NỘI DUNG HIỆN TẠI.
+""",
+))
+
+@functools.lru_cache(maxsize=None)
+def _update_output(sections: Tuple[str, ...]):
+    """ReportSectionsOutput limited to `sections` (response_schema of an update)."""
+    exclude = [f for f in ReportSectionsOutput.model_fields if f not in sections]
+    return output_model(ReportSectionsOutput, exclude=exclude, name="ReportUpdateOutput")
+
+def _build_update_prompt(req: MonthlyReportRequest, plan: ReportPlan, source_summary: Dict[str, Any]) -> str:
+    compacted = compact_report_data(req)
+    source_summary["prompt_compaction"] = compacted.report
+    current = {name: plan.stored.get(name) for name in plan.sections}
+    return render_prompt(
+        "a6.monthly_report_update",
+        key=req.student.student_id,
+        student_name=req.student.name,
+        from_date=req.range.from_date,
+        to_date=req.range.to_date,
+        sections=", ".join(plan.sections),
+        current=json.dumps(current, ensure_ascii=False),
+        data=_data_text(req, compacted, plan.changed_blocks),
+    )
+
+def _merge_update(plan: ReportPlan, update: Dict[str, Any]) -> Dict[str, Any]:
+    """The stored sections with the rewritten ones; sections the model left empty keep their old text."""
+    sec = dict(plan.stored)
+    for name in plan.sections:
+        if update.get(name):
+            sec[name] = update[name]
+    return sec
+
+def _prepare_call(req: MonthlyReportRequest, plan: Optional[ReportPlan], source_summary: Dict[str, Any]):
+    """(prompt, output model) for a full report, or for the sections `plan` has to rewrite."""
+    if plan is not None and plan.result == "partial":
+        return _build_update_prompt(req, plan, source_summary), _update_output(tuple(plan.sections))
+    return _build_prompt(req, source_summary), ReportSectionsOutput
+
+def _fallback_response(req: MonthlyReportRequest, source_summary: Dict[str, Any]) -> Dict[str, Any]:
+    rb = _rule_based_sections(req)
+    rb["source_summary"] = source_summary
+    draft_text = _format_draft_text(rb, req.student.name)
+
+    return {
+        "ai_used": False,
+        "draft_text": draft_text,
+        "sections": rb
+    }
+
+def _ai_response(
+    raw_text: Optional[str],
+    req: MonthlyReportRequest,
+    source_summary: Dict[str, Any],
+    sec: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    name = req.student.name
+    texts = [x.text.strip() for x in req.session_feedbacks if x.text and x.text.strip()]
+    attendance = req.attendance
+    homework = req.homework
+    mission = req.mission
+    topics = req.topics
+
+    if sec is None:
+        sec = parse_output(ReportSectionsOutput, raw_text)
+
+    # Validate and fill in missing values
+    attendance_rate = sec.get("attendance_rate") or (f"{attendance.percentage:.0f}%" if attendance else "N/A")
+    study_attitude = sec.get("study_attitude") or (texts[0] if texts else f"{name} có thái độ học tập tích cực.")
+    progress_level = sec.get("progress_level") or (mission.current_level if mission else "N/A")
+    progress_topics = sec.get("progress_topics") or (topics.topics if topics else [])
+
+    skills_data = sec.get("skills") or {}
+    skills = SkillAssessment(
+        phonics=skills_data.get("phonics") or "Chưa đủ dữ liệu để đánh giá.",
+        speaking=skills_data.get("speaking") or "Chưa đủ dữ liệu để đánh giá.",
+        listening=skills_data.get("listening") or "Chưa đủ dữ liệu để đánh giá.",
+        writing=skills_data.get("writing") or "Chưa đủ dữ liệu để đánh giá."
+    )
+
+    strengths = ensure_list_len(sec.get("strengths"), 3, f"{name} có thái độ học tập tích cực.")
+    improvements = ensure_list_len(sec.get("improvements"), 2, "Cần luyện tập thêm theo hướng dẫn của giáo viên.")
+    homework_completion = sec.get("homework_completion") or (f"{homework.completion_rate:.0f}%" if homework else "N/A")
+    parent_support = ensure_list_len(sec.get("parent_support"), 3, "Nhắc con làm và nộp bài tập về nhà đầy đủ.")
+
+    sections = {
+        "attendance_rate": attendance_rate,
+        "study_attitude": study_attitude,
+        "progress_level": progress_level,
+        "progress_topics": progress_topics,
+        "skills": skills.model_dump(),
+        "strengths": strengths,
+        "improvements": improvements,
+        "homework_completion": homework_completion,
+        "parent_support": parent_support,
+        "source_summary": source_summary
+    }
+
+    draft_text = _format_draft_text(sections, name)
+
+    return {
+        "ai_used": True,
+        "draft_text": draft_text,
+        "sections": sections
+    }
+
+def generate_monthly_report(req: MonthlyReportRequest) -> Dict[str, Any]:
+    # Build source summary
+    source_summary = _build_source_summary(req)
+
+    # Try AI first
+    client = get_gemini_client()
+    if not client:
+        # Fallback to rule-based
+        return _fallback_response(req, source_summary)
+
+    prompt = _build_prompt(req, source_summary)
 
     try:
-        resp = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-        sec = safe_json_loads(resp.text or "")
-
-        # Validate and fill in missing values
-        attendance_rate = sec.get("attendance_rate") or (f"{attendance.percentage:.0f}%" if attendance else "N/A")
-        study_attitude = sec.get("study_attitude") or texts[0] if texts else f"{name} có thái độ học tập tích cực."
-        progress_level = sec.get("progress_level") or (mission.current_level if mission else "N/A")
-        progress_topics = sec.get("progress_topics") or (topics.topics if topics else [])
-        
-        skills_data = sec.get("skills") or {}
-        skills = SkillAssessment(
-            phonics=skills_data.get("phonics") or "Chưa đủ dữ liệu để đánh giá.",
-            speaking=skills_data.get("speaking") or "Chưa đủ dữ liệu để đánh giá.",
-            listening=skills_data.get("listening") or "Chưa đủ dữ liệu để đánh giá.",
-            writing=skills_data.get("writing") or "Chưa đủ dữ liệu để đánh giá."
+        resp = client.models.generate_content(
+            model=GEMINI_MODEL, contents=prompt, config=output_config(ReportSectionsOutput)
         )
-        
-        strengths = ensure_list_len(sec.get("strengths"), 3, f"{name} có thái độ học tập tích cực.")
-        improvements = ensure_list_len(sec.get("improvements"), 2, "Cần luyện tập thêm theo hướng dẫn của giáo viên.")
-        homework_completion = sec.get("homework_completion") or (f"{homework.completion_rate:.0f}%" if homework else "N/A")
-        parent_support = ensure_list_len(sec.get("parent_support"), 3, "Nhắc con làm và nộp bài tập về nhà đầy đủ.")
-
-        sections = {
-            "attendance_rate": attendance_rate,
-            "study_attitude": study_attitude,
-            "progress_level": progress_level,
-            "progress_topics": progress_topics,
-            "skills": skills.model_dump(),
-            "strengths": strengths,
-            "improvements": improvements,
-            "homework_completion": homework_completion,
-            "parent_support": parent_support,
-            "source_summary": source_summary
-        }
+        return _ai_response(resp.text, req, source_summary)
+    except Exception as e:
+        # Fallback if AI fails
+        return _fallback_response(req, source_summary)
 
-        draft_text = _format_draft_text(sections, name)
+async def _generate_with_ai(client, req: MonthlyReportRequest, source_summary: Dict[str, Any]) -> Dict[str, Any]:
+    """One AI attempt; raises on model/parse errors so callers decide on retry or fallback."""
+    store = get_report_store()
+    plan = await store.plan(req) if store.enabled else None
+    if plan is not None:
+        source_summary["report_store"] = plan.summary()
+        if plan.result == "hit":
+            return _ai_response(None, req, source_summary, sec=plan.stored)
 
-        return {
-            "ai_used": True,
-            "draft_text": draft_text,
-            "sections": sections
-        }
+    with observe_stage("prompt_build"):
+        prompt, output = _prepare_call(req, plan, source_summary)
+    resp = await generate_content_async(
+        client, prompt, config=output_config(output), endpoint="a6.monthly_report", expect_json=True
+    )
+    if is_cached(resp):
+        source_summary["cached"] = True
+    with observe_stage("normalize"):
+        sec = parse_output(output, resp.text)
+        if plan is not None and plan.result == "partial":
+            sec = _merge_update(plan, sec)
+        result = _ai_response(None, req, source_summary, sec=sec)
+    if plan is not None:
+        await store.save(plan, result["sections"])
+    return result
+
+@instrumented("a6.monthly_report")
+async def generate_monthly_report_async(req: MonthlyReportRequest) -> Dict[str, Any]:
+    source_summary = _build_source_summary(req)
 
+    client = get_gemini_client()
+    if not client:
+        note_ai_error("MissingApiKey")
+        return _fallback_response(req, source_summary)
+
+    try:
+        return await _generate_with_ai(client, req, source_summary)
+    except ModelOverloaded:
+        raise
     except Exception as e:
-        # Fallback if AI fails
-        rb = _rule_based_sections(req)
-        rb["source_summary"] = source_summary
-        draft_text = _format_draft_text(rb, name)
-        
-        return {
-            "ai_used": False,
-            "draft_text": draft_text,
-            "sections": rb
-        }
+        note_ai_error(e)
+        return _fallback_response(req, source_summary)
+
+async def stream_monthly_report_async(req: MonthlyReportRequest) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    SSE variant of generate_monthly_report_async: yields ("delta", {"text"}) while
+    the model writes, then ("result", <MonthlyReportResponse>). A model error
+    mid-stream ends with the rule-based fallback, like the non-streaming path.
+    When the report store has the report, the deltas only cover the rewritten
+    sections (none on a hit); "result" is always the whole report.
+    """
+    endpoint = "a6.monthly_report"
+    source_summary = _build_source_summary(req)
+    error = None
+    version = None
+    try:
+        client = get_gemini_client()
+        if not client:
+            error = "MissingApiKey"
+            yield "result", _fallback_response(req, source_summary)
+            return
+
+        store = get_report_store()
+        plan = await store.plan(req) if store.enabled else None
+        if plan is not None:
+            source_summary["report_store"] = plan.summary()
+            if plan.result == "hit":
+                yield "result", _ai_response(None, req, source_summary, sec=plan.stored)
+                return
+
+        with observe_stage("prompt_build", endpoint):
+            prompt, output = _prepare_call(req, plan, source_summary)
+        version = (prompt.template.name, prompt.template.version)
+
+        extractor = StreamingJsonExtractor(endpoint=endpoint)
+        try:
+            async for chunk in generate_content_stream_async(
+                client, prompt, config=output_config(output), endpoint=endpoint, expect_json=True
+            ):
+                if is_cached(chunk):
+                    source_summary["cached"] = True
+                if chunk.text:
+                    extractor.feed(chunk.text)
+                    yield "delta", {"text": chunk.text}
+            with observe_stage("json_extract", endpoint):
+                sec = validate_output(output, extractor.result(), repaired=extractor.repaired)
+            with observe_stage("normalize", endpoint):
+                if plan is not None and plan.result == "partial":
+                    sec = _merge_update(plan, sec)
+                result = _ai_response(None, req, source_summary, sec=sec)
+            if plan is not None:
+                await store.save(plan, result["sections"])
+        except ModelOverloaded:
+            error = "ModelOverloaded"
+            raise
+        except Exception as e:
+            error = type(e).__name__
+            result = _fallback_response(req, source_summary)
+        yield "result", result
+    finally:
+        record_ai_result(endpoint, error, version)
@@ -0,0 +1,242 @@
+"""
+Duplicate detection for A7 payment proofs.
+
+Every extracted receipt is kept in a SQLite index (A7_DEDUP_DB) with its
+extraction, which includes account numbers, so receipts older than
+A7_DEDUP_TTL_DAYS (default 180) are deleted along with their hash bands: on
+open and whenever a receipt is added. Near-duplicate lookups only look at the
+last A7_DEDUP_WINDOW_DAYS of that; exact and same-transaction matches at all
+receipts still kept.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from app.core.startup import optional_import
+from app.core.utils import env_int
+
+logger = logging.getLogger("kidzgo.a7.dedup")
+
+DEDUP_ENABLED = os.getenv("A7_DEDUP_ENABLED", "1") not in ("0", "false", "False")
+DEDUP_DB_PATH = os.getenv("A7_DEDUP_DB", os.path.join("data", "a7_receipts.sqlite3"))
+# dHash bits that may differ for two screenshots to count as near-duplicates
+PHASH_MAX_DISTANCE = env_int("A7_PHASH_MAX_DISTANCE", 6)
+# only receipts seen in this window are compared by perceptual hash
+DEDUP_WINDOW_DAYS = env_int("A7_DEDUP_WINDOW_DAYS", 90)
+# receipts (and the personal data in their extraction) are deleted after this
+DEDUP_TTL_DAYS = env_int("A7_DEDUP_TTL_DAYS", 180)
+
+def _to_signed64(x: int) -> int:
+    return x - (1 << 64) if x >= (1 << 63) else x
+
+def _to_unsigned64(x: int) -> int:
+    return x + (1 << 64) if x < 0 else x
+
+def perceptual_hash(fp: BinaryIO) -> Optional[int]:
+    """64-bit difference hash (dHash) of an image file; None if it cannot be decoded."""
+    Image = optional_import("PIL.Image")
+    if Image is None:  # without Pillow only exact and transaction matches are used
+        return None
+    try:
+        fp.seek(0)
+        with Image.open(fp) as img:
+            small = img.convert("L").resize((9, 8), Image.BILINEAR)
+            px = list(small.getdata())
+    except Exception:
+        return None
+    finally:
+        fp.seek(0)
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = px[row * 9 + col]
+            right = px[row * 9 + col + 1]
+            bits = (bits << 1) | (1 if right > left else 0)
+    return bits
+
+def phash_bands(phash: int, bands: int) -> List[int]:
+    """
+    The 64 hash bits cut into `bands` slices. Two hashes within
+    PHASH_MAX_DISTANCE bits of each other share at least one slice when
+    bands = PHASH_MAX_DISTANCE + 1 (pigeonhole), so only receipts with an equal
+    slice have to be compared.
+    """
+    out = []
+    for b in range(bands):
+        start, end = 64 * b // bands, 64 * (b + 1) // bands
+        out.append((phash >> start) & ((1 << (end - start)) - 1))
+    return out
+
+def receipt_id_for(sha256: str) -> str:
+    return sha256[:16]
+
+class ReceiptIndex:
+    """
+    SQLite index of extracted payment proofs.
+
+    Keys: exact content sha256, perceptual hash (near-duplicate screenshots,
+    looked up through the receipt_phash_bands slices), and the extracted
+    transaction_id / (amount, transaction_datetime).
+    """
+
+    def __init__(self, path: str = DEDUP_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS receipts ("
+            " receipt_id TEXT PRIMARY KEY, sha256 TEXT NOT NULL UNIQUE, phash INTEGER,"
+            " branch_id TEXT, direction TEXT, transaction_id TEXT, amount REAL,"
+            " transaction_datetime TEXT, response_json TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_receipts_txn ON receipts(transaction_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_receipts_amount_dt ON receipts(amount, transaction_datetime)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_receipts_created ON receipts(created_at)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS receipt_phash_bands ("
+            " band INTEGER NOT NULL, value INTEGER NOT NULL, receipt_id TEXT NOT NULL,"
+            " PRIMARY KEY (band, value, receipt_id))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.bands = PHASH_MAX_DISTANCE + 1
+        self._rebuild_bands()
+        purged = self._purge(time.time())
+        self._conn.commit()
+        if purged:
+            logger.info("deleted %d receipts older than %d days", purged, DEDUP_TTL_DAYS)
+
+    def _purge(self, now: float) -> int:
+        """Deletes the receipts older than DEDUP_TTL_DAYS and their hash bands; returns how many."""
+        rows = self._conn.execute(
+            "SELECT receipt_id, phash FROM receipts WHERE created_at < ?", (now - DEDUP_TTL_DAYS * 86400,)
+        ).fetchall()
+        if not rows:
+            return 0
+        self._conn.executemany(
+            "DELETE FROM receipt_phash_bands WHERE band = ? AND value = ? AND receipt_id = ?",
+            [
+                (b, v, rid) for rid, phash in rows if phash is not None
+                for b, v in enumerate(phash_bands(_to_unsigned64(phash), self.bands))
+            ],
+        )
+        self._conn.executemany("DELETE FROM receipts WHERE receipt_id = ?", [(rid,) for rid, _ in rows])
+        return len(rows)
+
+    def _rebuild_bands(self) -> None:
+        """(Re)fills receipt_phash_bands for an index created before it or with another A7_PHASH_MAX_DISTANCE."""
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'phash_bands'").fetchone()
+        if row is not None and int(row[0]) == self.bands:
+            return
+        self._conn.execute("DELETE FROM receipt_phash_bands")
+        rows = self._conn.execute("SELECT receipt_id, phash FROM receipts WHERE phash IS NOT NULL").fetchall()
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO receipt_phash_bands (band, value, receipt_id) VALUES (?, ?, ?)",
+            [(b, v, rid) for rid, phash in rows for b, v in enumerate(phash_bands(_to_unsigned64(phash), self.bands))],
+        )
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('phash_bands', ?)", (str(self.bands),))
+        if rows:
+            logger.info("indexed perceptual hashes of %d receipts in %d bands", len(rows), self.bands)
+
+    def find_exact(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT receipt_id, phash, response_json FROM receipts WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "receipt_id": row[0],
+            "phash": _to_unsigned64(row[1]) if row[1] is not None else None,
+            "response": json.loads(row[2]),
+        }
+
+    def find_near(self, phash: Optional[int], exclude: Optional[str] = None) -> List[str]:
+        """Receipts of the last DEDUP_WINDOW_DAYS whose hash is within PHASH_MAX_DISTANCE bits."""
+        if phash is None:
+            return []
+        cutoff = time.time() - DEDUP_WINDOW_DAYS * 86400
+        bands = phash_bands(phash, self.bands)
+        match = " OR ".join(["(b.band = ? AND b.value = ?)"] * len(bands))
+        args = [x for pair in enumerate(bands) for x in pair]
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT r.receipt_id, r.phash FROM receipt_phash_bands b"
+                " JOIN receipts r ON r.receipt_id = b.receipt_id"
+                f" WHERE ({match}) AND r.created_at >= ?",
+                (*args, cutoff),
+            ).fetchall()
+        return [
+            rid for rid, other in rows
+            if rid != exclude and (phash ^ _to_unsigned64(other)).bit_count() <= PHASH_MAX_DISTANCE
+        ]
+
+    def find_transaction(self, fields: Dict[str, Any], exclude: Optional[str] = None) -> Optional[str]:
+        """Another receipt for the same transaction (different image)."""
+        txn = fields.get("transaction_id")
+        amount = fields.get("amount")
+        dt = fields.get("transaction_datetime")
+        with self._lock:
+            if txn:
+                row = self._conn.execute(
+                    "SELECT receipt_id FROM receipts WHERE transaction_id = ? AND receipt_id != ? LIMIT 1",
+                    (str(txn), exclude or ""),
+                ).fetchone()
+                if row:
+                    return row[0]
+            if amount is not None and dt:
+                row = self._conn.execute(
+                    "SELECT receipt_id FROM receipts WHERE amount = ? AND transaction_datetime = ?"
+                    " AND receipt_id != ? LIMIT 1",
+                    (float(amount), str(dt), exclude or ""),
+                ).fetchone()
+                if row:
+                    return row[0]
+        return None
+
+    def add(self, sha256: str, phash: Optional[int], response: Dict[str, Any]) -> str:
+        fields = response.get("fields") or {}
+        rid = receipt_id_for(sha256)
+        amount = fields.get("amount")
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO receipts (receipt_id, sha256, phash, branch_id, direction,"
+                " transaction_id, amount, transaction_datetime, response_json, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    rid, sha256, _to_signed64(phash) if phash is not None else None,
+                    fields.get("branch_id"), fields.get("direction"),
+                    str(fields["transaction_id"]) if fields.get("transaction_id") else None,
+                    float(amount) if amount is not None else None,
+                    str(fields["transaction_datetime"]) if fields.get("transaction_datetime") else None,
+                    json.dumps(response, ensure_ascii=False), now,
+                ),
+            )
+            if phash is not None:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO receipt_phash_bands (band, value, receipt_id) VALUES (?, ?, ?)",
+                    [(b, v, rid) for b, v in enumerate(phash_bands(phash, self.bands))],
+                )
+            self._conn.commit()
+        return rid
+
+_index: Optional[ReceiptIndex] = None
+_index_lock = threading.Lock()
+
+def get_receipt_index() -> Optional[ReceiptIndex]:
+    global _index
+    if not DEDUP_ENABLED:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ReceiptIndex()
+    return _index
@@ -1,6 +1,10 @@
-from fastapi import APIRouter, UploadFile, File, Form
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, UploadFile, File, Form
+from app.core.jobs import JobStatus, job_handler, job_headers, submit_job
+from app.core.uploads import receive_upload
 from app.agents.a7_receipts.schemas import PaymentProofExtractResponse
-from app.agents.a7_receipts.service import extract_payment_proof
+from app.agents.a7_receipts.service import extract_payment_proof_upload_async
 
 router = APIRouter()
 
@@ -10,10 +14,27 @@ async def extract(
     direction: str = Form("IN"),      # IN / OUT
     branch_id: str = Form("UNKNOWN")
 ):
-    img = await file.read()
-    return extract_payment_proof(
-        image_bytes=img,
-        mime_type=file.content_type or "image/jpeg",
+    upload = await receive_upload(file, "/a7/extract-payment-proof", "image/jpeg")
+    return await extract_payment_proof_upload_async(
+        upload=upload,
         direction=direction,
         branch_id=branch_id
     )
+
+# ---- Jobs (app.core.jobs): same work, answered 202 + job id, result via GET /jobs/{id} or callback ----
+
+@job_handler("a7.payment_proof", PaymentProofExtractResponse)
+async def _extract_job(payload, files):
+    return await extract_payment_proof_upload_async(
+        upload=files[0], direction=payload["direction"], branch_id=payload["branch_id"]
+    )
+
+@router.post("/extract-payment-proof/jobs", response_model=JobStatus, status_code=202)
+async def extract_job(
+    file: UploadFile = File(...),
+    direction: str = Form("IN"),
+    branch_id: str = Form("UNKNOWN"),
+    job: Dict[str, Optional[str]] = Depends(job_headers),
+):
+    upload = await receive_upload(file, "/a7/extract-payment-proof/jobs", "image/jpeg")
+    return await submit_job("a7.payment_proof", {"direction": direction, "branch_id": branch_id}, [upload], **job)
@@ -1,5 +1,7 @@
-from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from pydantic import BaseModel, Field
+from typing import Dict, Any, List, Optional, Union
+
+from app.core.structured import output_model
 
 class PaymentProofExtractResponse(BaseModel):
     ai_used: bool
@@ -7,3 +9,38 @@ class PaymentProofExtractResponse(BaseModel):
     confidence: Dict[str, float]
     raw_text: Optional[str] = None
     warnings: List[str] = []
+    receipt_id: Optional[str] = None
+    duplicate_of: Optional[str] = None  # earlier receipt with the same image or transaction
+    duplicate_reason: Optional[str] = None  # exact_image / transaction
+    near_duplicate_of: List[str] = []  # visually similar screenshots (perceptual hash)
+
+# What the model fills (response_schema). direction/branch_id and the dedup
+# fields are set by the server; fields/confidence get fixed keys because
+# response_schema cannot express free-form objects.
+class ReceiptFields(BaseModel):
+    transaction_datetime: Optional[str] = Field(None, description="YYYY-MM-DD HH:mm:ss")
+    amount: Union[float, str, None] = Field(None, description="Số tiền VND, bỏ dấu phân tách nghìn")
+    currency: Optional[str] = Field(None, description="VND")
+    bank_name: Optional[str] = None
+    transaction_id: Optional[str] = Field(None, description="Mã GD/Trace/Ref")
+    content: Optional[str] = Field(None, description="Nội dung chuyển khoản")
+    sender_name: Optional[str] = None
+    sender_account: Optional[str] = None
+    receiver_name: Optional[str] = None
+    receiver_account: Optional[str] = None
+    transaction_type: Optional[str] = None
+
+class ReceiptConfidence(BaseModel):
+    transaction_datetime: Optional[float] = None
+    amount: Optional[float] = None
+    transaction_id: Optional[float] = None
+    content: Optional[float] = None
+    sender_account: Optional[float] = None
+    receiver_account: Optional[float] = None
+
+PaymentProofOutput = output_model(
+    PaymentProofExtractResponse,
+    exclude=("ai_used", "receipt_id", "duplicate_of", "duplicate_reason", "near_duplicate_of"),
+    fields=(ReceiptFields, Field(default_factory=ReceiptFields)),
+    confidence=(ReceiptConfidence, Field(default_factory=ReceiptConfidence)),
+)
@@ -1,54 +1,49 @@
+import asyncio
+import copy
 import json
 from typing import Any, Dict, Optional
-from app.core.gemini_client import get_gemini_client
-from app.core.utils import safe_json_loads, normalize_amount_to_number, normalize_account
+from app.core.gemini_client import get_gemini_client, generate_content_async, GEMINI_MODEL
+from app.core.image_preprocess import preprocess_image_async
+from app.core.keywords import KeywordMatcher
+from app.core.metrics import instrumented, note_ai_error, observe_stage
+from app.core.model_cache import is_cached, CACHED_WARNING
+from app.core.prompts import PromptTemplate, register_prompt, render_prompt
+from app.core.scheduler import ModelOverloaded
+from app.agents.a7_receipts.dedup import get_receipt_index, perceptual_hash
+from app.core.structured import output_config, parse_output
+from app.core.utils import normalize_amount_to_number, normalize_account
+from app.agents.a7_receipts.schemas import PaymentProofOutput
 
-def _infer_transaction_type(content: Optional[str], raw_text: Optional[str]) -> str:
-    haystack = " ".join([content or "", raw_text or ""]).lower()
-    if not haystack.strip():
-        return "Khác"
-
-    rules = {
-        "Trả lương": ["lương", "salary", "payroll"],
-        "Thanh toán cơ sở vật chất": ["cơ sở vật chất", "csvc", "equipment", "vật tư", "mua sắm"],
-        "Thu học phí": ["học phí", "tuition", "course fee", "fee"],
-        "Thuê mặt bằng": ["thuê", "mặt bằng", "rent"],
-        "Hoàn tiền": ["hoàn", "refund", "reimburse"],
-        "Thưởng": ["thưởng", "bonus"],
-        "Phụ cấp": ["phụ cấp", "allowance"],
-        "Đặt cọc": ["đặt cọc", "deposit"],
-    }
+# keyword -> transaction type. Words that qualify a payment ("hoàn", "đặt cọc")
+# weigh more than what was paid for ("học phí"), so "hoàn tiền học phí" is a
+# refund; generic words ("fee", "hoàn") weigh less than specific phrases.
+TRANSACTION_TYPES = KeywordMatcher({
+    "Trả lương": ["lương", "salary", "payroll"],
+    "Thanh toán cơ sở vật chất": ["cơ sở vật chất", "csvc", "equipment", "vật tư", "mua sắm"],
+    "Thu học phí": ["học phí", "tuition", "course fee", ("fee", 0.5)],
+    "Thuê mặt bằng": ["thuê", "mặt bằng", "rent*"],
+    "Hoàn tiền": [("hoàn tiền", 2), ("hoàn phí", 2), ("hoàn trả", 2), "hoàn", ("refund*", 2), ("reimburs*", 2)],
+    "Thưởng": ["thưởng", "bonus*"],
+    "Phụ cấp": ["phụ cấp", "allowance*"],
+    "Đặt cọc": [("đặt cọc", 2), ("tiền cọc", 2), ("deposit*", 2)],
+})
 
-    for label, keywords in rules.items():
-        if any(k in haystack for k in keywords):
-            return label
-    return "Khác"
+# the transfer content is what the payer wrote; the rest of the OCR text
+# (bank boilerplate, balances) is weaker evidence
+_CONTENT_WEIGHT = 2.0
 
-def extract_payment_proof(
-    image_bytes: bytes,
-    mime_type: str,
-    direction: str,
-    branch_id: str
-) -> Dict[str, Any]:
-    client = get_gemini_client()
-    if not client:
-        return {
-            "ai_used": False,
-            "fields": {"direction": direction, "branch_id": branch_id},
-            "confidence": {},
-            "raw_text": None,
-            "warnings": ["Missing GEMINI_API_KEY on server process"]
-        }
-
-    prompt = f"""
-Bạn là trợ lý kế toán của trung tâm Anh ngữ KidzGo.
-Trích xuất dữ liệu từ ảnh biên lai/chứng từ chuyển khoản. Chỉ lấy những gì nhìn thấy rõ; không chắc thì null.
-Trả về DUY NHẤT 1 JSON object (không markdown, không giải thích) theo schema:
+def _infer_transaction_type(content: Optional[str], raw_text: Optional[str]) -> str:
+    content_scores, scores = TRANSACTION_TYPES.score_batch([content, raw_text])
+    for label, score in content_scores.items():
+        scores[label] = scores.get(label, 0.0) + score * _CONTENT_WEIGHT
+    return TRANSACTION_TYPES.pick(scores, "Khác")
+
+# direction/branch_id are set from the request after extraction (as with the
+# response_schema), so the schema block stays static
+_SCHEMA_PROMPT = """Trả về DUY NHẤT 1 JSON object (không markdown, không giải thích) theo schema:
 
-{{
-  "fields": {{
-    "direction": "{direction}",
-    "branch_id": "{branch_id}",
+{
+  "fields": {
     "transaction_datetime": "YYYY-MM-DD HH:mm:ss" | null,
     "amount": number | string | null,
     "currency": "VND" | null,
@@ -59,64 +54,208 @@ Trả về DUY NHẤT 1 JSON object (không markdown, không giải thích) theo
     "sender_account": string | null,
     "receiver_name": string | null,
     "receiver_account": string | null
-  }},
-  "confidence": {{
+  },
+  "confidence": {
     "transaction_datetime": 0.0,
     "amount": 0.0,
     "transaction_id": 0.0,
     "content": 0.0,
     "sender_account": 0.0,
     "receiver_account": 0.0
-  }},
+  },
   "raw_text": string | null,
   "warnings": [string]
-}}
+}
+"""
 
+register_prompt(PromptTemplate(
+    "a7.payment_proof",
+    "v1",
+    prefix="""
+Bạn là trợ lý kế toán của trung tâm Anh ngữ KidzGo.
+Trích xuất dữ liệu từ ảnh biên lai/chứng từ chuyển khoản. Chỉ lấy những gì nhìn thấy rõ; không chắc thì null.
+{schema}
 Quy tắc:
 - amount phải chuẩn hóa về số (VND), bỏ dấu phẩy/chấm phân tách nghìn.
 - Ưu tiên lấy: Số tiền, Ngày giờ, Mã GD/Trace/Ref, Nội dung.
 - Phân loại transaction_type dựa trên nội dung, ví dụ: "Trả lương", "Thu học phí",
   "Thanh toán cơ sở vật chất", "Thuê mặt bằng", "Hoàn tiền", "Thưởng", "Phụ cấp", "Đặt cọc", "Khác".
-"""
+""",
+    suffix="""
+Chứng từ:
+- direction: {direction} (IN = tiền vào trung tâm, OUT = tiền ra)
+- branch_id: {branch_id}
+""",
+    schema=_SCHEMA_PROMPT,
+))
+
+def _build_prompt(direction: str, branch_id: str) -> str:
+    return render_prompt("a7.payment_proof", direction=direction, branch_id=branch_id)
+
+def _contents(prompt: str, image_bytes: bytes, mime_type: str):
+    return [
+        prompt,
+        {"inline_data": {"mime_type": mime_type or "image/jpeg", "data": image_bytes}},
+    ]
+
+def _missing_key_response(direction: str, branch_id: str) -> Dict[str, Any]:
+    note_ai_error("MissingApiKey")
+    return {
+        "ai_used": False,
+        "fields": {"direction": direction, "branch_id": branch_id},
+        "confidence": {},
+        "raw_text": None,
+        "warnings": ["Missing GEMINI_API_KEY on server process"]
+    }
+
+def _failed_response(direction: str, branch_id: str, e: Exception) -> Dict[str, Any]:
+    note_ai_error(e)
+    return {
+        "ai_used": False,
+        "fields": {"direction": direction, "branch_id": branch_id},
+        "confidence": {},
+        "raw_text": None,
+        "warnings": [f"AI extract failed: {type(e).__name__}: {str(e)}"]
+    }
+
+def _extracted_response(text: Optional[str], direction: str, branch_id: str, cached: bool = False) -> Dict[str, Any]:
+    obj = parse_output(PaymentProofOutput, text)
+
+    fields = obj.get("fields") or {}
+    confidence = obj.get("confidence") or {}
+    raw_text = obj.get("raw_text")
+    warnings = obj.get("warnings") or []
+    if cached:
+        warnings = [*warnings, CACHED_WARNING]
+
+    # Normalize
+    fields["direction"] = direction
+    fields["branch_id"] = branch_id
+    fields["amount"] = normalize_amount_to_number(fields.get("amount"))
+    fields["sender_account"] = normalize_account(fields.get("sender_account"))
+    fields["receiver_account"] = normalize_account(fields.get("receiver_account"))
+    fields["transaction_type"] = fields.get("transaction_type") or _infer_transaction_type(
+        fields.get("content"),
+        raw_text,
+    )
+
+    return {
+        "ai_used": True,
+        "fields": fields,
+        "confidence": {k: float(v) for k, v in confidence.items() if v is not None},
+        "raw_text": raw_text,
+        "warnings": warnings
+    }
+
+def extract_payment_proof(
+    image_bytes: bytes,
+    mime_type: str,
+    direction: str,
+    branch_id: str
+) -> Dict[str, Any]:
+    client = get_gemini_client()
+    if not client:
+        return _missing_key_response(direction, branch_id)
+
+    prompt = _build_prompt(direction, branch_id)
 
     try:
         resp = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[
-                prompt,
-                {"inline_data": {"mime_type": mime_type or "image/jpeg", "data": image_bytes}},
-            ],
-        )
-        obj = safe_json_loads(resp.text or "")
-
-        fields = obj.get("fields") or {}
-        confidence = obj.get("confidence") or {}
-        raw_text = obj.get("raw_text")
-        warnings = obj.get("warnings") or []
-
-        # Normalize
-        fields["direction"] = direction
-        fields["branch_id"] = branch_id
-        fields["amount"] = normalize_amount_to_number(fields.get("amount"))
-        fields["sender_account"] = normalize_account(fields.get("sender_account"))
-        fields["receiver_account"] = normalize_account(fields.get("receiver_account"))
-        fields["transaction_type"] = fields.get("transaction_type") or _infer_transaction_type(
-            fields.get("content"),
-            raw_text,
+            model=GEMINI_MODEL,
+            contents=_contents(prompt, image_bytes, mime_type),
+            config=output_config(PaymentProofOutput),
         )
+        return _extracted_response(resp.text, direction, branch_id)
+    except Exception as e:
+        return _failed_response(direction, branch_id, e)
 
-        return {
-            "ai_used": True,
-            "fields": fields,
-            "confidence": {k: float(v) for k, v in confidence.items() if v is not None},
-            "raw_text": raw_text,
-            "warnings": warnings
-        }
+@instrumented("a7.payment_proof")
+async def extract_payment_proof_async(
+    image,
+    mime_type: str,
+    direction: str,
+    branch_id: str
+) -> Dict[str, Any]:
+    """image: bytes or a seekable binary file (spooled upload)."""
+    client = get_gemini_client()
+    if not client:
+        return _missing_key_response(direction, branch_id)
+
+    with observe_stage("prompt_build"):
+        prompt = _build_prompt(direction, branch_id)
+    prepared = await preprocess_image_async(image, mime_type, document=True, label="a7.payment_proof")
+
+    try:
+        resp = await generate_content_async(
+            client,
+            _contents(prompt, prepared.data, prepared.mime_type),
+            config=output_config(PaymentProofOutput),
+            endpoint="a7.payment_proof",
+            expect_json=True,
+        )
+        with observe_stage("normalize"):
+            return _extracted_response(resp.text, direction, branch_id, cached=is_cached(resp))
+    except ModelOverloaded:
+        raise
     except Exception as e:
-        return {
-            "ai_used": False,
-            "fields": {"direction": direction, "branch_id": branch_id},
-            "confidence": {},
-            "raw_text": None,
-            "warnings": [f"AI extract failed: {type(e).__name__}: {str(e)}"]
-        }
+        return _failed_response(direction, branch_id, e)
+
+_DEDUP_KEYS = ("receipt_id", "duplicate_of", "duplicate_reason", "near_duplicate_of")
+_DEDUP_WARNINGS = ("Duplicate upload of receipt ", "Looks like receipt(s) already uploaded: ", "Same transaction as receipt ")
+
+def _without_dedup_notes(response: Dict[str, Any]) -> Dict[str, Any]:
+    """A stored extraction without the duplicate flags of the upload it came from (older index rows have them)."""
+    out = {k: v for k, v in response.items() if k not in _DEDUP_KEYS}
+    out["warnings"] = [w for w in response.get("warnings") or [] if not w.startswith(_DEDUP_WARNINGS)]
+    return out
+
+@instrumented("a7.payment_proof")
+async def extract_payment_proof_upload_async(upload, direction: str, branch_id: str) -> Dict[str, Any]:
+    """
+    /a7/extract-payment-proof with the receipt dedup index in front:
+    - same bytes as an indexed receipt -> stored extraction, no model call
+    - visually similar screenshot -> extracted, flagged in near_duplicate_of
+    - same transaction_id (or amount + datetime) as another receipt -> flagged in duplicate_of
+    """
+    index = get_receipt_index()
+    if index is None:
+        return await extract_payment_proof_async(upload.file, upload.content_type, direction, branch_id)
+
+    hit = await asyncio.to_thread(index.find_exact, upload.sha256)
+    if hit is not None:
+        # the stored extraction; the duplicate checks are redone against today's index
+        out = _without_dedup_notes(hit["response"])
+        out["fields"]["direction"] = direction
+        out["fields"]["branch_id"] = branch_id
+        out["receipt_id"] = hit["receipt_id"]
+        out["duplicate_of"] = hit["receipt_id"]
+        out["duplicate_reason"] = "exact_image"
+        out["warnings"].append(f"Duplicate upload of receipt {hit['receipt_id']}")
+        near = await asyncio.to_thread(index.find_near, hit["phash"], hit["receipt_id"])
+        if near:
+            out["near_duplicate_of"] = near
+            out["warnings"].append(f"Looks like receipt(s) already uploaded: {', '.join(near)}")
+        same_txn = await asyncio.to_thread(index.find_transaction, out["fields"], hit["receipt_id"])
+        if same_txn:
+            out["warnings"].append(f"Same transaction as receipt {same_txn}")
+        return out
+
+    phash = await asyncio.to_thread(perceptual_hash, upload.file)
+    near = await asyncio.to_thread(index.find_near, phash)
+
+    out = await extract_payment_proof_async(upload.file, upload.content_type, direction, branch_id)
+    if out["ai_used"]:
+        same_txn = await asyncio.to_thread(index.find_transaction, out["fields"])
+        # stored before the duplicate notes, which are only true for this upload
+        out["receipt_id"] = await asyncio.to_thread(index.add, upload.sha256, phash, copy.deepcopy(out))
+    if near:
+        out["near_duplicate_of"] = near
+        out["warnings"].append(f"Looks like receipt(s) already uploaded: {', '.join(near)}")
+    if not out["ai_used"]:
+        return out
+
+    if same_txn and same_txn != out["receipt_id"]:
+        out["duplicate_of"] = same_txn
+        out["duplicate_reason"] = "transaction"
+        out["warnings"].append(f"Same transaction as receipt {same_txn}")
+    return out
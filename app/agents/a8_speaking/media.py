@@ -0,0 +1,102 @@
+import asyncio
+import glob
+import logging
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, List
+
+from app.core.utils import env_int
+
+logger = logging.getLogger("kidzgo.a8.media")
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN") or shutil.which("ffmpeg")
+AUDIO_SAMPLE_RATE = env_int("A8_AUDIO_SAMPLE_RATE", 16000)
+AUDIO_BITRATE = os.getenv("A8_AUDIO_BITRATE", "24k")
+SEGMENT_SECONDS = env_int("A8_SEGMENT_SECONDS", 120)
+SILENCE_DB = env_int("A8_SILENCE_DB", -40)
+# pauses inside the recording longer than this (seconds) are shortened to it,
+# not removed: hesitations are part of what fluency_score grades, only dead air goes
+PAUSE_MAX_SECONDS = os.getenv("A8_PAUSE_MAX_SECONDS", "3")
+FFMPEG_TIMEOUT = env_int("A8_FFMPEG_TIMEOUT", 300)
+
+AUDIO_MIME_TYPE = "audio/ogg"
+
+@dataclass
+class AudioSegment:
+    index: int
+    data: bytes
+    mime_type: str = AUDIO_MIME_TYPE
+
+def media_pipeline_available() -> bool:
+    return bool(FFMPEG_BIN)
+
+def _copy_to_path(src: BinaryIO, path: str) -> int:
+    src.seek(0)
+    with open(path, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+        size = dst.tell()
+    src.seek(0)
+    return size
+
+def _ffmpeg_args(src_path: str, out_pattern: str) -> List[str]:
+    # leading silence is trimmed; every later pause is kept up to PAUSE_MAX_SECONDS
+    silence = (
+        f"silenceremove=start_periods=1:start_threshold={SILENCE_DB}dB"
+        f":stop_periods=-1:stop_threshold={SILENCE_DB}dB"
+        f":stop_duration={PAUSE_MAX_SECONDS}:stop_silence={PAUSE_MAX_SECONDS}"
+    )
+    return [
+        FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-y",
+        "-i", src_path,
+        "-vn",                          # drop video track
+        "-ac", "1",                     # mono
+        "-ar", str(AUDIO_SAMPLE_RATE),  # resample
+        "-af", silence,
+        "-c:a", "libopus", "-b:a", AUDIO_BITRATE,
+        "-f", "segment", "-segment_time", str(SEGMENT_SECONDS),
+        out_pattern,
+    ]
+
+async def prepare_audio_segments(src: BinaryIO) -> List[AudioSegment]:
+    """
+    Student recording (any audio/video container) -> low-bitrate mono Opus
+    segments of at most SEGMENT_SECONDS; leading silence is trimmed and long
+    pauses are shortened to PAUSE_MAX_SECONDS (still audible as hesitations).
+    ffmpeg runs as a subprocess, so the event loop is not blocked.
+    """
+    if not FFMPEG_BIN:
+        raise RuntimeError("ffmpeg not available")
+
+    with tempfile.TemporaryDirectory(prefix="kidzgo-a8-") as workdir:
+        src_path = os.path.join(workdir, "input")
+        size_in = await asyncio.to_thread(_copy_to_path, src, src_path)
+        out_pattern = os.path.join(workdir, "seg_%03d.ogg")
+
+        proc = await asyncio.create_subprocess_exec(
+            *_ffmpeg_args(src_path, out_pattern),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, stderr = await asyncio.wait_for(proc.communicate(), timeout=FFMPEG_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode('utf-8', 'replace').strip()[-500:]}")
+
+        segments = []
+        for i, path in enumerate(sorted(glob.glob(os.path.join(workdir, "seg_*.ogg")))):
+            with open(path, "rb") as f:
+                data = f.read()
+            if data:
+                segments.append(AudioSegment(index=i, data=data))
+
+    logger.info(
+        "a8 media: %d bytes -> %d segment(s), %d bytes",
+        size_in, len(segments), sum(len(s.data) for s in segments),
+    )
+    return segments
@@ -1,12 +1,29 @@
-from fastapi import APIRouter, UploadFile, File
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, UploadFile, File
+from app.core.jobs import JobStatus, job_handler, job_headers, submit_job
+from app.core.uploads import receive_upload
 from app.agents.a8_speaking.schemas import AnalyzeTranscriptRequest, AnalyzeSpeakingResponse
-from app.agents.a8_speaking.service import analyze_transcript, analyze_media_bytes
+from app.agents.a8_speaking.service import analyze_transcript_async, analyze_media_upload_async
 
 router = APIRouter()
 
+class _MediaContext:
+    """quick context object from the /analyze-media query fields"""
+
+    def __init__(self, homework_id: str, student_id: str, mode: str = "phonics", target_words: str = "",
+                 expected_text: str = "", instructions: str = "", language: str = "vi"):
+        self.homework_id = homework_id
+        self.student_id = student_id
+        self.mode = mode
+        self.target_words = [x.strip() for x in target_words.split(",") if x.strip()]
+        self.expected_text = expected_text or None
+        self.instructions = instructions or None
+        self.language = language
+
 @router.post("/analyze-transcript", response_model=AnalyzeSpeakingResponse)
-def analyze_transcript_api(req: AnalyzeTranscriptRequest):
-    return analyze_transcript(req.context, req.transcript)
+async def analyze_transcript_api(req: AnalyzeTranscriptRequest):
+    return await analyze_transcript_async(req.context, req.transcript)
 
 @router.post("/analyze-media", response_model=AnalyzeSpeakingResponse)
 async def analyze_media_api(
@@ -19,16 +36,40 @@ async def analyze_media_api(
     language: str = "vi",
     file: UploadFile = File(...)
 ):
-    # quick context object
-    class Ctx:
-        def __init__(self):
-            self.homework_id = homework_id
-            self.student_id = student_id
-            self.mode = mode
-            self.target_words = [x.strip() for x in target_words.split(",") if x.strip()]
-            self.expected_text = expected_text or None
-            self.instructions = instructions or None
-            self.language = language
-
-    media = await file.read()
-    return analyze_media_bytes(Ctx(), media, file.content_type or "video/mp4")
+    ctx = _MediaContext(homework_id, student_id, mode, target_words, expected_text, instructions, language)
+    upload = await receive_upload(file, "/a8/analyze-media", "video/mp4")
+    return await analyze_media_upload_async(ctx, upload)
+
+# ---- Jobs (app.core.jobs): same work, answered 202 + job id, result via GET /jobs/{id} or callback ----
+
+@job_handler("a8.analyze_transcript", AnalyzeSpeakingResponse)
+async def _analyze_transcript_job(payload, files):
+    req = AnalyzeTranscriptRequest.model_validate(payload)
+    return await analyze_transcript_async(req.context, req.transcript)
+
+@job_handler("a8.analyze_media", AnalyzeSpeakingResponse)
+async def _analyze_media_job(payload, files):
+    return await analyze_media_upload_async(_MediaContext(**payload), files[0])
+
+@router.post("/analyze-transcript/jobs", response_model=JobStatus, status_code=202)
+async def analyze_transcript_job_api(req: AnalyzeTranscriptRequest, job: Dict[str, Optional[str]] = Depends(job_headers)):
+    return await submit_job("a8.analyze_transcript", req.model_dump(), **job)
+
+@router.post("/analyze-media/jobs", response_model=JobStatus, status_code=202)
+async def analyze_media_job_api(
+    homework_id: str,
+    student_id: str,
+    mode: str = "phonics",
+    target_words: str = "",
+    expected_text: str = "",
+    instructions: str = "",
+    language: str = "vi",
+    file: UploadFile = File(...),
+    job: Dict[str, Optional[str]] = Depends(job_headers),
+):
+    upload = await receive_upload(file, "/a8/analyze-media/jobs", "video/mp4")
+    payload = {
+        "homework_id": homework_id, "student_id": student_id, "mode": mode, "target_words": target_words,
+        "expected_text": expected_text, "instructions": instructions, "language": language,
+    }
+    return await submit_job("a8.analyze_media", payload, [upload], **job)
@@ -1,6 +1,8 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 
+from app.core.structured import output_model
+
 class SpeakingContext(BaseModel):
     homework_id: str
     student_id: str
@@ -28,6 +30,17 @@ class SpeakingResult(BaseModel):
     raw_text: Optional[str] = None
     warnings: List[str] = Field(default_factory=list)
 
+class SpeakingConfidence(BaseModel):
+    transcript: float = 0.0
+    scoring: float = 0.0
+
+# What the model fills (response_schema); raw_text is set by the server
+SpeakingOutput = output_model(
+    SpeakingResult,
+    exclude=("raw_text",),
+    confidence=(SpeakingConfidence, Field(default_factory=SpeakingConfidence)),
+)
+
 class AnalyzeSpeakingResponse(BaseModel):
     ai_used: bool
     result: SpeakingResult
@@ -1,37 +1,22 @@
-from app.core.gemini_client import get_gemini_client
-from app.core.utils import safe_json_loads, ensure_list_len
+import asyncio
 
-def analyze_transcript(context, transcript: str):
-    client = get_gemini_client()
-    if not client:
-        return {
-            "ai_used": False,
-            "result": {
-                "transcript": transcript,
-                "overall_score": 0,
-                "pronunciation_score": 0,
-                "fluency_score": 0,
-                "accuracy_score": 0,
-                "phonics_issues": [],
-                "speaking_issues": [],
-                "suggestions": [],
-                "practice_plan": [],
-                "confidence": {},
-                "raw_text": None,
-                "warnings": ["Missing GEMINI_API_KEY"]
-            }
-        }
+from app.core.gemini_client import (
+    get_gemini_client, generate_content_async, upload_media_async, delete_media_async, GEMINI_MODEL
+)
+from app.core.metrics import instrumented, note_ai_error, observe_stage
+from app.core.model_cache import is_cached, CACHED_WARNING
+from app.core.prompts import PromptTemplate, register_prompt, render_prompt
+from app.core.scheduler import ModelOverloaded
+from app.core.structured import output_config, parse_output
+from app.core.utils import ensure_list_len, env_int
+from app.agents.a8_speaking.schemas import SpeakingOutput
+from app.agents.a8_speaking.media import media_pipeline_available, prepare_audio_segments
 
-    prompt = f"""
-Bạn là giáo viên KidzGo chấm Speaking/Phonics.
-Dựa trên transcript (và target words/expected text nếu có), hãy:
-- Chấm điểm phát âm, độ trôi chảy, độ chính xác (0-10)
-- Liệt kê lỗi phonics (nếu mode=phonics) hoặc lỗi speaking (nếu mode=speaking)
-- Gợi ý luyện tập cụ thể (drill, shadowing, minimal pairs, đọc âm cuối...)
-Không bịa dữ liệu không có.
+# Larger recordings go through the Files API from the spooled upload instead of inline bytes
+MEDIA_INLINE_MAX_BYTES = env_int("A8_INLINE_MAX_BYTES", 8 * 1024 * 1024)
+SEGMENT_CONCURRENCY = env_int("A8_SEGMENT_CONCURRENCY", 4)
 
-Trả về DUY NHẤT 1 JSON object:
-{{
+_RESULT_SCHEMA = """{
   "transcript": "string",
   "overall_score": number,
   "pronunciation_score": number,
@@ -41,64 +26,192 @@ Trả về DUY NHẤT 1 JSON object:
   "speaking_issues": ["..."],
   "suggestions": ["..."],
   "practice_plan": ["..."],
-  "confidence": {{"transcript": 0.0, "scoring": 0.0}},
+  "confidence": {"transcript": 0.0, "scoring": 0.0},
   "warnings": ["..."]
-}}
+}"""
+
+_SCHEMA_PROMPT = f"""Trả về DUY NHẤT 1 JSON object:
+{_RESULT_SCHEMA}
+"""
+
+def _empty_response(transcript: str, suggestions, warnings):
+    return {
+        "ai_used": False,
+        "result": {
+            "transcript": transcript,
+            "overall_score": 0,
+            "pronunciation_score": 0,
+            "fluency_score": 0,
+            "accuracy_score": 0,
+            "phonics_issues": [],
+            "speaking_issues": [],
+            "suggestions": suggestions,
+            "practice_plan": [],
+            "confidence": {},
+            "raw_text": None,
+            "warnings": warnings
+        }
+    }
+
+def _missing_key_response(transcript: str):
+    note_ai_error("MissingApiKey")
+    return _empty_response(transcript, [], ["Missing GEMINI_API_KEY"])
+
+def _transcript_failed_response(transcript: str, e: Exception):
+    note_ai_error(e)
+    return _empty_response(
+        transcript,
+        ["AI lỗi, vui lòng thử lại."],
+        [f"AI failed: {type(e).__name__}: {str(e)}"],
+    )
+
+def _media_failed_response(e: Exception):
+    note_ai_error(e)
+    return _empty_response(
+        "",
+        ["Model có thể không hỗ trợ audio/video trực tiếp. Hãy dùng endpoint analyze-transcript (ASR trước)."],
+        [f"AI media failed: {type(e).__name__}: {str(e)}"],
+    )
+
+register_prompt(PromptTemplate(
+    "a8.transcript",
+    "v1",
+    prefix="""
+Bạn là giáo viên KidzGo chấm Speaking/Phonics.
+Dựa trên transcript (và target words/expected text nếu có), hãy:
+- Chấm điểm phát âm, độ trôi chảy, độ chính xác (0-10)
+- Liệt kê lỗi phonics (nếu mode=phonics) hoặc lỗi speaking (nếu mode=speaking)
+- Gợi ý luyện tập cụ thể (drill, shadowing, minimal pairs, đọc âm cuối...)
+Không bịa dữ liệu không có.
 
-Context:
-- Mode: {context.mode}
-- Target words: {context.target_words}
-- Expected text: {context.expected_text or "N/A"}
-- Instructions: {context.instructions or "N/A"}
+{schema}""",
+    suffix="""Context:
+- Mode: {mode}
+- Target words: {target_words}
+- Expected text: {expected_text}
+- Instructions: {instructions}
 
 Transcript:
 {transcript}
 
-Ngôn ngữ phản hồi: {context.language}
-"""
+Ngôn ngữ phản hồi: {language}
+""",
+    schema=_SCHEMA_PROMPT,
+))
 
-    try:
-        resp = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-        obj = safe_json_loads(resp.text or "")
-
-        suggestions = ensure_list_len(obj.get("suggestions"), 3, "Luyện tập 5–10 phút mỗi ngày theo hướng dẫn.")
-        practice_plan = ensure_list_len(obj.get("practice_plan"), 3, "Shadowing 3–5 phút/ngày với câu ngắn.")
-
-        return {
-            "ai_used": True,
-            "result": {
-                "transcript": (obj.get("transcript") or transcript).strip(),
-                "overall_score": float(obj.get("overall_score", 0)),
-                "pronunciation_score": float(obj.get("pronunciation_score", 0)),
-                "fluency_score": float(obj.get("fluency_score", 0)),
-                "accuracy_score": float(obj.get("accuracy_score", 0)),
-                "phonics_issues": (obj.get("phonics_issues") or [])[:8],
-                "speaking_issues": (obj.get("speaking_issues") or [])[:8],
-                "suggestions": suggestions,
-                "practice_plan": practice_plan,
-                "confidence": obj.get("confidence") or {},
-                "raw_text": resp.text,
-                "warnings": obj.get("warnings") or []
-            }
+register_prompt(PromptTemplate(
+    "a8.media",
+    "v1",
+    prefix="""
+Bạn là giáo viên KidzGo. File đính kèm là audio/video học sinh luyện nói/phonics.
+Trong MỘT lần trả lời, hãy:
+1) Tạo transcript ngắn gọn (tiếng Anh nếu học sinh nói tiếng Anh)
+2) Chấm điểm phát âm, độ trôi chảy, độ chính xác (0-10) dựa trên audio và transcript
+3) Liệt kê lỗi phonics (nếu mode=phonics) hoặc lỗi speaking (nếu mode=speaking)
+4) Gợi ý luyện tập cụ thể (drill, shadowing, minimal pairs, đọc âm cuối...)
+Không bịa dữ liệu không có.
+
+{schema}""",
+    suffix="""{part}Context:
+- Mode: {mode}
+- Target words: {target_words}
+- Expected text: {expected_text}
+- Instructions: {instructions}
+Ngôn ngữ phản hồi: {language}
+""",
+    schema=_SCHEMA_PROMPT,
+))
+
+def _context_values(context) -> dict:
+    return {
+        "mode": context.mode,
+        "target_words": context.target_words,
+        "expected_text": context.expected_text or "N/A",
+        "instructions": context.instructions or "N/A",
+        "language": context.language,
+    }
+
+def _build_transcript_prompt(context, transcript: str) -> str:
+    return render_prompt(
+        "a8.transcript", key=context.student_id, transcript=transcript, **_context_values(context)
+    )
+
+def _build_media_prompt(context, segment_index: int | None = None, segment_count: int | None = None) -> str:
+    part = ""
+    if segment_count and segment_count > 1:
+        part = f"Đây là đoạn {segment_index + 1}/{segment_count} của bài nói (đã cắt bỏ khoảng lặng). Chỉ chấm phần nghe được trong đoạn này.\n"
+    return render_prompt("a8.media", key=context.student_id, part=part, **_context_values(context))
+
+def _media_contents(prompt: str, media_bytes: bytes, mime_type: str):
+    return [
+        prompt,
+        {"inline_data": {"mime_type": mime_type or "video/mp4", "data": media_bytes}},
+    ]
+
+def _scored_response(raw_text: str | None, transcript: str, cached: bool = False):
+    obj = parse_output(SpeakingOutput, raw_text)
+    with observe_stage("normalize"):
+        return _scored_response_from_obj(obj, raw_text, transcript, cached)
+
+def _scored_response_from_obj(obj, raw_text: str | None, transcript: str, cached: bool = False):
+    warnings = obj.get("warnings") or []
+    if cached:
+        warnings = [*warnings, CACHED_WARNING]
+
+    suggestions = ensure_list_len(obj.get("suggestions"), 3, "Luyện tập 5–10 phút mỗi ngày theo hướng dẫn.")
+    practice_plan = ensure_list_len(obj.get("practice_plan"), 3, "Shadowing 3–5 phút/ngày với câu ngắn.")
+
+    return {
+        "ai_used": True,
+        "result": {
+            "transcript": (obj.get("transcript") or transcript).strip(),
+            "overall_score": float(obj.get("overall_score", 0)),
+            "pronunciation_score": float(obj.get("pronunciation_score", 0)),
+            "fluency_score": float(obj.get("fluency_score", 0)),
+            "accuracy_score": float(obj.get("accuracy_score", 0)),
+            "phonics_issues": (obj.get("phonics_issues") or [])[:8],
+            "speaking_issues": (obj.get("speaking_issues") or [])[:8],
+            "suggestions": suggestions,
+            "practice_plan": practice_plan,
+            "confidence": obj.get("confidence") or {},
+            "raw_text": raw_text,
+            "warnings": warnings
         }
+    }
+
+def analyze_transcript(context, transcript: str):
+    client = get_gemini_client()
+    if not client:
+        return _missing_key_response(transcript)
+
+    prompt = _build_transcript_prompt(context, transcript)
+
+    try:
+        resp = client.models.generate_content(
+            model=GEMINI_MODEL, contents=prompt, config=output_config(SpeakingOutput)
+        )
+        return _scored_response(resp.text, transcript)
     except Exception as e:
-        return {
-            "ai_used": False,
-            "result": {
-                "transcript": transcript,
-                "overall_score": 0,
-                "pronunciation_score": 0,
-                "fluency_score": 0,
-                "accuracy_score": 0,
-                "phonics_issues": [],
-                "speaking_issues": [],
-                "suggestions": ["AI lỗi, vui lòng thử lại."],
-                "practice_plan": [],
-                "confidence": {},
-                "raw_text": None,
-                "warnings": [f"AI failed: {type(e).__name__}: {str(e)}"]
-            }
-        }
+        return _transcript_failed_response(transcript, e)
+
+@instrumented("a8.transcript")
+async def analyze_transcript_async(context, transcript: str):
+    client = get_gemini_client()
+    if not client:
+        return _missing_key_response(transcript)
+
+    with observe_stage("prompt_build"):
+        prompt = _build_transcript_prompt(context, transcript)
+
+    try:
+        resp = await generate_content_async(
+            client, prompt, config=output_config(SpeakingOutput), endpoint="a8.transcript", expect_json=True
+        )
+        return _scored_response(resp.text, transcript, cached=is_cached(resp))
+    except ModelOverloaded:
+        raise
+    except Exception as e:
+        return _transcript_failed_response(transcript, e)
 
 def analyze_media_bytes(context, media_bytes: bytes, mime_type: str):
     """
@@ -107,66 +220,168 @@ def analyze_media_bytes(context, media_bytes: bytes, mime_type: str):
     """
     client = get_gemini_client()
     if not client:
-        return {
-            "ai_used": False,
-            "result": {
-                "transcript": "",
-                "overall_score": 0,
-                "pronunciation_score": 0,
-                "fluency_score": 0,
-                "accuracy_score": 0,
-                "phonics_issues": [],
-                "speaking_issues": [],
-                "suggestions": [],
-                "practice_plan": [],
-                "confidence": {},
-                "raw_text": None,
-                "warnings": ["Missing GEMINI_API_KEY"]
-            }
-        }
+        return _missing_key_response("")
 
-    prompt = f"""
-Bạn là giáo viên KidzGo. File đính kèm là audio/video học sinh luyện nói/phonics.
-Hãy:
-1) Tạo transcript ngắn gọn (tiếng Anh nếu học sinh nói tiếng Anh)
-2) Chấm và feedback theo context
+    prompt = _build_media_prompt(context)
 
-Trả về DUY NHẤT 1 JSON object theo schema giống analyze_transcript.
+    try:
+        resp = client.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=_media_contents(prompt, media_bytes, mime_type),
+            config=output_config(SpeakingOutput),
+        )
+        return _scored_response(resp.text, "")
+    except Exception as e:
+        return _media_failed_response(e)
 
-Context:
-- Mode: {context.mode}
-- Target words: {context.target_words}
-- Expected text: {context.expected_text or "N/A"}
-- Instructions: {context.instructions or "N/A"}
-Ngôn ngữ phản hồi: {context.language}
-"""
+@instrumented("a8.media")
+async def analyze_media_bytes_async(context, media_bytes: bytes, mime_type: str):
+    client = get_gemini_client()
+    if not client:
+        return _missing_key_response("")
+
+    with observe_stage("prompt_build"):
+        prompt = _build_media_prompt(context)
 
     try:
-        resp = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[
-                prompt,
-                {"inline_data": {"mime_type": mime_type or "video/mp4", "data": media_bytes}},
-            ],
+        resp = await generate_content_async(
+            client,
+            _media_contents(prompt, media_bytes, mime_type),
+            config=output_config(SpeakingOutput),
+            endpoint="a8.media",
+            expect_json=True,
         )
-        obj = safe_json_loads(resp.text or "")
-        # reuse normalize
-        return analyze_transcript(context, obj.get("transcript") or "")
+        return _scored_response(resp.text, "", cached=is_cached(resp))
+    except ModelOverloaded:
+        raise
     except Exception as e:
-        return {
-            "ai_used": False,
-            "result": {
-                "transcript": "",
-                "overall_score": 0,
-                "pronunciation_score": 0,
-                "fluency_score": 0,
-                "accuracy_score": 0,
-                "phonics_issues": [],
-                "speaking_issues": [],
-                "suggestions": ["Model có thể không hỗ trợ audio/video trực tiếp. Hãy dùng endpoint analyze-transcript (ASR trước)."],
-                "practice_plan": [],
-                "confidence": {},
-                "raw_text": None,
-                "warnings": [f"AI media failed: {type(e).__name__}: {str(e)}"]
-            }
+        return _media_failed_response(e)
+
+def _dedupe(items, limit: int):
+    out, seen = [], set()
+    for x in items:
+        if isinstance(x, str) and x.strip() and x.strip().lower() not in seen:
+            seen.add(x.strip().lower())
+            out.append(x.strip())
+    return out[:limit]
+
+def _merge_segment_responses(responses, weights):
+    """Combine per-segment results: transcripts joined, scores weighted by segment size."""
+    results = [r["result"] for r in responses]
+    total = float(sum(weights)) or 1.0
+
+    def wavg(key: str) -> float:
+        return round(sum(float(r[key]) * w for r, w in zip(results, weights)) / total, 2)
+
+    confidence = {}
+    for key in {k for r in results for k in (r.get("confidence") or {})}:
+        values = [float(r["confidence"][key]) for r in results if key in (r.get("confidence") or {})]
+        confidence[key] = round(sum(values) / len(values), 3)
+
+    return {
+        "ai_used": True,
+        "result": {
+            "transcript": " ".join(r["transcript"] for r in results if r["transcript"]).strip(),
+            "overall_score": wavg("overall_score"),
+            "pronunciation_score": wavg("pronunciation_score"),
+            "fluency_score": wavg("fluency_score"),
+            "accuracy_score": wavg("accuracy_score"),
+            "phonics_issues": _dedupe([x for r in results for x in r["phonics_issues"]], 8),
+            "speaking_issues": _dedupe([x for r in results for x in r["speaking_issues"]], 8),
+            "suggestions": _dedupe([x for r in results for x in r["suggestions"]], 3),
+            "practice_plan": _dedupe([x for r in results for x in r["practice_plan"]], 3),
+            "confidence": confidence,
+            "raw_text": "\n".join(r["raw_text"] or "" for r in results),
+            "warnings": _dedupe([x for r in results for x in r["warnings"]], 20),
         }
+    }
+
+async def _analyze_segments(client, context, segments):
+    sem = asyncio.Semaphore(SEGMENT_CONCURRENCY)
+
+    async def one(seg):
+        async with sem:
+            with observe_stage("prompt_build"):
+                prompt = _build_media_prompt(context, seg.index, len(segments))
+            resp = await generate_content_async(
+                client,
+                _media_contents(prompt, seg.data, seg.mime_type),
+                config=output_config(SpeakingOutput),
+                endpoint="a8.media",
+                expect_json=True,
+            )
+            return _scored_response(resp.text, "")
+
+    outcomes = await asyncio.gather(*(one(seg) for seg in segments), return_exceptions=True)
+    ok = [(o, len(seg.data)) for o, seg in zip(outcomes, segments) if not isinstance(o, BaseException)]
+    failed = [o for o in outcomes if isinstance(o, BaseException)]
+    if not ok:
+        raise failed[0]
+
+    merged = ok[0][0] if len(ok) == 1 else _merge_segment_responses([o for o, _ in ok], [w for _, w in ok])
+    if len(segments) > 1:
+        merged["result"]["warnings"].append(f"Analysed {len(ok)}/{len(segments)} audio segments")
+    if failed:
+        merged["result"]["warnings"].append(f"Segment failed: {type(failed[0]).__name__}: {str(failed[0])}")
+    return merged
+
+@instrumented("a8.media")
+async def analyze_media_upload_async(context, upload):
+    """
+    /a8/analyze-media path for a SpooledUpload.
+
+    With ffmpeg available the recording is reduced to low-bitrate mono audio
+    (leading silence trimmed, long pauses shortened but kept for the fluency
+    score) and split into segments that are transcribed and scored
+    concurrently (one model call each) and then merged. Without ffmpeg, or if
+    transcoding fails, the original file is sent: inline when small, through the
+    Files API from the spool file otherwise.
+    """
+    pipeline_warning = None
+    if media_pipeline_available():
+        client = get_gemini_client()
+        if not client:
+            return _missing_key_response("")
+        try:
+            segments = await prepare_audio_segments(upload.file)
+        except Exception as e:
+            segments = None
+            pipeline_warning = f"Audio pipeline failed, sent original media: {type(e).__name__}: {str(e)}"
+        if segments:
+            try:
+                return await _analyze_segments(client, context, segments)
+            except ModelOverloaded:
+                raise
+            except Exception as e:
+                return _media_failed_response(e)
+
+    out = await _analyze_original_upload(context, upload)
+    if pipeline_warning:
+        out["result"]["warnings"].append(pipeline_warning)
+    return out
+
+async def _analyze_original_upload(context, upload):
+    if upload.size <= MEDIA_INLINE_MAX_BYTES:
+        return await analyze_media_bytes_async(context, upload.read_bytes(), upload.content_type)
+
+    client = get_gemini_client()
+    if not client:
+        return _missing_key_response("")
+
+    with observe_stage("prompt_build"):
+        prompt = _build_media_prompt(context)
+    uploaded = None
+
+    try:
+        uploaded = await upload_media_async(client, upload.file, upload.content_type or "video/mp4")
+        resp = await generate_content_async(
+            client, [prompt, uploaded], config=output_config(SpeakingOutput), endpoint="a8.media", expect_json=True
+        )
+        return _scored_response(resp.text, "")
+    except ModelOverloaded:
+        raise
+    except Exception as e:
+        return _media_failed_response(e)
+    finally:
+        if uploaded is not None:
+            await delete_media_async(client, uploaded.name)
@@ -0,0 +1,167 @@
+"""
+Offline feedback enhancer: the answer of /a9/enhance-feedback when there is no
+API key, the circuit breaker is open or the model call failed.
+
+Each language has a table of phrase -> replacement, compiled once into one
+regex and applied in a single pass:
+- the longest phrase wins where phrases overlap ("tốt lắm" before "lắm"), and
+  replaced text is never matched again (no cascades)
+- whole words only ("em" does not touch "them" or "kem"); a Capitalised or
+  UPPER CASE phrase gets its replacement in the same case
+
+simple_enhance_batch() runs a whole batch of drafts (thousands per call) through
+one regex call.
+
+Env:
+- A9_ENHANCE_RULES: path of a JSON file {"<language>": {"<phrase>": "<replacement>"}};
+  its phrases are added to (or override) the built-in tables, new languages are added
+"""
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Mapping, Optional, Sequence
+
+from app.core.keywords import trie_regex
+
+
+logger = logging.getLogger("kidzgo.a9")
+
+DEFAULT_LANGUAGE = "vi"
+
+RULES: Dict[str, Dict[str, str]] = {
+    "vi": {
+        "hôm nay": "trong buổi học",
+        "em": "học sinh",
+        "tốt lắm": "có tiến bộ",
+        "lắm": "cao",
+        "làm bài": "hoàn thành bài tập",
+        "đầy đủ": "đầy đủ các nội dung được giao",
+        "chăm chỉ": "thể hiện sự chăm chỉ trong học tập",
+        "học tốt": "có kết quả học tập tốt",
+        "học tốt lắm": "có kết quả học tập rất tốt",
+        "ngoan": "có thái độ học tập tích cực",
+    },
+    "en": {
+        "today": "in today's lesson",
+        "kid": "student",
+        "good job": "made good progress",
+        "very good": "showed clear progress",
+        "did homework": "completed the assigned homework",
+        "did the homework": "completed the assigned homework",
+        "hard working": "showed a hard-working attitude",
+        "hardworking": "showed a hard-working attitude",
+        "nice": "positive",
+        "polite": "showed a positive attitude to learning",
+    },
+}
+
+# joins the drafts of a batch; neither a word character nor a space, so no phrase spans two drafts
+_SEPARATOR = "\x00"
+
+
+class ReplacementTable:
+    """
+    phrase -> replacement, applied in one pass (see the module docstring).
+
+    The phrases are matched case-sensitively in their lower case, Capitalised
+    and UPPER CASE forms (one trie-shaped regex); pattern.split() and a map()
+    over the lookup table then do the replacing without a Python call per
+    match.
+    """
+
+    def __init__(self, rules: Mapping[str, str]):
+        self.rules: Dict[str, str] = {}
+        for phrase, replacement in rules.items():
+            key = " ".join(unicodedata.normalize("NFC", phrase).lower().split())
+            if key:
+                self.rules[key] = unicodedata.normalize("NFC", replacement)
+        self._lookup: Dict[str, str] = {}
+        for key, new in self.rules.items():
+            self._lookup[key.upper()] = new.upper()
+            self._lookup[key[:1].upper() + key[1:]] = new[:1].upper() + new[1:]
+            self._lookup[key] = new
+        # the trie takes the longest phrase at each position
+        self._pattern = re.compile(r"(?<!\w)(%s)(?!\w)" % trie_regex(self._lookup)) if self._lookup else None
+
+    def apply(self, text: str) -> str:
+        if self._pattern is None or not text:
+            return text
+        parts = self._pattern.split(unicodedata.normalize("NFC", text))
+        found = parts[1::2]
+        replaced = list(map(self._lookup.get, found))
+        if None in replaced:  # a phrase written with other spacing ("hôm  nay")
+            replaced = [new if new is not None else self._lookup.get(" ".join(old.split()), old)
+                        for new, old in zip(replaced, found)]
+        parts[1::2] = replaced
+        return "".join(parts)
+
+    def apply_batch(self, texts: Sequence[str]) -> List[str]:
+        """apply() of every text, through a single split() over the joined batch."""
+        if self._pattern is None:
+            return list(texts)
+        joined = _SEPARATOR.join(t.replace(_SEPARATOR, " ") for t in texts)
+        return self.apply(joined).split(_SEPARATOR) if texts else []
+
+
+_tables: Optional[Dict[str, ReplacementTable]] = None
+_tables_lock = threading.Lock()
+
+
+def _load_rules() -> Dict[str, Dict[str, str]]:
+    rules = {lang: dict(table) for lang, table in RULES.items()}
+    path = os.getenv("A9_ENHANCE_RULES")
+    if not path:
+        return rules
+    try:
+        with open(path, encoding="utf-8") as f:
+            extra = json.load(f)
+        for lang, table in extra.items():
+            rules.setdefault(_language_key(lang), {}).update(table)
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning("A9_ENHANCE_RULES %s not loaded (%s); using the built-in tables", path, e)
+    return rules
+
+
+def _language_key(language: Optional[str]) -> str:
+    """Primary language subtag: "vi-VN" / "VI" -> "vi"."""
+    return (language or DEFAULT_LANGUAGE).strip().lower().replace("_", "-").split("-")[0] or DEFAULT_LANGUAGE
+
+
+def get_table(language: Optional[str] = None) -> Optional[ReplacementTable]:
+    """Compiled table for language; None when there is no table for it."""
+    global _tables
+    if _tables is None:
+        with _tables_lock:
+            if _tables is None:
+                _tables = {lang: ReplacementTable(rules) for lang, rules in _load_rules().items()}
+    return _tables.get(_language_key(language))
+
+
+def reload_rules() -> None:
+    """Rebuilds the tables, e.g. after A9_ENHANCE_RULES changed."""
+    global _tables
+    with _tables_lock:
+        _tables = None
+
+
+def _finish(text: str) -> str:
+    text = text.rstrip()
+    if text and not text.endswith((".", "!", "?")):
+        text += "."
+    return text
+
+
+def simple_enhance(draft: str, language: str = DEFAULT_LANGUAGE) -> str:
+    """Rule-based rewrite of one draft. Languages without a table only get the closing full stop."""
+    table = get_table(language)
+    return _finish(table.apply(draft) if table else draft)
+
+
+def simple_enhance_batch(drafts: Sequence[str], language: str = DEFAULT_LANGUAGE) -> List[str]:
+    """simple_enhance() of every draft, in order, with one regex pass over the whole batch."""
+    table = get_table(language)
+    enhanced = table.apply_batch(drafts) if table else list(drafts)
+    return [_finish(text) if draft and draft.strip() else draft for draft, text in zip(drafts, enhanced)]
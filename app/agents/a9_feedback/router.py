@@ -1,9 +1,46 @@
-from fastapi import APIRouter
-from app.agents.a9_feedback.schemas import EnhanceFeedbackRequest, EnhanceFeedbackResponse
-from app.agents.a9_feedback.service import enhance_feedback_api
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends
+from app.agents.a9_feedback.schemas import (
+    EnhanceFeedbackRequest, EnhanceFeedbackResponse, EnhanceFeedbackBatchRequest, EnhanceFeedbackBatchResponse,
+)
+from app.agents.a9_feedback.service import (
+    enhance_feedback_api_async, enhance_feedback_batch_async, stream_enhance_feedback_async,
+)
+from app.core.jobs import JobStatus, job_handler, job_headers, submit_job
+from app.core.sse import event_stream_response
 
 router = APIRouter()
 
 @router.post("/enhance-feedback", response_model=EnhanceFeedbackResponse)
-def enhance_feedback_endpoint(req: EnhanceFeedbackRequest):
-    return enhance_feedback_api(req)
+async def enhance_feedback_endpoint(req: EnhanceFeedbackRequest):
+    return await enhance_feedback_api_async(req)
+
+@router.post("/enhance-feedback/stream")
+async def enhance_feedback_stream_endpoint(req: EnhanceFeedbackRequest):
+    """SSE: "delta" events with partial text, then one "result" event (EnhanceFeedbackResponse)."""
+    return await event_stream_response(stream_enhance_feedback_async(req))
+
+@router.post("/enhance-feedback-batch", response_model=EnhanceFeedbackBatchResponse)
+async def enhance_feedback_batch_endpoint(req: EnhanceFeedbackBatchRequest):
+    """Many drafts (e.g. a whole session) in few packed model calls; items keep input order."""
+    return await enhance_feedback_batch_async(req.items, req.language, req.max_concurrency)
+
+@job_handler("a9.enhance_feedback", EnhanceFeedbackResponse)
+async def _enhance_feedback_job(payload, files):
+    return await enhance_feedback_api_async(EnhanceFeedbackRequest.model_validate(payload))
+
+@router.post("/enhance-feedback/jobs", response_model=JobStatus, status_code=202)
+async def enhance_feedback_job_endpoint(req: EnhanceFeedbackRequest, job: Dict[str, Optional[str]] = Depends(job_headers)):
+    """Job variant (app.core.jobs): 202 + job id; result via GET /jobs/{job_id} or the X-Callback-Url webhook."""
+    return await submit_job("a9.enhance_feedback", req.model_dump(), **job)
+
+@job_handler("a9.enhance_feedback_batch", EnhanceFeedbackBatchResponse)
+async def _enhance_feedback_batch_job(payload, files):
+    req = EnhanceFeedbackBatchRequest.model_validate(payload)
+    return await enhance_feedback_batch_async(req.items, req.language, req.max_concurrency)
+
+@router.post("/enhance-feedback-batch/jobs", response_model=JobStatus, status_code=202)
+async def enhance_feedback_batch_job_endpoint(req: EnhanceFeedbackBatchRequest, job: Dict[str, Optional[str]] = Depends(job_headers)):
+    """Job variant of /enhance-feedback-batch."""
+    return await submit_job("a9.enhance_feedback_batch", req.model_dump(), **job)
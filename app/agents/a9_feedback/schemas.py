@@ -1,4 +1,11 @@
-﻿from pydantic import BaseModel
+﻿from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from app.core.utils import env_int
+
+# drafts one batch request may carry (A9_BATCH_MAX_ITEMS is the per-prompt limit)
+BATCH_MAX_DRAFTS = env_int("A9_BATCH_MAX_DRAFTS", 500)
 
 
 class EnhanceFeedbackRequest(BaseModel):
@@ -8,3 +15,37 @@ class EnhanceFeedbackRequest(BaseModel):
 
 class EnhanceFeedbackResponse(BaseModel):
     enhanced: str
+    cached: bool = False
+
+
+class BatchDraft(BaseModel):
+    student_id: Optional[str] = None
+    draft: str
+
+
+class EnhanceFeedbackBatchRequest(BaseModel):
+    items: List[BatchDraft] = Field(max_length=BATCH_MAX_DRAFTS)  # e.g. every student of one session
+    language: str = 'vi'
+    max_concurrency: Optional[int] = None  # capped by A9_BATCH_CONCURRENCY
+
+
+class BatchEnhancedItem(BaseModel):
+    student_id: Optional[str] = None
+    enhanced: str
+    ai_used: bool
+    cached: bool = False
+
+
+class EnhanceFeedbackBatchResponse(BaseModel):
+    items: List[BatchEnhancedItem]  # input order
+    model_calls: int
+
+
+# What the model fills for a packed prompt (response_schema)
+class PackedFeedbackEntry(BaseModel):
+    index: int = Field(description="so trong ngoac vuong cua feedback")
+    enhanced: str
+
+
+class PackedFeedbackOutput(BaseModel):
+    results: List[PackedFeedbackEntry]
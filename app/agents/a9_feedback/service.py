@@ -1,5 +1,32 @@
+import asyncio
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
 from pydantic import BaseModel
 
+from app.agents.a9_feedback.offline import simple_enhance, simple_enhance_batch
+from app.agents.a9_feedback.schemas import PackedFeedbackOutput
+from app.core.json_extract import JsonObjectScanner, loads
+from app.core.metrics import instrumented, note_ai_error, observe_stage, record_ai_result
+from app.core.prompts import PromptTemplate, get_prompt, register_prompt, render_prompt
+from app.core.scheduler import estimate_input_tokens
+from app.core.structured import output_config, parse_output
+from app.core.utils import env_int
+
+
+BATCH_CONCURRENCY = env_int("A9_BATCH_CONCURRENCY", 4)
+# per packed call: estimated prompt tokens plus the expected output
+BATCH_TOKEN_BUDGET = env_int("A9_BATCH_TOKEN_BUDGET", 8000)
+BATCH_MAX_ITEMS = env_int("A9_BATCH_MAX_ITEMS", 50)
+# extra rounds for the drafts missing or malformed in a packed reply
+BATCH_RETRIES = env_int("A9_BATCH_RETRIES", 1)
+
+# expected output per draft: the enhanced paragraph is ~2x the draft, at least a few sentences
+_OUTPUT_RATIO = 2
+_MIN_OUTPUT_TOKENS = 120
+# "[i] " in the prompt, the index and keys of its "results" entry
+_ITEM_OVERHEAD_TOKENS = 12
+
 
 class EnhanceFeedbackRequest(BaseModel):
     draft: str
@@ -8,58 +35,330 @@ class EnhanceFeedbackRequest(BaseModel):
 
 class EnhanceFeedbackResponse(BaseModel):
     enhanced: str
+    cached: bool = False
+
+
+register_prompt(PromptTemplate(
+    "a9.enhance_feedback",
+    "v1",
+    prefix="""Ban la chuyen gia giao duc. Hay chinh sua doan feedback sau theo phong cach formal, ro rang, tich cuc va phu hop de giao vien su dung gui cho hoc sinh/phu huynh. Giup cau truc lai cau tu neu can de feedback de hieu, chuyen nghiep va de ap dung trong thuc te.
+
+""",
+    suffix="""Feedback: {draft}
+
+Enhanced:""",
+))
+
+
+_PACKED_SCHEMA_PROMPT = """Chi tra ve DUY NHAT 1 JSON object (khong markdown, khong giai thich) theo schema:
+
+{
+  "results": [
+    {"index": number, "enhanced": "string"}
+  ]
+}
+"""
+
+
+register_prompt(PromptTemplate(
+    "a9.enhance_feedback_batch",
+    "v1",
+    prefix="""Ban la chuyen gia giao duc. Hay chinh sua TUNG doan feedback duoi day theo phong cach formal, ro rang, tich cuc va phu hop de giao vien su dung gui cho hoc sinh/phu huynh. Giup cau truc lai cau tu neu can de feedback de hieu, chuyen nghiep va de ap dung trong thuc te. Moi doan la cua mot hoc sinh khac nhau: chinh sua doc lap, khong tron noi dung giua cac doan, giu nguyen ngon ngu cua tung doan.
+{schema}
+Moi feedback co dung 1 phan tu trong "results": "index" la so trong ngoac vuong, "enhanced" la doan da chinh sua.
+
+""",
+    suffix="""Cac feedback:
+{drafts}
+""",
+    schema=_PACKED_SCHEMA_PROMPT,
+))
+
+
+def _build_prompt(draft: str) -> str:
+    return render_prompt("a9.enhance_feedback", draft=draft)
+
+
+def _build_packed_prompt(chunk: Sequence[Tuple[int, str]]) -> str:
+    # one line per draft, so a line break inside a draft cannot start a new "[i]"
+    drafts = "\n".join(f"[{i}] {' '.join(draft.split())}" for i, draft in chunk)
+    return render_prompt("a9.enhance_feedback_batch", drafts=drafts)
+
+
+def _clean_enhanced(text: str | None, draft: str) -> str:
+    enhanced = (text or "").strip()
+    if enhanced.startswith('"') and enhanced.endswith('"'):
+        enhanced = enhanced[1:-1]
+    return enhanced if enhanced else draft
 
 
 def enhance_feedback(draft: str, language: str = "vi") -> str:
     if not draft or not draft.strip():
         return draft
 
-    prompt = f"""Ban la chuyen gia giao duc. Hay chinh sua doan feedback sau theo phong cach formal, ro rang, tich cuc va phu hop de giao vien su dung gui cho hoc sinh/phu huynh. Giup cau truc lai cau tu neu can de feedback de hieu, chuyen nghiep va de ap dung trong thuc te.
+    prompt = _build_prompt(draft)
 
-Feedback: {draft}
+    from app.core.gemini_client import get_gemini_client, GEMINI_MODEL
 
-Enhanced:"""
+    client = get_gemini_client()
+    if not client:
+        return _simple_enhance(draft, language)
 
-    from app.core.gemini_client import get_gemini_client
+    try:
+        resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
+        return _clean_enhanced(resp.text, draft)
+    except Exception as e:
+        print(f"Error: {e}")
+        return _simple_enhance(draft, language)
+
+
+@instrumented("a9.enhance_feedback")
+async def _enhance_feedback_async(draft: str, language: str = "vi") -> tuple[str, bool]:
+    """Returns (enhanced, served_from_cache)."""
+    if not draft or not draft.strip():
+        return draft, False
+
+    with observe_stage("prompt_build"):
+        prompt = _build_prompt(draft)
+
+    from app.core.gemini_client import get_gemini_client, generate_content_async
+    from app.core.model_cache import is_cached
+    from app.core.scheduler import ModelOverloaded
 
     client = get_gemini_client()
     if not client:
-        return _simple_enhance(draft)
+        note_ai_error("MissingApiKey")
+        return _simple_enhance(draft, language), False
 
     try:
-        resp = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-        enhanced = (resp.text or "").strip()
-        if enhanced.startswith('"') and enhanced.endswith('"'):
-            enhanced = enhanced[1:-1]
-        return enhanced if enhanced else draft
+        resp = await generate_content_async(client, prompt, endpoint="a9.enhance_feedback")
+        with observe_stage("normalize"):
+            return _clean_enhanced(resp.text, draft), is_cached(resp)
+    except ModelOverloaded:
+        raise
     except Exception as e:
         print(f"Error: {e}")
-        return _simple_enhance(draft)
-
-
-def _simple_enhance(draft: str) -> str:
-    replacements = {
-        "hôm nay": "trong buổi học",
-        "em": "học sinh",
-        "tốt lắm": "có tiến bộ",
-        "lắm": "cao",
-        "làm bài": "hoàn thành bài tập",
-        "đầy đủ": "đầy đủ các nội dung được giao",
-        "chăm chỉ": "thể hiện sự chăm chỉ trong học tập",
-        "học tốt": "có kết quả học tập tốt",
-        "ngoan": "có thái độ học tập tích cực",
-    }
+        note_ai_error(e)
+        return _simple_enhance(draft, language), False
 
-    result = draft
-    for old, new in replacements.items():
-        result = result.replace(old, new)
 
-    if not result.endswith(".") and not result.endswith("!") and not result.endswith("?"):
-        result += "."
+async def enhance_feedback_async(draft: str, language: str = "vi") -> str:
+    enhanced, _ = await _enhance_feedback_async(draft, language)
+    return enhanced
 
-    return result
+
+def _simple_enhance(draft: str, language: str = "vi") -> str:
+    """Offline fallback (no key, circuit open, model error): see app.agents.a9_feedback.offline."""
+    return simple_enhance(draft, language)
 
 
 def enhance_feedback_api(req: EnhanceFeedbackRequest) -> EnhanceFeedbackResponse:
     enhanced = enhance_feedback(req.draft, req.language)
-    return EnhanceFeedbackResponse(enhanced=enhanced)
\ No newline at end of file
+    return EnhanceFeedbackResponse(enhanced=enhanced)
+
+
+async def enhance_feedback_api_async(req: EnhanceFeedbackRequest) -> EnhanceFeedbackResponse:
+    enhanced, cached = await _enhance_feedback_async(req.draft, req.language)
+    return EnhanceFeedbackResponse(enhanced=enhanced, cached=cached)
+
+
+async def stream_enhance_feedback_async(req: EnhanceFeedbackRequest) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    SSE variant of enhance_feedback_api_async: ("delta", {"text"}) chunks, then
+    ("result", <EnhanceFeedbackResponse>). On a model error the result is
+    _simple_enhance(draft), as in the non-streaming endpoint.
+    """
+    endpoint = "a9.enhance_feedback"
+    draft = req.draft
+    if not draft or not draft.strip():
+        yield "result", EnhanceFeedbackResponse(enhanced=draft).model_dump()
+        return
+
+    from app.core.gemini_client import get_gemini_client, generate_content_stream_async
+    from app.core.model_cache import is_cached
+    from app.core.scheduler import ModelOverloaded
+
+    error = None
+    version = None
+    try:
+        client = get_gemini_client()
+        if not client:
+            error = "MissingApiKey"
+            yield "result", EnhanceFeedbackResponse(enhanced=_simple_enhance(draft, req.language)).model_dump()
+            return
+
+        with observe_stage("prompt_build", endpoint):
+            prompt = _build_prompt(draft)
+        version = (prompt.template.name, prompt.template.version)
+
+        parts = []
+        cached = False
+        try:
+            async for chunk in generate_content_stream_async(client, prompt, endpoint=endpoint):
+                cached = cached or is_cached(chunk)
+                if chunk.text:
+                    parts.append(chunk.text)
+                    yield "delta", {"text": chunk.text}
+            with observe_stage("normalize", endpoint):
+                result = EnhanceFeedbackResponse(enhanced=_clean_enhanced("".join(parts), draft), cached=cached)
+        except ModelOverloaded:
+            error = "ModelOverloaded"
+            raise
+        except Exception as e:
+            print(f"Error: {e}")
+            error = type(e).__name__
+            result = EnhanceFeedbackResponse(enhanced=_simple_enhance(draft, req.language))
+        yield "result", result.model_dump()
+    finally:
+        record_ai_result(endpoint, error, version)
+
+
+def _draft_tokens(draft: str) -> int:
+    """Estimated tokens a draft adds to a packed call, prompt and output."""
+    tokens = estimate_input_tokens(draft)
+    return tokens + max(_MIN_OUTPUT_TOKENS, _OUTPUT_RATIO * tokens) + _ITEM_OVERHEAD_TOKENS
+
+
+def _pack(pending: Sequence[Tuple[int, str]]) -> List[List[Tuple[int, str]]]:
+    """
+    (index, draft) pairs split into packed calls of at most BATCH_MAX_ITEMS
+    drafts and BATCH_TOKEN_BUDGET estimated tokens, in input order. A draft over
+    the budget on its own gets a call of its own.
+    """
+    budget = BATCH_TOKEN_BUDGET - get_prompt("a9.enhance_feedback_batch").prefix_tokens()
+    max_items = max(1, BATCH_MAX_ITEMS)
+    chunks: List[List[Tuple[int, str]]] = []
+    chunk: List[Tuple[int, str]] = []
+    used = 0
+    for i, draft in pending:
+        tokens = _draft_tokens(draft)
+        if chunk and (used + tokens > budget or len(chunk) >= max_items):
+            chunks.append(chunk)
+            chunk, used = [], 0
+        chunk.append((i, draft))
+        used += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+_RESULTS_START = re.compile(r'"results"\s*:\s*\[')
+
+def _packed_entries(text: str | None) -> List[Any]:
+    try:
+        obj = parse_output(PackedFeedbackOutput, text, repair=False)
+    except ValueError:
+        # a reply cut off inside an entry fails validation as a whole; keep the
+        # entries that were closed (no repair: the one being written when the
+        # output stopped goes to the retry round)
+        text = text or ""
+        m = _RESULTS_START.search(text)
+        if m is None:
+            return []
+        entries = []
+        for block in JsonObjectScanner().feed(text[m.end():]):
+            try:
+                entries.append(loads(block))
+            except ValueError:
+                pass
+        return entries
+    results = obj.get("results") if isinstance(obj, dict) else None
+    return results if isinstance(results, list) else []
+
+
+@instrumented("a9.enhance_feedback_batch")
+async def _enhance_packed(client, chunk: Sequence[Tuple[int, str]], results: List[Any]) -> None:
+    """
+    One model call for several drafts. Fills results[i] for every draft of the
+    chunk the reply has a usable entry for; the others stay None.
+    """
+    from app.core.gemini_client import generate_content_async
+    from app.core.model_cache import is_cached
+    from app.core.scheduler import ModelOverloaded
+
+    with observe_stage("prompt_build"):
+        prompt = _build_packed_prompt(chunk)
+    try:
+        resp = await generate_content_async(
+            client,
+            prompt,
+            config=output_config(PackedFeedbackOutput),
+            endpoint="a9.enhance_feedback_batch",
+            expect_json=True,
+        )
+        with observe_stage("normalize"):
+            entries = _packed_entries(resp.text)
+    except ModelOverloaded:
+        raise
+    except Exception as e:
+        print(f"Error: {e}")
+        note_ai_error(e)
+        return
+
+    drafts = dict(chunk)
+    cached = is_cached(resp)
+    for entry in entries:
+        i = entry.get("index") if isinstance(entry, dict) else None
+        text = entry.get("enhanced") if isinstance(entry, dict) else None
+        if type(i) is int and i in drafts and results[i] is None and isinstance(text, str) and text.strip():
+            results[i] = {"enhanced": _clean_enhanced(text, drafts[i]), "ai_used": True, "cached": cached}
+    if any(results[i] is None for i, _ in chunk):
+        note_ai_error("IncompletePackedOutput")
+
+
+async def enhance_feedback_batch_async(
+    items: Sequence[Any], language: str = "vi", max_concurrency: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Enhance the drafts of a whole session (items with .draft and .student_id)
+    in as few model calls as possible: the drafts are packed into prompts of
+    A9_BATCH_TOKEN_BUDGET estimated tokens / A9_BATCH_MAX_ITEMS drafts with
+    indexed JSON output. Drafts missing or malformed in a reply are packed again
+    (A9_BATCH_RETRIES rounds); what is still left, the chunks shed by the quota
+    scheduler, or the whole batch without a model, gets the offline enhancer
+    (ai_used false). Results keep input order.
+    """
+    from app.core.gemini_client import count_model_calls, get_gemini_client
+    from app.core.scheduler import ModelOverloaded, batch_lane
+
+    results: List[Any] = [None] * len(items)
+    counter = {"model_calls": 0}  # stays 0 without a model
+    pending = []
+    for i, item in enumerate(items):
+        if item.draft and item.draft.strip():
+            pending.append((i, item.draft))
+        else:
+            results[i] = {"enhanced": item.draft, "ai_used": False, "cached": False}
+
+    client = get_gemini_client() if pending else None
+    if client:
+        limit = max(1, min(max_concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+        sem = asyncio.Semaphore(limit)
+
+        shed = set()
+
+        async def run_chunk(chunk):
+            async with sem:
+                try:
+                    await _enhance_packed(client, chunk, results)
+                except ModelOverloaded:
+                    # no quota for this chunk: its drafts go offline, the other chunks go on
+                    note_ai_error("ModelOverloaded")
+                    shed.update(i for i, _ in chunk)
+
+        with batch_lane(), count_model_calls() as counter:
+            for _ in range(1 + max(0, BATCH_RETRIES)):
+                await asyncio.gather(*(run_chunk(chunk) for chunk in _pack(pending)))
+                pending = [(i, draft) for i, draft in pending if results[i] is None and i not in shed]
+                if not pending:
+                    break
+
+    left = [(i, item.draft) for i, item in enumerate(items) if results[i] is None]
+    if left:
+        enhanced = simple_enhance_batch([draft for _, draft in left], language)
+        for (i, _), text in zip(left, enhanced):
+            results[i] = {"enhanced": text, "ai_used": False, "cached": False}
+    return {
+        "items": [{"student_id": item.student_id, **result} for item, result in zip(items, results)],
+        "model_calls": counter["model_calls"],
+    }
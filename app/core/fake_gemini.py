@@ -0,0 +1,337 @@
+"""
+Offline stand-in for genai.Client, used when GEMINI_BACKEND=fake.
+
+Answers every agent's prompt with schema-valid JSON (plain text for A9) after a
+simulated latency, and can inject API errors and malformed outputs. Used for
+load tests (scripts/benchmarks) and local development without Gemini quota.
+
+Env:
+- FAKE_GEMINI_LATENCY: fixed:S | uniform:LO,HI | normal:MEAN,SD | lognormal:MEDIAN,SIGMA
+  (seconds, default lognormal:0.8,0.4); FAKE_GEMINI_LATENCY_A3 ... _A9 override per agent
+- FAKE_GEMINI_ERROR_RATE: share of calls raising an APIError (default 0)
+- FAKE_GEMINI_ERROR_CODES: codes picked for those errors (default 429,503)
+- FAKE_GEMINI_MALFORMED_RATE: share of calls returning truncated JSON or prose (default 0)
+- FAKE_GEMINI_SEED: RNG seed, same seed + same call order -> same outputs (default 42)
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.genai import errors, types
+
+from app.core.utils import env_float, env_int
+
+FAKE_ERROR_RATE = env_float("FAKE_GEMINI_ERROR_RATE", 0.0)
+FAKE_MALFORMED_RATE = env_float("FAKE_GEMINI_MALFORMED_RATE", 0.0)
+FAKE_ERROR_CODES = [int(c) for c in os.getenv("FAKE_GEMINI_ERROR_CODES", "429,503").split(",") if c.strip().isdigit()]
+FAKE_SEED = env_int("FAKE_GEMINI_SEED", 42)
+
+_STATUS_BY_CODE = {
+    400: "INVALID_ARGUMENT",
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+    504: "DEADLINE_EXCEEDED",
+}
+
+def parse_latency(spec: str) -> Tuple[str, List[float]]:
+    kind, _, args = (spec or "").partition(":")
+    try:
+        values = [float(x) for x in args.split(",") if x.strip()]
+    except ValueError:
+        values = []
+    kind = kind.strip().lower()
+    needed = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+    if kind not in needed or len(values) < needed[kind]:
+        return "lognormal", [0.8, 0.4]
+    return kind, values
+
+def sample_latency(rng: random.Random, spec: Tuple[str, List[float]]) -> float:
+    kind, v = spec
+    if kind == "fixed":
+        return max(v[0], 0.0)
+    if kind == "uniform":
+        return rng.uniform(v[0], v[1])
+    if kind == "normal":
+        return max(rng.gauss(v[0], v[1]), 0.0)
+    return rng.lognormvariate(math.log(max(v[0], 1e-6)), v[1])
+
+def _prompt_text(contents: Any) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(t for t in (_prompt_text(c) for c in contents) if t)
+    text = getattr(contents, "text", None)
+    if isinstance(text, str):
+        return text
+    parts = getattr(contents, "parts", None)
+    return _prompt_text(parts) if parts else ""
+
+def _schema_text(config: Any) -> str:
+    """JSON schema of a structured-output call, so agents are recognised without the prompt's schema block."""
+    schema = getattr(config, "response_schema", None)
+    if isinstance(schema, type) and hasattr(schema, "model_json_schema"):
+        return json.dumps(schema.model_json_schema()) + "\n"
+    if hasattr(schema, "model_dump"):  # types.Schema
+        return json.dumps(schema.model_dump(exclude_none=True, mode="json")) + "\n"
+    return ""
+
+def detect_agent(prompt: str) -> str:
+    """Which agent a prompt belongs to, from the JSON schema it asks for."""
+    if '"results"' in prompt and '"enhanced"' in prompt:
+        return "a9_batch"
+    if '"results"' in prompt:
+        return "a3_batch"
+    if "Mục cần cập nhật:" in prompt:
+        return "a6_update"
+    if '"fields"' in prompt and '"receiver_account"' in prompt:
+        return "a7"
+    if '"pronunciation_score"' in prompt:
+        return "a8"
+    if '"parent_support"' in prompt:
+        return "a6"
+    if '"extracted_student_answer"' in prompt:
+        return "a3"
+    return "a9"
+
+def _a3(rng: random.Random) -> Dict[str, Any]:
+    score = round(rng.uniform(5, 10), 1)
+    return {
+        "score": score,
+        "max_score": 10,
+        "summary": f"Bài làm đạt {score}/10, nội dung đúng yêu cầu.",
+        "strengths": ["Trả lời đúng trọng tâm.", "Câu văn rõ ràng."],
+        "issues": ["Còn lỗi chính tả nhỏ.", "Thiếu mạo từ ở vài câu."],
+        "suggestions": ["Đọc lại bài trước khi nộp.", "Ôn mạo từ a/an/the.", "Luyện viết 5 câu mỗi ngày."],
+        "extracted_student_answer": None,
+        "confidence": {"score": round(rng.uniform(0.6, 0.95), 2), "extraction": round(rng.uniform(0.6, 0.95), 2)},
+        "warnings": [],
+    }
+
+def _a6(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "attendance_rate": f"{rng.randint(70, 100)}%",
+        "study_attitude": "Con tích cực phát biểu và hợp tác tốt với bạn.",
+        "progress_level": rng.choice(["Starters", "Movers", "Flyers"]),
+        "progress_topics": ["Family", "Animals"],
+        "skills": {
+            "phonics": "Phát âm các âm cuối rõ hơn.",
+            "speaking": "Tự tin trả lời câu hỏi ngắn.",
+            "listening": "Nghe hiểu yêu cầu của giáo viên.",
+            "writing": "Viết được câu đơn đúng ngữ pháp.",
+        },
+        "strengths": ["Chăm chỉ.", "Tự tin.", "Hoàn thành bài tập đầy đủ."],
+        "improvements": ["Luyện phát âm âm cuối.", "Mở rộng vốn từ."],
+        "homework_completion": f"{rng.randint(60, 100)}%",
+        "parent_support": ["Nghe nhạc tiếng Anh cùng con.", "Nhắc con làm bài tập.", "Khen ngợi khi con tiến bộ."],
+    }
+
+def _a7(rng: random.Random) -> Dict[str, Any]:
+    amount = rng.randint(5, 400) * 10000
+    return {
+        "fields": {
+            "transaction_datetime": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(7, 21):02d}:{rng.randint(0, 59):02d}:00",
+            "amount": f"{amount:,}".replace(",", "."),
+            "currency": "VND",
+            "bank_name": rng.choice(["Vietcombank", "Techcombank", "MB Bank"]),
+            "transaction_id": f"FT{rng.randint(10 ** 11, 10 ** 12 - 1)}",
+            "content": rng.choice(["hoc phi thang 3", "tra luong thang 3", "hoan tien hoc phi"]),
+            "sender_name": "NGUYEN VAN A",
+            "sender_account": "0123 456 789",
+            "receiver_name": "KIDZGO",
+            "receiver_account": "9876543210",
+        },
+        "confidence": {"transaction_datetime": 0.9, "amount": 0.95, "transaction_id": 0.9, "content": 0.8},
+        "raw_text": "Chuyen tien thanh cong",
+        "warnings": [],
+    }
+
+def _a8(rng: random.Random) -> Dict[str, Any]:
+    scores = [round(rng.uniform(5, 9.5), 1) for _ in range(4)]
+    return {
+        "transcript": "My name is An. I like cats and dogs.",
+        "overall_score": scores[0],
+        "pronunciation_score": scores[1],
+        "fluency_score": scores[2],
+        "accuracy_score": scores[3],
+        "phonics_issues": ["/θ/ đọc thành /t/"],
+        "speaking_issues": ["Ngắt nghỉ chưa tự nhiên."],
+        "suggestions": ["Luyện âm /θ/.", "Đọc to 5 phút mỗi ngày.", "Shadowing câu ngắn."],
+        "practice_plan": ["Ngày 1-2: âm /θ/.", "Ngày 3-4: nối âm.", "Ngày 5: đọc đoạn văn."],
+        "confidence": {"transcript": 0.85, "scoring": 0.8},
+        "warnings": [],
+    }
+
+def fake_output(prompt: str, rng: random.Random) -> str:
+    agent = detect_agent(prompt)
+    if agent == "a9":
+        draft = prompt.rsplit("Feedback:", 1)[-1].split("Enhanced:", 1)[0].strip()
+        return f"Trong buổi học, {draft[:400]} Học sinh có thái độ học tập tích cực."
+    if agent == "a9_batch":
+        drafts = re.findall(r"^\[(\d+)\] (.*)$", prompt, re.M)
+        obj = {"results": [
+            {"index": int(i), "enhanced": f"Trong buổi học, {draft[:400]} Học sinh có thái độ học tập tích cực."}
+            for i, draft in drafts
+        ]}
+    elif agent == "a3_batch":
+        indices = [int(i) for i in re.findall(r"^\[(\d+)\]", prompt, re.M)]
+        obj = {"results": [dict(_a3(rng), index=i) for i in indices]}
+    elif agent == "a6_update":
+        wanted = re.search(r"^Mục cần cập nhật: (.*)$", prompt, re.M).group(1).split(", ")
+        obj = {k: v for k, v in _a6(rng).items() if k in wanted}
+    else:
+        obj = {"a3": _a3, "a6": _a6, "a7": _a7, "a8": _a8}[agent](rng)
+    return json.dumps(obj, ensure_ascii=False)
+
+def _malformed(text: str, rng: random.Random) -> str:
+    if rng.random() < 0.5:
+        return text[: max(1, len(text) // 2)]  # truncated mid-object
+    return "Xin lỗi, tôi không thể trả lời theo định dạng JSON lúc này."
+
+def _usage(prompt: str, text: str, cached: str = ""):
+    # ~4 chars per token, good enough for rate-limit accounting
+    return SimpleNamespace(
+        prompt_token_count=max(1, len(prompt) // 4),
+        cached_content_token_count=len(cached) // 4 or None,
+        candidates_token_count=max(1, len(text) // 4),
+        total_token_count=max(1, len(prompt) // 4) + max(1, len(text) // 4),
+    )
+
+class FakeResponse:
+    def __init__(self, text: str, prompt: str = "", cached: str = ""):
+        self.text = text
+        self.usage_metadata = _usage(prompt, text, cached)
+
+class _Engine:
+    """Shared RNG and settings for the sync and async faces."""
+
+    def __init__(self, seed: int = FAKE_SEED):
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._latency = {}
+        self.calls = 0
+        self.context_caches: Dict[str, str] = {}
+
+    def _spec(self, agent: str):
+        key = agent.split("_", 1)[0].upper()
+        if key not in self._latency:
+            spec = os.getenv(f"FAKE_GEMINI_LATENCY_{key}") or os.getenv("FAKE_GEMINI_LATENCY", "lognormal:0.8,0.4")
+            self._latency[key] = parse_latency(spec)
+        return self._latency[key]
+
+    def cached_prefix(self, config=None) -> str:
+        """Text of the context cache a call refers to (config.cached_content)."""
+        name = getattr(config, "cached_content", None)
+        if not name:
+            return ""
+        if name not in self.context_caches:
+            body = {"error": {"code": 404, "message": f"{name} not found", "status": "NOT_FOUND"}}
+            raise errors.ClientError(404, body)
+        return self.context_caches[name]
+
+    def plan(self, contents: Any, config=None) -> Tuple[float, Optional[Exception], str, str]:
+        """-> (delay, error to raise or None, output text, prompt)"""
+        prompt = self.cached_prefix(config) + _prompt_text(contents)
+        schema = _schema_text(config)
+        with self._lock:
+            self.calls += 1
+            rng = random.Random(self._rng.random())
+        delay = sample_latency(rng, self._spec(detect_agent(schema + prompt)))
+        if FAKE_ERROR_CODES and rng.random() < FAKE_ERROR_RATE:
+            code = rng.choice(FAKE_ERROR_CODES)
+            body = {"error": {"code": code, "message": "fake backend error", "status": _STATUS_BY_CODE.get(code, "UNKNOWN")}}
+            error = errors.ClientError(code, body) if code < 500 else errors.ServerError(code, body)
+            return delay, error, "", prompt
+        text = fake_output(schema + prompt, rng)
+        if rng.random() < FAKE_MALFORMED_RATE:
+            text = _malformed(text, rng)
+        return delay, None, text, prompt
+
+class _Models:
+    def __init__(self, engine: _Engine):
+        self._engine = engine
+
+    def generate_content(self, model: str, contents: Any, config=None, **kwargs) -> FakeResponse:
+        delay, error, text, prompt = self._engine.plan(contents, config)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return FakeResponse(text, prompt, self._engine.cached_prefix(config))
+
+class _AsyncModels:
+    def __init__(self, engine: _Engine):
+        self._engine = engine
+
+    async def generate_content(self, model: str, contents: Any, config=None, **kwargs) -> FakeResponse:
+        delay, error, text, prompt = self._engine.plan(contents, config)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return FakeResponse(text, prompt, self._engine.cached_prefix(config))
+
+    async def generate_content_stream(self, model: str, contents: Any, config=None, **kwargs):
+        delay, error, text, prompt = self._engine.plan(contents, config)
+        chunk = 40
+
+        async def stream():
+            # first token after ~1/3 of the latency, the rest spread over the remainder
+            await asyncio.sleep(delay / 3)
+            if error is not None:
+                raise error
+            steps = max(1, math.ceil(len(text) / chunk))
+            for i in range(steps):
+                if i:
+                    await asyncio.sleep(delay * 2 / 3 / steps)
+                last = i == steps - 1
+                yield FakeResponse(
+                    text[i * chunk:(i + 1) * chunk],
+                    prompt if last else "",
+                    self._engine.cached_prefix(config) if last else "",
+                )
+
+        return stream()
+
+class _AsyncFiles:
+    async def upload(self, file=None, config=None, **kwargs):
+        mime_type = getattr(config, "mime_type", None) or "application/octet-stream"
+        return types.File(
+            name=f"files/fake-{uuid.uuid4().hex[:12]}", mime_type=mime_type, state=types.FileState.ACTIVE
+        )
+
+    async def get(self, name: str, **kwargs):
+        return types.File(name=name, state=types.FileState.ACTIVE)
+
+    async def delete(self, name: str, **kwargs):
+        return None
+
+class _AsyncCaches:
+    """Context caches (caches.create/delete); the stored text is prepended to calls that name them."""
+
+    def __init__(self, engine: _Engine):
+        self._engine = engine
+
+    async def create(self, model: str, config=None, **kwargs):
+        name = f"cachedContents/fake-{uuid.uuid4().hex[:12]}"
+        self._engine.context_caches[name] = _prompt_text(getattr(config, "contents", None) or [])
+        return types.CachedContent(name=name, model=model, display_name=getattr(config, "display_name", None))
+
+    async def delete(self, name: str, **kwargs):
+        self._engine.context_caches.pop(name, None)
+
+class FakeGeminiClient:
+    """Duck-types the parts of genai.Client the agents use."""
+
+    def __init__(self, seed: int = FAKE_SEED):
+        self.engine = _Engine(seed)
+        self.models = _Models(self.engine)
+        self.aio = SimpleNamespace(
+            models=_AsyncModels(self.engine), files=_AsyncFiles(), caches=_AsyncCaches(self.engine)
+        )
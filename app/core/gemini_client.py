@@ -1,14 +1,490 @@
+from __future__ import annotations
+
+import asyncio
+import logging
 import os
-from google import genai
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import httpx
+
+from app.core.metrics import (
+    AI_FIRST_CHUNK, AI_IN_FLIGHT, AI_PAYLOAD_BYTES, AI_STAGE_LATENCY, current_endpoint, observe_stage
+)
+from app.core.model_cache import get_model_cache, cache_key, CachedResponse
+from app.core.prompts import get_context_caches, record_usage
+from app.core.resilience import call_with_resilience, stream_with_resilience
+from app.core.scheduler import get_scheduler
+from app.core.startup import lazy_import
+from app.core.utils import env_int, env_float, extract_json_block
+
+if TYPE_CHECKING:
+    from google import genai
+
+logger = logging.getLogger("kidzgo.gemini")
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# genai (default) or fake: offline stand-in for load tests, see app.core.fake_gemini
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "genai").lower()
+# when the client (and with it the genai SDK, imported on first use) is built:
+# background (default: in a thread after start-up, the worker serves meanwhile),
+# startup (before the app accepts requests) or lazy (on the first model call)
+GEMINI_CLIENT_WARMUP = os.getenv("GEMINI_CLIENT_WARMUP", "background").strip().lower()
 
 def gemini_key_present() -> bool:
     return bool(os.getenv("GEMINI_API_KEY"))
 
+class GeminiClientManager:
+    """
+    Process-wide genai.Client backed by pooled, keep-alive httpx clients.
+
+    Created at app startup and closed at shutdown (see app.main lifespan).
+    If GEMINI_API_KEY changes, a new client is built on the next call; the old
+    one is kept until close() so in-flight requests are not cut off.
+
+    Env:
+    - GEMINI_POOL_SIZE: max connections per httpx client (default 20)
+    - GEMINI_KEEPALIVE_EXPIRY: idle keep-alive seconds (default 60)
+    - GEMINI_HTTP_TIMEOUT: httpx timeout seconds (default 120)
+    - GEMINI_CLIENT_WARMUP: background (default) / startup / lazy, see init_client_manager()
+    """
+
+    def __init__(
+        self,
+        pool_size: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.pool_size = pool_size or env_int("GEMINI_POOL_SIZE", 20)
+        self.keepalive_expiry = keepalive_expiry or env_float("GEMINI_KEEPALIVE_EXPIRY", 60.0)
+        self.timeout = timeout or env_float("GEMINI_HTTP_TIMEOUT", 120.0)
+
+        self._lock = threading.Lock()
+        self._key: Optional[str] = None
+        self._client: Optional[genai.Client] = None
+        self._http: Optional[httpx.Client] = None
+        self._http_async: Optional[httpx.AsyncClient] = None
+        self._retired: List[Any] = []
+        self._closed = False
+        self._fake = None
+
+        self._clients_built = 0
+        self._requests = 0
+        self._new_connections = 0
+
+    # ---- connection accounting (httpcore "trace" extension) ----
+
+    def _on_trace_event(self, event_name: str) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self._new_connections += 1
+
+    def _trace_sync(self, event_name: str, info: Dict[str, Any]) -> None:
+        self._on_trace_event(event_name)
+
+    async def _trace_async(self, event_name: str, info: Dict[str, Any]) -> None:
+        self._on_trace_event(event_name)
+
+    def _on_request_sync(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._trace_sync
+
+    async def _on_request_async(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._trace_async
+
+    def _on_response_sync(self, response: httpx.Response) -> None:
+        with self._lock:
+            self._requests += 1
+
+    async def _on_response_async(self, response: httpx.Response) -> None:
+        with self._lock:
+            self._requests += 1
+
+    # ---- lifecycle ----
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _build(self, key: str) -> None:
+        http = httpx.Client(
+            limits=self._limits(),
+            timeout=self.timeout,
+            event_hooks={"request": [self._on_request_sync], "response": [self._on_response_sync]},
+        )
+        http_async = httpx.AsyncClient(
+            limits=self._limits(),
+            timeout=self.timeout,
+            event_hooks={"request": [self._on_request_async], "response": [self._on_response_async]},
+        )
+        genai = lazy_import("google.genai")
+        client = genai.Client(
+            api_key=key,
+            http_options=genai.types.HttpOptions(httpx_client=http, httpx_async_client=http_async),
+        )
+
+        if self._client is not None:
+            self._retired.append((self._http, self._http_async))
+
+        self._key = key
+        self._client = client
+        self._http = http
+        self._http_async = http_async
+        self._clients_built += 1
+
+    def get_client(self) -> Optional[genai.Client]:
+        """
+        Returns: shared genai.Client or None if missing key
+        """
+        if GEMINI_BACKEND == "fake":
+            if self._fake is None:
+                from app.core.fake_gemini import FakeGeminiClient
+                with self._lock:
+                    if self._fake is None:
+                        self._fake = FakeGeminiClient()
+            return self._fake
+        key = os.getenv("GEMINI_API_KEY")
+        if not key:
+            return None
+        if self._client is not None and key == self._key:
+            return self._client
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("GeminiClientManager is closed")
+            if self._client is None or key != self._key:
+                self._build(key)
+            return self._client
+
+    async def aclose(self) -> None:
+        client = self._client or self._fake
+        if client is not None:
+            await get_context_caches().aclose(client)
+        with self._lock:
+            self._closed = True
+            pairs = self._retired + [(self._http, self._http_async)]
+            self._retired = []
+            self._client = None
+            self._http = None
+            self._http_async = None
+            self._key = None
+
+        for http, http_async in pairs:
+            if http is not None:
+                http.close()
+            if http_async is not None:
+                await http_async.aclose()
+
+    # ---- stats ----
+
+    @staticmethod
+    def _pool_connections(http: Any) -> Dict[str, int]:
+        # httpx does not expose its pool publicly; best effort via the transport.
+        pool = getattr(getattr(http, "_transport", None), "_pool", None)
+        conns = list(getattr(pool, "connections", None) or [])
+        return {
+            "open": len(conns),
+            "idle": sum(1 for c in conns if c.is_idle()),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self._requests
+            new_connections = self._new_connections
+            built = self._clients_built
+        reused = max(requests - new_connections, 0)
+        return {
+            "backend": GEMINI_BACKEND,
+            "client_ready": self._client is not None or self._fake is not None,
+            "pool_size": self.pool_size,
+            "keepalive_expiry": self.keepalive_expiry,
+            "clients_built": built,
+            "requests": requests,
+            "new_connections": new_connections,
+            "reused_requests": reused,
+            "reuse_ratio": round(reused / requests, 4) if requests else None,
+            "sync_pool": self._pool_connections(self._http) if self._http else None,
+            "async_pool": self._pool_connections(self._http_async) if self._http_async else None,
+        }
+
+_manager: Optional[GeminiClientManager] = None
+_manager_lock = threading.Lock()
+
+def get_client_manager() -> GeminiClientManager:
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = GeminiClientManager()
+    return _manager
+
+def _warm_up(manager: GeminiClientManager) -> None:
+    try:
+        manager.get_client()
+    except Exception as e:  # the first model call builds it (and reports the error) again
+        logger.warning("Gemini client warm-up failed: %s", e)
+
+def init_client_manager() -> GeminiClientManager:
+    """Called at app startup: create the manager and warm the client if a key is set (GEMINI_CLIENT_WARMUP)."""
+    manager = get_client_manager()
+    if GEMINI_CLIENT_WARMUP == "startup":
+        manager.get_client()
+    elif GEMINI_CLIENT_WARMUP != "lazy":
+        threading.Thread(target=_warm_up, args=(manager,), name="gemini-warmup", daemon=True).start()
+    return manager
+
+async def close_client_manager() -> None:
+    """Called at app shutdown."""
+    global _manager
+    with _manager_lock:
+        manager, _manager = _manager, None
+    if manager is not None:
+        await manager.aclose()
+
+async def drain_model_calls(timeout: float) -> int:
+    """
+    Called at app shutdown before close_client_manager(): waits up to `timeout`
+    seconds for the model calls still on the network (background jobs).
+    Returns how many were still running.
+    """
+    deadline = time.monotonic() + timeout
+    while AI_IN_FLIGHT.total() > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    return int(AI_IN_FLIGHT.total())
+
 def get_gemini_client():
     """
-    Returns: genai.Client or None if missing key
+    Returns: shared genai.Client or None if missing key
     """
-    key = os.getenv("GEMINI_API_KEY")
-    if not key:
-        return None
-    return genai.Client(api_key=key)
\ No newline at end of file
+    return get_client_manager().get_client()
+
+# the count_model_calls() counter of the current request, if any
+_model_calls: ContextVar[Optional[Dict[str, int]]] = ContextVar("kidzgo_model_calls", default=None)
+
+@contextmanager
+def count_model_calls() -> Iterator[Dict[str, int]]:
+    """
+    {"model_calls": n}: model calls made upstream inside the block, including
+    its tasks (not response-cache hits, not calls shed by the scheduler).
+    """
+    counter = {"model_calls": 0}
+    token = _model_calls.set(counter)
+    try:
+        yield counter
+    finally:
+        _model_calls.reset(token)
+
+def _count_model_call() -> None:
+    counter = _model_calls.get()
+    if counter is not None:
+        counter["model_calls"] += 1
+
+def _admit(scheduler, label: str, contents):
+    """resilience.Admit for one model call: retries wait for quota, hedges only use what is free."""
+    async def admit(wait: bool) -> bool:
+        if wait:
+            await scheduler.acquire(label, contents)
+            return True
+        return scheduler.try_acquire(label, contents) is not None
+    return admit
+
+async def generate_content_async(
+    client,
+    contents,
+    model: str = GEMINI_MODEL,
+    config=None,
+    endpoint: Optional[str] = None,
+    expect_json: bool = False,
+):
+    """
+    Async model call on the SDK's aio client; never blocks the event loop.
+    All agents' async services go through here. Quota scheduling is done by
+    app.core.scheduler; timeouts, retries, hedging and the circuit breaker by
+    app.core.resilience.
+
+    endpoint: label such as "a3.grade_text"; endpoints listed in AI_CACHE_ENDPOINTS
+    are served from the response cache (see app.core.model_cache).
+    expect_json: only cache responses that contain a JSON object.
+    """
+    cache = get_model_cache()
+    key = None
+    if cache.enabled_for(endpoint):
+        key = cache_key(model, contents, config)
+        if cache.backend.blocking:
+            text = await asyncio.to_thread(cache.get, endpoint, key)
+        else:
+            text = cache.get(endpoint, key)
+        if text is not None:
+            return CachedResponse(text)
+
+    label = endpoint or current_endpoint()
+    scheduler = get_scheduler()
+    grant = await scheduler.acquire(label, contents)  # may raise ModelOverloaded (503)
+    admit = _admit(scheduler, label, contents)
+    _count_model_call()
+    # a template prompt's static prefix may be served from a context cache (app.core.prompts)
+    context_caches = get_context_caches()
+    call_contents, call_config, cache_ref = await context_caches.prepare(client, model, contents, config)
+    AI_PAYLOAD_BYTES.observe(_payload_bytes(call_contents), endpoint=label)
+    AI_IN_FLIGHT.inc(endpoint=label)
+    try:
+        with observe_stage("network", label):
+            try:
+                resp = await call_with_resilience(
+                    label,
+                    lambda: client.aio.models.generate_content(model=model, contents=call_contents, config=call_config),
+                    admit,
+                )
+            except Exception as e:
+                if not context_caches.invalidate(cache_ref, e):
+                    raise
+                # the context cache is gone upstream: once more with the full prompt
+                await admit(True)
+                resp = await call_with_resilience(
+                    label,
+                    lambda: client.aio.models.generate_content(model=model, contents=contents, config=config),
+                    admit,
+                )
+    finally:
+        AI_IN_FLIGHT.dec(endpoint=label)
+    scheduler.settle(grant, resp)
+    record_usage(contents, resp)
+
+    if key is not None and resp.text and (not expect_json or _has_json(resp.text)):
+        if cache.backend.blocking:
+            await asyncio.to_thread(cache.put, key, resp.text)
+        else:
+            cache.put(key, resp.text)
+    return resp
+
+async def generate_content_stream_async(
+    client,
+    contents,
+    model: str = GEMINI_MODEL,
+    config=None,
+    endpoint: Optional[str] = None,
+    expect_json: bool = False,
+) -> AsyncIterator[Any]:
+    """
+    Streaming variant of generate_content_async: yields response chunks (each
+    with .text) as the model produces them. Same cache, scheduler and resilience
+    path; a cache hit is yielded as a single CachedResponse chunk.
+    """
+    cache = get_model_cache()
+    key = None
+    if cache.enabled_for(endpoint):
+        key = cache_key(model, contents, config)
+        if cache.backend.blocking:
+            text = await asyncio.to_thread(cache.get, endpoint, key)
+        else:
+            text = cache.get(endpoint, key)
+        if text is not None:
+            yield CachedResponse(text)
+            return
+
+    label = endpoint or current_endpoint()
+    scheduler = get_scheduler()
+    grant = await scheduler.acquire(label, contents)
+    admit = _admit(scheduler, label, contents)
+    _count_model_call()
+    context_caches = get_context_caches()
+    call_contents, call_config, cache_ref = await context_caches.prepare(client, model, contents, config)
+    AI_PAYLOAD_BYTES.observe(_payload_bytes(call_contents), endpoint=label)
+    AI_IN_FLIGHT.inc(endpoint=label)
+    def open_stream(stream_contents, stream_config):
+        return stream_with_resilience(
+            label,
+            lambda: client.aio.models.generate_content_stream(
+                model=model, contents=stream_contents, config=stream_config
+            ),
+            admit,
+        )
+
+    async def chunks():
+        try:
+            async for chunk in open_stream(call_contents, call_config):
+                yield chunk
+        except Exception as e:
+            if last is not None or not context_caches.invalidate(cache_ref, e):
+                raise
+            # the context cache is gone upstream: once more with the full prompt
+            await admit(True)
+            async for chunk in open_stream(contents, config):
+                yield chunk
+
+    start = time.perf_counter()
+    parts: List[str] = []
+    last = None
+    try:
+        async for chunk in chunks():
+            if last is None:
+                AI_FIRST_CHUNK.observe(time.perf_counter() - start, endpoint=label)
+            last = chunk
+            parts.append(chunk.text or "")
+            yield chunk
+    finally:
+        AI_IN_FLIGHT.dec(endpoint=label)
+        AI_STAGE_LATENCY.observe(time.perf_counter() - start, endpoint=label, stage="network")
+
+    if last is not None:
+        scheduler.settle(grant, last)
+        record_usage(contents, last)
+    text = "".join(parts)
+    if key is not None and text and (not expect_json or _has_json(text)):
+        if cache.backend.blocking:
+            await asyncio.to_thread(cache.put, key, text)
+        else:
+            cache.put(key, text)
+
+async def upload_media_async(client, file, mime_type: str, timeout: float = 300.0):
+    """
+    Uploads a file handle through the Files API (no in-memory copy of the payload)
+    and waits until it is ACTIVE. Use the returned File object in `contents`.
+    """
+    types = lazy_import("google.genai.types")
+    uploaded = await client.aio.files.upload(file=file, config=types.UploadFileConfig(mime_type=mime_type))
+    deadline = asyncio.get_running_loop().time() + timeout
+    while uploaded.state == types.FileState.PROCESSING:
+        if asyncio.get_running_loop().time() > deadline:
+            raise TimeoutError(f"File {uploaded.name} still processing after {timeout}s")
+        await asyncio.sleep(1.0)
+        uploaded = await client.aio.files.get(name=uploaded.name)
+    if uploaded.state == types.FileState.FAILED:
+        raise RuntimeError(f"File {uploaded.name} processing failed")
+    return uploaded
+
+async def delete_media_async(client, name: str) -> None:
+    try:
+        await client.aio.files.delete(name=name)
+    except Exception:
+        pass
+
+def _payload_bytes(contents) -> int:
+    """Approximate request payload: UTF-8 prompt text plus inline media bytes."""
+    if isinstance(contents, str):
+        return len(contents.encode("utf-8"))
+    if isinstance(contents, (bytes, bytearray)):
+        return len(contents)
+    if isinstance(contents, (list, tuple)):
+        return sum(_payload_bytes(c) for c in contents)
+    inline = getattr(contents, "inline_data", None)
+    if inline is not None and getattr(inline, "data", None):
+        return len(inline.data)
+    text = getattr(contents, "text", None)
+    if isinstance(text, str):
+        return len(text.encode("utf-8"))
+    parts = getattr(contents, "parts", None)
+    if parts:
+        return _payload_bytes(parts)
+    return 0
+
+def _has_json(text: str) -> bool:
+    try:
+        extract_json_block(text)
+        return True
+    except ValueError:
+        return False
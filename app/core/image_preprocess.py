@@ -0,0 +1,136 @@
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Optional, Union
+
+from app.core.startup import optional_import
+from app.core.utils import env_int
+
+logger = logging.getLogger("kidzgo.image")
+
+IMAGE_MAX_EDGE = env_int("IMAGE_MAX_EDGE", 1600)
+IMAGE_QUALITY = env_int("IMAGE_QUALITY", 80)
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()  # JPEG / WEBP
+IMAGE_WORKERS = env_int("IMAGE_WORKERS", 2)
+# thread (default) or process; Pillow releases the GIL for most work
+IMAGE_EXECUTOR = os.getenv("IMAGE_EXECUTOR", "thread").lower()
+
+_MIME_BY_FORMAT = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+@dataclass
+class PreprocessedImage:
+    data: bytes
+    mime_type: str
+    bytes_in: int
+    bytes_out: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    changed: bool = False
+
+def _read_all(fp: BinaryIO) -> bytes:
+    fp.seek(0)
+    data = fp.read()
+    fp.seek(0)
+    return data
+
+def _size_of(fp: BinaryIO) -> int:
+    fp.seek(0, io.SEEK_END)
+    size = fp.tell()
+    fp.seek(0)
+    return size
+
+def preprocess_image(source: Union[bytes, BinaryIO], mime_type: str, document: bool = True) -> PreprocessedImage:
+    """
+    Shrink a phone photo before it goes to the model:
+    EXIF auto-rotate -> downscale to IMAGE_MAX_EDGE -> (document) grayscale + autocontrast
+    -> re-encode as IMAGE_FORMAT. The original is kept if Pillow is missing, the
+    image cannot be decoded, or the re-encoded result is not smaller.
+
+    source: bytes or a seekable binary file (e.g. a spooled upload); files are
+    decoded straight from disk and only read fully if the original must be sent.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        fp = io.BytesIO(source)
+        size_in = len(source)
+    else:
+        fp = source
+        size_in = _size_of(fp)
+
+    def original(width=None, height=None) -> PreprocessedImage:
+        data = bytes(source) if isinstance(source, (bytes, bytearray)) else _read_all(fp)
+        return PreprocessedImage(
+            data=data, mime_type=mime_type, bytes_in=size_in, bytes_out=size_in, width=width, height=height
+        )
+
+    # Pillow is optional (images are then sent unchanged) and imported on the first image
+    Image = optional_import("PIL.Image")
+    ImageOps = optional_import("PIL.ImageOps")
+    if Image is None or ImageOps is None or not size_in:
+        return original()
+
+    try:
+        fp.seek(0)
+        with Image.open(fp) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+            if document:
+                img = ImageOps.autocontrast(img.convert("L"), cutoff=1)
+            elif img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+
+            fmt = IMAGE_FORMAT if IMAGE_FORMAT in _MIME_BY_FORMAT else "JPEG"
+            out = io.BytesIO()
+            img.save(out, format=fmt, quality=IMAGE_QUALITY, optimize=True)
+            encoded = out.getvalue()
+            width, height = img.size
+    except Exception as e:
+        logger.warning("image preprocess failed, sending original: %s: %s", type(e).__name__, e)
+        return original()
+
+    if len(encoded) >= size_in:
+        return original(width, height)
+
+    return PreprocessedImage(
+        data=encoded,
+        mime_type=_MIME_BY_FORMAT[fmt],
+        bytes_in=size_in,
+        bytes_out=len(encoded),
+        width=width,
+        height=height,
+        changed=True,
+    )
+
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        if IMAGE_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-prep")
+    return _executor
+
+async def preprocess_image_async(
+    source: Union[bytes, BinaryIO], mime_type: str, document: bool = True, label: str = ""
+) -> PreprocessedImage:
+    """Runs preprocess_image off the event loop and logs bytes in/out."""
+    loop = asyncio.get_running_loop()
+    if IMAGE_EXECUTOR == "process" and not isinstance(source, (bytes, bytearray)):
+        # file handles cannot be sent to another process
+        source = await asyncio.to_thread(_read_all, source)
+    result = await loop.run_in_executor(_get_executor(), preprocess_image, source, mime_type, document)
+    logger.info(
+        "image preprocess %s: %d -> %d bytes (%s, %sx%s)",
+        label, result.bytes_in, result.bytes_out, result.mime_type, result.width, result.height,
+    )
+    return result
+
+def shutdown_image_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,716 @@
+"""
+Persistent job queue for long-running AI calls (submit / poll / callback).
+
+Each agent endpoint that can take long has a job variant (POST <endpoint>/jobs)
+that stores the request, and its uploaded file if any, in a local SQLite queue
+and answers 202 with a job id right away. Workers take jobs from the queue, run
+the same service function as the synchronous endpoint and store the result:
+
+- GET /jobs/{job_id} returns the status and, once finished, the result
+  (?wait=N long-polls up to N seconds)
+- with an X-Callback-Url header, the finished job is also POSTed there (JSON
+  JobStatus, signed with X-KidzGo-Signature: sha256=<hmac> when
+  JOB_CALLBACK_SECRET is set). Only hosts in JOB_CALLBACK_ALLOWED_HOSTS are
+  accepted (none by default), so callers cannot make the service POST to
+  arbitrary internal addresses
+- an Idempotency-Key header makes re-submits of the same request return the
+  existing job instead of running it again (409 if the key comes with a
+  different request)
+
+Execution is at-least-once: a worker holds a lease on its job and renews it
+while running. If the worker dies, the lease runs out and another worker picks
+the job up again. A job whose handler raises is retried with backoff; after
+JOB_MAX_ATTEMPTS it fails. Finished jobs are kept for JOB_RESULT_TTL.
+Callbacks are at-least-once as well: a finished job keeps callback_status
+"pending" under a lease until the delivery ends, and workers pick up pending
+callbacks whose lease ran out (the worker died between finishing the job and
+delivering it).
+
+Workers run inside the web processes (JOB_INPROCESS_CONCURRENCY) and/or as
+dedicated processes (python -m app.worker) sharing the same database file. With
+dedicated workers, set JOB_INPROCESS_CONCURRENCY=0 so the web workers only
+serve requests.
+
+Env:
+- JOB_DB_PATH: sqlite file (default data/jobs.sqlite3)
+- JOB_FILES_DIR: uploads of queued jobs (default data/jobs)
+- JOB_INPROCESS_CONCURRENCY: jobs run at once per web process (default 2; 0 = none)
+- JOB_MAX_ATTEMPTS: default 3
+- JOB_RETRY_BACKOFF: seconds before the first retry, doubled per attempt (default 5)
+- JOB_LEASE_SECONDS: lease of a running job, renewed every third of it (default 60)
+- JOB_RESULT_TTL: seconds finished jobs are kept (default 86400)
+- JOB_POLL_INTERVAL: seconds between queue polls of an idle worker (default 0.5)
+- JOB_CALLBACK_RETRIES: webhook attempts after the first one (default 3)
+- JOB_CALLBACK_TIMEOUT: seconds per webhook attempt (default 10)
+- JOB_CALLBACK_SECRET: HMAC key for X-KidzGo-Signature (default unset, unsigned)
+- JOB_CALLBACK_ALLOWED_HOSTS: comma-separated hosts (or host:port) X-Callback-Url
+  may point to (default none: X-Callback-Url is refused)
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+import httpx
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from app.core.metrics import REGISTRY, Counter, Gauge, Histogram
+from app.core.model_cache import content_hash
+from app.core.resilience import CircuitOpenError
+from app.core.scheduler import ModelOverloaded, batch_lane
+from app.core.uploads import SpooledUpload
+from app.core.utils import env_float, env_int
+
+logger = logging.getLogger("kidzgo.jobs")
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join("data", "jobs.sqlite3"))
+JOB_FILES_DIR = os.getenv("JOB_FILES_DIR", os.path.join("data", "jobs"))
+INPROCESS_CONCURRENCY = env_int("JOB_INPROCESS_CONCURRENCY", 2)
+MAX_ATTEMPTS = env_int("JOB_MAX_ATTEMPTS", 3)
+RETRY_BACKOFF = env_float("JOB_RETRY_BACKOFF", 5.0)
+LEASE_SECONDS = env_float("JOB_LEASE_SECONDS", 60.0)
+RESULT_TTL = env_int("JOB_RESULT_TTL", 24 * 3600)
+POLL_INTERVAL = env_float("JOB_POLL_INTERVAL", 0.5)
+CALLBACK_RETRIES = env_int("JOB_CALLBACK_RETRIES", 3)
+CALLBACK_TIMEOUT = env_float("JOB_CALLBACK_TIMEOUT", 10.0)
+CALLBACK_SECRET = os.getenv("JOB_CALLBACK_SECRET", "")
+CALLBACK_ALLOWED_HOSTS = {
+    h.strip().lower() for h in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if h.strip()
+}
+# lease of a callback delivery: every attempt timing out plus the backoff between them
+CALLBACK_LEASE = (CALLBACK_RETRIES + 1) * CALLBACK_TIMEOUT + sum(min(60.0, 2 ** a) for a in range(CALLBACK_RETRIES)) + 30.0
+# longest ?wait= of GET /jobs/{job_id}
+MAX_WAIT = 30.0
+_PURGE_EVERY = 60.0
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+JOB_EVENTS = REGISTRY.register(Counter(
+    "kidzgo_jobs_total",
+    "Job events per kind: submitted, deduplicated, succeeded, failed, retried, cancelled, callback_failed,"
+    " callback_redelivered.",
+    ("kind", "event")))
+JOB_SECONDS = REGISTRY.register(Histogram(
+    "kidzgo_job_seconds", "Time jobs spent queued (wait) and running (run).", ("kind", "stage")))
+JOBS_RUNNING = REGISTRY.register(Gauge(
+    "kidzgo_jobs_running", "Jobs running in this process.", ("kind",)))
+
+class JobStatus(BaseModel):
+    job_id: str
+    kind: str
+    status: str  # queued / running / succeeded / failed / cancelled
+    attempts: int
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    expires_at: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    callback_status: Optional[str] = None
+
+JobRun = Callable[[Dict[str, Any], List[SpooledUpload]], Awaitable[Any]]
+
+@dataclass
+class JobHandler:
+    kind: str
+    run: JobRun
+    response_model: Optional[Type[BaseModel]] = None
+
+_handlers: Dict[str, JobHandler] = {}
+# id of the job whose handler runs in the current task
+_current_job: ContextVar[Optional[str]] = ContextVar("kidzgo_current_job", default=None)
+
+def current_job_id() -> Optional[str]:
+    """Id of the job being run (inside a job handler), for JobQueue.add_item(); None elsewhere."""
+    return _current_job.get()
+
+def job_handler(kind: str, response_model: Optional[Type[BaseModel]] = None):
+    """
+    Registers `async def run(payload, files)` for jobs of `kind`. It gets the
+    payload given to submit_job and the stored uploads, and returns what the
+    synchronous endpoint would (validated against `response_model`).
+    """
+    def decorator(run: JobRun) -> JobRun:
+        _handlers[kind] = JobHandler(kind, run, response_model)
+        return run
+    return decorator
+
+class JobQueue:
+    """The jobs table; all methods block (callers in async code use asyncio.to_thread)."""
+
+    def __init__(self, path: str = JOB_DB_PATH, files_dir: str = JOB_FILES_DIR):
+        self.path = path
+        self.files_dir = files_dir
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+            " payload TEXT NOT NULL, files TEXT NOT NULL DEFAULT '[]',"
+            " idempotency_key TEXT UNIQUE, request_hash TEXT, callback_url TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL,"
+            " available_at REAL NOT NULL, lease_until REAL, worker TEXT,"
+            " created_at REAL NOT NULL, started_at REAL, finished_at REAL, expires_at REAL,"
+            " result TEXT, error TEXT, callback_status TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_ready ON jobs(status, available_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_expires ON jobs(expires_at)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_jobs_callback ON jobs(lease_until) WHERE callback_status = 'pending'"
+        )
+        # partial results of long jobs (one row per A6 bulk report), in completion order (rowid)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_items ("
+            " job_id TEXT NOT NULL, idx INTEGER NOT NULL, item TEXT NOT NULL, PRIMARY KEY (job_id, idx))"
+        )
+        # woken on submit, so in-process workers do not wait for the next poll
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def _store_files(self, job_id: str, files: List[SpooledUpload]) -> List[Dict[str, Any]]:
+        stored = []
+        for n, upload in enumerate(files):
+            directory = os.path.join(self.files_dir, job_id)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, str(n))
+            upload.file.seek(0)
+            with open(path, "wb") as out:
+                shutil.copyfileobj(upload.file, out, 1024 * 1024)
+            upload.file.seek(0)
+            stored.append({
+                "path": path, "size": upload.size, "sha256": upload.sha256,
+                "content_type": upload.content_type, "filename": upload.filename,
+            })
+        return stored
+
+    def submit(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        files: List[SpooledUpload] = (),
+        idempotency_key: Optional[str] = None,
+        callback_url: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Queues a job; with a known idempotency_key, returns that job instead (ValueError if the request differs)."""
+        request_hash = content_hash([kind, payload, [f.sha256 for f in files]])
+        key = f"{kind}:{idempotency_key}" if idempotency_key else None
+        if key is not None:
+            existing = self._by_key(key)
+            if existing is not None:
+                if existing["request_hash"] != request_hash:
+                    raise ValueError("Idempotency-Key was used for a different request")
+                JOB_EVENTS.inc(kind=kind, event="deduplicated")
+                return existing
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        stored = self._store_files(job_id, list(files))
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, kind, status, payload, files, idempotency_key, request_hash,"
+                    " callback_url, max_attempts, available_at, created_at)"
+                    " VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, json.dumps(payload, ensure_ascii=False), json.dumps(stored), key,
+                     request_hash, callback_url, MAX_ATTEMPTS, now, now),
+                )
+        except sqlite3.IntegrityError:
+            # same key submitted concurrently
+            self._remove_files(job_id)
+            return self.submit(kind, payload, files, idempotency_key, callback_url)
+        JOB_EVENTS.inc(kind=kind, event="submitted")
+        return self.get(job_id)
+
+    def _by_key(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE idempotency_key = ?", (key,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def claim(self, worker: str, limit: int, kinds: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Takes up to `limit` jobs that are due, or whose worker's lease ran out,
+        and leases them to `worker`. kinds: only jobs of these kinds (the
+        handlers of the agents this process serves, see ENABLED_AGENTS).
+        """
+        now = time.time()
+        kind_filter, kind_args = "", ()
+        if kinds is not None:
+            kind_filter = " AND kind IN (%s)" % ",".join("?" * len(kinds)) if kinds else " AND 0"
+            kind_args = tuple(kinds)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [r[0] for r in self._conn.execute(
+                    "SELECT id FROM jobs WHERE ((status = 'queued' AND available_at <= ?)"
+                    " OR (status = 'running' AND lease_until < ?))" + kind_filter + " ORDER BY available_at LIMIT ?",
+                    (now, now, *kind_args, limit),
+                )]
+                for job_id in ids:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?,"
+                        " worker = ?, started_at = COALESCE(started_at, ?) WHERE id = ?",
+                        (now + LEASE_SECONDS, worker, now, job_id),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            if not ids:
+                return []
+            marks = ",".join("?" * len(ids))
+            rows = self._conn.execute(f"SELECT * FROM jobs WHERE id IN ({marks})", ids).fetchall()
+        return [dict(r) for r in rows]
+
+    def renew(self, job_id: str, worker: str) -> bool:
+        """Extends the lease; False if the job is no longer this worker's."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + LEASE_SECONDS, job_id, worker),
+            )
+        return cur.rowcount == 1
+
+    def finish(self, job_id: str, worker: str, status: str, result: Any = None, error: Optional[str] = None) -> bool:
+        """Stores the outcome; a job with a callback URL keeps the lease for delivering it (callback_status pending)."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, expires_at = ?,"
+                " callback_status = CASE WHEN callback_url IS NULL THEN NULL ELSE 'pending' END,"
+                " lease_until = CASE WHEN callback_url IS NULL THEN NULL ELSE ? END"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+                 now, now + RESULT_TTL, now + CALLBACK_LEASE, job_id, worker),
+            )
+        if cur.rowcount == 1:
+            self._remove_files(job_id)
+        return cur.rowcount == 1
+
+    def retry(self, job_id: str, worker: str, delay: float, error: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, error = ?, lease_until = NULL, worker = NULL"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + delay, error, job_id, worker),
+            )
+
+    def release(self, job_id: str, worker: str) -> None:
+        """Gives an unfinished job back (worker shutting down); the attempt does not count."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, lease_until = NULL, worker = NULL"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (job_id, worker),
+            )
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a job that has not started; False if it is running or finished."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, expires_at = ? WHERE id = ? AND status = 'queued'",
+                (now, now + RESULT_TTL, job_id),
+            )
+        if cur.rowcount == 1:
+            self._remove_files(job_id)
+        return cur.rowcount == 1
+
+    def claim_callbacks(self, worker: str, limit: int) -> List[Dict[str, Any]]:
+        """Finished jobs whose callback is still pending and whose delivery lease ran out, leased to `worker`."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [r[0] for r in self._conn.execute(
+                    "SELECT id FROM jobs WHERE callback_status = 'pending' AND (lease_until IS NULL OR lease_until < ?)"
+                    " LIMIT ?",
+                    (now, limit),
+                )]
+                for job_id in ids:
+                    self._conn.execute(
+                        "UPDATE jobs SET lease_until = ?, worker = ? WHERE id = ?", (now + CALLBACK_LEASE, worker, job_id)
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            if not ids:
+                return []
+            marks = ",".join("?" * len(ids))
+            rows = self._conn.execute(f"SELECT * FROM jobs WHERE id IN ({marks})", ids).fetchall()
+        return [dict(r) for r in rows]
+
+    def set_callback_status(self, job_id: str, status: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET callback_status = ?, lease_until = NULL WHERE id = ?", (status, job_id)
+            )
+
+    def add_item(self, job_id: str, index: int, item: Any) -> None:
+        """Stores partial result `index` of a job; the first one stored for an index is kept."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO job_items (job_id, idx, item) VALUES (?, ?, ?)",
+                (job_id, index, json.dumps(item, ensure_ascii=False)),
+            )
+
+    def items(self, job_id: str, after: int = 0) -> List[Tuple[int, Dict[str, Any]]]:
+        """(seq, item) of the partial results stored after seq `after`, in the order they were stored."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, item FROM job_items WHERE job_id = ? AND rowid > ? ORDER BY rowid", (job_id, after)
+            ).fetchall()
+        return [(seq, json.loads(item)) for seq, item in rows]
+
+    def purge(self) -> int:
+        """Deletes finished jobs past their TTL, with their partial results."""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM jobs WHERE expires_at < ?", (time.time(),))
+            if cur.rowcount:
+                self._conn.execute("DELETE FROM job_items WHERE job_id NOT IN (SELECT id FROM jobs)")
+        return cur.rowcount
+
+    def _remove_files(self, job_id: str) -> None:
+        shutil.rmtree(os.path.join(self.files_dir, job_id), ignore_errors=True)
+
+    def notify(self) -> None:
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+def job_status(row: Dict[str, Any]) -> Dict[str, Any]:
+    """A jobs row as JobStatus (the API's and the webhook's body)."""
+    return {
+        "job_id": row["id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+        "expires_at": row["expires_at"],
+        "error": row["error"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "callback_status": row["callback_status"],
+    }
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
+
+async def submit_job(
+    kind: str,
+    payload: Dict[str, Any],
+    files: List[SpooledUpload] = (),
+    idempotency_key: Optional[str] = None,
+    callback_url: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Queues a job for a registered handler; returns its JobStatus. Used by the agents' /jobs endpoints."""
+    if kind not in _handlers:
+        raise ValueError(f"No job handler for {kind!r}")
+    if callback_url:
+        problem = callback_url_problem(callback_url)
+        if problem:
+            raise HTTPException(status_code=422, detail=f"X-Callback-Url: {problem}")
+    queue = get_job_queue()
+    try:
+        row = await asyncio.to_thread(
+            queue.submit, kind, jsonable_encoder(payload), list(files), idempotency_key, callback_url
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    queue.notify()
+    return job_status(row)
+
+def callback_url_problem(url: str) -> Optional[str]:
+    """Why `url` may not be used as a callback (None if it may): http(s) to a JOB_CALLBACK_ALLOWED_HOSTS host only."""
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return "not a valid URL"
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return "must be an http(s) URL"
+    if parts.username or parts.password:
+        return "must not contain credentials"
+    if not CALLBACK_ALLOWED_HOSTS:
+        return "callbacks are not enabled (JOB_CALLBACK_ALLOWED_HOSTS)"
+    host = parts.hostname.lower()
+    if host not in CALLBACK_ALLOWED_HOSTS and f"{host}:{port}" not in CALLBACK_ALLOWED_HOSTS:
+        return f"host {host} is not in JOB_CALLBACK_ALLOWED_HOSTS"
+    return None
+
+def _sign(body: bytes) -> Dict[str, str]:
+    if not CALLBACK_SECRET:
+        return {}
+    digest = hmac.new(CALLBACK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return {"X-KidzGo-Signature": f"sha256={digest}"}
+
+async def deliver_callback(url: str, status: Dict[str, Any]) -> str:
+    """POSTs the finished job to `url`, retrying with backoff; returns "sent" or the last error."""
+    problem = callback_url_problem(url)  # the allowed hosts may have changed since the submit
+    if problem:
+        return f"failed: {problem}"
+    body = json.dumps(status, ensure_ascii=False).encode("utf-8")
+    headers = {"Content-Type": "application/json", **_sign(body)}
+    error = ""
+    async with httpx.AsyncClient(timeout=CALLBACK_TIMEOUT) as client:
+        for attempt in range(CALLBACK_RETRIES + 1):
+            try:
+                resp = await client.post(url, content=body, headers=headers)
+                if resp.status_code < 300:
+                    return "sent"
+                error = f"HTTP {resp.status_code}"
+                if 400 <= resp.status_code < 500 and resp.status_code not in (408, 429):
+                    break
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+            if attempt < CALLBACK_RETRIES:
+                await asyncio.sleep(min(60.0, 2 ** attempt))
+    return f"failed: {error}"
+
+class JobWorker:
+    """
+    Runs jobs from the queue, up to `concurrency` at once, on the current event
+    loop. stop() stops taking jobs, waits for running ones up to `timeout` and
+    gives back the rest.
+    """
+
+    def __init__(self, queue: JobQueue, concurrency: int, name: Optional[str] = None):
+        self.queue = queue
+        self.concurrency = max(1, concurrency)
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._running: Dict[str, asyncio.Task] = {}
+        self._callbacks: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+        self._loop_task: Optional[asyncio.Task] = None
+        self.completed = 0
+
+    def start(self) -> None:
+        self._loop_task = asyncio.create_task(self.run())
+
+    async def run(self) -> None:
+        self.queue.wakeup = wakeup = asyncio.Event()
+        next_purge = 0.0
+        while not self._stopping:
+            if time.time() >= next_purge:
+                purged = await asyncio.to_thread(self.queue.purge)
+                if purged:
+                    logger.info("purged %d expired jobs", purged)
+                next_purge = time.time() + _PURGE_EVERY
+            free = self.concurrency - len(self._running)
+            jobs = await asyncio.to_thread(self.queue.claim, self.name, free, sorted(_handlers)) if free > 0 else []
+            for row in jobs:
+                self._running[row["id"]] = asyncio.create_task(self._execute(row))
+            if free > 0 and len(self._callbacks) < self.concurrency:
+                for row in await asyncio.to_thread(
+                    self.queue.claim_callbacks, self.name, self.concurrency - len(self._callbacks)
+                ):
+                    self._callbacks[row["id"]] = asyncio.create_task(self._redeliver(row))
+            if jobs and len(self._running) < self.concurrency:
+                continue
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        self._stopping = True
+        self.queue.notify()
+        if self._loop_task is not None:
+            await self._loop_task
+        running = [*self._running.values(), *self._callbacks.values()]
+        if running:
+            _, pending = await asyncio.wait(running, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _keep_lease(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            if not await asyncio.to_thread(self.queue.renew, job_id, self.name):
+                return
+
+    async def _execute(self, row: Dict[str, Any]) -> None:
+        job_id, kind = row["id"], row["kind"]
+        JOB_SECONDS.observe(max(0.0, time.time() - row["available_at"]), kind=kind, stage="wait")
+        JOBS_RUNNING.inc(kind=kind)
+        lease = asyncio.create_task(self._keep_lease(job_id))
+        started = time.perf_counter()
+        try:
+            await self._attempt(row)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self.queue.release, job_id, self.name)
+            raise
+        finally:
+            lease.cancel()
+            JOBS_RUNNING.dec(kind=kind)
+            JOB_SECONDS.observe(time.perf_counter() - started, kind=kind, stage="run")
+            self._running.pop(job_id, None)
+
+    async def _attempt(self, row: Dict[str, Any]) -> None:
+        job_id, kind = row["id"], row["kind"]
+        handler = _handlers.get(kind)
+        if handler is None:
+            await self._finish(row, "failed", error=f"No job handler for {kind!r}")
+            return
+        if row["attempts"] > row["max_attempts"]:
+            # the worker holding it died on the last attempt
+            await self._finish(row, "failed", error=row["error"] or "worker lost")
+            return
+
+        files = [
+            SpooledUpload(open(f["path"], "rb"), f["size"], f["sha256"], f["content_type"], f.get("filename"))
+            for f in json.loads(row["files"])
+        ]
+        token = _current_job.set(job_id)
+        try:
+            with batch_lane():
+                result = await handler.run(json.loads(row["payload"]), files)
+            result = jsonable_encoder(result)
+            if handler.response_model is not None:
+                result = jsonable_encoder(handler.response_model.model_validate(result))
+            await self._finish(row, "succeeded", result=result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {getattr(e, 'detail', None) or e}"
+            if row["attempts"] >= row["max_attempts"]:
+                logger.warning("job %s (%s) failed after %d attempts: %s", job_id, kind, row["attempts"], error)
+                await self._finish(row, "failed", error=error)
+                return
+            if isinstance(e, ModelOverloaded):
+                delay = e.retry_after
+            elif isinstance(e, CircuitOpenError):
+                delay = e.retry_in
+            else:
+                delay = RETRY_BACKOFF * (2 ** (row["attempts"] - 1))
+            JOB_EVENTS.inc(kind=kind, event="retried")
+            await asyncio.to_thread(self.queue.retry, job_id, self.name, delay, error)
+        finally:
+            _current_job.reset(token)
+            for f in files:
+                f.file.close()
+
+    async def _finish(self, row: Dict[str, Any], status: str, result: Any = None, error: Optional[str] = None) -> None:
+        job_id, kind = row["id"], row["kind"]
+        if not await asyncio.to_thread(self.queue.finish, job_id, self.name, status, result, error):
+            # lease lost: another worker has the job now
+            return
+        self.completed += 1
+        JOB_EVENTS.inc(kind=kind, event=status)
+        if row["callback_url"]:
+            await self._deliver(row)
+
+    async def _deliver(self, row: Dict[str, Any]) -> None:
+        job_id, kind = row["id"], row["kind"]
+        final = await asyncio.to_thread(self.queue.get, job_id)
+        outcome = await deliver_callback(row["callback_url"], job_status(final))
+        if outcome != "sent":
+            JOB_EVENTS.inc(kind=kind, event="callback_failed")
+            logger.warning("job %s callback to %s %s", job_id, row["callback_url"], outcome)
+        await asyncio.to_thread(self.queue.set_callback_status, job_id, outcome)
+
+    async def _redeliver(self, row: Dict[str, Any]) -> None:
+        """A callback left pending by a worker that stopped before delivering it."""
+        try:
+            JOB_EVENTS.inc(kind=row["kind"], event="callback_redelivered")
+            await self._deliver(row)
+        finally:
+            self._callbacks.pop(row["id"], None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name, "concurrency": self.concurrency, "running": len(self._running),
+                "completed": self.completed}
+
+_inprocess: Optional[JobWorker] = None
+
+def start_inprocess_worker() -> None:
+    """Runs jobs inside this web process too (JOB_INPROCESS_CONCURRENCY > 0); call from the app lifespan."""
+    global _inprocess
+    if INPROCESS_CONCURRENCY > 0 and _inprocess is None:
+        _inprocess = JobWorker(get_job_queue(), INPROCESS_CONCURRENCY)
+        _inprocess.start()
+
+async def stop_inprocess_worker(timeout: float = 10.0) -> None:
+    global _inprocess
+    if _inprocess is not None:
+        await _inprocess.stop(timeout)
+        _inprocess = None
+
+def job_stats() -> Dict[str, Any]:
+    return {
+        "handlers": sorted(_handlers),
+        "queue": get_job_queue().counts(),
+        "inprocess_worker": _inprocess.stats() if _inprocess is not None else None,
+    }
+
+router = APIRouter()
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str, wait: float = 0):
+    """Status of a job; with wait > 0, waits up to that many seconds (max 30) for it to finish."""
+    queue = get_job_queue()
+    deadline = time.monotonic() + min(max(wait, 0.0), MAX_WAIT)
+    while True:
+        row = await asyncio.to_thread(queue.get, job_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if row["status"] in FINISHED or time.monotonic() >= deadline:
+            return job_status(row)
+        await asyncio.sleep(min(0.25, max(0.0, deadline - time.monotonic())))
+
+@router.delete("/jobs/{job_id}", response_model=JobStatus)
+async def cancel_job(job_id: str):
+    """Cancels a queued job; 409 once it is running or finished."""
+    queue = get_job_queue()
+    if not await asyncio.to_thread(queue.cancel, job_id):
+        row = await asyncio.to_thread(queue.get, job_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail=f"Job is {row['status']}")
+    row = await asyncio.to_thread(queue.get, job_id)
+    JOB_EVENTS.inc(kind=row["kind"], event="cancelled")
+    return job_status(row)
+
+def job_headers(
+    idempotency_key: Optional[str] = Header(None, max_length=200),
+    x_callback_url: Optional[str] = Header(None),
+) -> Dict[str, Optional[str]]:
+    """Dependency of the /jobs endpoints: Idempotency-Key and X-Callback-Url headers as submit_job kwargs."""
+    return {"idempotency_key": idempotency_key, "callback_url": x_callback_url}
@@ -0,0 +1,240 @@
+"""
+Extracting the JSON object from model output.
+
+Model replies wrap the object in prose, ``` fences, trailing notes (which may
+contain braces of their own) or get cut off at the output token limit. The
+scanner here walks the text once, tracking string/escape state and bracket
+depth, so it finds balanced top-level {...} blocks regardless of what
+surrounds them, and it can be fed the text chunk by chunk while a response
+streams in.
+
+Order of preference in parse_json_object():
+1. the whole first-'{'-to-last-'}' slice, if it parses (the common case, C speed)
+2. the first balanced block that parses to an object
+3. the unfinished trailing block, repaired (open arrays/objects closed,
+   dangling commas and keys dropped; a string or number cut off mid-way is
+   dropped with its key or array slot rather than kept as a half sentence or
+   the first digits of a score)
+
+A repaired object can still lack fields that came after the cut, so callers
+validate it against their output schema (app.core.structured) before use.
+
+orjson is used for parsing when installed (optional; stdlib json otherwise).
+"""
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+from app.core.metrics import REGISTRY, Counter, current_endpoint
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+logger = logging.getLogger("kidzgo.json")
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+# how many cut points (from the end) are tried when repairing a truncated object
+_MAX_REPAIR_ATTEMPTS = 16
+
+JSON_REPAIRED = REGISTRY.register(Counter(
+    "kidzgo_ai_json_repaired_total", "Model outputs parsed only after repairing a truncated object.", ("endpoint",)))
+
+_STRUCT = re.compile(r'[{}\[\]"]')
+_IN_STRING = re.compile(r'["\\]')
+# a number at the very end of the fragment may be missing digits ("1" of "10")
+_TRAILING_NUMBER = re.compile(r'[:\[,]\s*-?[\d.eE+-]+$')
+_CLOSER = {"{": "}", "[": "]"}
+
+def loads(text: str) -> Any:
+    """json.loads, through orjson when installed (its errors subclass json.JSONDecodeError)."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def _loads_object(text: str) -> Optional[Dict[str, Any]]:
+    try:
+        obj = loads(text)
+    except ValueError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+class JsonObjectScanner:
+    """
+    Finds top-level {...} blocks in text fed in chunks, in a single pass.
+    Text outside blocks is dropped as it is seen; only the block being scanned
+    is buffered.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, chunk: str) -> List[str]:
+        """Scans `chunk`; returns the blocks completed by it, in order."""
+        done: List[str] = []
+        buf = self._buf + chunk if self._buf else chunk
+        pos = self._pos
+        while True:
+            if self._depth == 0:
+                start = buf.find("{", pos)
+                if start == -1:
+                    buf, pos = "", 0
+                    break
+                buf, pos, self._depth = buf[start:], 1, 1
+                continue
+            if self._in_string:
+                m = _IN_STRING.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                if m.group() == "\\":
+                    if m.end() >= len(buf):  # escaped char is in the next chunk
+                        pos = m.start()
+                        break
+                    pos = m.end() + 1
+                    continue
+                self._in_string = False
+                pos = m.end()
+                continue
+            m = _STRUCT.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            c = m.group()
+            pos = m.end()
+            if c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    done.append(buf[:pos])
+                    buf, pos = buf[pos:], 0
+        self._buf, self._pos = buf, pos
+        return done
+
+    def pending(self) -> str:
+        """The unfinished block (from its '{'), or "" when between blocks."""
+        return self._buf if self._depth else ""
+
+def _close(text: str, stack: List[str]) -> str:
+    text = text.rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    elif text.endswith(":"):
+        text += "null"
+    return text + "".join(_CLOSER[c] for c in reversed(stack))
+
+def repair_truncated(fragment: str) -> Optional[Dict[str, Any]]:
+    """
+    Best-effort parse of an object cut off mid-way: closes the open
+    containers; if that is not valid (half a literal, a key without value) or
+    the cut is inside a string or right after a number, retries from earlier
+    ',' / '{' / '[' boundaries, so a truncated string or number value is
+    dropped, never served cut mid-word or with digits missing. None if nothing
+    parses.
+    """
+    stack: List[str] = []
+    cuts = []  # (index, stack at that point) for ',' and openers outside strings
+    in_string = False
+    i, n = 0, len(fragment)
+    while i < n:
+        c = fragment[i]
+        if in_string:
+            if c == "\\":
+                i += 2
+                continue
+            if c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append(c)
+            cuts.append((i + 1, list(stack)))
+        elif c in "}]":
+            if stack:
+                stack.pop()
+        elif c == ",":
+            cuts.append((i, list(stack)))
+        i += 1
+
+    if not stack:
+        return None  # not truncated, just invalid
+
+    if not in_string and not _TRAILING_NUMBER.search(fragment):
+        obj = _loads_object(_close(fragment, stack))
+        if obj is not None:
+            return obj
+    for end, cut_stack in reversed(cuts[-_MAX_REPAIR_ATTEMPTS:]):
+        obj = _loads_object(_close(fragment[:end], cut_stack))
+        if obj is not None:
+            return obj
+    return None
+
+class StreamingJsonExtractor:
+    """
+    Incremental parse_json_object(): feed() the chunks of a streamed response,
+    then result(). Complete blocks are parsed as soon as they close, so the
+    work overlaps with the network. `repaired` tells whether result() had to
+    repair a truncated object.
+    """
+
+    def __init__(self, repair: bool = True, endpoint: Optional[str] = None):
+        self.repair = repair
+        self.endpoint = endpoint
+        self.repaired = False
+        self._scanner = JsonObjectScanner()
+        self._obj: Optional[Dict[str, Any]] = None
+
+    def feed(self, chunk: str) -> Optional[Dict[str, Any]]:
+        """Returns the object once the first valid block is complete."""
+        if self._obj is None and chunk:
+            for block in self._scanner.feed(chunk):
+                self._obj = _loads_object(block)
+                if self._obj is not None:
+                    break
+        return self._obj
+
+    def result(self) -> Dict[str, Any]:
+        if self._obj is not None:
+            return self._obj
+        pending = self._scanner.pending()
+        if self.repair and pending:
+            obj = repair_truncated(pending)
+            if obj is not None:
+                self.repaired = True
+                label = self.endpoint or current_endpoint()
+                JSON_REPAIRED.inc(endpoint=label)
+                logger.warning("repaired truncated model JSON (%s, %d chars)", label, len(pending))
+                return obj
+        raise ValueError("No JSON object found in text")
+
+def find_json_block(text: str) -> str:
+    """Text of the first balanced {...} block that parses to an object."""
+    if not text:
+        raise ValueError("Empty text")
+    for block in JsonObjectScanner().feed(text):
+        if _loads_object(block) is not None:
+            return block
+    raise ValueError("No JSON object found in text")
+
+def parse_json_object(text: str, repair: bool = True, endpoint: Optional[str] = None) -> Dict[str, Any]:
+    """The JSON object in a model reply; ValueError when there is none (even after repair)."""
+    if not text:
+        raise ValueError("Empty text")
+    start = text.find("{")
+    end = text.rfind("}")
+    if start != -1 and end > start:
+        obj = _loads_object(text[start:end + 1])
+        if obj is not None:
+            return obj
+    extractor = StreamingJsonExtractor(repair=repair, endpoint=endpoint)
+    extractor.feed(text)
+    return extractor.result()
@@ -0,0 +1,216 @@
+"""
+Keyword matching for the rule-based heuristics (A7 transaction type, A6
+fallback report sections).
+
+A KeywordMatcher compiles the keywords of all its labels once (one regex for
+all of them, see KeywordMatcher) and returns every hit:
+
+- accents and case are ignored ("hoc phi", "HỌC PHÍ" and "học phí" all match
+  "học phí"). A hit typed without accents counts with UNACCENTED_WEIGHT of the
+  keyword's weight; a word written with other accents ("thuế" for the keyword
+  "thuê") is not a hit.
+- whole words only: "fee" does not match "coffee"; a trailing "*" makes the
+  keyword a prefix ("refund*" also matches "refunded")
+- where keywords overlap the longest wins, so "chưa tốt" is one hit and not
+  "chưa" plus "tốt"
+
+Keywords carry weights; scores() sums them per label and best() returns the
+label with the highest score (on ties the label declared first), instead of
+the first label that has any hit. score_batch() scores many short texts (the
+feedback lines of a report) in one pass.
+"""
+import bisect
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+# a hit whose text has no accents where the keyword has some ("hoc phi" for
+# "học phí") is less certain: "luong" may be "lương" or "lượng"
+UNACCENTED_WEIGHT = 0.8
+
+Keyword = Union[str, Tuple[str, float]]
+
+# joins the texts of score_batch(); neither a word character nor a space, so no hit spans two texts
+_SEPARATOR = "\x00"
+
+def _fold_table() -> Dict[int, str]:
+    table = {}
+    # ASCII, Latin-1, Latin Extended-A/B and Latin Extended Additional (Vietnamese)
+    for cp in list(range(0x41, 0x5B)) + list(range(0xC0, 0x250)) + list(range(0x1E00, 0x1F00)):
+        low = chr(cp).lower()
+        if len(low) != 1:
+            continue
+        base = unicodedata.normalize("NFD", low)[0]
+        if base != chr(cp):
+            table[cp] = base
+    table[ord("đ")] = table[ord("Đ")] = "d"
+    return table
+
+_FOLD = _fold_table()
+
+# base letter -> regex class of every letter folding to it ("a" -> "[aAàÀáÁ...]"),
+# for checking a scanned hit against the original text
+_VARIANTS: Dict[str, List[str]] = {}
+for _cp, _base in _FOLD.items():
+    _VARIANTS.setdefault(_base, [_base, _base.upper()]).append(chr(_cp))
+_CLASSES = {base: "[%s]" % "".join(sorted(set(chars))) for base, chars in _VARIANTS.items()}
+
+def fold_text(text: str) -> str:
+    """Lowercase without accents ("Học phí Đợt 2" -> "hoc phi dot 2"), same length as NFC(text)."""
+    if text.isascii():
+        return text.lower()
+    return unicodedata.normalize("NFC", text).translate(_FOLD)
+
+def _keyword_pattern(folded: str) -> str:
+    return "".join(r"\s+" if c == " " else _CLASSES.get(c) or re.escape(c) for c in folded)
+
+class Hit(NamedTuple):
+    label: str
+    keyword: str
+    start: int
+    end: int
+    weight: float
+
+def trie_regex(words: Iterable[str]) -> str:
+    """Alternation of words factored into a trie ("hoan|hoan tien" -> "hoan(?:\\s+tien)?")."""
+    root: Dict[str, Any] = {}
+    for word in words:
+        node = root
+        for c in word:
+            node = node.setdefault(c, {})
+        node[""] = True
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [(r"\s+" if c == " " else re.escape(c)) + build(child)
+                    for c, child in sorted(node.items()) if c]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:%s)" % "|".join(branches)
+        return "(?:%s)?" % body if "" in node else body
+
+    return build(root)
+
+class KeywordMatcher:
+    """
+    rules: label -> keywords, each a string (weight 1.0) or (keyword, weight).
+    Labels keep their order; it breaks ties in best().
+
+    hits() runs one regex, a trie of all folded keywords, over the folded
+    text; each match is then checked at its position in the original text for
+    word boundaries and accents. A text without any keyword costs that one
+    scan, whatever the number of keywords.
+    """
+
+    def __init__(self, rules: Mapping[str, Iterable[Keyword]]):
+        self.labels: List[str] = list(rules)
+        # folded keyword -> [(label, keyword, weight)]
+        self._entries: Dict[str, List[Tuple[str, str, float]]] = {}
+        prefixes = set()
+        for label, keywords in rules.items():
+            for kw in keywords:
+                word, weight = (kw, 1.0) if isinstance(kw, str) else kw
+                word = " ".join(unicodedata.normalize("NFC", word.lower()).split())
+                if word.endswith("*"):
+                    word = word[:-1].rstrip()
+                    prefixes.add(fold_text(word))
+                if word:
+                    self._entries.setdefault(fold_text(word), []).append((label, word, float(weight)))
+        # the scan over the folded text. No lookbehind for the word boundary: a
+        # pattern starting with plain letters lets the regex engine skip ahead to
+        # possible first letters; the boundary is checked in hits()
+        self._scan = re.compile(trie_regex(self._entries)) if self._entries else None
+        # keywords to try at the same place when the scanned one is not a hit
+        # ("hoàn" for "hoàn tiễn", scanned as "hoan tien")
+        self._shorter = {
+            w: sorted((v for v in self._entries if v != w and w.startswith(v)), key=len, reverse=True)
+            for w in self._entries
+        }
+        # the check on the original text, at the scanned position
+        self._exact = {
+            w: re.compile(r"%s%s(?!\w)" % (_keyword_pattern(w), r"\w*" if w in prefixes else ""))
+            for w in self._entries
+        }
+
+    @staticmethod
+    def _accent_factor(original: str, keyword: str) -> float:
+        """For a hit that is not exactly the keyword: UNACCENTED_WEIGHT if accents were left out, 0.0 if different."""
+        if original.isascii() or len(original) != len(keyword):
+            return UNACCENTED_WEIGHT
+        for o, f, k in zip(original, original.translate(_FOLD), keyword):
+            if o != k and o != f:  # an accent, but not the keyword's
+                return 0.0
+        return UNACCENTED_WEIGHT
+
+    def _check(self, text: str, start: int, word: str) -> Tuple[int, List[Hit]]:
+        """Hits of the folded keyword `word` at text[start:] (accents checked) and their end."""
+        m = self._exact[word].match(text, start)
+        if m is None:
+            return start, []
+        n = len(word)
+        original = m.group().lower()
+        if len(original) != n:  # extra spaces, or the rest of a prefix keyword's word
+            original = " ".join(original.split())[:n]
+        hits = []
+        for label, keyword, weight in self._entries[word]:
+            if original != keyword:
+                weight *= self._accent_factor(original, keyword)
+            if weight:
+                hits.append(Hit(label, keyword, start, m.end(), weight))
+        return m.end(), hits
+
+    def hits(self, text: Optional[str]) -> List[Hit]:
+        """Every keyword hit in text, in text order; where keywords overlap, the longest."""
+        if not text or self._scan is None:
+            return []
+        if not text.isascii() and not unicodedata.is_normalized("NFC", text):
+            text = unicodedata.normalize("NFC", text)
+        folded = fold_text(text)
+        out: List[Hit] = []
+        pos = 0
+        while True:
+            m = self._scan.search(folded, pos)
+            if m is None:
+                return out
+            start = m.start()
+            pos = start + 1
+            if start and (folded[start - 1].isalnum() or folded[start - 1] == "_"):
+                continue  # inside a word
+            word = " ".join(m.group().split())
+            for candidate in [word] + self._shorter[word]:
+                end, found = self._check(text, start, candidate)
+                if found:
+                    out.extend(found)
+                    pos = end
+                    break
+
+    def scores(self, text: Optional[str]) -> Dict[str, float]:
+        """Summed hit weights per label."""
+        scores: Dict[str, float] = {}
+        for hit in self.hits(text):
+            scores[hit.label] = scores.get(hit.label, 0.0) + hit.weight
+        return scores
+
+    def score_batch(self, texts: Sequence[Optional[str]]) -> List[Dict[str, float]]:
+        """scores() of every text, from a single hits() pass over all of them."""
+        parts = [unicodedata.normalize("NFC", t) if t and not t.isascii() else (t or "") for t in texts]
+        starts, pos = [], 0
+        for part in parts:
+            starts.append(pos)
+            pos += len(part) + len(_SEPARATOR)
+        out: List[Dict[str, float]] = [{} for _ in parts]
+        for hit in self.hits(_SEPARATOR.join(parts)):
+            scores = out[bisect.bisect_right(starts, hit.start) - 1]
+            scores[hit.label] = scores.get(hit.label, 0.0) + hit.weight
+        return out
+
+    def pick(self, scores: Mapping[str, float], default: Optional[str] = None) -> Optional[str]:
+        """Highest scoring label; ties go to the label declared first."""
+        best, best_score = default, 0.0
+        for label in self.labels:
+            score = scores.get(label, 0.0)
+            if score > best_score:
+                best, best_score = label, score
+        return best
+
+    def best(self, text: Optional[str], default: Optional[str] = None) -> Optional[str]:
+        return self.pick(self.scores(text), default)
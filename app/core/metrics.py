@@ -0,0 +1,331 @@
+"""
+In-process metrics in the Prometheus text exposition format (served on /metrics).
+
+Counters/gauges/histograms are per worker process; scrape each worker or
+aggregate with `sum by (...)` on the Prometheus side.
+"""
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+SIZE_BUCKETS = (1024, 8192, 65536, 262144, 1048576, 4194304, 16777216, 67108864, 268435456)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def total(self) -> float:
+        """Sum over all label sets."""
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels_text(self.label_names, k)} {v}" for k, v in items]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def total(self, **labels) -> float:
+        state = self._values.get(self._key(labels))
+        return state[1] if state else 0.0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v[0]), v[1]) for k, v in self._values.items()]
+        lines = self.header()
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = _labels_text(self.label_names, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += counts[-1]
+            le = _labels_text(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_labels_text(self.label_names, key)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# ---- HTTP ----
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "kidzgo_http_requests_total", "HTTP requests by router, route and status.", ("router", "route", "method", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "kidzgo_http_request_duration_seconds", "HTTP request latency.", ("router", "route")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "kidzgo_http_requests_in_flight", "HTTP requests currently being served.", ("router",)))
+HTTP_REQUEST_BYTES = REGISTRY.register(Histogram(
+    "kidzgo_http_request_size_bytes", "Request body size (Content-Length).", ("router", "route"), SIZE_BUCKETS))
+
+# ---- model calls ----
+AI_STAGE_LATENCY = REGISTRY.register(Histogram(
+    "kidzgo_ai_stage_seconds",
+    "Time per model-call stage (prompt_build, network, json_extract, normalize), exclusive of nested stages.",
+    ("endpoint", "stage")))
+AI_IN_FLIGHT = REGISTRY.register(Gauge(
+    "kidzgo_ai_calls_in_flight", "Model calls waiting on the network.", ("endpoint",)))
+AI_PAYLOAD_BYTES = REGISTRY.register(Histogram(
+    "kidzgo_ai_payload_bytes", "Prompt + inline media bytes sent per model call.", ("endpoint",), SIZE_BUCKETS))
+AI_FIRST_CHUNK = REGISTRY.register(Histogram(
+    "kidzgo_ai_time_to_first_chunk_seconds", "Streaming calls: time until the first model chunk.", ("endpoint",)))
+AI_RESULTS = REGISTRY.register(Counter(
+    "kidzgo_ai_results_total", "Service results by ai_used and fallback reason (exception type).",
+    ("endpoint", "ai_used", "reason")))
+PROMPT_RESULTS = REGISTRY.register(Counter(
+    "kidzgo_ai_prompt_results_total", "Service results by prompt template version (for A/B tests).",
+    ("template", "version", "ai_used")))
+
+def _resident_memory_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, KiB on Linux
+    except ImportError:  # Windows
+        return None
+
+def _process_lines() -> List[str]:
+    # labelled by pid: with several uvicorn workers behind one port each scrape hits one of them
+    rss = _resident_memory_bytes()
+    if rss is None:
+        return []
+    return [
+        "# HELP kidzgo_process_resident_memory_bytes Resident memory of the worker that served this scrape.",
+        "# TYPE kidzgo_process_resident_memory_bytes gauge",
+        f'kidzgo_process_resident_memory_bytes{{pid="{os.getpid()}"}} {rss}',
+    ]
+
+def render_metrics() -> str:
+    return REGISTRY.render() + "\n".join(_process_lines() + [""])
+
+# ---- per-call state ----
+
+class _CallState:
+    __slots__ = ("endpoint", "error", "prompt")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.error: Optional[str] = None
+        self.prompt: Optional[Tuple[str, str]] = None
+
+_current: contextvars.ContextVar[Optional[_CallState]] = contextvars.ContextVar("kidzgo_ai_call", default=None)
+# innermost open stage as [start, nested_time]; per task, so concurrent segments do not interleave
+_stage: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("kidzgo_ai_stage", default=None)
+
+def current_endpoint() -> str:
+    state = _current.get()
+    return state.endpoint if state else "unknown"
+
+@contextmanager
+def observe_stage(stage: str, endpoint: Optional[str] = None):
+    """Times a stage of the current model call; nested stages are subtracted from the outer one."""
+    label = endpoint or current_endpoint()
+    parent = _stage.get()
+    frame = [time.perf_counter(), 0.0]
+    token = _stage.set(frame)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+        elapsed = time.perf_counter() - frame[0]
+        if parent is not None:
+            parent[1] += elapsed
+        AI_STAGE_LATENCY.observe(max(elapsed - frame[1], 0.0), endpoint=label, stage=stage)
+
+def note_ai_error(error) -> None:
+    """Marks the current service call as a fallback; `error` is an exception or a reason string."""
+    state = _current.get()
+    if state is not None and state.error is None:
+        state.error = error if isinstance(error, str) else type(error).__name__
+
+def note_prompt(template: str, version: str) -> None:
+    """Records the prompt template version the current service call used."""
+    state = _current.get()
+    if state is not None and state.prompt is None:
+        state.prompt = (template, version)
+
+def record_ai_result(endpoint: str, error: Optional[str] = None, prompt: Optional[Tuple[str, str]] = None) -> None:
+    """
+    Counts one service result; for code that cannot use @instrumented (async
+    generators). prompt: (template, version) used, if any.
+    """
+    ai_used = "false" if error else "true"
+    AI_RESULTS.inc(endpoint=endpoint, ai_used=ai_used, reason=error or "")
+    if prompt is not None:
+        PROMPT_RESULTS.inc(template=prompt[0], version=prompt[1], ai_used=ai_used)
+
+def instrumented(endpoint: str):
+    """
+    Decorator for async service functions: sets the endpoint label for nested
+    stages and counts the result as ai_used / fallback (reason from note_ai_error).
+    Nested instrumented calls report into the outermost one.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if _current.get() is not None:
+                return await fn(*args, **kwargs)
+            state = _CallState(endpoint)
+            token = _current.set(state)
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                note_ai_error(e)
+                raise
+            finally:
+                _current.reset(token)
+                record_ai_result(endpoint, state.error, state.prompt)
+        return wrapper
+    return decorator
+
+# ---- ASGI middleware ----
+
+# label values are limited to these (anything else is "other"), so scanner
+# traffic (/wp-login.php, /.env, ...) cannot create a series per path
+_ROUTERS = frozenset(("a3", "a6", "a7", "a8", "a9", "jobs", "health", "metrics", "debug", "docs", "openapi.json"))
+_METHODS = frozenset(("GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"))
+
+def _router_of(path: str) -> str:
+    seg = path.strip("/").split("/", 1)[0]
+    if not seg:
+        return "root"
+    return seg if seg in _ROUTERS else "other"
+
+def _method_of(scope) -> str:
+    method = scope.get("method", "")
+    return method if method in _METHODS else "other"
+
+def _route_of(scope, router: str) -> str:
+    """Route template (not the raw path) to keep label cardinality bounded."""
+    path = getattr(scope.get("route"), "path", None)
+    if not path:
+        return "unmatched"
+    # routes of included routers may be stored without their prefix
+    if router not in ("other", "root") and path != f"/{router}" and not path.startswith(f"/{router}/"):
+        path = f"/{router}{path}"
+    return path
+
+class MetricsMiddleware:
+    """Request count, latency, in-flight and request size per router (a3/a6/a7/a8/a9/jobs/..., other)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        router = _router_of(scope.get("path", ""))
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(router=router)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec(router=router)
+            route = _route_of(scope, router)
+            HTTP_REQUESTS.inc(router=router, route=route, method=_method_of(scope), status=str(status["code"]))
+            HTTP_LATENCY.observe(elapsed, router=router, route=route)
+            for k, v in scope.get("headers") or []:
+                if k == b"content-length" and v.isdigit():
+                    HTTP_REQUEST_BYTES.observe(int(v), router=router, route=route)
+                    break
@@ -0,0 +1,240 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.core.utils import env_int
+
+CACHED_WARNING = "cached_response"
+
+def _hash_part(h, part: Any) -> None:
+    if part is None:
+        h.update(b"\x00")
+    elif isinstance(part, (bytes, bytearray, memoryview)):
+        h.update(b"b")
+        h.update(part)
+    elif isinstance(part, str):
+        h.update(b"s")
+        h.update(part.encode("utf-8"))
+    elif isinstance(part, dict):
+        h.update(b"d")
+        for k in sorted(part):
+            h.update(str(k).encode("utf-8"))
+            _hash_part(h, part[k])
+    elif isinstance(part, (list, tuple)):
+        h.update(b"l")
+        for x in part:
+            _hash_part(h, x)
+    elif hasattr(part, "model_dump"):
+        _hash_part(h, part.model_dump(exclude_none=True))
+    else:
+        h.update(b"r")
+        h.update(repr(part).encode("utf-8"))
+
+def cache_key(model: str, contents: Any, config: Any = None) -> str:
+    """
+    Content address of a model call: sha256 over (model, prompt, media bytes, config).
+    """
+    h = hashlib.sha256()
+    _hash_part(h, model)
+    _hash_part(h, contents)
+    _hash_part(h, config)
+    return h.hexdigest()
+
+def content_hash(part: Any) -> str:
+    """sha256 of one value, hashed like cache_key hashes prompts (str, bytes, dicts, lists, Pydantic models)."""
+    h = hashlib.sha256()
+    _hash_part(h, part)
+    return h.hexdigest()
+
+class CachedResponse:
+    """Stand-in for a genai response served from the cache (only .text is used)."""
+
+    cached = True
+
+    def __init__(self, text: str):
+        self.text = text
+
+def is_cached(resp: Any) -> bool:
+    return bool(getattr(resp, "cached", False))
+
+class MemoryLRUCache:
+    """In-process LRU with TTL. Lookups are a dict hit; no I/O."""
+
+    blocking = False
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = (value, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def size(self) -> int:
+        return len(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+class SQLiteCache:
+    """On-disk cache (survives restarts, shared by workers on one host) with TTL and LRU trim."""
+
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int = 10000, ttl: float = 86400, table: str = "model_cache"):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_accessed ON {table}(accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f" SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+class ModelResponseCache:
+    """
+    Response cache for model calls, opt-in per endpoint.
+
+    Env:
+    - AI_CACHE_BACKEND: memory | sqlite | off (default memory)
+    - AI_CACHE_ENDPOINTS: comma-separated endpoint labels, e.g. "a3.grade_text,a9.enhance_feedback"
+    - AI_CACHE_TTL: seconds (default 3600)
+    - AI_CACHE_MAX_ENTRIES: default 1024
+    - AI_CACHE_MAX_ENTRY_BYTES: larger responses are not stored (default 256 KB)
+    - AI_CACHE_PATH: sqlite file (default data/ai_cache.sqlite3)
+    """
+
+    def __init__(self, backend=None, endpoints=None, max_entry_bytes: Optional[int] = None):
+        if endpoints is None:
+            raw = os.getenv("AI_CACHE_ENDPOINTS", "a3.grade_text,a9.enhance_feedback")
+            endpoints = [x.strip() for x in raw.split(",") if x.strip()]
+        self.endpoints = set(endpoints)
+        self.max_entry_bytes = max_entry_bytes or env_int("AI_CACHE_MAX_ENTRY_BYTES", 256 * 1024)
+        self.backend = backend if backend is not None else self._backend_from_env()
+        self._lock = threading.Lock()
+        self._hits: Dict[str, int] = {}
+        self._misses: Dict[str, int] = {}
+
+    @staticmethod
+    def _backend_from_env():
+        kind = os.getenv("AI_CACHE_BACKEND", "memory").lower()
+        ttl = env_int("AI_CACHE_TTL", 3600)
+        max_entries = env_int("AI_CACHE_MAX_ENTRIES", 1024)
+        if kind == "off":
+            return None
+        if kind == "sqlite":
+            path = os.getenv("AI_CACHE_PATH", os.path.join("data", "ai_cache.sqlite3"))
+            return SQLiteCache(path, max_entries=max_entries, ttl=ttl)
+        return MemoryLRUCache(max_entries=max_entries, ttl=ttl)
+
+    def enabled_for(self, endpoint: Optional[str]) -> bool:
+        return self.backend is not None and endpoint is not None and endpoint in self.endpoints
+
+    def _count(self, counter: Dict[str, int], endpoint: str) -> None:
+        with self._lock:
+            counter[endpoint] = counter.get(endpoint, 0) + 1
+
+    def get(self, endpoint: str, key: str) -> Optional[str]:
+        value = self.backend.get(key)
+        self._count(self._hits if value is not None else self._misses, endpoint)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        if value and len(value.encode("utf-8")) <= self.max_entry_bytes:
+            self.backend.put(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = dict(self._hits)
+            misses = dict(self._misses)
+        total_hits = sum(hits.values())
+        total = total_hits + sum(misses.values())
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "endpoints": sorted(self.endpoints),
+            "entries": self.backend.size() if self.backend is not None else 0,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(total_hits / total, 4) if total else None,
+        }
+
+_cache: Optional[ModelResponseCache] = None
+_cache_lock = threading.Lock()
+
+def get_model_cache() -> ModelResponseCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ModelResponseCache()
+    return _cache
@@ -0,0 +1,382 @@
+"""
+Versioned prompt templates with a static, cacheable prefix.
+
+Every agent registers its prompts here once, at import: a static prefix (role,
+task, rules and, without structured output, the JSON schema block) and a
+suffix holding the per-request data. The suffix is parsed once into literal /
+field parts, so rendering is a join. render_prompt() returns a Prompt: a str
+(so caching, scheduling and the fake backend see the full text as before) that
+also knows its template and where the prefix ends.
+
+Putting the static part first lets Gemini's implicit prefix caching apply.
+Prefixes of at least GEMINI_CONTEXT_CACHE_MIN_TOKENS estimated tokens are also
+stored as an explicit context cache (one per model, template and version per
+worker process) and only the suffix is sent with each call
+(app.core.gemini_client.generate_content_async).
+
+Several versions of a template can be registered for A/B tests; which one is
+used is set by PROMPT_VERSIONS, e.g.
+    PROMPT_VERSIONS="a6.monthly_report=v2;a3.grade_text=v1:90,v2:10"
+With weights, the version is picked by a stable hash of the request key
+(student id where there is one), so a student always sees the same version.
+Results, renders and token usage are counted per template and version
+(/metrics, /debug/ai "prompts"; scripts/benchmarks/prompt_tokens.py).
+
+Env:
+- PROMPT_VERSIONS: see above (default: first registered version of each template)
+- GEMINI_CONTEXT_CACHE: 0 disables explicit context caches (default 1)
+- GEMINI_CONTEXT_CACHE_MIN_TOKENS: smallest prefix worth an explicit cache
+  (default 1024, the API minimum for gemini-2.5-flash)
+- GEMINI_CONTEXT_CACHE_TTL: seconds a context cache lives (default 3600)
+- GEMINI_CONTEXT_CACHE_RETRY: seconds before retrying a prefix whose cache could not be created (default 600)
+"""
+import asyncio
+import logging
+import os
+import random
+import string
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core import structured
+from app.core.metrics import REGISTRY, Counter, Gauge, Histogram, note_prompt
+from app.core.resilience import error_code
+from app.core.scheduler import estimate_input_tokens
+from app.core.startup import lazy_import
+from app.core.utils import env_float, env_int
+
+logger = logging.getLogger("kidzgo.prompts")
+
+CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "1").strip().lower() not in ("0", "false", "off", "no")
+CONTEXT_CACHE_MIN_TOKENS = env_int("GEMINI_CONTEXT_CACHE_MIN_TOKENS", 1024)
+CONTEXT_CACHE_TTL = env_float("GEMINI_CONTEXT_CACHE_TTL", 3600.0)
+CONTEXT_CACHE_RETRY = env_float("GEMINI_CONTEXT_CACHE_RETRY", 600.0)
+# a cache this close to expiry is replaced instead of used
+_CACHE_REFRESH_MARGIN = 60.0
+
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+PROMPT_RENDERS = REGISTRY.register(Counter(
+    "kidzgo_ai_prompt_renders_total", "Prompts rendered per template and version.", ("template", "version")))
+PROMPT_PREFIX_TOKENS = REGISTRY.register(Gauge(
+    "kidzgo_ai_prompt_prefix_tokens", "Estimated tokens of a template's static prefix.", ("template", "version")))
+PROMPT_SUFFIX_TOKENS = REGISTRY.register(Histogram(
+    "kidzgo_ai_prompt_suffix_tokens", "Estimated tokens of the per-request part of a prompt.",
+    ("template", "version"), TOKEN_BUCKETS))
+PROMPT_USAGE_TOKENS = REGISTRY.register(Counter(
+    "kidzgo_ai_prompt_tokens_total",
+    "Prompt tokens reported by the API per template: input (all) and cached (served from a context cache).",
+    ("template", "version", "kind")))
+CONTEXT_CACHE_EVENTS = REGISTRY.register(Counter(
+    "kidzgo_ai_context_cache_total", "Context caches created, failed to create or rejected by a call, per template.",
+    ("template", "event")))
+
+def _parse_versions(spec: str) -> Dict[str, List[Tuple[str, float]]]:
+    out: Dict[str, List[Tuple[str, float]]] = {}
+    for entry in spec.split(";"):
+        name, _, versions = entry.partition("=")
+        if not name.strip() or not versions.strip():
+            continue
+        weighted = []
+        for v in versions.split(","):
+            version, _, weight = v.partition(":")
+            try:
+                weighted.append((version.strip(), float(weight) if weight.strip() else 1.0))
+            except ValueError:
+                continue
+        out[name.strip()] = [(v, w) for v, w in weighted if v and w > 0]
+    return out
+
+PROMPT_VERSIONS = _parse_versions(os.getenv("PROMPT_VERSIONS", ""))
+
+class PromptTemplate:
+    """
+    prefix: static text; "{schema}" in it is replaced by the schema block while
+    structured output is off (app.core.structured.schema_section).
+    suffix: str.format-style text with the per-request fields.
+    """
+
+    def __init__(self, name: str, version: str, prefix: str, suffix: str, schema: str = ""):
+        self.name = name
+        self.version = version
+        self.schema = schema
+        self._prefix_source = prefix
+        self._prefix: Dict[bool, str] = {}
+        self._suffix = suffix
+        self._parts = [
+            (literal, field, spec or "", conversion)
+            for literal, field, spec, conversion in string.Formatter().parse(suffix)
+        ]
+        self.fields = [field for _, field, _, _ in self._parts if field]
+
+    @property
+    def prefix(self) -> str:
+        mode = structured.STRUCTURED_OUTPUT
+        text = self._prefix.get(mode)
+        if text is None:
+            text = self._prefix[mode] = self._prefix_source.replace(
+                "{schema}", structured.schema_section(self.schema)
+            )
+        return text
+
+    def prefix_tokens(self) -> int:
+        return estimate_input_tokens(self.prefix)
+
+    def render_suffix(self, values: Dict[str, Any]) -> str:
+        out = []
+        for literal, field, spec, conversion in self._parts:
+            out.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "s":
+                value = str(value)
+            out.append(format(value, spec))
+        return "".join(out)
+
+    def render(self, **values) -> "Prompt":
+        return Prompt(self, self.prefix, self.render_suffix(values))
+
+class Prompt(str):
+    """A rendered template: the full prompt text, plus its template and static prefix."""
+
+    def __new__(cls, template: PromptTemplate, prefix: str, suffix: str):
+        self = super().__new__(cls, prefix + suffix)
+        self.template = template
+        self.prefix = prefix
+        self.suffix = suffix
+        return self
+
+_templates: Dict[str, Dict[str, PromptTemplate]] = {}
+
+def register_prompt(template: PromptTemplate) -> PromptTemplate:
+    """Adds a template version; the first version registered under a name is its default."""
+    _templates.setdefault(template.name, {})[template.version] = template
+    PROMPT_PREFIX_TOKENS.set(template.prefix_tokens(), template=template.name, version=template.version)
+    return template
+
+def get_prompt(name: str, key: Optional[str] = None) -> PromptTemplate:
+    """The template version to use for `name` (PROMPT_VERSIONS), stable per `key`."""
+    versions = _templates[name]
+    weighted = [(v, w) for v, w in PROMPT_VERSIONS.get(name, ()) if v in versions]
+    if not weighted:
+        return next(iter(versions.values()))
+    if len(weighted) == 1:
+        return versions[weighted[0][0]]
+    total = sum(w for _, w in weighted)
+    if key is None:
+        point = random.random() * total
+    else:
+        point = zlib.crc32(f"{name}:{key}".encode("utf-8")) / 0xFFFFFFFF * total
+    for version, weight in weighted:
+        point -= weight
+        if point < 0:
+            return versions[version]
+    return versions[weighted[-1][0]]
+
+def render_prompt(name: str, /, key: Optional[str] = None, **values) -> Prompt:
+    """Renders the selected version of `name` and counts it for the current call."""
+    template = get_prompt(name, key)
+    prompt = template.render(**values)
+    PROMPT_RENDERS.inc(template=template.name, version=template.version)
+    PROMPT_SUFFIX_TOKENS.observe(
+        estimate_input_tokens(prompt.suffix), template=template.name, version=template.version
+    )
+    note_prompt(template.name, template.version)
+    return prompt
+
+def prompt_of(contents: Any) -> Optional[Prompt]:
+    """The Prompt in a call's contents (the text itself, or the first part before media)."""
+    if isinstance(contents, Prompt):
+        return contents
+    if isinstance(contents, (list, tuple)) and contents and isinstance(contents[0], Prompt):
+        return contents[0]
+    return None
+
+def record_usage(contents: Any, response: Any) -> None:
+    """Counts the prompt tokens the API reported (usage_metadata) against the call's template."""
+    prompt = prompt_of(contents)
+    usage = getattr(response, "usage_metadata", None)
+    if prompt is None or usage is None:
+        return
+    labels = {"template": prompt.template.name, "version": prompt.template.version}
+    total = getattr(usage, "prompt_token_count", None)
+    if total:
+        PROMPT_USAGE_TOKENS.inc(total, kind="input", **labels)
+    cached = getattr(usage, "cached_content_token_count", None)
+    if cached:
+        PROMPT_USAGE_TOKENS.inc(cached, kind="cached", **labels)
+
+class _CacheEntry:
+    __slots__ = ("name", "expires_at")
+
+    def __init__(self, name: str, expires_at: float):
+        self.name = name
+        self.expires_at = expires_at
+
+class ContextCacheManager:
+    """
+    Explicit context caches for template prefixes, keyed by model, template,
+    version and structured-output mode. Creation failures (prefix below the
+    model's minimum, unsupported model) fall back to sending the full prompt.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = CONTEXT_CACHE,
+        min_tokens: int = CONTEXT_CACHE_MIN_TOKENS,
+        ttl: float = CONTEXT_CACHE_TTL,
+    ):
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self.ttl = ttl
+        self._entries: Dict[Tuple, _CacheEntry] = {}
+        self._locks: Dict[Tuple, asyncio.Lock] = {}
+        self._skip_until: Dict[Tuple, float] = {}
+        self._created: List[str] = []
+
+    @staticmethod
+    def _key(model: str, prompt: Prompt) -> Tuple:
+        return (model, prompt.template.name, prompt.template.version, structured.STRUCTURED_OUTPUT)
+
+    def eligible(self, client, prompt: Optional[Prompt]) -> bool:
+        return (
+            self.enabled
+            and prompt is not None
+            and hasattr(client.aio, "caches")
+            and prompt.template.prefix_tokens() >= self.min_tokens
+        )
+
+    async def _cache_name(self, client, model: str, prompt: Prompt) -> Optional[str]:
+        key = self._key(model, prompt)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at - _CACHE_REFRESH_MARGIN > now:
+            return entry.name
+        if self._skip_until.get(key, 0.0) > now:
+            return None
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at - _CACHE_REFRESH_MARGIN > time.monotonic():
+                return entry.name
+            template = prompt.template
+            types = lazy_import("google.genai.types")
+            try:
+                cache = await client.aio.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        contents=[types.Content(role="user", parts=[types.Part(text=prompt.prefix)])],
+                        ttl=f"{int(self.ttl)}s",
+                        display_name=f"kidzgo-{template.name}-{template.version}",
+                    ),
+                )
+            except Exception as e:
+                self._skip_until[key] = time.monotonic() + CONTEXT_CACHE_RETRY
+                CONTEXT_CACHE_EVENTS.inc(template=template.name, event="failed")
+                logger.warning(
+                    "context cache for %s %s not created, sending full prompts: %s: %s",
+                    template.name, template.version, type(e).__name__, e,
+                )
+                return None
+            self._entries[key] = _CacheEntry(cache.name, time.monotonic() + self.ttl)
+            self._created.append(cache.name)
+            CONTEXT_CACHE_EVENTS.inc(template=template.name, event="created")
+            return cache.name
+
+    async def prepare(self, client, model: str, contents: Any, config: Any) -> Tuple[Any, Any, Optional[Tuple]]:
+        """
+        -> (contents, config, cache key): with a context cache for the prompt's
+        prefix, contents carry only the suffix and config names the cache.
+        The key is passed to invalidate() if the call is rejected.
+        """
+        prompt = prompt_of(contents)
+        if not self.eligible(client, prompt):
+            return contents, config, None
+        name = await self._cache_name(client, model, prompt)
+        if name is None:
+            return contents, config, None
+        if isinstance(contents, Prompt):
+            contents = prompt.suffix
+        else:
+            contents = [prompt.suffix, *contents[1:]]
+        if config is None:
+            config = lazy_import("google.genai.types").GenerateContentConfig(cached_content=name)
+        else:
+            config = config.model_copy(update={"cached_content": name})
+        return contents, config, self._key(model, prompt)
+
+    def invalidate(self, key: Optional[Tuple], error: BaseException) -> bool:
+        """
+        Drops a cache the API rejected (expired or deleted upstream) so the next
+        call recreates it. True if the failed call should be repeated with the full prompt.
+        """
+        code = error_code(error)
+        if key is None or code is None or not 400 <= code < 500 or code == 429:
+            return False
+        self._entries.pop(key, None)
+        CONTEXT_CACHE_EVENTS.inc(template=key[1], event="rejected")
+        return True
+
+    async def aclose(self, client) -> None:
+        """Deletes the caches this process created (they would expire on their own)."""
+        names, self._created = self._created, []
+        self._entries.clear()
+        for name in names:
+            try:
+                await client.aio.caches.delete(name=name)
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "enabled": self.enabled,
+            "min_tokens": self.min_tokens,
+            "ttl": self.ttl,
+            "active": {
+                f"{name}/{version}": round(entry.expires_at - now)
+                for (_, name, version, _), entry in self._entries.items()
+                if entry.expires_at > now
+            },
+            "backing_off": sorted(
+                f"{name}/{version}" for (_, name, version, _), until in self._skip_until.items() if until > now
+            ),
+        }
+
+_context_caches: Optional[ContextCacheManager] = None
+
+def get_context_caches() -> ContextCacheManager:
+    global _context_caches
+    if _context_caches is None:
+        _context_caches = ContextCacheManager()
+    return _context_caches
+
+def prompt_stats() -> Dict[str, Any]:
+    """Per template and version: prefix size, renders and reported token usage (for /debug/ai)."""
+    templates = {}
+    for name, versions in _templates.items():
+        selected = dict(PROMPT_VERSIONS.get(name, ()))
+        default = next(iter(versions))
+        for version, template in versions.items():
+            labels = {"template": name, "version": version}
+            templates[f"{name}/{version}"] = {
+                "prefix_chars": len(template.prefix),
+                "prefix_tokens_est": template.prefix_tokens(),
+                "fields": template.fields,
+                "weight": selected.get(version, 0.0) if selected else float(version == default),
+                "renders": int(PROMPT_RENDERS.value(**labels)),
+                "suffix_tokens_est_avg": _avg(PROMPT_SUFFIX_TOKENS, labels),
+                "input_tokens": int(PROMPT_USAGE_TOKENS.value(kind="input", **labels)),
+                "cached_tokens": int(PROMPT_USAGE_TOKENS.value(kind="cached", **labels)),
+            }
+    return {"templates": templates, "context_cache": get_context_caches().stats()}
+
+def _avg(histogram: Histogram, labels: Dict[str, str]) -> Optional[float]:
+    count = histogram.count(**labels)
+    if not count:
+        return None
+    return round(histogram.total(**labels) / count, 1)
@@ -0,0 +1,405 @@
+"""
+Timeouts, retries, hedged requests and a circuit breaker around model calls.
+
+Every async model call goes through call_with_resilience() (from
+app.core.gemini_client.generate_content_async). When the breaker is open the
+call fails at once with CircuitOpenError and the agents take their usual
+fallback paths (rule-based sections for A6, _simple_enhance for A9) instead of
+waiting for the upstream to time out.
+
+Env:
+- GEMINI_CALL_TIMEOUT: seconds per attempt (default 60); GEMINI_MEDIA_CALL_TIMEOUT for a8.media (default 180)
+- GEMINI_RETRIES: extra attempts for retryable errors (default 2)
+- GEMINI_RETRY_BASE / GEMINI_RETRY_MAX: full-jitter backoff bounds in seconds (default 0.5 / 8)
+- GEMINI_RETRY_DEADLINE: no retry is started after this many seconds (default 90)
+- GEMINI_HEDGE_ENDPOINTS: endpoints that may send a second request once the first
+  is slower than their observed p95 (default none; costs quota)
+- GEMINI_HEDGE_MIN_SAMPLES: latencies needed before hedging starts (default 20)
+- GEMINI_BREAKER_WINDOW: seconds of outcomes considered (default 30)
+- GEMINI_BREAKER_MIN_CALLS / GEMINI_BREAKER_FAILURE_RATIO: open when at least this many
+  calls in the window and this share failed (default 10 / 0.5)
+- GEMINI_BREAKER_CONSECUTIVE: or after this many failures in a row (default 5)
+- GEMINI_BREAKER_COOLDOWN: seconds open before a half-open probe (default 30)
+"""
+import asyncio
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import httpx
+
+from app.core.metrics import REGISTRY, Counter, Gauge
+from app.core.utils import env_float, env_int
+
+logger = logging.getLogger("kidzgo.resilience")
+
+CALL_TIMEOUT = env_float("GEMINI_CALL_TIMEOUT", 60.0)
+MEDIA_CALL_TIMEOUT = env_float("GEMINI_MEDIA_CALL_TIMEOUT", 180.0)
+RETRIES = env_int("GEMINI_RETRIES", 2)
+RETRY_BASE = env_float("GEMINI_RETRY_BASE", 0.5)
+RETRY_MAX = env_float("GEMINI_RETRY_MAX", 8.0)
+RETRY_DEADLINE = env_float("GEMINI_RETRY_DEADLINE", 90.0)
+HEDGE_ENDPOINTS = {e.strip() for e in os.getenv("GEMINI_HEDGE_ENDPOINTS", "").split(",") if e.strip()}
+HEDGE_MIN_SAMPLES = env_int("GEMINI_HEDGE_MIN_SAMPLES", 20)
+
+_MEDIA_ENDPOINTS = {"a8.media"}
+# 429 is quota, not an outage: retried but not counted against the breaker
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+_BREAKER_CODES = {500, 502, 503, 504}
+
+RETRIES_TOTAL = REGISTRY.register(Counter(
+    "kidzgo_ai_retries_total", "Model call retries by endpoint and error.", ("endpoint", "reason")))
+HEDGES_TOTAL = REGISTRY.register(Counter(
+    "kidzgo_ai_hedged_requests_total", "Second (hedged) requests sent, and how many of them won.",
+    ("endpoint", "outcome")))
+BREAKER_STATE = REGISTRY.register(Gauge(
+    "kidzgo_ai_breaker_open", "1 while the model circuit breaker is open or half-open.", ("breaker",)))
+BREAKER_REJECTED = REGISTRY.register(Counter(
+    "kidzgo_ai_breaker_rejected_total", "Calls failed fast by the open breaker.", ("endpoint",)))
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the model while the breaker is open."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Gemini circuit open, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+def error_code(e: BaseException) -> Optional[int]:
+    # the genai SDK is imported lazily; before that no call can have raised its errors
+    errors = sys.modules.get("google.genai.errors")
+    if errors is not None and isinstance(e, errors.APIError):
+        return e.code
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code
+    return None
+
+def is_retryable(e: BaseException) -> bool:
+    if isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    return error_code(e) in RETRYABLE_CODES
+
+def counts_against_breaker(e: BaseException) -> bool:
+    if isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    return error_code(e) in _BREAKER_CODES
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    try:
+        value = headers.get("retry-after") if headers is not None else None
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int, e: Optional[BaseException] = None) -> float:
+    """Full-jitter exponential backoff; a server Retry-After is respected as a lower bound."""
+    delay = random.uniform(0, min(RETRY_MAX, RETRY_BASE * (2 ** attempt)))
+    hinted = _retry_after(e) if e is not None else None
+    return max(delay, min(hinted, RETRY_MAX)) if hinted else delay
+
+def call_timeout(endpoint: Optional[str]) -> float:
+    return MEDIA_CALL_TIMEOUT if endpoint in _MEDIA_ENDPOINTS else CALL_TIMEOUT
+
+class CircuitBreaker:
+    """closed -> open (on failure ratio or consecutive failures) -> half-open (one probe) -> closed/open."""
+
+    def __init__(
+        self,
+        name: str = "gemini",
+        window: Optional[float] = None,
+        min_calls: Optional[int] = None,
+        failure_ratio: Optional[float] = None,
+        consecutive: Optional[int] = None,
+        cooldown: Optional[float] = None,
+    ):
+        self.name = name
+        self.window = window or env_float("GEMINI_BREAKER_WINDOW", 30.0)
+        self.min_calls = min_calls or env_int("GEMINI_BREAKER_MIN_CALLS", 10)
+        self.failure_ratio = failure_ratio or env_float("GEMINI_BREAKER_FAILURE_RATIO", 0.5)
+        self.consecutive = consecutive or env_int("GEMINI_BREAKER_CONSECUTIVE", 5)
+        self.cooldown = cooldown or env_float("GEMINI_BREAKER_COOLDOWN", 30.0)
+
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._consecutive_failures = 0
+        self._times_opened = 0
+        self._rejected = 0
+        self._last_error: Optional[str] = None
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def _set_state(self, state: str) -> None:
+        if state != self._state:
+            logger.warning("circuit breaker %s: %s -> %s", self.name, self._state, state)
+        self._state = state
+        BREAKER_STATE.set(0 if state == "closed" else 1, breaker=self.name)
+
+    def before_call(self) -> None:
+        """Raises CircuitOpenError when the call must not go upstream."""
+        with self._lock:
+            if self._state == "closed":
+                return
+            now = time.monotonic()
+            if self._state == "open":
+                remaining = self._opened_at + self.cooldown - now
+                if remaining > 0:
+                    self._rejected += 1
+                    raise CircuitOpenError(remaining)
+                self._set_state("half_open")
+            # half-open: a single probe at a time
+            if self._probe_in_flight:
+                self._rejected += 1
+                raise CircuitOpenError(1.0)
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+            if self._state != "closed":
+                self._outcomes.clear()
+                self._set_state("closed")
+            self._outcomes.append((now, True))
+            self._trim(now)
+
+    def record_failure(self, e: BaseException) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._last_error = f"{type(e).__name__}: {e}"[:300]
+            self._consecutive_failures += 1
+            self._probe_in_flight = False
+            self._outcomes.append((now, False))
+            self._trim(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            tripped = (
+                self._state == "half_open"
+                or self._consecutive_failures >= self.consecutive
+                or (len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_ratio)
+            )
+            if tripped and self._state != "open":
+                self._opened_at = now
+                self._times_opened += 1
+                self._set_state("open")
+
+    def release_probe(self) -> None:
+        """A half-open probe ended without an upstream verdict (e.g. a 400)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            return {
+                "state": self._state,
+                "retry_in": round(max(self._opened_at + self.cooldown - now, 0.0), 1) if self._state == "open" else 0.0,
+                "window_calls": len(self._outcomes),
+                "window_failures": failures,
+                "consecutive_failures": self._consecutive_failures,
+                "times_opened": self._times_opened,
+                "rejected": self._rejected,
+                "last_error": self._last_error,
+            }
+
+class LatencyTracker:
+    """Recent successful call latencies per endpoint, for the hedging delay."""
+
+    def __init__(self, size: int = 200):
+        self._size = size
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def add(self, endpoint: str, seconds: float) -> None:
+        self._samples.setdefault(endpoint, deque(maxlen=self._size)).append(seconds)
+
+    def p95(self, endpoint: str) -> Optional[float]:
+        samples = self._samples.get(endpoint)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+_breaker = CircuitBreaker()
+_latency = LatencyTracker()
+
+def get_breaker() -> CircuitBreaker:
+    return _breaker
+
+def resilience_stats() -> Dict[str, Any]:
+    return {
+        "breaker": _breaker.stats(),
+        "retries": RETRIES,
+        "call_timeout": CALL_TIMEOUT,
+        "hedge_endpoints": sorted(HEDGE_ENDPOINTS),
+        "hedge_delay": {e: _latency.p95(e) for e in sorted(HEDGE_ENDPOINTS)},
+    }
+
+# admit(wait): charges one more upstream request to the quota scheduler. wait=True
+# (retries) queues for it and may raise ModelOverloaded; wait=False (hedges) only
+# takes free capacity and returns False when there is none.
+Admit = Callable[[bool], Awaitable[bool]]
+
+async def _hedged(endpoint: str, factory: Callable[[], Awaitable[Any]], timeout: float, admit: Optional[Admit] = None) -> Any:
+    delay = _latency.p95(endpoint) if endpoint in HEDGE_ENDPOINTS else None
+    first = asyncio.ensure_future(asyncio.wait_for(factory(), timeout))
+    if delay is None:
+        return await first
+
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+    if admit is not None and not await admit(False):
+        return await first  # no quota to spare for a duplicate
+
+    HEDGES_TOTAL.inc(endpoint=endpoint, outcome="sent")
+    second = asyncio.ensure_future(asyncio.wait_for(factory(), timeout))
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        HEDGES_TOTAL.inc(endpoint=endpoint, outcome="won")
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def call_with_resilience(
+    endpoint: Optional[str], factory: Callable[[], Awaitable[Any]], admit: Optional[Admit] = None
+) -> Any:
+    """
+    factory() must start a fresh upstream call each time it is invoked
+    (it is called again for retries and hedges). The caller has charged the
+    first attempt to the scheduler; admit (see Admit) charges the others.
+    """
+    label = endpoint or "unknown"
+    timeout = call_timeout(endpoint)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        if attempt and admit is not None:
+            await admit(True)  # may raise ModelOverloaded
+        try:
+            _breaker.before_call()
+        except CircuitOpenError:
+            BREAKER_REJECTED.inc(endpoint=label)
+            raise
+
+        t0 = time.monotonic()
+        try:
+            result = await _hedged(label, factory, timeout, admit)
+        except asyncio.CancelledError:
+            _breaker.release_probe()
+            raise
+        except Exception as e:
+            if counts_against_breaker(e):
+                _breaker.record_failure(e)
+            else:
+                _breaker.release_probe()
+            delay = backoff_delay(attempt, e)
+            if (
+                not is_retryable(e)
+                or attempt >= RETRIES
+                or time.monotonic() - started + delay > RETRY_DEADLINE
+            ):
+                raise
+            RETRIES_TOTAL.inc(endpoint=label, reason=str(error_code(e) or type(e).__name__))
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+
+        _breaker.record_success()
+        _latency.add(label, time.monotonic() - t0)
+        return result
+
+async def stream_with_resilience(
+    endpoint: Optional[str], factory: Callable[[], Awaitable[Any]], admit: Optional[Admit] = None
+) -> AsyncIterator[Any]:
+    """
+    Streaming counterpart of call_with_resilience. factory() opens a new stream
+    (an awaitable returning an async iterator). Opening and the first chunk are
+    retried like a normal call; once a chunk has been yielded, errors propagate
+    since partial output has already been consumed. Each chunk must arrive
+    within the per-call timeout. Retries are charged through admit.
+    """
+    label = endpoint or "unknown"
+    timeout = call_timeout(endpoint)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        if attempt and admit is not None:
+            await admit(True)  # may raise ModelOverloaded
+        try:
+            _breaker.before_call()
+        except CircuitOpenError:
+            BREAKER_REJECTED.inc(endpoint=label)
+            raise
+
+        try:
+            stream = await asyncio.wait_for(factory(), timeout)
+            chunks = stream.__aiter__()
+            first = await asyncio.wait_for(chunks.__anext__(), timeout)
+            break
+        except StopAsyncIteration:
+            _breaker.record_success()
+            return
+        except asyncio.CancelledError:
+            _breaker.release_probe()
+            raise
+        except Exception as e:
+            if counts_against_breaker(e):
+                _breaker.record_failure(e)
+            else:
+                _breaker.release_probe()
+            delay = backoff_delay(attempt, e)
+            if (
+                not is_retryable(e)
+                or attempt >= RETRIES
+                or time.monotonic() - started + delay > RETRY_DEADLINE
+            ):
+                raise
+            RETRIES_TOTAL.inc(endpoint=label, reason=str(error_code(e) or type(e).__name__))
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    settled = False
+    try:
+        yield first
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                break
+            yield chunk
+        _breaker.record_success()
+        settled = True
+    except Exception as e:
+        if counts_against_breaker(e):
+            _breaker.record_failure(e)
+            settled = True
+        raise
+    finally:
+        # the consumer stopped early (aclose() on a client disconnect, cancellation)
+        # or a non-upstream error: free a half-open probe so later calls can probe again
+        if not settled:
+            _breaker.release_probe()
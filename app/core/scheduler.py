@@ -0,0 +1,338 @@
+"""
+Client-side scheduler for the shared Gemini quota.
+
+Every model call acquires a slot here before going upstream
+(app.core.gemini_client.generate_content_async):
+
+- token buckets on requests per minute and estimated tokens per minute; the
+  estimate is corrected with the real usage_metadata after the call
+- two priority lanes: interactive (single requests) before batch (A3 grade-batch,
+  A9 enhance-feedback-batch, A6 bulk jobs); use `with batch_lane():` around batch work
+- per-lane queue depth and queue-time limits; beyond them the call is shed with
+  ModelOverloaded (HTTP 503 + Retry-After)
+
+Limits are for the whole API key and are split evenly across the processes
+calling Gemini: the uvicorn workers (WEB_CONCURRENCY) plus any dedicated job
+workers (python -m app.worker); set GEMINI_QUOTA_PROCESSES to the total then.
+
+Env:
+- GEMINI_RPM / GEMINI_TPM: quota for the key (default 1000 / 1000000; 0 = unlimited)
+- GEMINI_QUOTA_PROCESSES: processes sharing the quota (default WEB_CONCURRENCY)
+- GEMINI_QUEUE_MAX_INTERACTIVE / GEMINI_QUEUE_MAX_BATCH: waiting calls per lane (default 100 / 5000)
+- GEMINI_QUEUE_TIMEOUT_INTERACTIVE / GEMINI_QUEUE_TIMEOUT_BATCH: max seconds queued (default 10 / 600)
+"""
+import asyncio
+import contextvars
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+from app.core.metrics import REGISTRY, Counter, Gauge, Histogram
+from app.core.utils import env_float, env_int
+
+LANES = ("interactive", "batch")  # highest priority first
+
+WORKERS = max(1, env_int("GEMINI_QUOTA_PROCESSES", env_int("WEB_CONCURRENCY", 1)))
+GEMINI_RPM = env_float("GEMINI_RPM", 1000) / WORKERS
+GEMINI_TPM = env_float("GEMINI_TPM", 1_000_000) / WORKERS
+QUEUE_MAX = {
+    "interactive": env_int("GEMINI_QUEUE_MAX_INTERACTIVE", 100),
+    "batch": env_int("GEMINI_QUEUE_MAX_BATCH", 5000),
+}
+QUEUE_TIMEOUT = {
+    "interactive": env_float("GEMINI_QUEUE_TIMEOUT_INTERACTIVE", 10.0),
+    "batch": env_float("GEMINI_QUEUE_TIMEOUT_BATCH", 600.0),
+}
+
+# Expected output tokens per call, added to the prompt estimate
+OUTPUT_TOKENS = {
+    "a3.grade_batch": 4000,
+    "a6.monthly_report": 1500,
+    "a8.media": 1200,
+    "a9.enhance_feedback": 300,
+    "a9.enhance_feedback_batch": 4000,
+}
+DEFAULT_OUTPUT_TOKENS = 800
+# Rough input token costs of media parts (Gemini: 258 tokens per 768px image tile,
+# 32 tokens per second of audio, ~300 per second of video)
+IMAGE_TOKENS = 1300
+AUDIO_TOKENS_PER_BYTE = 32 / 3000       # ~24 kbit/s Opus
+VIDEO_TOKENS_PER_BYTE = 300 / 250_000   # ~2 Mbit/s phone video
+UPLOADED_FILE_TOKENS = 20_000            # Files API upload, size unknown here
+
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "kidzgo_ai_queue_depth", "Model calls waiting for quota, per lane.", ("lane",)))
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    "kidzgo_ai_queue_wait_seconds", "Time a model call waited for quota.", ("lane", "endpoint")))
+SHED_TOTAL = REGISTRY.register(Counter(
+    "kidzgo_ai_shed_total", "Model calls rejected by the scheduler (503).", ("lane", "reason")))
+TOKENS_TOTAL = REGISTRY.register(Counter(
+    "kidzgo_ai_tokens_total", "Tokens per endpoint: scheduler estimate and reported usage.", ("endpoint", "kind")))
+
+_lane: contextvars.ContextVar[str] = contextvars.ContextVar("kidzgo_ai_lane", default="interactive")
+
+@contextmanager
+def batch_lane():
+    """Model calls made inside (including tasks started inside) use the batch lane."""
+    token = _lane.set("batch")
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+def current_lane() -> str:
+    return _lane.get()
+
+class ModelOverloaded(HTTPException):
+    """Model quota queue is full or the call waited too long: 503 with Retry-After."""
+
+    def __init__(self, retry_after: float, reason: str):
+        seconds = max(1, int(retry_after + 0.999))
+        super().__init__(
+            status_code=503,
+            detail=f"AI service busy ({reason}), retry in {seconds}s",
+            headers={"Retry-After": str(seconds)},
+        )
+        self.retry_after = seconds
+        self.reason = reason
+
+def _media_tokens(mime_type: str, size: int) -> int:
+    mime_type = (mime_type or "").lower()
+    if mime_type.startswith("image/"):
+        return IMAGE_TOKENS
+    if mime_type.startswith("audio/"):
+        return int(size * AUDIO_TOKENS_PER_BYTE)
+    if mime_type.startswith("video/"):
+        return int(size * VIDEO_TOKENS_PER_BYTE)
+    return size // 4
+
+def estimate_input_tokens(contents: Any) -> int:
+    if isinstance(contents, str):
+        return len(contents) // 3 + 1  # Vietnamese text tokenizes denser than English
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_input_tokens(c) for c in contents)
+    if isinstance(contents, dict):
+        inline = contents.get("inline_data")
+        if inline:
+            return _media_tokens(inline.get("mime_type"), len(inline.get("data") or b""))
+        return estimate_input_tokens(contents.get("text") or "")
+    inline = getattr(contents, "inline_data", None)
+    if inline is not None and getattr(inline, "data", None):
+        return _media_tokens(inline.mime_type, len(inline.data))
+    if getattr(contents, "uri", None) or type(contents).__name__ == "File":
+        size = getattr(contents, "size_bytes", None)
+        return _media_tokens(getattr(contents, "mime_type", ""), size) if size else UPLOADED_FILE_TOKENS
+    text = getattr(contents, "text", None)
+    if isinstance(text, str):
+        return estimate_input_tokens(text)
+    parts = getattr(contents, "parts", None)
+    return estimate_input_tokens(parts) if parts else 0
+
+def estimate_tokens(contents: Any, endpoint: Optional[str]) -> int:
+    return estimate_input_tokens(contents) + OUTPUT_TOKENS.get(endpoint or "", DEFAULT_OUTPUT_TOKENS)
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute up to one minute of capacity; rate <= 0 means unlimited."""
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60.0
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # a single huge call must not block forever
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        if not self.unlimited:
+            self._refill(now)
+            self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """Correct a previous take by delta tokens (positive = used more than estimated)."""
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+    def available(self, now: float) -> Optional[float]:
+        if self.unlimited:
+            return None
+        self._refill(now)
+        return round(self.tokens, 1)
+
+@dataclass
+class Grant:
+    endpoint: str
+    lane: str
+    estimated_tokens: int
+    waited: float = 0.0
+
+@dataclass
+class _Waiter:
+    grant: Grant
+    future: asyncio.Future
+    enqueued: float = field(default_factory=time.monotonic)
+
+class ModelScheduler:
+    def __init__(self, rpm: float = GEMINI_RPM, tpm: float = GEMINI_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._queues: Dict[str, Deque[_Waiter]] = {lane: deque() for lane in LANES}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._pump: Optional[asyncio.Task] = None
+        self._granted = {lane: 0 for lane in LANES}
+        self._shed = {lane: 0 for lane in LANES}
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._pump = None
+            for q in self._queues.values():
+                q.clear()
+
+    def _wait_time(self, grant: Grant, now: float) -> float:
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(grant.estimated_tokens, now))
+
+    def _take(self, grant: Grant, now: float) -> None:
+        self.requests.take(1, now)
+        self.tokens.take(grant.estimated_tokens, now)
+        self._granted[grant.lane] += 1
+
+    def _queued_ahead(self, lane: str) -> int:
+        return sum(len(self._queues[l]) for l in LANES[: LANES.index(lane) + 1])
+
+    def _shed_call(self, grant: Grant, reason: str, retry_after: float) -> ModelOverloaded:
+        self._shed[grant.lane] += 1
+        SHED_TOTAL.inc(lane=grant.lane, reason=reason)
+        return ModelOverloaded(retry_after, reason)
+
+    async def acquire(self, endpoint: Optional[str], contents: Any) -> Grant:
+        self._bind_loop()
+        lane = current_lane()
+        grant = Grant(endpoint=endpoint or "unknown", lane=lane, estimated_tokens=estimate_tokens(contents, endpoint))
+        TOKENS_TOTAL.inc(grant.estimated_tokens, endpoint=grant.endpoint, kind="estimated")
+
+        now = time.monotonic()
+        if self._queued_ahead(lane) == 0 and self._wait_time(grant, now) == 0:
+            self._take(grant, now)
+            QUEUE_WAIT.observe(0.0, lane=lane, endpoint=grant.endpoint)
+            return grant
+
+        queue = self._queues[lane]
+        if len(queue) >= QUEUE_MAX[lane]:
+            raise self._shed_call(grant, "queue_full", self._wait_time(grant, now) + len(queue) * 60.0 / max(self.requests.capacity, 1))
+
+        waiter = _Waiter(grant, self._loop.create_future())
+        queue.append(waiter)
+        QUEUE_DEPTH.set(len(queue), lane=lane)
+        self._wake.set()
+        if self._pump is None or self._pump.done():
+            self._pump = self._loop.create_task(self._run_pump())
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), QUEUE_TIMEOUT[lane])
+        except asyncio.TimeoutError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                pass  # granted at the deadline
+            else:
+                waiter.future.cancel()
+                raise self._shed_call(grant, "queue_timeout", self._wait_time(grant, time.monotonic()))
+        except asyncio.CancelledError:
+            waiter.future.cancel()  # caller went away; the pump skips it
+            raise
+        finally:
+            grant.waited = time.monotonic() - waiter.enqueued
+            QUEUE_WAIT.observe(grant.waited, lane=lane, endpoint=grant.endpoint)
+        return grant
+
+    def try_acquire(self, endpoint: Optional[str], contents: Any) -> Optional[Grant]:
+        """A grant only if the call can go right now (nothing queued ahead, buckets not empty); None otherwise."""
+        self._bind_loop()
+        lane = current_lane()
+        grant = Grant(endpoint=endpoint or "unknown", lane=lane, estimated_tokens=estimate_tokens(contents, endpoint))
+        now = time.monotonic()
+        if self._queued_ahead(lane) or self._wait_time(grant, now) > 0:
+            return None
+        TOKENS_TOTAL.inc(grant.estimated_tokens, endpoint=grant.endpoint, kind="estimated")
+        self._take(grant, now)
+        return grant
+
+    async def _run_pump(self) -> None:
+        """Grants queued calls in priority order as the buckets refill."""
+        while True:
+            head = None
+            for lane in LANES:
+                queue = self._queues[lane]
+                while queue and queue[0].future.done():
+                    queue.popleft()
+                QUEUE_DEPTH.set(len(queue), lane=lane)
+                if queue:
+                    head = queue[0]
+                    break
+            if head is None:
+                return
+
+            now = time.monotonic()
+            wait = self._wait_time(head.grant, now)
+            if wait <= 0:
+                self._queues[head.grant.lane].popleft()
+                self._take(head.grant, now)
+                head.future.set_result(True)
+                continue
+
+            # sleep until the head fits, or until a new (possibly higher-priority) call arrives
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def settle(self, grant: Grant, response: Any) -> None:
+        """Replace the token estimate with the usage reported by the API."""
+        usage = getattr(response, "usage_metadata", None)
+        total = getattr(usage, "total_token_count", None) if usage is not None else None
+        if not total:
+            return
+        TOKENS_TOTAL.inc(total, endpoint=grant.endpoint, kind="actual")
+        self.tokens.adjust(total - grant.estimated_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "workers": WORKERS,
+            "rpm_limit": self.requests.capacity or None,
+            "tpm_limit": self.tokens.capacity or None,
+            "requests_available": self.requests.available(now),
+            "tokens_available": self.tokens.available(now),
+            "queue_depth": {lane: sum(1 for w in q if not w.future.done()) for lane, q in self._queues.items()},
+            "queue_max": QUEUE_MAX,
+            "queue_timeout": QUEUE_TIMEOUT,
+            "granted": dict(self._granted),
+            "shed": dict(self._shed),
+        }
+
+_scheduler: Optional[ModelScheduler] = None
+
+def get_scheduler() -> ModelScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ModelScheduler()
+    return _scheduler
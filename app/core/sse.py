@@ -0,0 +1,39 @@
+"""
+Server-sent events for the streaming endpoints.
+
+A stream is an async generator of (event, data) pairs: "delta" events carry
+{"text": ...} as the model produces it, and the last event ("result") carries
+the same payload as the non-streaming endpoint. Clients should treat the
+deltas as a preview and replace them with the result (which may be a
+rule-based fallback if the model failed mid-stream).
+"""
+import json
+from typing import Any, AsyncIterator, Tuple
+
+from fastapi.responses import StreamingResponse
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # nginx: do not buffer the stream
+}
+
+def format_sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+async def event_stream_response(events: AsyncIterator[Tuple[str, Any]]) -> StreamingResponse:
+    """
+    Pulls the first event before the response starts, so errors raised up
+    front (ModelOverloaded -> 503, validation) are still plain HTTP errors.
+    """
+    try:
+        first = await events.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def body():
+        if first is not None:
+            yield format_sse(*first)
+        async for event, data in events:
+            yield format_sse(event, data)
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,68 @@
+"""
+Cold-start accounting and lazy imports of heavy modules.
+
+The genai SDK (~0.5 s to import) and Pillow are imported on first use through
+lazy_import() instead of at module import, so a worker starts serving before
+it needs them. Every timed import is recorded and shown on /debug/ai
+("startup"): seconds per module (cumulative, including what it imported for
+the first time), whether it was loaded lazily, and when.
+"""
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+# app.main imports this module first (after loading .env): the start of the app import
+IMPORT_STARTED = time.perf_counter()
+
+# heavy optional modules reported as loaded / not loaded
+HEAVY_MODULES = ("google.genai", "PIL.Image", "httpx")
+
+_imports: Dict[str, Dict[str, Any]] = {}
+_phases: Dict[str, float] = {}
+_lock = threading.Lock()
+
+def _record(name: str, seconds: float, lazy: bool) -> None:
+    with _lock:
+        _imports.setdefault(name, {
+            "seconds": round(seconds, 4),
+            "lazy": lazy,
+            "at_s": round(time.perf_counter() - IMPORT_STARTED, 3),
+        })
+
+@contextmanager
+def timed_import(name: str, lazy: bool = False) -> Iterator[None]:
+    """Records the time of the imports done inside under `name`."""
+    t0 = time.perf_counter()
+    yield
+    _record(name, time.perf_counter() - t0, lazy)
+
+def lazy_import(name: str) -> Any:
+    """The module `name`, imported (and timed) on the first call."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with timed_import(name, lazy=True):
+        return importlib.import_module(name)
+
+def optional_import(name: str) -> Optional[Any]:
+    """lazy_import() of an optional dependency; None when it is not installed."""
+    try:
+        return lazy_import(name)
+    except ImportError:
+        return None
+
+def mark(phase: str) -> None:
+    """Seconds from the start of the app import to `phase` ("app_imported", "ready")."""
+    _phases.setdefault(phase, round(time.perf_counter() - IMPORT_STARTED, 3))
+
+def startup_stats() -> Dict[str, Any]:
+    with _lock:
+        imports = dict(sorted(_imports.items(), key=lambda kv: -kv[1]["seconds"]))
+    return {
+        "phases": dict(_phases),
+        "imports": imports,
+        "loaded": {name: name in sys.modules for name in HEAVY_MODULES},
+    }
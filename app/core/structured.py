@@ -0,0 +1,138 @@
+"""
+Gemini structured output (JSON mode + response_schema) from the Pydantic schemas.
+
+Each agent declares an output model derived from its response schema with
+output_model() (the fields the model fills, minus server-side ones). With
+GEMINI_STRUCTURED_OUTPUT on (default) the call sends that model as
+response_schema, the prompt drops its hand-written JSON schema block, and the
+reply is validated straight into the model. Off, prompts carry the schema text
+again and replies go through safe_json_loads as before; useful for comparing
+the two (scripts/benchmarks/structured_output_bench.py).
+
+Gemini schemas cannot express free-form objects (Dict[str, float]), so those
+fields are overridden with fixed-key models.
+
+A reply repaired after truncation (app.core.json_extract) is validated against
+the output model in both modes: whatever came after the cut is missing, and a
+reply without its required fields (score, summary, ...) must count as a model
+failure, not be served as a complete one.
+"""
+from __future__ import annotations
+
+import functools
+import os
+from typing import TYPE_CHECKING, Any, Dict, Optional, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError, create_model
+
+from app.core.metrics import observe_stage
+from app.core.startup import lazy_import
+from app.core.utils import safe_json_loads
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "1").strip().lower() not in ("0", "false", "off", "no")
+
+M = TypeVar("M", bound=BaseModel)
+
+def output_model(model: Type[BaseModel], exclude=(), name: Optional[str] = None, **overrides) -> Type[BaseModel]:
+    """
+    `model` minus the `exclude` fields, with `overrides` as (annotation, default)
+    pairs like create_model takes. Field defaults and descriptions are kept.
+    """
+    fields: Dict[str, Any] = {}
+    for field_name, info in model.model_fields.items():
+        if field_name in exclude:
+            continue
+        fields[field_name] = overrides.pop(field_name, None) or (info.annotation, info)
+    fields.update(overrides)
+    return create_model(name or f"{model.__name__}Output", **fields)
+
+_JSON_TYPES = {
+    "string": "STRING", "number": "NUMBER", "integer": "INTEGER",
+    "boolean": "BOOLEAN", "array": "ARRAY", "object": "OBJECT",
+}
+
+def _gemini_schema(node: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pydantic JSON schema node -> compact Gemini Schema: refs inlined, titles and
+    defaults dropped (they cost input tokens), descriptions and field order kept.
+    Every property is required (nullable ones may be null), like the prompt
+    schemas always listed every field.
+    """
+    if "$ref" in node:
+        ref = defs[node["$ref"].rsplit("/", 1)[-1]]
+        node = {**ref, **{k: v for k, v in node.items() if k != "$ref"}}
+    out: Dict[str, Any] = {}
+    variants = node.get("anyOf")
+    if variants:
+        non_null = [v for v in variants if v.get("type") != "null"]
+        if len(non_null) < len(variants):
+            out["nullable"] = True
+        if len(non_null) == 1:
+            out.update(_gemini_schema(non_null[0], defs))
+        else:
+            out["any_of"] = [_gemini_schema(v, defs) for v in non_null]
+    elif "type" in node:
+        out["type"] = _JSON_TYPES[node["type"]]
+    if node.get("description"):
+        out["description"] = node["description"]
+    if "enum" in node:
+        out["enum"] = [str(v) for v in node["enum"]]
+    if "items" in node:
+        out["items"] = _gemini_schema(node["items"], defs)
+    properties = node.get("properties")
+    if properties:
+        out["properties"] = {name: _gemini_schema(p, defs) for name, p in properties.items()}
+        out["property_ordering"] = list(properties)
+        out["required"] = list(properties)
+    return out
+
+def response_schema(model: Type[BaseModel]) -> types.Schema:
+    types = lazy_import("google.genai.types")
+    json_schema = model.model_json_schema()
+    return types.Schema.model_validate(_gemini_schema(json_schema, json_schema.get("$defs", {})))
+
+@functools.lru_cache(maxsize=None)
+def _config(model: Type[BaseModel]) -> types.GenerateContentConfig:
+    types = lazy_import("google.genai.types")
+    return types.GenerateContentConfig(response_mime_type="application/json", response_schema=response_schema(model))
+
+def output_config(model: Type[BaseModel]) -> Optional[types.GenerateContentConfig]:
+    """generate_content config for `model` as the reply schema; None when structured output is off."""
+    return _config(model) if STRUCTURED_OUTPUT else None
+
+def schema_section(schema_text: str) -> str:
+    """The prompt's hand-written schema block, only needed without response_schema."""
+    return "" if STRUCTURED_OUTPUT else schema_text
+
+def validate_output(model: Type[M], obj: Dict[str, Any], repaired: bool = False) -> Dict[str, Any]:
+    """An already parsed reply checked against `model` (no-op when structured output is off, unless `repaired`)."""
+    return model.model_validate(obj).model_dump() if STRUCTURED_OUTPUT or repaired else obj
+
+def _loads(model: Type[M], text: str, repair: bool) -> Dict[str, Any]:
+    """safe_json_loads; an object that only parses after repair must also validate against `model`."""
+    try:
+        return safe_json_loads(text, repair=False)
+    except ValueError:
+        if not repair:
+            raise
+    return validate_output(model, safe_json_loads(text), repaired=True)
+
+def parse_output(model: Type[M], text: Optional[str], repair: bool = True) -> Dict[str, Any]:
+    """
+    Reply text -> dict. Structured: validated against `model` (ValidationError, a
+    ValueError, on a bad reply, which callers treat as a model failure).
+    Otherwise the lenient safe_json_loads of the free-text path; a truncated
+    reply is repaired only if the result still validates. repair=False: a
+    truncated reply is a ValueError too instead of being repaired.
+    """
+    if not STRUCTURED_OUTPUT:
+        return _loads(model, text or "", repair)
+    with observe_stage("json_extract"):
+        try:
+            return model.model_validate_json(text or "").model_dump()
+        except ValidationError:
+            # cached replies from before the switch, or a reply wrapped in text
+            return validate_output(model, _loads(model, text or "", repair))
@@ -0,0 +1,113 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+
+from app.core.utils import env_int
+
+MB = 1024 * 1024
+UPLOAD_CHUNK_SIZE = env_int("UPLOAD_CHUNK_SIZE", MB)
+# multipart boundaries and small form fields on top of the file itself
+_FORM_OVERHEAD = 64 * 1024
+
+# Per-endpoint upload limits (bytes)
+UPLOAD_LIMITS: Dict[str, int] = {
+    "/a3/grade-image": env_int("A3_IMAGE_MAX_BYTES", 15 * MB),
+    "/a7/extract-payment-proof": env_int("A7_IMAGE_MAX_BYTES", 15 * MB),
+    "/a8/analyze-media": env_int("A8_MEDIA_MAX_BYTES", 200 * MB),
+}
+# job variants (app.core.jobs) take the same uploads
+UPLOAD_LIMITS.update({f"{path}/jobs": limit for path, limit in list(UPLOAD_LIMITS.items())})
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Upload exceeds limit of {limit} bytes")
+
+class UploadLimitMiddleware:
+    """
+    Enforces UPLOAD_LIMITS before and while the body is read:
+    - rejects up front with 413 when Content-Length is over the limit
+    - counts streamed body bytes (chunked uploads) and aborts with 413 once over
+    """
+
+    def __init__(self, app, limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.limits = limits if limits is not None else UPLOAD_LIMITS
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        max_body = limit + _FORM_OVERHEAD
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_body:
+            body = json.dumps({"detail": f"Upload exceeds limit of {limit} bytes"}).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    raise _too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+@dataclass
+class SpooledUpload:
+    """
+    An uploaded file kept in Starlette's spooled temp file (memory up to 1 MB,
+    then disk). Size and sha256 are computed while streaming it once in chunks.
+    """
+    file: BinaryIO
+    size: int
+    sha256: str
+    content_type: str
+    filename: Optional[str] = None
+
+    def read_bytes(self) -> bytes:
+        """Full copy in memory; only for payloads known to be small."""
+        self.file.seek(0)
+        data = self.file.read()
+        self.file.seek(0)
+        return data
+
+async def receive_upload(file: UploadFile, path: str, default_mime: str) -> SpooledUpload:
+    """
+    Streams `file` in UPLOAD_CHUNK_SIZE chunks, hashing as it goes and enforcing
+    the limit configured for `path`. Leaves the spool positioned at 0.
+    """
+    limit = UPLOAD_LIMITS.get(path)
+    h = hashlib.sha256()
+    size = 0
+    await file.seek(0)
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if limit is not None and size > limit:
+            raise _too_large(limit)
+        h.update(chunk)
+    await file.seek(0)
+    return SpooledUpload(
+        file=file.file,
+        size=size,
+        sha256=h.hexdigest(),
+        content_type=file.content_type or default_mime,
+        filename=file.filename,
+    )
@@ -1,21 +1,33 @@
-import json
+import os
 import re
 from typing import Any, Dict, List, Optional
 
+from app.core.json_extract import find_json_block, parse_json_object
+from app.core.metrics import observe_stage
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
 def extract_json_block(text: str) -> str:
     """
-    Extract the first {...} block from a model output.
+    Extract the first complete {...} object from a model output
+    (string-aware, so braces in surrounding prose do not matter).
     """
-    if not text:
-        raise ValueError("Empty text")
-    start = text.find("{")
-    end = text.rfind("}")
-    if start == -1 or end == -1 or end <= start:
-        raise ValueError("No JSON object found in text")
-    return text[start:end+1]
-
-def safe_json_loads(text: str) -> Dict[str, Any]:
-    return json.loads(extract_json_block(text))
+    return find_json_block(text)
+
+def safe_json_loads(text: str, repair: bool = True) -> Dict[str, Any]:
+    """Parsed object from a model output; truncated objects are repaired unless repair=False (see app.core.json_extract)."""
+    with observe_stage("json_extract"):
+        return parse_json_object(text, repair=repair)
 
 def ensure_list_len(items: Optional[List[str]], n: int, filler: str) -> List[str]:
     items = [x.strip() for x in (items or []) if isinstance(x, str) and x.strip()]
@@ -1,17 +1,79 @@
-from fastapi import FastAPI
+import importlib
+import logging
+import os
+from contextlib import asynccontextmanager
+
 from dotenv import load_dotenv
-from app.core.gemini_client import gemini_key_present
 
-# Load environment variables from .env file
+# Load environment variables from .env file, before any app module reads its
+# settings at import time
 load_dotenv()
 
-from app.agents.a6_reports.router import router as a6_router
-from app.agents.a7_receipts.router import router as a7_router
-from app.agents.a3_homework.router import router as a3_router
-from app.agents.a8_speaking.router import router as a8_router
-from app.agents.a9_feedback.router import router as a9_router
+from app.core.startup import mark, startup_stats, timed_import
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from app.core.gemini_client import (
+    gemini_key_present, init_client_manager, close_client_manager, drain_model_calls, get_client_manager
+)
+from app.core.model_cache import get_model_cache
+from app.core.image_preprocess import shutdown_image_executor
+from app.core.jobs import job_stats, router as jobs_router, start_inprocess_worker, stop_inprocess_worker
+from app.core.metrics import MetricsMiddleware, render_metrics
+from app.core.prompts import prompt_stats
+from app.core.resilience import resilience_stats
+from app.core.scheduler import get_scheduler
+from app.core.uploads import UploadLimitMiddleware
+from app.core.utils import env_float
+
+mark("core_imported")
+
+logger = logging.getLogger("kidzgo.main")
 
-app = FastAPI(title="KidzGo AI Service")
+# agent -> (router module, prefix, tag). ENABLED_AGENTS="a3,a9" serves (and
+# imports) only those; default all. Job workers (app.worker) load the same set.
+AGENTS = {
+    "a6": ("app.agents.a6_reports.router", "/a6", "A6 Reports"),
+    "a7": ("app.agents.a7_receipts.router", "/a7", "A7 Receipts"),
+    "a3": ("app.agents.a3_homework.router", "/a3", "A3 Homework"),
+    "a8": ("app.agents.a8_speaking.router", "/a8", "A8 Speaking/Phonics"),
+    "a9": ("app.agents.a9_feedback.router", "/a9", "A9 Feedback Enhancement"),
+}
+
+def _enabled_agents() -> list:
+    raw = os.getenv("ENABLED_AGENTS", "all").strip().lower()
+    if raw in ("", "all", "*"):
+        return list(AGENTS)
+    wanted = [name.strip() for name in raw.split(",") if name.strip()]
+    unknown = [name for name in wanted if name not in AGENTS]
+    if unknown:
+        logger.warning("ENABLED_AGENTS: unknown agent(s) %s ignored", ", ".join(unknown))
+    return [name for name in AGENTS if name in wanted]
+
+ENABLED_AGENTS = _enabled_agents()
+
+# seconds the shutdown waits for running jobs and model calls (set by app.serve)
+SHUTDOWN_DRAIN = env_float("WEB_DRAIN", 10.0)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled Gemini client per process (keep-alive connections)
+    init_client_manager()
+    start_inprocess_worker()
+    mark("ready")
+    yield
+    # requests have finished (uvicorn graceful shutdown); now the background work
+    await stop_inprocess_worker(SHUTDOWN_DRAIN)
+    left = await drain_model_calls(SHUTDOWN_DRAIN)
+    if left:
+        logger.warning("shutting down with %d model call(s) still running", left)
+    shutdown_image_executor()
+    await close_client_manager()
+
+app = FastAPI(title="KidzGo AI Service", lifespan=lifespan)
+app.add_middleware(UploadLimitMiddleware)
+# outermost, so 413s from the upload limits are counted too
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/health")
 def health():
@@ -19,15 +81,36 @@ def health():
 
 @app.get("/debug/ai")
 def debug_ai():
-    return {"gemini_key_present": gemini_key_present()}
+    out = {
+        "gemini_key_present": gemini_key_present(),
+        "client_pool": get_client_manager().stats(),
+        "model_cache": get_model_cache().stats(),
+        "resilience": resilience_stats(),
+        "scheduler": get_scheduler().stats(),
+        "prompts": prompt_stats(),
+        "jobs": job_stats(),
+        "agents": ENABLED_AGENTS,
+        "startup": startup_stats(),
+    }
+    if "a6" in ENABLED_AGENTS:
+        from app.agents.a6_reports.report_store import get_report_store
+        out["a6_report_store"] = get_report_store().stats()
+    return out
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Prometheus text exposition format, per worker process
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
-app.include_router(a6_router, prefix="/a6", tags=["A6 Reports"])
-app.include_router(a7_router, prefix="/a7", tags=["A7 Receipts"])
-app.include_router(a3_router, prefix="/a3", tags=["A3 Homework"])
-app.include_router(a8_router, prefix="/a8", tags=["A8 Speaking/Phonics"])
-app.include_router(a9_router, prefix="/a9", tags=["A9 Feedback Enhancement"])
+for name in ENABLED_AGENTS:
+    module_name, prefix, tag = AGENTS[name]
+    with timed_import(module_name):
+        module = importlib.import_module(module_name)
+    app.include_router(module.router, prefix=prefix, tags=[tag])
+app.include_router(jobs_router, tags=["Jobs"])
+mark("app_imported")
 
 if __name__ == "__main__":
-    import uvicorn
-    # Use import string to enable reload feature
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # production server (workers, drain, recycling); `python -m app.serve --reload` for development
+    from app.serve import main
+    raise SystemExit(main())
\ No newline at end of file
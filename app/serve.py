@@ -0,0 +1,123 @@
+"""
+Production entry point of the web service (instead of `uvicorn --reload`).
+
+    python -m app.serve                      # workers from the CPU count
+    python -m app.serve --workers 4 --port 8000
+    python -m app.serve --reload             # development: one worker, auto-reload
+
+Runs uvicorn with a supervisor process and --workers worker processes sharing
+one listening socket:
+
+- the app is imported once in the supervisor before any worker starts (a broken
+  deploy fails right away instead of in every worker), then every worker loads
+  it and finishes the lifespan start-up (Gemini client, job worker) before it
+  is sent requests
+- keep-alive, listen backlog and the per-worker concurrency limit (503 beyond
+  it) are set for a long-running service
+- SIGTERM / Ctrl+C (CTRL_BREAK on Windows): stop accepting, let running
+  requests and their model calls finish for up to --drain seconds, then the
+  lifespan shutdown drains the background work (app.main)
+- a worker is replaced after --max-requests requests (plus up to
+  --max-requests-jitter, so the workers do not restart together) to bound
+  memory growth from large uploads; the supervisor starts its replacement.
+  With a single worker the process exits instead and the service manager has
+  to start it again, so use at least 2 workers with recycling.
+
+WEB_CONCURRENCY is set to the worker count for the workers, so the Gemini quota
+is split between them (app.core.scheduler); dedicated job workers (app.worker)
+still have to be counted in GEMINI_QUOTA_PROCESSES.
+
+Env (defaults of the options): WEB_HOST (0.0.0.0), WEB_PORT (8000),
+WEB_CONCURRENCY (CPU count, at most WEB_MAX_WORKERS=8), WEB_BACKLOG (2048),
+WEB_KEEPALIVE (75 s; longer than the idle timeout of a proxy / HttpClient pool
+in front), WEB_LIMIT_CONCURRENCY (256 connections per worker, 0 = none),
+WEB_MAX_REQUESTS (5000, 0 = never recycle), WEB_MAX_REQUESTS_JITTER (500),
+WEB_DRAIN (30 s), WEB_LOG_LEVEL (info). Read from the environment or .env.
+"""
+import argparse
+import inspect
+import logging
+import os
+import sys
+import time
+
+from app.core.utils import env_float, env_int
+
+logger = logging.getLogger("kidzgo.serve")
+
+def default_workers() -> int:
+    return max(1, min(os.cpu_count() or 1, env_int("WEB_MAX_WORKERS", 8)))
+
+def _preload() -> None:
+    """Imports the app in the supervisor, so import errors stop the start before any worker."""
+    t0 = time.perf_counter()
+    import app.main  # noqa: F401
+    logger.info("app imported in %.2fs", time.perf_counter() - t0)
+
+def uvicorn_options(args: argparse.Namespace) -> dict:
+    """uvicorn.run() keyword arguments for the parsed options."""
+    import uvicorn
+
+    options = dict(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keepalive,
+        limit_concurrency=args.limit_concurrency or None,
+        limit_max_requests=args.max_requests or None,
+        limit_max_requests_jitter=args.max_requests_jitter,
+        timeout_graceful_shutdown=args.drain,
+        log_level=args.log_level,
+    )
+    if args.reload:
+        options.update(workers=1, reload=True, limit_max_requests=None)
+    if "limit_max_requests_jitter" not in inspect.signature(uvicorn.Config).parameters:
+        options.pop("limit_max_requests_jitter")  # older uvicorn: every worker recycles at --max-requests
+    return options
+
+def main(argv=None) -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv()  # the option defaults below (and the inherited worker env) come from .env too
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--host", default=os.getenv("WEB_HOST", "0.0.0.0"))
+    p.add_argument("--port", type=int, default=env_int("WEB_PORT", 8000))
+    p.add_argument("--workers", type=int, default=env_int("WEB_CONCURRENCY", default_workers()))
+    p.add_argument("--backlog", type=int, default=env_int("WEB_BACKLOG", 2048))
+    p.add_argument("--keepalive", type=int, default=env_int("WEB_KEEPALIVE", 75),
+                   help="seconds an idle keep-alive connection is kept open")
+    p.add_argument("--limit-concurrency", type=int, default=env_int("WEB_LIMIT_CONCURRENCY", 256),
+                   help="connections per worker before answering 503 (0 = no limit)")
+    p.add_argument("--max-requests", type=int, default=env_int("WEB_MAX_REQUESTS", 5000),
+                   help="requests after which a worker is replaced (0 = never)")
+    p.add_argument("--max-requests-jitter", type=int, default=env_int("WEB_MAX_REQUESTS_JITTER", 500))
+    p.add_argument("--drain", type=int, default=int(env_float("WEB_DRAIN", 30.0)),
+                   help="seconds running requests may take to finish on shutdown")
+    p.add_argument("--log-level", default=os.getenv("WEB_LOG_LEVEL", "info"))
+    p.add_argument("--no-preload", dest="preload", action="store_false",
+                   help="do not import the app in the supervisor first")
+    p.add_argument("--reload", action="store_true", help="development: one worker, restart on code changes")
+    args = p.parse_args(argv)
+    args.workers = max(1, args.workers)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    import uvicorn
+
+    options = uvicorn_options(args)
+    # inherited by the workers: the scheduler splits the quota by it
+    os.environ["WEB_CONCURRENCY"] = str(options["workers"])
+    os.environ.setdefault("WEB_DRAIN", str(args.drain))
+    if args.preload and not args.reload:
+        _preload()
+    if options["workers"] == 1 and options.get("limit_max_requests"):
+        logger.warning("one worker with --max-requests %d: the process exits when it recycles", args.max_requests)
+    logger.info(
+        "serving on %s:%d, %d worker(s), keep-alive %ds, drain %ds, recycle after %s requests",
+        args.host, args.port, options["workers"], args.keepalive, args.drain, args.max_requests or "no",
+    )
+    uvicorn.run("app.main:app", **options)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
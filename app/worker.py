@@ -0,0 +1,99 @@
+"""
+Dedicated job worker processes for the job queue (app.core.jobs).
+
+    python -m app.worker --processes 2 --concurrency 4
+
+Each process loads the app (so the job handlers of the agents in
+ENABLED_AGENTS are registered), opens its own pooled Gemini client and runs up
+to --concurrency jobs at once from the shared queue database; it only takes
+jobs it has a handler for. SIGTERM / Ctrl+C stops taking jobs, waits up
+to --drain seconds for running ones and hands the rest back to the queue.
+
+Run it next to the web server on the same JOB_DB_PATH / JOB_FILES_DIR, and
+start the web server with JOB_INPROCESS_CONCURRENCY=0 so that only these
+processes run jobs. Count them in GEMINI_QUOTA_PROCESSES (app.core.scheduler).
+
+Env: JOB_WORKER_PROCESSES (default 1), JOB_WORKER_CONCURRENCY (default 4),
+JOB_WORKER_DRAIN (default 60), plus the JOB_* settings of app.core.jobs.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sys
+
+from app.core.utils import env_float, env_int
+
+logger = logging.getLogger("kidzgo.worker")
+
+async def _serve(concurrency: int, drain: float) -> None:
+    import app.main  # noqa: F401  (loads .env, registers the agents' job handlers)
+    from app.core.gemini_client import close_client_manager, init_client_manager
+    from app.core.jobs import JobWorker, get_job_queue
+
+    init_client_manager()
+    worker = JobWorker(get_job_queue(), concurrency)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C arrives as KeyboardInterrupt
+    worker.start()
+    logger.info("job worker %s started, concurrency %d", worker.name, concurrency)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("job worker %s draining (up to %.0fs)", worker.name, drain)
+        await worker.stop(drain)
+        await close_client_manager()
+
+def run_worker(concurrency: int, drain: float) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(_serve(concurrency, drain))
+    except KeyboardInterrupt:
+        pass
+
+def main(argv=None) -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv()  # the option defaults below (and the inherited worker env) come from .env too
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--processes", type=int, default=env_int("JOB_WORKER_PROCESSES", 1))
+    p.add_argument("--concurrency", type=int, default=env_int("JOB_WORKER_CONCURRENCY", 4),
+                   help="jobs run at once per process")
+    p.add_argument("--drain", type=float, default=env_float("JOB_WORKER_DRAIN", 60.0),
+                   help="seconds to let running jobs finish on shutdown")
+    args = p.parse_args(argv)
+
+    if args.processes <= 1:
+        run_worker(args.concurrency, args.drain)
+        return 0
+
+    procs = [
+        multiprocessing.Process(target=run_worker, args=(args.concurrency, args.drain), name=f"job-worker-{i}")
+        for i in range(args.processes)
+    ]
+    for proc in procs:
+        proc.start()
+
+    def forward(signum, frame):
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        # children got the same Ctrl+C and drain themselves
+        for proc in procs:
+            proc.join()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
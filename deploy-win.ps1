@@ -20,7 +20,8 @@ function Stop-ServiceSafe {
         if ($svc.Status -eq 'Running') {
             Write-Host "Stopping service $Name..." -ForegroundColor Yellow
             Stop-Service -Name $Name -Force -ErrorAction Stop
-            $svc.WaitForStatus('Stopped','00:00:20')
+            # python -m app.serve chờ request/model call đang chạy xong (WEB_DRAIN, mặc định 30s) rồi mới dừng
+            $svc.WaitForStatus('Stopped','00:01:30')
         }
     }
     catch {
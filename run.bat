@@ -25,7 +25,8 @@ echo Swagger UI will be available at: http://localhost:8000/docs
 echo Press Ctrl+C to stop the server
 echo.
 
-uvicorn app.main:app --reload --host 0.0.0.0 --port 8000
+REM Production server (workers, graceful shutdown, worker recycling). Development: python -m app.serve --reload
+python -m app.serve --host 0.0.0.0 --port 8000
 
 pause
 
@@ -23,5 +23,6 @@ Write-Host "`n3. Starting FastAPI server..." -ForegroundColor Yellow
 Write-Host "Swagger UI will be available at: http://localhost:8000/docs" -ForegroundColor Cyan
 Write-Host "Press Ctrl+C to stop the server`n" -ForegroundColor Yellow
 
-uvicorn app.main:app --reload --host 0.0.0.0 --port 8000
+# Server production (nhiều worker, tắt êm, thay worker định kỳ). Khi phát triển: python -m app.serve --reload
+python -m app.serve --host 0.0.0.0 --port 8000
 
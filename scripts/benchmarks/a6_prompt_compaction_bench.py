@@ -0,0 +1,193 @@
+"""
+A6 monthly report prompt size with and without token-budget compaction.
+
+Builds synthetic students from light to extreme (number of session feedbacks,
+share of near-duplicate feedback, tests, topics, previous reports, length of
+teacher notes) and reports, per profile, the estimated prompt tokens without
+compaction (A6_PROMPT_TOKEN_BUDGET=0) and with the budget, the time to build
+the prompt, and what the compaction dropped.
+
+With --live (needs GEMINI_API_KEY; costs quota) every profile is also sent to
+Gemini --calls times per mode to compare billed prompt tokens and latency.
+
+Examples:
+    python scripts/benchmarks/a6_prompt_compaction_bench.py
+    python scripts/benchmarks/a6_prompt_compaction_bench.py --budget 1500 --json-out compaction.json
+    python scripts/benchmarks/a6_prompt_compaction_bench.py --live --calls 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from app.core.scheduler import estimate_input_tokens  # noqa: E402
+from app.agents.a6_reports import compaction, service as a6  # noqa: E402
+from app.agents.a6_reports.schemas import MonthlyReportRequest, ReportSectionsOutput  # noqa: E402
+
+# feedbacks, duplicate share, tests, topics, previous reports, teacher note sentences
+PROFILES = {
+    "light": (8, 0.0, 2, 4, 1, 0),
+    "typical": (20, 0.2, 4, 8, 3, 2),
+    "heavy": (60, 0.4, 15, 20, 3, 10),
+    "extreme": (300, 0.5, 60, 40, 12, 60),
+}
+
+FEEDBACK_PHRASES = [
+    "Con tích cực phát biểu, phát âm âm cuối còn thiếu.",
+    "Con làm bài đầy đủ, cần luyện thêm từ vựng chủ đề động vật.",
+    "Hôm nay con hơi mất tập trung, hay nói chuyện riêng trong giờ.",
+    "Con đọc to rõ ràng, tự tin khi trình bày trước lớp.",
+    "Con còn nhầm lẫn thì hiện tại đơn và hiện tại tiếp diễn.",
+    "Con viết câu đúng cấu trúc nhưng chính tả còn sai vài từ.",
+    "Con hợp tác tốt khi làm việc nhóm, giúp đỡ bạn.",
+]
+
+def _student(profile: str, rng: random.Random) -> MonthlyReportRequest:
+    n_feedback, dup_share, n_tests, n_topics, n_reports, n_notes = PROFILES[profile]
+    feedbacks = []
+    for i in range(n_feedback):
+        day = f"2026-03-{1 + i % 28:02d}"
+        if feedbacks and rng.random() < dup_share:
+            text = rng.choice(feedbacks)["text"].replace(".", "!").upper() if rng.random() < 0.3 else rng.choice(feedbacks)["text"]
+        else:
+            text = " ".join(rng.sample(FEEDBACK_PHRASES, 2)) + f" (buổi {i + 1})"
+        feedbacks.append({"date": day, "text": text})
+    reports = [
+        {
+            "month": f"2025-{12 - i:02d}" if i < 12 else f"2024-{24 - i:02d}",
+            "overview": " ".join(rng.choice(FEEDBACK_PHRASES) for _ in range(6)),
+            "strengths": rng.sample(FEEDBACK_PHRASES, 3),
+            "improvements": rng.sample(FEEDBACK_PHRASES, 3),
+        }
+        for i in range(n_reports)
+    ]
+    return MonthlyReportRequest.model_validate({
+        "student": {"student_id": f"ST-{profile}", "name": "An", "program": "Movers"},
+        "range": {"from_date": "2026-03-01", "to_date": "2026-03-31"},
+        "attendance": {"total": 12, "present": 11, "percentage": 91.7},
+        "homework": {"total": 12, "completed": 10, "submitted": 11, "average": 81, "completion_rate": 83.3},
+        "mission": {"completed": 8, "total": 10, "stars": 40, "current_level": "Movers 2", "current_xp": 1200},
+        "test": {
+            "total": n_tests,
+            "tests": [
+                {"exam_id": f"E{i}", "type": rng.choice(["quiz", "mid", "final"]), "score": rng.randint(5, 10),
+                 "max_score": 10, "date": f"2026-03-{1 + i % 28:02d}"}
+                for i in range(n_tests)
+            ],
+        },
+        "topics": {"total": n_topics, "topics": [f"Unit {i + 1}: Topic {i + 1}" for i in range(n_topics)]},
+        "session_feedbacks": feedbacks,
+        "recent_reports": reports,
+        "teacher_notes": " ".join(rng.choice(FEEDBACK_PHRASES) for _ in range(n_notes)) or None,
+    })
+
+def _build(req: MonthlyReportRequest, budget: int):
+    saved = compaction.PROMPT_TOKEN_BUDGET
+    compaction.PROMPT_TOKEN_BUDGET = budget
+    try:
+        summary: Dict[str, Any] = {}
+        return a6._build_prompt(req, summary), summary.get("prompt_compaction", {})
+    finally:
+        compaction.PROMPT_TOKEN_BUDGET = saved
+
+def _time_build(req: MonthlyReportRequest, budget: int, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        _build(req, budget)
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples)
+
+def measure(budget: int, repeat: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    out = {}
+    for profile in PROFILES:
+        req = _student(profile, rng)
+        full, _ = _build(req, 0)
+        compact, report = _build(req, budget)
+        out[profile] = {
+            "full_tokens": estimate_input_tokens(full),
+            "compact_tokens": estimate_input_tokens(compact),
+            "full_build_ms": _time_build(req, 0, repeat) * 1000,
+            "compact_build_ms": _time_build(req, budget, repeat) * 1000,
+            "compaction": report,
+        }
+    return out
+
+async def _live(budget: int, calls: int, seed: int) -> Dict[str, Any]:
+    from app.core.gemini_client import GEMINI_MODEL, get_gemini_client
+    from app.core.structured import output_config
+
+    client = get_gemini_client()
+    if client is None:
+        raise SystemExit("--live needs GEMINI_API_KEY")
+    rng = random.Random(seed)
+    out = {}
+    for profile in PROFILES:
+        req = _student(profile, rng)
+        row = {}
+        for mode, b in (("full", 0), ("compact", budget)):
+            prompt, _ = _build(req, b)
+            latencies: List[float] = []
+            tokens: List[int] = []
+            for _ in range(calls):
+                t0 = time.perf_counter()
+                resp = await client.aio.models.generate_content(
+                    model=GEMINI_MODEL, contents=str(prompt), config=output_config(ReportSectionsOutput)
+                )
+                latencies.append(time.perf_counter() - t0)
+                usage = getattr(resp, "usage_metadata", None)
+                if usage is not None and usage.prompt_token_count:
+                    tokens.append(usage.prompt_token_count)
+            row[mode] = {
+                "prompt_tokens": statistics.median(tokens) if tokens else None,
+                "p50_ms": round(statistics.median(latencies) * 1000),
+            }
+        out[profile] = row
+    return out
+
+def print_report(result: Dict[str, Any], live: Dict[str, Any], budget: int) -> None:
+    print(f"data budget: {budget} tokens (A6_PROMPT_TOKEN_BUDGET)")
+    print(f"{'profile':<9} {'full tok':>9} {'compact tok':>12} {'saved':>6} {'full ms':>8} {'compact ms':>11}  dropped/merged")
+    for profile, row in result.items():
+        saved = 1 - row["compact_tokens"] / max(row["full_tokens"], 1)
+        sections = row["compaction"].get("sections", {})
+        notes = "; ".join(f"{s}: " + ", ".join(f"{k} {v}" for k, v in d.items()) for s, d in sections.items())
+        print(f"{profile:<9} {row['full_tokens']:>9} {row['compact_tokens']:>12} {saved:>6.0%} "
+              f"{row['full_build_ms']:>8.2f} {row['compact_build_ms']:>11.2f}  {notes or '-'}")
+    if not live:
+        return
+    print()
+    print(f"{'profile':<9} {'full tok':>9} {'full p50':>9} {'compact tok':>12} {'compact p50':>12}")
+    for profile, row in live.items():
+        print(f"{profile:<9} {str(row['full']['prompt_tokens']):>9} {row['full']['p50_ms']:>9} "
+              f"{str(row['compact']['prompt_tokens']):>12} {row['compact']['p50_ms']:>12}")
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--budget", type=int, default=compaction.PROMPT_TOKEN_BUDGET or 2500)
+    p.add_argument("--repeat", type=int, default=50, help="timed prompt builds per profile and mode")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--live", action="store_true", help="also call Gemini (GEMINI_API_KEY; uses quota)")
+    p.add_argument("--calls", type=int, default=3, help="live calls per profile and mode")
+    p.add_argument("--json-out", help="write the result as JSON")
+    args = p.parse_args()
+
+    result = measure(args.budget, args.repeat, args.seed)
+    live = asyncio.run(_live(args.budget, args.calls, args.seed)) if args.live else {}
+    print_report(result, live, args.budget)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"offline": result, "live": live}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+A6 report store: model calls and prompt tokens of a teacher's editing session.
+
+Every synthetic student (scripts/benchmarks/a6_prompt_compaction_bench.py
+profiles) goes through one session: the first report, a re-request without
+changes, --edits edits of teacher_notes and one homework update. The session is
+run with the report store off and on (A6_REPORT_STORE) and compared by model
+calls, prompt tokens (usage reported by the backend, per template) and time.
+
+Runs in-process against the offline fake backend (GEMINI_BACKEND=fake, no
+quota; FAKE_GEMINI_LATENCY sets the simulated model latency). With
+GEMINI_BACKEND=genai and GEMINI_API_KEY set it measures real Gemini calls.
+
+Examples:
+    python scripts/benchmarks/a6_report_store_bench.py
+    FAKE_GEMINI_LATENCY=fixed:1.5 python scripts/benchmarks/a6_report_store_bench.py --edits 5 --json-out store.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("GEMINI_BACKEND", "fake")
+os.environ.setdefault("FAKE_GEMINI_LATENCY", "fixed:0.8")
+
+from app.core.gemini_client import get_gemini_client  # noqa: E402
+from app.core.model_cache import MemoryLRUCache  # noqa: E402
+from app.core.prompts import PROMPT_USAGE_TOKENS  # noqa: E402
+from app.agents.a6_reports import report_store, service as a6  # noqa: E402
+from a6_prompt_compaction_bench import FEEDBACK_PHRASES, PROFILES, _student  # noqa: E402
+
+TEMPLATES = ("a6.monthly_report", "a6.monthly_report_update")
+
+def _session(req, edits: int, rng: random.Random) -> List[tuple]:
+    """(step, request) pairs of one editing session."""
+    steps = [("first", req), ("unchanged", req)]
+    for i in range(edits):
+        req = req.model_copy(update={"teacher_notes": f"{req.teacher_notes or ''} {rng.choice(FEEDBACK_PHRASES)}"})
+        steps.append((f"notes {i + 1}", req))
+    if req.homework is not None:
+        homework = req.homework.model_copy(update={"completed": req.homework.completed + 1})
+        steps.append(("homework", req.model_copy(update={"homework": homework})))
+    return steps
+
+def _tokens() -> float:
+    return sum(PROMPT_USAGE_TOKENS.value(template=t, version="v1", kind="input") for t in TEMPLATES)
+
+async def run(store_on: bool, edits: int, seed: int) -> Dict[str, Any]:
+    a6_store = report_store.get_report_store()
+    a6_store.backend = MemoryLRUCache(max_entries=1000, ttl=3600) if store_on else None
+    client = get_gemini_client()
+    if client is None:
+        raise SystemExit("no model client (GEMINI_BACKEND=fake, or GEMINI_API_KEY for genai)")
+    engine = getattr(client, "engine", None)
+    out = {}
+    for profile in PROFILES:
+        rng = random.Random(seed)
+        calls0 = engine.calls if engine is not None else 0
+        tokens0 = _tokens()
+        steps = []
+        t_session = time.perf_counter()
+        for step, req in _session(_student(profile, rng), edits, rng):
+            t0 = time.perf_counter()
+            result = await a6.generate_monthly_report_async(req)
+            store = result["sections"]["source_summary"].get("report_store", {})
+            steps.append({
+                "step": step,
+                "ai_used": result["ai_used"],
+                "store": store.get("result", "off"),
+                "regenerated": len(store.get("regenerated", [])),
+                "ms": round((time.perf_counter() - t0) * 1000),
+            })
+        out[profile] = {
+            "model_calls": (engine.calls - calls0) if engine is not None else None,
+            "prompt_tokens": int(_tokens() - tokens0),
+            "session_s": round(time.perf_counter() - t_session, 2),
+            "steps": steps,
+        }
+    return out
+
+def print_report(off: Dict[str, Any], on: Dict[str, Any]) -> None:
+    print(f"{'profile':<9} {'calls off':>9} {'calls on':>9} {'tokens off':>11} {'tokens on':>10} {'saved':>6} "
+          f"{'time off':>9} {'time on':>8}")
+    for profile in off:
+        a, b = off[profile], on[profile]
+        saved = 1 - b["prompt_tokens"] / max(a["prompt_tokens"], 1)
+        print(f"{profile:<9} {str(a['model_calls']):>9} {str(b['model_calls']):>9} {a['prompt_tokens']:>11} "
+              f"{b['prompt_tokens']:>10} {saved:>6.0%} {a['session_s']:>8}s {b['session_s']:>7}s")
+    print()
+    profile = next(iter(on))
+    print(f"steps with the store on ({profile}):")
+    for step in on[profile]["steps"]:
+        extra = f", {step['regenerated']} sections rewritten" if step["store"] == "partial" else ""
+        print(f"  {step['step']:<10} {step['store']:<8} {step['ms']:>6} ms{extra}")
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--edits", type=int, default=3, help="teacher_notes edits per session")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--json-out", help="write the result as JSON")
+    args = p.parse_args()
+
+    async def both():
+        return await run(False, args.edits, args.seed), await run(True, args.edits, args.seed)
+
+    off, on = asyncio.run(both())
+    print_report(off, on)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"store_off": off, "store_on": on}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
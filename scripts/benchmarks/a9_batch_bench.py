@@ -0,0 +1,119 @@
+"""
+A9: one /a9/enhance-feedback call per draft versus /a9/enhance-feedback-batch
+(enhance_feedback_batch_async), for --classes sessions of --students drafts
+each, all sessions at once.
+
+Reports model calls, wall time, estimated prompt tokens and how many drafts
+ended up with the offline fallback (ai_used false). Uses the offline fake
+backend (GEMINI_BACKEND=fake; FAKE_GEMINI_LATENCY sets the simulated model
+latency, FAKE_GEMINI_MALFORMED_RATE the share of broken replies, which the
+batch endpoint re-issues), so no quota is used. GEMINI_RPM limits both modes
+the same way. The fake latency does not grow with the reply length, while a
+real packed call writes many paragraphs: compare wall times on Gemini.
+
+Examples:
+    python scripts/benchmarks/a9_batch_bench.py
+    FAKE_GEMINI_MALFORMED_RATE=0.1 python scripts/benchmarks/a9_batch_bench.py --classes 10 --students 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("GEMINI_BACKEND", "fake")
+os.environ.setdefault("GEMINI_API_KEY", "fake")
+os.environ.setdefault("AI_CACHE_ENDPOINTS", "")  # every call reaches the (fake) model
+
+from app.agents.a9_feedback import service as a9  # noqa: E402
+from app.core.scheduler import estimate_input_tokens  # noqa: E402
+
+OPENINGS = ["hôm nay con", "buổi này em", "con", "hôm nay bé"]
+NOTES = [
+    "làm bài đầy đủ", "phát âm tốt lắm", "còn rụt rè khi nói", "chăm chỉ, ngoan", "quên mang sách",
+    "đọc to rõ ràng", "viết chưa cẩn thận, sai chính tả", "tích cực phát biểu", "nghe hiểu tốt hơn tuần trước",
+]
+
+def make_class(students: int, seed: int) -> List[Any]:
+    rng = random.Random(seed)
+    return [
+        SimpleNamespace(
+            student_id=f"S{seed}-{i}",
+            draft=f"{rng.choice(OPENINGS)} {', '.join(rng.sample(NOTES, rng.randint(2, 4)))}",
+        )
+        for i in range(students)
+    ]
+
+async def run_single(classes: List[List[Any]]) -> Dict[str, Any]:
+    calls = 0
+
+    async def one(item):
+        nonlocal calls
+        calls += 1
+        return await a9._enhance_feedback_async(item.draft, "vi")
+
+    drafts = [item for session in classes for item in session]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(item) for item in drafts))
+    elapsed = time.perf_counter() - t0
+    return {
+        "model_calls": calls,
+        "wall_s": round(elapsed, 3),
+        "prompt_tokens": sum(estimate_input_tokens(str(a9._build_prompt(item.draft))) for item in drafts),
+        # the single endpoint has no ai_used flag; a failed call ends in the offline text
+        "fallbacks": None,
+    }
+
+async def run_batch(classes: List[List[Any]]) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    out = await asyncio.gather(*(a9.enhance_feedback_batch_async(session, "vi") for session in classes))
+    elapsed = time.perf_counter() - t0
+    tokens = 0
+    for session in classes:
+        for chunk in a9._pack([(i, item.draft) for i, item in enumerate(session)]):
+            tokens += estimate_input_tokens(str(a9._build_packed_prompt(chunk)))
+    return {
+        "model_calls": sum(r["model_calls"] for r in out),
+        "wall_s": round(elapsed, 3),
+        "prompt_tokens": tokens,  # first round only
+        "fallbacks": sum(1 for r in out for item in r["items"] if not item["ai_used"]),
+    }
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--classes", type=int, default=5)
+    p.add_argument("--students", type=int, default=30, help="drafts per session")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--json-out", help="write the result as JSON")
+    args = p.parse_args()
+
+    classes = [make_class(args.students, args.seed + k) for k in range(args.classes)]
+    result = {
+        "classes": args.classes,
+        "students": args.students,
+        "single": asyncio.run(run_single(classes)),
+        "batch": asyncio.run(run_batch(classes)),
+    }
+    single, batch = result["single"], result["batch"]
+    result["call_reduction"] = round(single["model_calls"] / max(1, batch["model_calls"]), 1)
+    print(f"{args.classes} sessions x {args.students} drafts, "
+          f"FAKE_GEMINI_LATENCY={os.getenv('FAKE_GEMINI_LATENCY', 'lognormal:0.8,0.4')}, "
+          f"A9_BATCH_TOKEN_BUDGET={a9.BATCH_TOKEN_BUDGET}, A9_BATCH_MAX_ITEMS={a9.BATCH_MAX_ITEMS}")
+    print(f"{'':>8} {'calls':>6} {'wall s':>7} {'prompt tok':>10} {'fallbacks':>9}")
+    for name in ("single", "batch"):
+        row = result[name]
+        print(f"{name:>8} {row['model_calls']:>6} {row['wall_s']:>7} {row['prompt_tokens']:>10} {str(row['fallbacks']):>9}")
+    print(f"model calls: {result['call_reduction']}x fewer")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
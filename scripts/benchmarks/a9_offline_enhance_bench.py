@@ -0,0 +1,112 @@
+"""
+A9 offline enhancer (no key / circuit open / model error): the previous chain
+of str.replace calls versus the compiled single-pass tables of
+app.agents.a9_feedback.offline, per draft and as one batch.
+
+Reports drafts per second for each way and how many outputs differ from the
+old chain (cascaded replacements such as "tốt lắm" -> "có tiến bộ" being
+rewritten again, "em" replaced inside other words), with a few examples.
+
+Examples:
+    python scripts/benchmarks/a9_offline_enhance_bench.py
+    python scripts/benchmarks/a9_offline_enhance_bench.py --drafts 50000 --batch 5000 --json-out a9_offline.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from app.agents.a9_feedback.offline import simple_enhance, simple_enhance_batch  # noqa: E402
+
+OPENINGS = ["Hôm nay em", "hôm nay con", "Em", "Buổi này em", "Con"]
+BODIES = [
+    "làm bài đầy đủ", "học tốt lắm", "rất ngoan và chăm chỉ", "phát âm tốt lắm nhưng còn quên từ",
+    "làm bài chưa đầy đủ, cần cố gắng", "đọc to, rõ ràng, hiểu bài nhanh", "hay nói chuyện riêng, cần tập trung hơn",
+    "tham gia trò chơi tích cực, them nhiều câu hỏi hay", "viết đúng chính tả, trình bày sạch đẹp",
+]
+CLOSINGS = ["", ".", "!", " Cô khen em.", " Phụ huynh nhắc em ôn bài ở nhà nhé", " Tuyệt vời lắm!"]
+
+def legacy_simple_enhance(draft: str) -> str:
+    """_simple_enhance before the compiled tables (nine chained str.replace calls)."""
+    replacements = {
+        "hôm nay": "trong buổi học",
+        "em": "học sinh",
+        "tốt lắm": "có tiến bộ",
+        "lắm": "cao",
+        "làm bài": "hoàn thành bài tập",
+        "đầy đủ": "đầy đủ các nội dung được giao",
+        "chăm chỉ": "thể hiện sự chăm chỉ trong học tập",
+        "học tốt": "có kết quả học tập tốt",
+        "ngoan": "có thái độ học tập tích cực",
+    }
+    result = draft
+    for old, new in replacements.items():
+        result = result.replace(old, new)
+    if not result.endswith(".") and not result.endswith("!") and not result.endswith("?"):
+        result += "."
+    return result
+
+def make_drafts(n: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        sentences = [f"{rng.choice(OPENINGS)} {rng.choice(BODIES)}" for _ in range(rng.randint(1, 4))]
+        out.append(", ".join(sentences) + rng.choice(CLOSINGS))
+    return out
+
+def _rate(fn: Callable[[], Any], n: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return n / best
+
+def run(drafts: int, batch: int, seed: int, repeat: int) -> Dict[str, Any]:
+    data = make_drafts(drafts, seed)
+    legacy = [legacy_simple_enhance(d) for d in data]
+    single = [simple_enhance(d, "vi") for d in data]
+    batched = [x for i in range(0, drafts, batch) for x in simple_enhance_batch(data[i:i + batch], "vi")]
+    assert batched == single, "batch output differs from per-draft output"
+    changed = [i for i in range(drafts) if legacy[i] != single[i]]
+    return {
+        "drafts": drafts,
+        "batch": batch,
+        "legacy_drafts_per_s": round(_rate(lambda: [legacy_simple_enhance(d) for d in data], drafts, repeat)),
+        "single_drafts_per_s": round(_rate(lambda: [simple_enhance(d, "vi") for d in data], drafts, repeat)),
+        "batch_drafts_per_s": round(_rate(
+            lambda: [simple_enhance_batch(data[i:i + batch], "vi") for i in range(0, drafts, batch)], drafts, repeat)),
+        "outputs_changed": len(changed),
+        "examples": [{"draft": data[i], "legacy": legacy[i], "now": single[i]} for i in changed[:3]],
+    }
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--drafts", type=int, default=20_000)
+    p.add_argument("--batch", type=int, default=2_000, help="drafts per simple_enhance_batch() call")
+    p.add_argument("--repeat", type=int, default=3, help="timing runs per way (best is reported)")
+    p.add_argument("--seed", type=int, default=11)
+    p.add_argument("--json-out", help="write the result as JSON")
+    args = p.parse_args()
+
+    r = run(args.drafts, args.batch, args.seed, args.repeat)
+    print(f"{r['drafts']} drafts")
+    print(f"  chained str.replace     : {r['legacy_drafts_per_s']:>9} drafts/s")
+    print(f"  simple_enhance          : {r['single_drafts_per_s']:>9} drafts/s")
+    print(f"  simple_enhance_batch    : {r['batch_drafts_per_s']:>9} drafts/s (batches of {r['batch']})")
+    print(f"  output differs from the chain for {r['outputs_changed']} drafts, e.g.")
+    for ex in r["examples"]:
+        print(f"    draft : {ex['draft']}\n    before: {ex['legacy']}\n    now   : {ex['now']}")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
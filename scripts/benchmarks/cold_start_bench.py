@@ -0,0 +1,162 @@
+"""
+Cold start: time to import the app and time until a fresh server answers
+/health, for several configurations (all agents, a subset via ENABLED_AGENTS,
+and the genai SDK imported eagerly as before app.core.startup).
+
+Each run is a new Python process, so nothing is shared between runs (the OS
+file cache is, hence a warm-up run that is not counted). Reports the median
+and min per configuration plus the server's own start-up report from
+/debug/ai ("startup") of the last run. No model calls are made; a dummy
+GEMINI_API_KEY lets the client warm-up run as in production.
+
+Examples:
+    python scripts/benchmarks/cold_start_bench.py
+    python scripts/benchmarks/cold_start_bench.py --runs 10 --json-out cold.json
+    python scripts/benchmarks/cold_start_bench.py --baseline cold.json   # exit 1 if slower than --tolerance
+
+Exit code 1 when --baseline is given and a median regressed by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# name -> (extra env, import the genai SDK before the app)
+CONFIGS = {
+    "all agents": ({}, False),
+    "all agents + eager SDK": ({"GEMINI_CLIENT_WARMUP": "startup"}, True),
+    "a9 only": ({"ENABLED_AGENTS": "a9"}, False),
+    "a3 + a7": ({"ENABLED_AGENTS": "a3,a7"}, False),
+}
+
+_IMPORT_SNIPPET = """
+import time
+t0 = time.perf_counter()
+if {eager}:
+    import google.genai
+import app.main
+print(time.perf_counter() - t0)
+"""
+
+def _env(extra: Dict[str, str]) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "cold-start-bench")  # never used: no model calls
+    env.pop("ENABLED_AGENTS", None)
+    env.update({"PYTHONPATH": ROOT, "JOB_INPROCESS_CONCURRENCY": "0"})
+    env.update(extra)
+    return env
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def measure_import(extra: Dict[str, str], eager: bool) -> float:
+    out = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", _IMPORT_SNIPPET.format(eager=eager)],
+        env=_env(extra), cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+def measure_ready(extra: Dict[str, str], eager: bool, timeout: float) -> Dict[str, Any]:
+    """Seconds from process start to the first 200 of /health, and the /debug/ai start-up report."""
+    port = _free_port()
+    env = _env(extra)
+    cmd = [sys.executable, "-W", "ignore", "-m", "app.serve", "--workers", "1", "--port", str(port),
+           "--host", "127.0.0.1", "--no-preload", "--max-requests", "0", "--log-level", "warning"]
+    if eager:
+        # as before the lazy imports: the SDK is loaded before the app
+        cmd = [sys.executable, "-W", "ignore", "-c",
+               "import sys, google.genai; from app.serve import main; sys.exit(main(sys.argv[1:]))", *cmd[5:]]
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        while time.perf_counter() - t0 < timeout:
+            try:
+                if httpx.get(f"{url}/health", timeout=0.5).status_code == 200:
+                    ready = time.perf_counter() - t0
+                    report = httpx.get(f"{url}/debug/ai", timeout=5).json().get("startup")
+                    return {"ready_s": ready, "startup": report}
+            except httpx.HTTPError:
+                pass
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with {proc.returncode}")
+            time.sleep(0.02)
+        raise TimeoutError(f"server not ready after {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait(30)
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {"median": round(statistics.median(values), 3), "min": round(min(values), 3)}
+
+def run(runs: int, configs: List[str], timeout: float) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"runs": runs, "configs": {}}
+    for name in configs:
+        extra, eager = CONFIGS[name]
+        measure_import(extra, eager)  # warm-up: .pyc files, OS file cache
+        imports = [measure_import(extra, eager) for _ in range(runs)]
+        ready: List[float] = []
+        report: Optional[Dict[str, Any]] = None
+        for _ in range(runs):
+            r = measure_ready(extra, eager, timeout)
+            ready.append(r["ready_s"])
+            report = r["startup"]
+        out["configs"][name] = {"import_s": _summary(imports), "ready_s": _summary(ready), "startup": report}
+    return out
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    problems = []
+    for name, r in result["configs"].items():
+        b = baseline.get("configs", {}).get(name)
+        if not b:
+            continue
+        for key in ("import_s", "ready_s"):
+            if r[key]["median"] > b[key]["median"] * (1 + tolerance):
+                problems.append(f"{name}: {key} {r[key]['median']}s > baseline {b[key]['median']}s")
+    return problems
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--configs", default=",".join(CONFIGS), help="comma-separated names from: " + ", ".join(CONFIGS))
+    p.add_argument("--timeout", type=float, default=60.0, help="seconds a server may take to start")
+    p.add_argument("--json-out", help="write the result as JSON (usable as --baseline later)")
+    p.add_argument("--baseline", help="previous --json-out to compare against")
+    p.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression vs baseline")
+    args = p.parse_args()
+
+    configs = [c.strip() for c in args.configs.split(",") if c.strip()]
+    result = run(args.runs, configs, args.timeout)
+    print(f"{'configuration':<24} {'import s':>9} {'(min)':>7} {'ready s':>9} {'(min)':>7}")
+    for name, r in result["configs"].items():
+        print(f"{name:<24} {r['import_s']['median']:>9} {r['import_s']['min']:>7} "
+              f"{r['ready_s']['median']:>9} {r['ready_s']['min']:>7}")
+    for name, r in result["configs"].items():
+        startup = r["startup"] or {}
+        slowest = list(startup.get("imports", {}).items())[:3]
+        print(f"  {name}: phases {startup.get('phases')}, slowest imports "
+              + ", ".join(f"{m} {v['seconds']}s{' (lazy)' if v['lazy'] else ''}" for m, v in slowest))
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print("REGRESSION", problem)
+        return 1 if problems else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Job queue throughput versus the number of dedicated worker processes.
+
+For every --processes value: starts that many `python -m app.worker` processes
+on a fresh queue database, submits --jobs jobs of --kind at once and waits for
+all to finish. Reports the drain time, jobs per second and the p50/p95 time
+from submit to finish.
+
+Uses the offline fake backend (GEMINI_BACKEND=fake; FAKE_GEMINI_LATENCY sets
+the simulated model latency), so no quota is used.
+
+Examples:
+    python scripts/benchmarks/job_queue_bench.py
+    FAKE_GEMINI_LATENCY=fixed:3 python scripts/benchmarks/job_queue_bench.py --jobs 200 --processes 1,2,4 --concurrency 8
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+SAMPLE_PAYLOADS = {
+    "a9.enhance_feedback": lambda i: {"draft": f"hôm nay con làm bài đầy đủ, phát âm tốt ({i})", "language": "vi"},
+    "a8.analyze_transcript": lambda i: {
+        "context": {"homework_id": "HW1", "student_id": f"ST{i}", "mode": "speaking"},
+        "transcript": "My name is An. I like cats and dogs.",
+    },
+    "a6.monthly_report": lambda i: {
+        "student": {"student_id": f"ST{i}", "name": "An"},
+        "range": {"from_date": "2026-03-01", "to_date": "2026-03-31"},
+        "session_feedbacks": [{"date": "2026-03-02", "text": "Con tích cực phát biểu."}],
+    },
+}
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def _watch(proc: subprocess.Popen, ready: threading.Event) -> None:
+    """Sets `ready` once the worker logged its start; keeps draining its stderr."""
+    for line in proc.stderr:
+        if "started" in line:
+            ready.set()
+    ready.set()
+
+def run(processes: int, jobs: int, kind: str, concurrency: int, timeout: float) -> Dict[str, Any]:
+    from app.core import jobs as job_queue
+
+    workdir = tempfile.mkdtemp(prefix="kidzgo-jobs-")
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_BACKEND": env.get("GEMINI_BACKEND", "fake"),
+        "JOB_DB_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "JOB_FILES_DIR": os.path.join(workdir, "files"),
+        "JOB_POLL_INTERVAL": "0.05",
+        "GEMINI_QUOTA_PROCESSES": str(processes),
+        "PYTHONPATH": ROOT,
+    })
+    queue = job_queue.JobQueue(env["JOB_DB_PATH"], env["JOB_FILES_DIR"])
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-W", "ignore", "-m", "app.worker", "--concurrency", str(concurrency), "--drain", "5"],
+            env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        for _ in range(processes)
+    ]
+    ready = [threading.Event() for _ in workers]
+    for w, event in zip(workers, ready):
+        threading.Thread(target=_watch, args=(w, event), daemon=True).start()
+    try:
+        # worker start-up (imports, client) is not part of the measurement
+        for event in ready:
+            event.wait(60)
+        t0 = time.time()
+        ids = [queue.submit(kind, SAMPLE_PAYLOADS[kind](i))["id"] for i in range(jobs)]
+        pending = set(ids)
+        deadline = time.time() + timeout
+        while pending and time.time() < deadline:
+            time.sleep(0.1)
+            pending = {i for i in pending if queue.get(i)["status"] not in job_queue.FINISHED}
+        elapsed = time.time() - t0
+        rows = [queue.get(i) for i in ids]
+    finally:
+        for w in workers:
+            w.terminate()
+        for w in workers:
+            w.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    done = [r for r in rows if r["status"] == "succeeded"]
+    latencies = [r["finished_at"] - r["created_at"] for r in done]
+    return {
+        "processes": processes,
+        "concurrency": concurrency,
+        "jobs": jobs,
+        "succeeded": len(done),
+        "unfinished": len([r for r in rows if r["status"] not in job_queue.FINISHED]),
+        "drain_s": round(elapsed, 2),
+        "jobs_per_s": round(len(done) / elapsed, 2) if elapsed else None,
+        "p50_s": round(_percentile(latencies, 0.5), 2) if latencies else None,
+        "p95_s": round(_percentile(latencies, 0.95), 2) if latencies else None,
+    }
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--jobs", type=int, default=60)
+    p.add_argument("--kind", default="a9.enhance_feedback", choices=sorted(SAMPLE_PAYLOADS))
+    p.add_argument("--processes", default="1,2,4", help="comma-separated worker process counts")
+    p.add_argument("--concurrency", type=int, default=4, help="jobs at once per worker process")
+    p.add_argument("--timeout", type=float, default=300.0)
+    p.add_argument("--json-out", help="write the result as JSON")
+    args = p.parse_args()
+
+    results = []
+    print(f"{args.jobs} x {args.kind}, concurrency {args.concurrency} per process, "
+          f"FAKE_GEMINI_LATENCY={os.getenv('FAKE_GEMINI_LATENCY', 'lognormal:0.8,0.4')}")
+    print(f"{'processes':>9} {'done':>6} {'drain s':>8} {'jobs/s':>7} {'p50 s':>6} {'p95 s':>6}")
+    for n in [int(x) for x in args.processes.split(",") if x.strip()]:
+        row = run(n, args.jobs, args.kind, args.concurrency, args.timeout)
+        results.append(row)
+        print(f"{n:>9} {row['succeeded']:>6} {row['drain_s']:>8} {str(row['jobs_per_s']):>7} "
+              f"{str(row['p50_s']):>6} {str(row['p95_s']):>6}")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Micro-benchmark: JSON extraction from model outputs, old vs new.
+
+Compares the previous extract_json_block (first '{' to last '}' + json.loads)
+with app.core.json_extract.parse_json_object (stdlib json and orjson when
+installed) and the streaming extractor fed in 40-char chunks, per output shape:
+
+  clean, fenced (```json), prose (text before/after, with braces), two_objects,
+  truncated (cut at 60-95%), no_json
+
+Reports the share of outputs each implementation parses and the median time
+per call. The default corpus is built from the fake backend's per-agent
+outputs (app/core/fake_gemini.py) wrapped in the shapes above; pass
+--corpus FILE to use recorded outputs instead (JSON lines with "text" and an
+optional "kind").
+
+Examples:
+    python scripts/benchmarks/json_extract_bench.py
+    python scripts/benchmarks/json_extract_bench.py --save-corpus outputs.jsonl
+    python scripts/benchmarks/json_extract_bench.py --corpus outputs.jsonl --repeat 2000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from app.core import json_extract  # noqa: E402
+from app.core.fake_gemini import fake_output  # noqa: E402
+
+# minimal prompts that make the fake backend answer like each agent
+AGENT_PROMPTS = {
+    "a3": '"extracted_student_answer"',
+    "a3_batch": '"results"\n[0] a\n[1] b\n[2] c\n[3] d',
+    "a6": '"parent_support"',
+    "a7": '"fields" "receiver_account"',
+    "a8": '"pronunciation_score"',
+}
+
+PROSE_BEFORE = [
+    "Dưới đây là kết quả đánh giá theo định dạng {JSON} bạn yêu cầu:\n",
+    "Here is the result:\n\n",
+]
+PROSE_AFTER = [
+    "\n\nLưu ý: các trường {score} và {feedback} được ước lượng từ ảnh.",
+    "\nHy vọng kết quả này hữu ích!",
+]
+
+def _legacy(text: str) -> Dict[str, Any]:
+    """The implementation before app.core.json_extract."""
+    if not text:
+        raise ValueError("Empty text")
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end == -1 or end <= start:
+        raise ValueError("No JSON object found in text")
+    return json.loads(text[start:end + 1])
+
+def _stdlib(text: str) -> Dict[str, Any]:
+    saved, json_extract.orjson = json_extract.orjson, None
+    try:
+        return json_extract.parse_json_object(text)
+    finally:
+        json_extract.orjson = saved
+
+def _streamed(text: str) -> Dict[str, Any]:
+    extractor = json_extract.StreamingJsonExtractor()
+    for i in range(0, len(text), 40):
+        extractor.feed(text[i:i + 40])
+    return extractor.result()
+
+def build_corpus(per_agent: int, seed: int) -> List[Dict[str, str]]:
+    rng = random.Random(seed)
+    corpus = []
+    for agent, prompt in AGENT_PROMPTS.items():
+        for _ in range(per_agent):
+            text = fake_output(prompt, rng)
+            if rng.random() < 0.5:  # models often pretty-print
+                text = json.dumps(json.loads(text), ensure_ascii=False, indent=2)
+            cut = int(len(text) * rng.uniform(0.6, 0.95))
+            corpus += [
+                {"agent": agent, "kind": "clean", "text": text},
+                {"agent": agent, "kind": "fenced", "text": f"```json\n{text}\n```"},
+                {"agent": agent, "kind": "prose", "text": rng.choice(PROSE_BEFORE) + text + rng.choice(PROSE_AFTER)},
+                {"agent": agent, "kind": "two_objects", "text": text + "\n\nVí dụ khác:\n" + fake_output(prompt, rng)},
+                {"agent": agent, "kind": "truncated", "text": text[:cut]},
+                {"agent": agent, "kind": "no_json", "text": "Xin lỗi, tôi không thể đọc được ảnh bài làm này."},
+            ]
+    return corpus
+
+def load_corpus(path: str) -> List[Dict[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [{"agent": r.get("agent", "?"), "kind": r.get("kind", "recorded"), "text": r["text"]} for r in rows]
+
+def _time_per_call(fn: Callable[[str], Any], texts: List[str], repeat: int) -> float:
+    """Median seconds per call over `repeat` passes of the texts."""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for text in texts:
+            try:
+                fn(text)
+            except ValueError:
+                pass
+        samples.append((time.perf_counter() - t0) / len(texts))
+    return statistics.median(samples)
+
+def _parses(fn: Callable[[str], Any], text: str) -> bool:
+    try:
+        return isinstance(fn(text), dict)
+    except ValueError:
+        return False
+
+def run(corpus: List[Dict[str, str]], repeat: int) -> Dict[str, Any]:
+    impls = {"legacy": _legacy, "new_json": _stdlib, "streamed": _streamed}
+    if json_extract.orjson is not None:
+        impls["new_orjson"] = json_extract.parse_json_object
+
+    by_kind: Dict[str, List[str]] = defaultdict(list)
+    for row in corpus:
+        by_kind[row["kind"]].append(row["text"])
+
+    result: Dict[str, Any] = {}
+    for kind, texts in by_kind.items():
+        result[kind] = {
+            name: {
+                "ok_rate": sum(_parses(fn, t) for t in texts) / len(texts),
+                "us_per_call": _time_per_call(fn, texts, repeat) * 1e6,
+            }
+            for name, fn in impls.items()
+        }
+        result[kind]["n"] = len(texts)
+    return result
+
+def print_report(result: Dict[str, Any]) -> None:
+    names = [k for k in next(iter(result.values())) if k != "n"]
+    print(f"{'shape':<12} {'n':>5}  " + "  ".join(f"{n:>20}" for n in names))
+    print(f"{'':<12} {'':>5}  " + "  ".join(f"{'ok    us/call':>20}" for _ in names))
+    for kind, row in result.items():
+        cells = [f"{row[n]['ok_rate']:>6.0%} {row[n]['us_per_call']:>13.1f}" for n in names]
+        print(f"{kind:<12} {row['n']:>5}  " + "  ".join(f"{c:>20}" for c in cells))
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--corpus", help="JSON lines of recorded outputs ({\"text\": ..., \"kind\": ...})")
+    p.add_argument("--per-agent", type=int, default=20, help="generated outputs per agent and shape")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--repeat", type=int, default=200, help="timed passes over each shape")
+    p.add_argument("--save-corpus", help="write the corpus used as JSON lines")
+    p.add_argument("--json-out", help="write the result as JSON")
+    args = p.parse_args()
+
+    logging.getLogger("kidzgo.json").setLevel(logging.ERROR)  # one warning per repaired output otherwise
+    corpus = load_corpus(args.corpus) if args.corpus else build_corpus(args.per_agent, args.seed)
+    if args.save_corpus:
+        with open(args.save_corpus, "w", encoding="utf-8") as f:
+            for row in corpus:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    result = run(corpus, args.repeat)
+    print(f"json backend: {json_extract.JSON_BACKEND}, {len(corpus)} outputs")
+    print_report(result)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
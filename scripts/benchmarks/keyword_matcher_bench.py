@@ -0,0 +1,203 @@
+"""
+Keyword heuristics: the previous nested `any(k in text ...)` scans versus
+app.core.keywords.KeywordMatcher, on large batches of synthetic receipts and
+feedback lines.
+
+Receipts are a transfer content (with or without accents, sometimes upper
+case) plus bank-app OCR text around it. Reports the time per item for both
+implementations and how often, and how, the inferred transaction type differs.
+The scaling part grows the rule set with extra (synthetic) keywords: the
+any() scans get slower with every keyword, the matcher's single scan barely.
+
+Examples:
+    python scripts/benchmarks/keyword_matcher_bench.py
+    python scripts/benchmarks/keyword_matcher_bench.py --receipts 200000 --json-out keywords.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from app.core.keywords import KeywordMatcher, fold_text  # noqa: E402
+from app.agents.a6_reports import service as a6  # noqa: E402
+from app.agents.a7_receipts.service import _infer_transaction_type  # noqa: E402
+
+CONTENTS = [
+    "CK hoc phi thang {m} be {name}", "Học phí tháng {m} - {name}", "HOC PHI KHOA HE {name}",
+    "Hoàn tiền học phí tháng {m} cho {name}", "Hoan tien hoc phi {name}", "Refund tuition {name}",
+    "Đặt cọc học phí khoá hè {name}", "Dat coc giu cho lop {name}", "Tiền cọc lớp tiếng Anh {name}",
+    "Trả lương tháng {m} GV {name}", "TRA LUONG T{m} {name}", "Salary {m}/2026 {name}",
+    "Thanh toán tiền thuê mặt bằng T{m}", "Thue mat bang co so 2 thang {m}", "Rent office {m}/2026",
+    "Mua sắm vật tư lớp học", "Thanh toan CSVC ban ghe", "Phụ cấp ăn trưa T{m} {name}",
+    "Thưởng tết GV {name}", "Bonus Q{m} {name}", "Nộp thuế TNCN tháng {m}", "Chuyen tien {name}",
+    "Course fee level {m} {name}", "Thanh toan phi tai lieu {name}",
+]
+NAMES = ["Nguyen Van An", "Trần Thị Bình", "LE MINH CHAU", "Phạm Gia Huy", "Vo Ngoc Lan"]
+OCR_WRAPPERS = [
+    "Chuyển tiền thành công\nSố tiền {amount} VND\nNội dung: {content}\nMã giao dịch FT{tx}\nTài khoản nhận 0123456789",
+    "VIETCOMBANK\nGiao dich thanh cong\nSo tien: {amount} VND\nNoi dung CK: {content}\nSo du kha dung: {balance} VND",
+    "Transfer successful\nAmount {amount} VND\nDescription: {content}\nReference {tx}\nFee 0 VND",
+    "{content}",
+]
+FEEDBACKS = [
+    "Con tiến bộ rõ, phát âm tốt hơn.", "Con chưa tốt phần nghe, cần luyện thêm.",
+    "Con tự tin phát biểu nhưng còn chậm khi viết.", "Hôm nay con quên mang sách.",
+    "Con lam bai dung va nhanh", "Con không tự tin khi nói trước lớp.", "Con tham gia đầy đủ các hoạt động.",
+    "Con còn rụt rè, hay nhầm lẫn từ vựng.", "Con chăm chỉ, tích cực xây dựng bài.",
+]
+
+# ---- previous implementations (as before app.core.keywords) ----
+
+_LEGACY_RULES = {
+    "Trả lương": ["lương", "salary", "payroll"],
+    "Thanh toán cơ sở vật chất": ["cơ sở vật chất", "csvc", "equipment", "vật tư", "mua sắm"],
+    "Thu học phí": ["học phí", "tuition", "course fee", "fee"],
+    "Thuê mặt bằng": ["thuê", "mặt bằng", "rent"],
+    "Hoàn tiền": ["hoàn", "refund", "reimburse"],
+    "Thưởng": ["thưởng", "bonus"],
+    "Phụ cấp": ["phụ cấp", "allowance"],
+    "Đặt cọc": ["đặt cọc", "deposit"],
+}
+
+def legacy_transaction_type(content: Optional[str], raw_text: Optional[str]) -> str:
+    haystack = " ".join([content or "", raw_text or ""]).lower()
+    if not haystack.strip():
+        return "Khác"
+    for label, keywords in _LEGACY_RULES.items():
+        if any(k in haystack for k in keywords):
+            return label
+    return "Khác"
+
+def legacy_feedback_sections(texts: List[str]) -> Tuple[List[str], List[str]]:
+    strengths, improvements = [], []
+    for t in texts:
+        tl = t.lower()
+        if any(k in tl for k in a6.POSITIVE) and len(strengths) < 3:
+            strengths.append(t)
+        if any(k in tl for k in a6.NEGATIVE) and len(improvements) < 3:
+            improvements.append(t)
+    return strengths, improvements
+
+def matcher_feedback_sections(texts: List[str]) -> Tuple[List[str], List[str]]:
+    scored = list(zip(texts, a6._FEEDBACK_TONE.score_batch(texts)))
+    return a6._top_feedbacks(scored, "positive"), a6._top_feedbacks(scored, "negative")
+
+# ---- data ----
+
+def make_receipts(n: int, seed: int) -> List[Tuple[str, str]]:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        content = rng.choice(CONTENTS).format(m=rng.randint(1, 12), name=rng.choice(NAMES))
+        if rng.random() < 0.3:
+            content = fold_text(content)  # typed without accents
+        raw = rng.choice(OCR_WRAPPERS).format(
+            content=content, amount=f"{rng.randint(1, 90) * 100_000:,}", tx=rng.randint(10**9, 10**10),
+            balance=f"{rng.randint(1, 500) * 1_000_000:,}",
+        )
+        out.append((content, raw))
+    return out
+
+def make_feedback_batches(n: int, seed: int) -> List[List[str]]:
+    rng = random.Random(seed)
+    return [rng.sample(FEEDBACKS, rng.randint(3, len(FEEDBACKS))) for _ in range(n)]
+
+SYLLABLES = ["ba", "chi", "dung", "gia", "khanh", "lam", "minh", "nga", "phuc", "quang", "son", "trang", "vinh", "xuan"]
+
+def scaled_rules(keywords: int, seed: int) -> Dict[str, List[str]]:
+    """The transaction rules plus synthetic two-syllable keywords spread over 8 extra labels."""
+    rng = random.Random(seed)
+    rules = {label: list(words) for label, words in _LEGACY_RULES.items()}
+    extra = max(0, keywords - sum(len(v) for v in rules.values()))
+    for i in range(extra):
+        word = f"{rng.choice(SYLLABLES)} {rng.choice(SYLLABLES)}{rng.choice(SYLLABLES)}"
+        rules.setdefault(f"extra {i % 8}", []).append(word)
+    return rules
+
+def legacy_scan(rules: Dict[str, List[str]], text: str) -> str:
+    haystack = text.lower()
+    for label, keywords in rules.items():
+        if any(k in haystack for k in keywords):
+            return label
+    return "Khác"
+
+def run_scaling(sizes: List[int], texts: List[str], seed: int) -> List[Dict[str, Any]]:
+    rows = []
+    for size in sizes:
+        rules = scaled_rules(size, seed)
+        matcher = KeywordMatcher(rules)
+        legacy_s, _ = _time(lambda t: legacy_scan(rules, t), texts, star=False)
+        matcher_s, _ = _time(lambda t: matcher.best(t, "Khác"), texts, star=False)
+        rows.append({
+            "keywords": sum(len(v) for v in rules.values()),
+            "legacy_us_per_text": round(legacy_s / len(texts) * 1e6, 2),
+            "matcher_us_per_text": round(matcher_s / len(texts) * 1e6, 2),
+        })
+    return rows
+
+def _time(fn, items, star: bool = True) -> Tuple[float, List[Any]]:
+    t0 = time.perf_counter()
+    out = [fn(*x) for x in items] if star else [fn(x) for x in items]
+    return time.perf_counter() - t0, out
+
+def run(receipts: int, reports: int, seed: int, sizes: List[int]) -> Dict[str, Any]:
+    data = make_receipts(receipts, seed)
+    legacy_s, legacy = _time(legacy_transaction_type, data)
+    matcher_s, matched = _time(_infer_transaction_type, data)
+    changes = Counter((a, b) for a, b in zip(legacy, matched) if a != b)
+
+    batches = make_feedback_batches(reports, seed)
+    fb_legacy_s, fb_legacy = _time(legacy_feedback_sections, batches, star=False)
+    fb_matcher_s, fb_matched = _time(matcher_feedback_sections, batches, star=False)
+    return {
+        "receipts": receipts,
+        "legacy_us_per_receipt": round(legacy_s / receipts * 1e6, 2),
+        "matcher_us_per_receipt": round(matcher_s / receipts * 1e6, 2),
+        "labels_changed": sum(changes.values()),
+        "labels_changed_pct": round(100 * sum(changes.values()) / receipts, 1),
+        "top_changes": [{"legacy": a, "matcher": b, "count": c} for (a, b), c in changes.most_common(10)],
+        "label_counts": dict(Counter(matched).most_common()),
+        "reports": reports,
+        "legacy_us_per_report": round(fb_legacy_s / reports * 1e6, 2),
+        "matcher_us_per_report": round(fb_matcher_s / reports * 1e6, 2),
+        "reports_changed": sum(1 for a, b in zip(fb_legacy, fb_matched) if a != b),
+        "scaling": run_scaling(sizes, [raw for _, raw in data[:10_000]], seed),
+    }
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--receipts", type=int, default=50_000)
+    p.add_argument("--reports", type=int, default=20_000, help="feedback batches for the A6 fallback sections")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--sizes", default="25,100,400,1600", help="rule set sizes (keywords) for the scaling part")
+    p.add_argument("--json-out", help="write the result as JSON")
+    args = p.parse_args()
+
+    r = run(args.receipts, args.reports, args.seed, [int(x) for x in args.sizes.split(",") if x.strip()])
+    print(f"A7 transaction type, {r['receipts']} receipts")
+    print(f"  legacy any() scans : {r['legacy_us_per_receipt']:>8} us/receipt")
+    print(f"  KeywordMatcher     : {r['matcher_us_per_receipt']:>8} us/receipt")
+    print(f"  label differs for {r['labels_changed']} ({r['labels_changed_pct']}%):")
+    for c in r["top_changes"]:
+        print(f"    {c['count']:>7}  {c['legacy']} -> {c['matcher']}")
+    print(f"A6 fallback strengths/improvements, {r['reports']} reports")
+    print(f"  legacy any() scans : {r['legacy_us_per_report']:>8} us/report")
+    print(f"  KeywordMatcher     : {r['matcher_us_per_report']:>8} us/report")
+    print(f"  sections differ for {r['reports_changed']} reports")
+    print("Rule set size, us per OCR text (first-match any() scans vs KeywordMatcher.best)")
+    for row in r["scaling"]:
+        print(f"  {row['keywords']:>6} keywords: {row['legacy_us_per_text']:>8} vs {row['matcher_us_per_text']:>8}")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,502 @@
+"""
+Load test for the agent endpoints (/a3, /a6, /a7, /a8, /a9) at a target request rate.
+
+By default a local server is started with the offline fake model backend
+(GEMINI_BACKEND=fake, see app/core/fake_gemini.py), so no Gemini quota is used.
+FAKE_GEMINI_* variables in the environment are passed through to it.
+
+Reports per endpoint: throughput, p50/p95/p99 latency, HTTP errors, fallback
+rate (ai_used=false in the response, and server-side by reason from /metrics)
+and resident memory per worker.
+
+Examples:
+    python scripts/benchmarks/load_test.py --rps 20 --duration 30
+    python scripts/benchmarks/load_test.py --workers 4 --mix a3=3,a9=3,a6=1 --json-out bench.json
+    FAKE_GEMINI_ERROR_RATE=0.05 python scripts/benchmarks/load_test.py --baseline bench.json
+    python scripts/benchmarks/load_test.py --url http://staging:8000 --rps 5   # real server, real model!
+
+Exit code 1 when --baseline is given and p95 latency, throughput or fallback
+rate regressed by more than --tolerance.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import re
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from PIL import Image
+except ImportError:  # images are then tiny placeholder bytes
+    Image = None
+
+# ---------------------------------------------------------------- payloads
+
+CONTEXT = {
+    "homework_id": "HW-BENCH",
+    "student_id": "ST-BENCH",
+    "skill": "writing",
+    "instructions": "Write 3-5 sentences about your family.",
+}
+
+ANSWERS = [
+    "My family have four people. My father is a doctor. My mother is teacher. I love my family very much.",
+    "I has a small family. We live in Ha Noi. My brother like play football and I like reading book.",
+    "There are five people in my family. My grandmother cook very good. On Sunday we go to the park together.",
+]
+
+FEEDBACKS = [
+    "em làm bài tốt lắm, hôm nay em ngoan và chăm chỉ",
+    "hôm nay em học tốt, làm bài đầy đủ nhưng còn nói chuyện riêng",
+    "em tiến bộ nhiều, phát âm tốt lắm, cần chăm chỉ làm bài tập về nhà",
+]
+
+def _jpeg(width: int, height: int, seed: int) -> bytes:
+    if Image is None:
+        return b"\xff\xd8\xff" + os.urandom(2048)
+    rng = random.Random(seed)
+    # page-like: light background with dark "text" noise, compresses like a phone photo
+    img = Image.effect_noise((width, height), 40).convert("RGB")
+    img = Image.blend(img, Image.new("RGB", (width, height), (235, 232, 225)), 0.6)
+    for _ in range(60):
+        x, y = rng.randrange(width), rng.randrange(height)
+        img.paste((30, 30, 30), (x, y, min(width, x + rng.randint(40, 400)), min(height, y + 8)))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=88)
+    return out.getvalue()
+
+def _wav(seconds: float, seed: int, rate: int = 16000) -> bytes:
+    rng = random.Random(seed)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        frames = bytearray()
+        for i in range(int(seconds * rate)):
+            # tone bursts with short pauses, roughly speech-shaped
+            on = (i // (rate // 2)) % 3 != 2
+            v = math.sin(2 * math.pi * 220 * i / rate) * 8000 if on else 0
+            frames += struct.pack("<h", int(v + rng.uniform(-300, 300)))
+        w.writeframes(bytes(frames))
+    return out.getvalue()
+
+def _monthly_report(i: int) -> Dict[str, Any]:
+    return {
+        "student": {"student_id": f"ST{i:05d}", "name": f"Học sinh {i}", "program": "Movers"},
+        "range": {"from_date": "2026-03-01", "to_date": "2026-03-31"},
+        "attendance": {"total_sessions": 12, "attended": 11, "absent": 1, "makeup": 0, "percentage": 91.7},
+        "homework": {"total": 10, "completed": 9, "submitted": 9, "average": 8.2, "completion_rate": 90},
+        "test": {"total": 1, "tests": [
+            {"exam_id": "E1", "type": "midterm", "score": 8.5, "max_score": 10, "date": "2026-03-20"}
+        ]},
+        "mission": {"completed": 6, "total": 8, "stars": 40, "xp": 1200, "current_level": "L3"},
+        "topics": {"total": 3, "topics": ["Family", "Food", "Animals"]},
+        "session_feedbacks": [
+            {"date": f"2026-03-{d:02d}", "text": FEEDBACKS[(i + d) % len(FEEDBACKS)]} for d in range(2, 30, 3)
+        ],
+        "recent_reports": [],
+    }
+
+class Payloads:
+    """Pre-built request payloads so the client spends its time sending, not encoding."""
+
+    def __init__(self, image_edge: int, audio_seconds: float, pool: int = 16):
+        h = int(image_edge * 0.75)
+        self.images = [_jpeg(image_edge, h, s) for s in range(pool)]
+        self.audio = [_wav(audio_seconds, s) for s in range(min(pool, 4))]
+
+    def build(self, name: str, i: int) -> Tuple[str, str, Dict[str, Any]]:
+        """-> (method, path, httpx request kwargs)"""
+        if name == "a3":
+            return "POST", "/a3/grade-text", {"json": {
+                "context": CONTEXT, "student_answer_text": ANSWERS[i % len(ANSWERS)] + f" ({i})", "language": "vi",
+            }}
+        if name == "a3_image":
+            return "POST", "/a3/grade-image", {
+                "params": CONTEXT,
+                "files": {"file": ("hw.jpg", self.images[i % len(self.images)], "image/jpeg")},
+            }
+        if name == "a6":
+            return "POST", "/a6/generate-monthly-report", {"json": _monthly_report(i)}
+        if name == "a7":
+            return "POST", "/a7/extract-payment-proof", {
+                "files": {"file": ("receipt.jpg", self.images[i % len(self.images)], "image/jpeg")},
+                "data": {"direction": "IN", "branch_id": "BR1"},
+            }
+        if name == "a8":
+            return "POST", "/a8/analyze-transcript", {"json": {
+                "context": {
+                    "homework_id": "HW-BENCH", "student_id": "ST-BENCH", "mode": "speaking",
+                    "expected_text": "My name is An. I like cats.",
+                },
+                "transcript": f"my name is an i like cat ({i})",
+            }}
+        if name == "a8_media":
+            return "POST", "/a8/analyze-media", {
+                "params": {"homework_id": "HW-BENCH", "student_id": "ST-BENCH", "mode": "speaking"},
+                "files": {"file": ("speech.wav", self.audio[i % len(self.audio)], "audio/wav")},
+            }
+        if name == "a9":
+            return "POST", "/a9/enhance-feedback", {"json": {"draft": FEEDBACKS[i % len(FEEDBACKS)] + f" ({i})"}}
+        raise ValueError(f"unknown endpoint {name}")
+
+# benchmark name -> endpoint label used by the server in /metrics
+ENDPOINTS = {
+    "a3": "a3.grade_text",
+    "a3_image": "a3.grade_image",
+    "a6": "a6.monthly_report",
+    "a7": "a7.payment_proof",
+    "a8": "a8.transcript",
+    "a8_media": "a8.media",
+    "a9": "a9.enhance_feedback",
+}
+
+# ---------------------------------------------------------------- server metrics
+
+_LINE = re.compile(r"^([a-zA-Z_:][\w:]*)(?:\{(.*)\})? (\S+)$")
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def parse_metrics(text: str) -> List[Tuple[str, Dict[str, str], float]]:
+    out = []
+    for line in text.splitlines():
+        m = _LINE.match(line)
+        if m:
+            out.append((m.group(1), dict(_LABEL.findall(m.group(2) or "")), float(m.group(3))))
+    return out
+
+class WorkerSnapshots:
+    """
+    /metrics of every worker seen, keyed by pid. Each scrape reaches one worker,
+    so scraping repeatedly collects all of them (best effort).
+    """
+
+    def __init__(self):
+        self.first: Dict[str, Dict[Tuple, float]] = {}
+        self.last: Dict[str, Dict[Tuple, float]] = {}
+        self.max_rss: Dict[str, float] = {}
+
+    async def scrape(self, client: httpx.AsyncClient, times: int = 1) -> None:
+        for _ in range(times):
+            try:
+                r = await client.get("/metrics", timeout=5)
+            except httpx.HTTPError:
+                continue
+            if r.status_code != 200:
+                continue
+            samples = parse_metrics(r.text)
+            pid = next((l["pid"] for n, l, _ in samples if n == "kidzgo_process_resident_memory_bytes"), "?")
+            results = {}
+            for name, labels, value in samples:
+                if name == "kidzgo_ai_results_total":
+                    results[(labels.get("endpoint"), labels.get("ai_used"), labels.get("reason"))] = value
+                elif name == "kidzgo_process_resident_memory_bytes":
+                    self.max_rss[pid] = max(self.max_rss.get(pid, 0.0), value)
+            self.first.setdefault(pid, results)
+            self.last[pid] = results
+
+    def fallback_by_endpoint(self) -> Dict[str, Dict[str, Any]]:
+        totals: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"calls": 0.0, "fallbacks": 0.0, "reasons": {}})
+        for pid, last in self.last.items():
+            first = self.first.get(pid, {})
+            for (endpoint, ai_used, reason), value in last.items():
+                delta = value - first.get((endpoint, ai_used, reason), 0.0)
+                if delta <= 0:
+                    continue
+                t = totals[endpoint]
+                t["calls"] += delta
+                if ai_used == "false":
+                    t["fallbacks"] += delta
+                    t["reasons"][reason] = t["reasons"].get(reason, 0) + delta
+        return {
+            e: {**t, "fallback_rate": round(t["fallbacks"] / t["calls"], 4) if t["calls"] else None}
+            for e, t in sorted(totals.items())
+        }
+
+# ---------------------------------------------------------------- load generator
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = math.floor(k), math.ceil(k)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition("=")
+        if not name:
+            continue
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint {name!r}, choose from {', '.join(ENDPOINTS)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+async def run_load(
+    client: httpx.AsyncClient,
+    payloads: Payloads,
+    mix: List[Tuple[str, float]],
+    rps: float,
+    duration: float,
+    max_in_flight: int,
+    timeout: float,
+    on_tick: Callable[[], Any],
+) -> Dict[str, Any]:
+    """Open-loop arrivals (Poisson) at `rps`; requests beyond max_in_flight are counted as dropped."""
+    rng = random.Random(7)
+    names = [n for n, _ in mix]
+    weights = [w for _, w in mix]
+    stats: Dict[str, Dict[str, Any]] = {
+        n: {"latencies": [], "status": defaultdict(int), "fallbacks": 0, "with_ai_flag": 0, "dropped": 0}
+        for n in names
+    }
+    in_flight = 0
+    tasks = set()
+
+    async def one(name: str, i: int) -> None:
+        nonlocal in_flight
+        method, path, kwargs = payloads.build(name, i)
+        s = stats[name]
+        start = time.perf_counter()
+        try:
+            r = await client.request(method, path, timeout=timeout, **kwargs)
+            status = str(r.status_code)
+            if r.status_code == 200:
+                body = r.json()
+                if isinstance(body, dict) and "ai_used" in body:
+                    s["with_ai_flag"] += 1
+                    s["fallbacks"] += 0 if body["ai_used"] else 1
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        finally:
+            in_flight -= 1
+        s["latencies"].append(time.perf_counter() - start)
+        s["status"][status] += 1
+
+    start = time.perf_counter()
+    next_at = start
+    next_tick = start + 2.0
+    i = 0
+    while True:
+        now = time.perf_counter()
+        if now - start >= duration:
+            break
+        if now < next_at:
+            await asyncio.sleep(next_at - now)
+            continue
+        name = rng.choices(names, weights)[0]
+        if in_flight >= max_in_flight:
+            stats[name]["dropped"] += 1
+        else:
+            in_flight += 1
+            t = asyncio.create_task(one(name, i))
+            tasks.add(t)
+            t.add_done_callback(tasks.discard)
+        i += 1
+        next_at += rng.expovariate(rps)
+        if now >= next_tick:
+            next_tick = now + 2.0
+            asyncio.create_task(on_tick())
+
+    sent_window = time.perf_counter() - start
+    if tasks:
+        await asyncio.wait(tasks)
+    elapsed = time.perf_counter() - start
+
+    report = {}
+    for name, s in stats.items():
+        lat = s["latencies"]
+        ok = s["status"].get("200", 0)
+        report[name] = {
+            "requests": len(lat),
+            "ok": ok,
+            "status": dict(s["status"]),
+            "dropped": s["dropped"],
+            "throughput_rps": round(ok / elapsed, 3) if elapsed else 0.0,
+            "p50_ms": _ms(_percentile(lat, 0.50)),
+            "p95_ms": _ms(_percentile(lat, 0.95)),
+            "p99_ms": _ms(_percentile(lat, 0.99)),
+            "max_ms": _ms(max(lat) if lat else None),
+            "fallback_rate": round(s["fallbacks"] / s["with_ai_flag"], 4) if s["with_ai_flag"] else None,
+        }
+    return {"elapsed_s": round(elapsed, 2), "send_window_s": round(sent_window, 2), "endpoints": report}
+
+def _ms(x: Optional[float]) -> Optional[float]:
+    return round(x * 1000, 1) if x is not None else None
+
+# ---------------------------------------------------------------- local server
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(workers: int, workdir: str) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = dict(os.environ)
+    env.setdefault("GEMINI_BACKEND", "fake")
+    env.setdefault("AI_CACHE_BACKEND", "off")          # measure the model path, not cache hits
+    env.setdefault("A7_DEDUP_ENABLED", "0")            # the image pool repeats; avoid exact-duplicate hits
+    env.setdefault("A7_DEDUP_DB", os.path.join(workdir, "a7.sqlite3"))
+    env["WEB_CONCURRENCY"] = str(workers)          # the scheduler splits the quota per worker
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    cmd = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+    ]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"server exited with code {proc.returncode}")
+        try:
+            if httpx.get(url + "/health", timeout=1).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    proc.terminate()
+    raise SystemExit("server did not become healthy within 60s")
+
+def stop_server(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+# ---------------------------------------------------------------- report
+
+def print_report(result: Dict[str, Any]) -> None:
+    cols = ["endpoint", "req", "ok", "drop", "rps", "p50", "p95", "p99", "max", "fallback", "srv_fallback"]
+    print()
+    print(f"elapsed {result['elapsed_s']}s, target {result['target_rps']} rps, workers {result.get('workers') or '?'}")
+    print("{:<10} {:>6} {:>6} {:>5} {:>7} {:>8} {:>8} {:>8} {:>8} {:>9} {:>12}".format(*cols))
+    server = result.get("server_fallback", {})
+    for name, r in result["endpoints"].items():
+        srv_rate = (server.get(ENDPOINTS[name]) or {}).get("fallback_rate")
+        print("{:<10} {:>6} {:>6} {:>5} {:>7} {:>8} {:>8} {:>8} {:>8} {:>9} {:>12}".format(
+            name, r["requests"], r["ok"], r["dropped"], r["throughput_rps"],
+            _fmt(r["p50_ms"]), _fmt(r["p95_ms"]), _fmt(r["p99_ms"]), _fmt(r["max_ms"]),
+            _pct(r["fallback_rate"]), _pct(srv_rate),
+        ))
+    reasons = {e: v["reasons"] for e, v in server.items() if v["reasons"]}
+    if reasons:
+        print("fallback reasons (server):", json.dumps(reasons))
+    if result.get("worker_rss_mb"):
+        print("max RSS per worker (MB):", json.dumps(result["worker_rss_mb"]))
+
+def _fmt(x) -> str:
+    return "-" if x is None else f"{x:.0f}"
+
+def _pct(x) -> str:
+    return "-" if x is None else f"{x * 100:.1f}%"
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    problems = []
+    for name, r in result["endpoints"].items():
+        b = baseline.get("endpoints", {}).get(name)
+        if not b:
+            continue
+        if b.get("p95_ms") and r.get("p95_ms") and r["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {r['p95_ms']}ms > baseline {b['p95_ms']}ms")
+        if b.get("throughput_rps") and r["throughput_rps"] < b["throughput_rps"] * (1 - tolerance):
+            problems.append(f"{name}: throughput {r['throughput_rps']} < baseline {b['throughput_rps']}")
+        if r.get("fallback_rate") is not None and b.get("fallback_rate") is not None:
+            if r["fallback_rate"] > b["fallback_rate"] + tolerance * max(b["fallback_rate"], 0.01):
+                problems.append(f"{name}: fallback {r['fallback_rate']} > baseline {b['fallback_rate']}")
+    return problems
+
+# ---------------------------------------------------------------- main
+
+async def main_async(args) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    print(f"building payloads (image edge {args.image_edge}px, audio {args.audio_seconds}s)...")
+    payloads = Payloads(args.image_edge, args.audio_seconds)
+
+    proc = None
+    workdir = tempfile.mkdtemp(prefix="kidzgo-bench-")
+    url = args.url
+    if not url:
+        proc, url = start_server(args.workers, workdir)
+        print(f"started {url} with {args.workers} worker(s), GEMINI_BACKEND={os.getenv('GEMINI_BACKEND', 'fake')}")
+    try:
+        limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+        async with httpx.AsyncClient(base_url=url, limits=limits) as client:
+            snapshots = WorkerSnapshots()
+            await snapshots.scrape(client, times=max(4, args.workers * 4))
+            if args.warmup > 0:
+                await run_load(client, payloads, mix, args.rps, args.warmup, args.max_in_flight, args.timeout,
+                               lambda: asyncio.sleep(0))
+                await snapshots.scrape(client, times=max(4, args.workers * 4))
+                snapshots.first = dict(snapshots.last)
+
+            result = await run_load(
+                client, payloads, mix, args.rps, args.duration, args.max_in_flight, args.timeout,
+                lambda: snapshots.scrape(client),
+            )
+            await snapshots.scrape(client, times=max(4, args.workers * 4))
+    finally:
+        if proc is not None:
+            stop_server(proc)
+
+    result["target_rps"] = args.rps
+    result["workers"] = args.workers if proc is not None else None
+    result["mix"] = args.mix
+    result["server_fallback"] = snapshots.fallback_by_endpoint()
+    result["worker_rss_mb"] = {pid: round(v / 1048576, 1) for pid, v in sorted(snapshots.max_rss.items())}
+    result["fake_backend"] = {k: v for k, v in os.environ.items() if k.startswith("FAKE_GEMINI_")}
+    return result
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--url", help="existing server; default starts a local one on the fake backend")
+    p.add_argument("--workers", type=int, default=1, help="uvicorn workers for the local server")
+    p.add_argument("--rps", type=float, default=10.0, help="target request rate (all endpoints together)")
+    p.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    p.add_argument("--warmup", type=float, default=3.0, help="seconds of load before measuring")
+    p.add_argument("--mix", default="a3=3,a3_image=1,a6=1,a7=1,a8=2,a8_media=1,a9=3",
+                   help=f"endpoint=weight list from {', '.join(ENDPOINTS)}")
+    p.add_argument("--max-in-flight", type=int, default=256, help="client-side concurrency cap")
+    p.add_argument("--timeout", type=float, default=120.0)
+    p.add_argument("--image-edge", type=int, default=2000, help="width of generated photos (px)")
+    p.add_argument("--audio-seconds", type=float, default=20.0)
+    p.add_argument("--json-out", help="write the full result as JSON (usable as --baseline later)")
+    p.add_argument("--baseline", help="previous --json-out to compare against")
+    p.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression vs baseline")
+    args = p.parse_args()
+
+    result = asyncio.run(main_async(args))
+    print_report(result)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for line in problems:
+            print("REGRESSION", line)
+        return 1 if problems else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
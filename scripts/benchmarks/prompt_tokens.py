@@ -0,0 +1,115 @@
+"""
+Token counts of the registered prompt templates (app.core.prompts).
+
+For every template version: size of the static prefix, of the per-request
+suffix for a representative request (the requests of structured_output_bench),
+the share of the prompt the prefix makes up, and whether the prefix is large
+enough for an explicit context cache (GEMINI_CONTEXT_CACHE_MIN_TOKENS);
+smaller prefixes only benefit from Gemini's implicit prefix caching.
+
+Token counts are the scheduler's estimate; with --live (needs GEMINI_API_KEY,
+no generation quota used) they are counted by the API (models.count_tokens).
+
+Examples:
+    python scripts/benchmarks/prompt_tokens.py
+    GEMINI_STRUCTURED_OUTPUT=0 python scripts/benchmarks/prompt_tokens.py --live --json-out prompts.json
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from app.core import prompts  # noqa: E402
+from app.core.scheduler import estimate_input_tokens  # noqa: E402
+from app.agents.a9_feedback import service as a9  # noqa: E402
+from structured_output_bench import CASES  # noqa: E402  (registers the other agents' templates)
+
+SAMPLES = {name: build for name, (build, _, _) in CASES.items()}
+SAMPLES["a9.enhance_feedback"] = lambda: a9._build_prompt(
+    "hôm nay em làm bài đầy đủ, phát âm tốt lắm nhưng còn quên âm cuối"
+)
+
+def _count(client, model: str, text: str) -> Optional[int]:
+    if client is None or not text:
+        return None
+    return client.models.count_tokens(model=model, contents=text).total_tokens
+
+def measure(live: bool) -> Dict[str, Any]:
+    client = model = None
+    if live:
+        from app.core.gemini_client import GEMINI_MODEL, get_gemini_client
+
+        client, model = get_gemini_client(), GEMINI_MODEL
+        if client is None:
+            raise SystemExit("--live needs GEMINI_API_KEY")
+
+    out = {}
+    for name, versions in prompts._templates.items():
+        for version, template in versions.items():
+            build = SAMPLES.get(name)
+            suffix = None
+            if build is not None:
+                with _pinned(name, version):
+                    suffix = build().suffix
+            row = {
+                "prefix_chars": len(template.prefix),
+                "prefix_tokens_est": estimate_input_tokens(template.prefix),
+                "suffix_tokens_est": estimate_input_tokens(suffix) if suffix is not None else None,
+                "prefix_tokens": _count(client, model, template.prefix),
+                "suffix_tokens": _count(client, model, suffix),
+            }
+            prefix = row["prefix_tokens"] or row["prefix_tokens_est"]
+            sample = row["suffix_tokens"] or row["suffix_tokens_est"]
+            row["prefix_share"] = round(prefix / (prefix + sample), 3) if sample is not None else None
+            row["explicit_cache"] = prefix >= prompts.CONTEXT_CACHE_MIN_TOKENS
+            out[f"{name}/{version}"] = row
+    return out
+
+class _pinned:
+    """Renders `version` of `name` regardless of PROMPT_VERSIONS."""
+
+    def __init__(self, name: str, version: str):
+        self.name, self.version = name, version
+
+    def __enter__(self):
+        self.saved = prompts.PROMPT_VERSIONS.get(self.name)
+        prompts.PROMPT_VERSIONS[self.name] = [(self.version, 1.0)]
+
+    def __exit__(self, *exc):
+        if self.saved is None:
+            prompts.PROMPT_VERSIONS.pop(self.name, None)
+        else:
+            prompts.PROMPT_VERSIONS[self.name] = self.saved
+
+def print_report(result: Dict[str, Any], live: bool) -> None:
+    kind = "tokens" if live else "est tokens"
+    print(f"{'template':<24} {'prefix chars':>12} {'prefix ' + kind:>18} {'suffix ' + kind:>18} "
+          f"{'prefix share':>13} {'explicit cache':>15}")
+    for key, row in result.items():
+        prefix = row["prefix_tokens"] if live else row["prefix_tokens_est"]
+        suffix = row["suffix_tokens"] if live else row["suffix_tokens_est"]
+        share = f"{row['prefix_share']:.0%}" if row["prefix_share"] is not None else "-"
+        print(f"{key:<24} {row['prefix_chars']:>12} {prefix:>18} {str(suffix if suffix is not None else '-'):>18} "
+              f"{share:>13} {'yes' if row['explicit_cache'] else 'no':>15}")
+    print(f"\nexplicit context cache from {prompts.CONTEXT_CACHE_MIN_TOKENS} prefix tokens "
+          f"(GEMINI_CONTEXT_CACHE_MIN_TOKENS); smaller prefixes rely on implicit caching")
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--live", action="store_true", help="count tokens with the API (GEMINI_API_KEY)")
+    p.add_argument("--json-out", help="write the result as JSON")
+    args = p.parse_args()
+
+    result = measure(args.live)
+    print_report(result, args.live)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Prompt-size and latency savings of structured output (GEMINI_STRUCTURED_OUTPUT).
+
+For each endpoint, builds the prompt of a representative request twice: with
+the hand-written JSON schema block (free-text mode) and without it (JSON mode
++ response_schema), and reports prompt characters and estimated input tokens
+(app.core.scheduler.estimate_input_tokens) plus the size of the response
+schema that replaces the block.
+
+With --live (needs GEMINI_API_KEY; costs quota) each text endpoint is also
+called --calls times per mode, reporting the prompt tokens Gemini actually
+billed (usage_metadata, which includes the response_schema), p50/p95 latency
+and how many replies failed to parse/validate.
+
+Examples:
+    python scripts/benchmarks/structured_output_bench.py
+    python scripts/benchmarks/structured_output_bench.py --live --calls 10 --json-out structured.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from app.core import structured  # noqa: E402
+from app.core.scheduler import estimate_input_tokens  # noqa: E402
+from app.agents.a3_homework import service as a3  # noqa: E402
+from app.agents.a3_homework.schemas import (  # noqa: E402
+    BatchAnswer, BatchHomeworkContext, GradingOutput, HomeworkContext, PackedGradingOutput
+)
+from app.agents.a6_reports import service as a6  # noqa: E402
+from app.agents.a6_reports.schemas import MonthlyReportRequest, ReportSectionsOutput  # noqa: E402
+from app.agents.a7_receipts import service as a7  # noqa: E402
+from app.agents.a7_receipts.schemas import PaymentProofOutput  # noqa: E402
+from app.agents.a8_speaking import service as a8  # noqa: E402
+from app.agents.a8_speaking.schemas import SpeakingContext, SpeakingOutput  # noqa: E402
+
+HOMEWORK = HomeworkContext(
+    homework_id="HW-BENCH",
+    student_id="ST-BENCH",
+    instructions="Write 3-5 sentences about your family.",
+)
+ANSWER = "My family have four people. My father is a doctor. My mother is teacher. I love my family very much."
+SPEAKING = SpeakingContext(
+    homework_id="HW-BENCH", student_id="ST-BENCH", mode="phonics", target_words=["think", "three", "bath"]
+)
+REPORT = MonthlyReportRequest.model_validate({
+    "student": {"student_id": "ST-BENCH", "name": "An", "program": "Movers"},
+    "range": {"from_date": "2026-03-01", "to_date": "2026-03-31"},
+    "attendance": {"total": 8, "present": 7, "percentage": 87.5},
+    "homework": {"total": 8, "completed": 7, "submitted": 7, "average": 82, "completion_rate": 87.5},
+    "test": {"total": 1, "tests": [{"exam_id": "E1", "type": "mid", "score": 8, "max_score": 10, "date": "2026-03-20"}]},
+    "topics": {"total": 2, "topics": ["Family", "Animals"]},
+    "session_feedbacks": [
+        {"date": "2026-03-02", "text": "Con tích cực phát biểu, phát âm âm cuối còn thiếu."},
+        {"date": "2026-03-09", "text": "Con làm bài đầy đủ, cần luyện thêm từ vựng chủ đề động vật."},
+    ],
+})
+
+# endpoint -> (prompt builder, output model, usable with --live)
+CASES: Dict[str, Tuple[Callable[[], str], Any, bool]] = {
+    "a3.grade_text": (lambda: a3._build_prompt(HOMEWORK, ANSWER, None, "vi"), GradingOutput, True),
+    "a3.grade_image": (lambda: a3._build_image_prompt(HOMEWORK, None, "vi"), GradingOutput, False),
+    "a3.grade_batch": (
+        lambda: a3._build_packed_prompt(
+            BatchHomeworkContext(**HOMEWORK.model_dump()),
+            [(i, BatchAnswer(student_id=f"S{i}", student_answer_text=ANSWER)) for i in range(4)],
+            "vi",
+        ),
+        PackedGradingOutput,
+        True,
+    ),
+    "a6.monthly_report": (lambda: a6._build_prompt(REPORT), ReportSectionsOutput, True),
+    "a7.payment_proof": (lambda: a7._build_prompt("IN", "BR-1"), PaymentProofOutput, False),
+    "a8.transcript": (
+        lambda: a8._build_transcript_prompt(SPEAKING, "I tink tree bird is in the baf."), SpeakingOutput, True
+    ),
+    "a8.media": (lambda: a8._build_media_prompt(SPEAKING), SpeakingOutput, False),
+}
+
+def _set_mode(on: bool) -> None:
+    structured.STRUCTURED_OUTPUT = on
+
+def measure_prompts() -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for endpoint, (build, model, _) in CASES.items():
+        row = {}
+        for mode, on in (("free_text", False), ("structured", True)):
+            _set_mode(on)
+            prompt = build()
+            row[mode] = {"chars": len(prompt), "est_tokens": estimate_input_tokens(prompt)}
+        schema = structured.response_schema(model).model_dump(exclude_none=True, mode="json")
+        row["schema_chars"] = len(json.dumps(schema, ensure_ascii=False))
+        row["saved_est_tokens"] = row["free_text"]["est_tokens"] - row["structured"]["est_tokens"]
+        out[endpoint] = row
+    return out
+
+async def _live_one(client, model_name: str, endpoint: str, on: bool, calls: int) -> Dict[str, Any]:
+    build, model, _ = CASES[endpoint]
+    _set_mode(on)
+    prompt = build()
+    config = structured.output_config(model)
+    latencies: List[float] = []
+    prompt_tokens: List[int] = []
+    failures = 0
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        try:
+            resp = await client.aio.models.generate_content(model=model_name, contents=prompt, config=config)
+        except Exception as e:
+            print(f"  {endpoint}: {type(e).__name__}: {e}")
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - t0)
+        usage = getattr(resp, "usage_metadata", None)
+        if usage is not None and usage.prompt_token_count:
+            prompt_tokens.append(usage.prompt_token_count)
+        try:
+            structured.parse_output(model, resp.text)
+        except ValueError:
+            failures += 1
+    latencies.sort()
+    return {
+        "prompt_tokens": statistics.median(prompt_tokens) if prompt_tokens else None,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000) if latencies else None,
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000) if latencies else None,
+        "failures": failures,
+        "calls": calls,
+    }
+
+async def measure_live(calls: int) -> Dict[str, Dict[str, Any]]:
+    from app.core.gemini_client import GEMINI_MODEL, get_gemini_client
+
+    client = get_gemini_client()
+    if client is None:
+        raise SystemExit("--live needs GEMINI_API_KEY")
+    out = {}
+    for endpoint, (_, _, live) in CASES.items():
+        if not live:
+            continue
+        out[endpoint] = {
+            "free_text": await _live_one(client, GEMINI_MODEL, endpoint, False, calls),
+            "structured": await _live_one(client, GEMINI_MODEL, endpoint, True, calls),
+        }
+    return out
+
+def print_report(prompts: Dict[str, Any], live: Dict[str, Any]) -> None:
+    print(f"{'endpoint':<20} {'free-text chars':>16} {'structured chars':>17} {'est tokens saved':>17} {'schema chars':>13}")
+    for endpoint, row in prompts.items():
+        saved = row["saved_est_tokens"] / max(row["free_text"]["est_tokens"], 1)
+        print(
+            f"{endpoint:<20} {row['free_text']['chars']:>16} {row['structured']['chars']:>17} "
+            f"{row['saved_est_tokens']:>9} ({saved:>4.0%}) {row['schema_chars']:>13}"
+        )
+    if not live:
+        return
+    print()
+    print(f"{'endpoint':<20} {'mode':<11} {'prompt tok':>10} {'p50 ms':>7} {'p95 ms':>7} {'failed':>7}")
+    for endpoint, modes in live.items():
+        for mode, r in modes.items():
+            print(
+                f"{endpoint:<20} {mode:<11} {str(r['prompt_tokens']):>10} {str(r['p50_ms']):>7} "
+                f"{str(r['p95_ms']):>7} {r['failures']:>3}/{r['calls']:<3}"
+            )
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--live", action="store_true", help="also call Gemini (GEMINI_API_KEY; uses quota)")
+    p.add_argument("--calls", type=int, default=5, help="live calls per endpoint and mode")
+    p.add_argument("--json-out", help="write the result as JSON")
+    args = p.parse_args()
+
+    saved = structured.STRUCTURED_OUTPUT
+    try:
+        prompts = measure_prompts()
+        live = asyncio.run(measure_live(args.calls)) if args.live else {}
+    finally:
+        _set_mode(saved)
+
+    print_report(prompts, live)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"prompts": prompts, "live": live}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())